@@ -26,6 +26,7 @@ from __future__ import print_function
 import os
 import sys
 import re
+import signal
 import subprocess
 import threading
 import traceback
@@ -33,6 +34,8 @@ import traceback
 import azurelinuxagent.common.logger as logger
 import azurelinuxagent.common.event as event
 import azurelinuxagent.common.conf as conf
+import azurelinuxagent.common.timingstats as timingstats
+from azurelinuxagent.common.future import ustr
 from azurelinuxagent.common.version import AGENT_NAME, AGENT_LONG_VERSION, \
                                      DISTRO_NAME, DISTRO_VERSION, \
                                      PY_VERSION_MAJOR, PY_VERSION_MINOR, \
@@ -62,10 +65,18 @@ class Agent(object):
         #Init log
         verbose = verbose or conf.get_logs_verbose()
         level = logger.LogLevel.VERBOSE if verbose else logger.LogLevel.INFO
-        logger.add_logger_appender(logger.AppenderType.FILE, level,
+        if conf.get_logs_buffered():
+            file_appender_type = logger.AppenderType.ASYNC_FILE if conf.get_logs_writer_thread() \
+                else logger.AppenderType.BUFFERED_FILE
+            console_appender_type = file_appender_type
+            Agent._reopen_logs_on_sighup()
+        else:
+            file_appender_type = logger.AppenderType.FILE
+            console_appender_type = logger.AppenderType.CONSOLE
+        logger.add_logger_appender(file_appender_type, level,
                                  path="/var/log/waagent.log")
         if conf.get_logs_console():
-            logger.add_logger_appender(logger.AppenderType.CONSOLE, level,
+            logger.add_logger_appender(console_appender_type, level,
                     path="/dev/console")
 
         if event.send_logs_to_telemetry():
@@ -95,6 +106,15 @@ class Agent(object):
         event.init_event_logger(event_dir)
         event.enable_unhandled_err_dump("WALA")
 
+    @staticmethod
+    def _reopen_logs_on_sighup():
+        # The buffered appenders keep the log files open; SIGHUP makes them reopen the files (e.g. after logrotate)
+        try:
+            signal.signal(signal.SIGHUP, lambda signum, frame: logger.reopen())
+        except ValueError as e:
+            # signal handlers can be set only on the main thread
+            logger.warn("Failed to set the handler for SIGHUP: {0}", ustr(e))
+
     def daemon(self):
         """
         Run agent daemon
@@ -151,6 +171,16 @@ class Agent(object):
         for k in sorted(configuration.keys()):
             print("{0} = {1}".format(k, configuration[k]))
 
+    def show_stats(self):
+        """
+        Print the timing statistics saved by the extension handler
+        """
+        path = os.path.join(conf.get_lib_dir(), timingstats.TIMING_STATS_FILE_NAME)
+        if not os.path.exists(path):
+            print("No timing statistics are available; {0} does not exist".format(path))
+            return
+        print(timingstats.format_stats(timingstats.load_stats(path)))
+
 
 def main(args=[]):
     """
@@ -183,6 +213,8 @@ def main(args=[]):
                 agent.run_exthandlers(debug)
             elif command == "show-configuration":
                 agent.show_configuration()
+            elif command == "show-stats":
+                agent.show_stats()
         except Exception:
             logger.error(u"Failed to run '{0}': {1}",
                          command,
@@ -229,6 +261,8 @@ def parse_args(sys_args):
             force = True
         elif re.match("^([-/]*)show-configuration", a):
             cmd = "show-configuration"
+        elif re.match("^([-/]*)show-stats", a):
+            cmd = "show-stats"
         elif re.match("^([-/]*)(help|usage|\\?)", a):
             cmd = "help"
         else:
@@ -258,7 +292,7 @@ def usage():
     s += ("usage: {0} [-verbose] [-force] [-help] "
            "-configuration-path:<path to configuration file>"
            "-deprovision[+user]|-register-service|-version|-daemon|-start|"
-           "-run-exthandlers|-show-configuration]"
+           "-run-exthandlers|-show-configuration|-show-stats]"
            "").format(sys.argv[0])
     s += "\n"
     return s
@@ -24,19 +24,47 @@ from azurelinuxagent.common.osutil import get_osutil
 from azurelinuxagent.common.utils import fileutil
 
 re_user_system_times = re.compile(r'user (\d+)\nsystem (\d+)\n')
+re_pressure = re.compile(r'^(some|full) avg10=[\d.]+ avg60=[\d.]+ avg300=([\d.]+) total=\d+$', re.MULTILINE)
+
+# cpu.stat in the unified hierarchy reports the CPU time in microseconds; it is converted to USER_HZ, the unit used by
+# /proc/stat, to compute the CPU usage
+USER_HZ = os.sysconf('SC_CLK_TCK')
 
 
 class CGroupContollers(object):
     CPU = "cpu"
     MEMORY = "memory"
+    IO = "io"
+
+
+def _parse_flat_keyed_file(contents):
+    """
+    Parses the contents of a file with "<key> <value>" lines (e.g. cpu.stat or memory.stat) and returns them as a
+    dictionary of integers
+    """
+    values = {}
+    for line in contents.splitlines():
+        fields = line.split()
+        if len(fields) == 2 and fields[1].isdigit():
+            values[fields[0]] = int(fields[1])
+    return values
 
 
 class CGroup(object):
     @staticmethod
-    def create(cgroup_path, controller, extension_name):
+    def create(cgroup_path, controller, extension_name, unified_hierarchy=False):
         """
-        Factory method to create the correct CGroup.
+        Factory method to create the correct CGroup. If unified_hierarchy is True the cgroup is in the unified hierarchy
+        (cgroup v2), where all the controllers share the same path.
         """
+        if unified_hierarchy:
+            if controller == CGroupContollers.CPU:
+                return CpuCgroupV2(extension_name, cgroup_path)
+            if controller == CGroupContollers.MEMORY:
+                return MemoryCgroupV2(extension_name, cgroup_path)
+            if controller == CGroupContollers.IO:
+                return IoCgroupV2(extension_name, cgroup_path)
+            raise CGroupsException('CGroup controller {0} is not supported'.format(controller))
         if controller == CGroupContollers.CPU:
             return CpuCgroup(extension_name, cgroup_path)
         if controller == CGroupContollers.MEMORY:
@@ -95,6 +123,32 @@ class CGroup(object):
             raise CGroupsException("Exception while attempting to read {0}".format(parameter_filename), e)
         return result
 
+    def _get_pressure(self, file_name):
+        """
+        Returns the pressure stall information (PSI) in the given file (e.g. cpu.pressure) as a dictionary with the
+        "some" and (when reported) "full" percentages of time over the last 300 seconds, or None if PSI is not available.
+        """
+        try:
+            contents = self._get_file_contents(file_name)
+        except Exception as e:
+            # the file does not exist if the kernel does not support PSI, and reading it fails with EOPNOTSUPP if PSI
+            # has been disabled at boot
+            if isinstance(e, (IOError, OSError)) and e.errno in (errno.ENOENT, errno.EOPNOTSUPP):
+                return None
+            raise CGroupsException("Failed to read {0}: {1}".format(file_name, ustr(e)))
+
+        pressure = dict((kind, float(avg300)) for kind, avg300 in re_pressure.findall(contents))
+        if "some" not in pressure:
+            raise CGroupsException("The contents of {0} are invalid: {1}".format(self._get_cgroup_file(file_name), contents))
+        return pressure
+
+    def get_pressure(self):
+        """
+        Returns the pressure stall information (PSI) for the resource of this controller (see _get_pressure), or None if
+        it is not available. PSI is reported per cgroup only in the unified hierarchy.
+        """
+        return None
+
     def is_active(self):
         try:
             tasks = self._get_parameters("tasks")
@@ -180,22 +234,36 @@ class CpuCgroup(CGroup):
     def _cpu_usage_initialized(self):
         return self._current_cgroup_cpu is not None and self._current_system_cpu is not None
 
-    def initialize_cpu_usage(self):
+    def get_cpu_ticks(self):
+        """
+        Returns the number of USER_HZ of CPU time consumed by this cgroup (see get_cpu_usage())
+        """
+        return self._get_cpu_ticks()
+
+    def initialize_cpu_usage(self, system_cpu=None):
         """
         Sets the initial values of CPU usage. This function must be invoked before calling get_cpu_usage().
+
+        system_cpu is the current value of get_total_cpu_ticks_since_boot(); if it is None, it is read from /proc/stat.
         """
         if self._cpu_usage_initialized():
             raise CGroupsException("initialize_cpu_usage() should be invoked only once")
         self._current_cgroup_cpu = self._get_cpu_ticks(allow_no_such_file_or_directory_error=True)
-        self._current_system_cpu = self._osutil.get_total_cpu_ticks_since_boot()
+        self._current_system_cpu = self._osutil.get_total_cpu_ticks_since_boot() if system_cpu is None else system_cpu
 
-    def get_cpu_usage(self):
+    def get_cpu_usage(self, system_cpu=None, cgroup_cpu=None):
         """
         Computes the CPU used by the cgroup since the last call to this function.
 
         The usage is measured as a percentage of utilization of all cores in the system. For example,
         using 1 core at 100% on a 4-core system would be reported as 25%.
 
+        system_cpu is the current value of get_total_cpu_ticks_since_boot(); if it is None, it is read from /proc/stat.
+        Passing the same value to all the cgroups polled at the same time avoids reading /proc/stat for each of them
+        and makes their usages consistent with each other. cgroup_cpu is the current value of get_cpu_ticks(); if it is
+        None, it is read from the cgroup. The cgroup must be read before /proc/stat, otherwise the system delta would
+        cover less time than the cgroup delta.
+
         NOTE: initialize_cpu_usage() must be invoked before calling get_cpu_usage()
         """
         if not self._cpu_usage_initialized():
@@ -203,8 +271,8 @@ class CpuCgroup(CGroup):
 
         self._previous_cgroup_cpu = self._current_cgroup_cpu
         self._previous_system_cpu = self._current_system_cpu
-        self._current_cgroup_cpu = self._get_cpu_ticks()
-        self._current_system_cpu = self._osutil.get_total_cpu_ticks_since_boot()
+        self._current_cgroup_cpu = self._get_cpu_ticks() if cgroup_cpu is None else cgroup_cpu
+        self._current_system_cpu = self._osutil.get_total_cpu_ticks_since_boot() if system_cpu is None else system_cpu
 
         cgroup_delta = self._current_cgroup_cpu - self._previous_cgroup_cpu
         system_delta = max(1, self._current_system_cpu - self._previous_system_cpu)
@@ -259,3 +327,187 @@ class MemoryCgroup(CGroup):
             raise CGroupsException("Exception while attempting to read {0}".format("memory.usage_in_bytes"), e)
 
         return int(usage)
+
+
+class CpuCgroupV2(CpuCgroup):
+    """
+    CPU controller in the unified hierarchy (cgroup v2); the CPU time is read from cpu.stat
+    """
+    def __init__(self, name, cgroup_path):
+        super(CpuCgroupV2, self).__init__(name, cgroup_path)
+
+        self._previous_throttled_time = None
+        self._current_throttled_time = None
+
+    def _get_cpu_ticks(self, allow_no_such_file_or_directory_error=False):
+        """
+        Returns the number of USER_HZ of CPU time consumed by this cgroup (see CpuCgroup._get_cpu_ticks). The throttled
+        time reported in cpu.stat is saved for get_throttled_time().
+        """
+        try:
+            cpu_stat = self._get_file_contents('cpu.stat')
+        except Exception as e:
+            if not isinstance(e, (IOError, OSError)) or e.errno != errno.ENOENT:
+                raise CGroupsException("Failed to read cpu.stat: {0}".format(ustr(e)))
+            if not allow_no_such_file_or_directory_error:
+                raise e
+            cpu_stat = None
+
+        usage_usec = 0
+        throttled_usec = 0
+
+        if cpu_stat is not None:
+            values = _parse_flat_keyed_file(cpu_stat)
+            if 'usage_usec' not in values:
+                raise CGroupsException("The contents of {0} are invalid: {1}".format(self._get_cgroup_file('cpu.stat'), cpu_stat))
+            usage_usec = values['usage_usec']
+            # throttled_usec is reported only when the cpu controller is enabled for the cgroup
+            throttled_usec = values.get('throttled_usec', 0)
+
+        self._previous_throttled_time = self._current_throttled_time
+        self._current_throttled_time = throttled_usec
+
+        return float(usage_usec) * USER_HZ / 1000000
+
+    def get_throttled_time(self):
+        """
+        Returns the time (in milliseconds) the cgroup was throttled between the last two calls to get_cpu_usage(), or
+        None if get_cpu_usage() has not been invoked yet.
+        """
+        if self._previous_throttled_time is None:
+            return None
+        return round((self._current_throttled_time - self._previous_throttled_time) / 1000.0, 3)
+
+    def get_pressure(self):
+        return self._get_pressure('cpu.pressure')
+
+    def is_active(self):
+        # the unified hierarchy has no "tasks" file
+        return len(self.get_tracked_processes()) != 0
+
+
+class MemoryCgroupV2(MemoryCgroup):
+    """
+    Memory controller in the unified hierarchy (cgroup v2)
+    """
+    def __init__(self, name, cgroup_path):
+        super(MemoryCgroupV2, self).__init__(name, cgroup_path)
+
+        self._max_memory_usage = 0
+
+    def _get_memory_parameter(self, file_name):
+        try:
+            usage = self._get_parameters(file_name, first_line_only=True)
+        except Exception as e:
+            if isinstance(e, (IOError, OSError)) and e.errno == errno.ENOENT:
+                raise
+            raise CGroupsException("Exception while attempting to read {0}".format(file_name), e)
+
+        return int(usage)
+
+    def get_memory_usage(self):
+        """
+        Collect memory.current from the cgroup.
+
+        :return: Memory usage in bytes
+        :rtype: int
+        """
+        usage = self._get_memory_parameter('memory.current')
+        self._max_memory_usage = max(self._max_memory_usage, usage)
+        return usage
+
+    def get_max_memory_usage(self):
+        """
+        Collect memory.peak from the cgroup. memory.peak is not available before Linux 5.19; in that case the maximum
+        of the usages returned by get_memory_usage() is returned instead.
+
+        :return: Memory usage in bytes
+        :rtype: int
+        """
+        try:
+            return self._get_memory_parameter('memory.peak')
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT or not os.path.isdir(self.path):
+                raise
+        return self._max_memory_usage
+
+    def get_memory_stat(self):
+        """
+        Collect memory.stat from the cgroup.
+
+        :return: Dictionary with the values in memory.stat (e.g. "anon" and "file", the anonymous and page cache memory
+        in bytes)
+        :rtype: dict
+        """
+        try:
+            memory_stat = self._get_file_contents('memory.stat')
+        except Exception as e:
+            if isinstance(e, (IOError, OSError)) and e.errno == errno.ENOENT:
+                raise
+            raise CGroupsException("Exception while attempting to read {0}".format('memory.stat'), e)
+
+        return _parse_flat_keyed_file(memory_stat)
+
+    def get_pressure(self):
+        return self._get_pressure('memory.pressure')
+
+    def is_active(self):
+        # the unified hierarchy has no "tasks" file
+        return len(self.get_tracked_processes()) != 0
+
+
+class IoCgroupV2(CGroup):
+    """
+    IO controller in the unified hierarchy (cgroup v2); the controller is not tracked in the v1 hierarchy.
+    """
+    def __init__(self, name, cgroup_path):
+        super(IoCgroupV2, self).__init__(name, cgroup_path, CGroupContollers.IO)
+
+        self._previous_io_bytes = None
+
+    def __str__(self):
+        return "cgroup: Name: {0}, cgroup_path: {1}; Controller: {2}".format(
+            self.name, self.path, self.controller
+        )
+
+    def _get_io_bytes(self):
+        """
+        Returns a tuple with the bytes read and written by the cgroup on all devices, as reported by io.stat
+        """
+        try:
+            io_stat = self._get_file_contents('io.stat')
+        except Exception as e:
+            if isinstance(e, (IOError, OSError)) and e.errno == errno.ENOENT:
+                raise
+            raise CGroupsException("Exception while attempting to read {0}".format('io.stat'), e)
+
+        read_bytes = 0
+        written_bytes = 0
+        # each line is "<major>:<minor> rbytes=<n> wbytes=<n> rios=<n> wios=<n> dbytes=<n> dios=<n>"
+        for line in io_stat.splitlines():
+            for field in line.split()[1:]:
+                key, _, value = field.partition('=')
+                if key == 'rbytes':
+                    read_bytes += int(value)
+                elif key == 'wbytes':
+                    written_bytes += int(value)
+        return read_bytes, written_bytes
+
+    def get_io_usage(self):
+        """
+        Returns a tuple with the bytes read and written by the cgroup since the last call to this function, or None on
+        the first call.
+        """
+        previous = self._previous_io_bytes
+        self._previous_io_bytes = self._get_io_bytes()
+        if previous is None:
+            return None
+        # the counters of a device are dropped when the device is removed, so the deltas can be negative
+        return max(0, self._previous_io_bytes[0] - previous[0]), max(0, self._previous_io_bytes[1] - previous[1])
+
+    def get_pressure(self):
+        return self._get_pressure('io.pressure')
+
+    def is_active(self):
+        # the unified hierarchy has no "tasks" file
+        return len(self.get_tracked_processes()) != 0
@@ -34,6 +34,9 @@ from azurelinuxagent.common.version import AGENT_NAME, CURRENT_VERSION
 
 CGROUPS_FILE_SYSTEM_ROOT = '/sys/fs/cgroup'
 CGROUP_CONTROLLERS = ["cpu", "memory"]
+CGROUP_V2_CONTROLLERS = ["cpu", "memory", "io"]
+# accounting properties of the extension scopes on the unified hierarchy (see start_extension_command)
+SYSTEMD_V2_ACCOUNTING_PROPERTIES = ["CPUAccounting", "MemoryAccounting", "IOAccounting"]
 VM_AGENT_CGROUP_NAME = "walinuxagent.service"
 EXTENSIONS_ROOT_CGROUP_NAME = "walinuxagent.extensions"
 UNIT_FILES_FILE_SYSTEM_PATH = "/etc/systemd/system"
@@ -83,7 +86,12 @@ class CGroupsApi(object):
         """
         Factory method to create the correct API for the current platform
         """
-        return SystemdCgroupsApi() if CGroupsApi._is_systemd() else FileSystemCgroupsApi()
+        if CGroupsApi._is_systemd():
+            return SystemdCgroupsApi()
+        if CGroupsApi.is_unified_hierarchy():
+            # without systemd the agent would need to enable the controllers in the subtrees of the hierarchy itself
+            raise CGroupsException("The unified cgroup hierarchy (cgroup v2) is supported only under systemd")
+        return FileSystemCgroupsApi()
 
     @staticmethod
     def _is_systemd():
@@ -93,6 +101,25 @@ class CGroupsApi(object):
         """
         return os.path.exists('/run/systemd/system/')
 
+    @staticmethod
+    def is_unified_hierarchy():
+        """
+        Determine if the cgroups file system is the unified hierarchy (cgroup v2); cgroup.controllers exists only in
+        the root of a cgroup v2 file system (in hybrid mode the root is a tmpfs and the unified hierarchy is mounted on a
+        subdirectory)
+        """
+        return os.path.exists(os.path.join(CGROUPS_FILE_SYSTEM_ROOT, 'cgroup.controllers'))
+
+    @staticmethod
+    def _get_cgroup_path(controller, relative_path):
+        """
+        Returns the path of the given cgroup in the hierarchy of the given controller; in the unified hierarchy all the
+        controllers share the same path
+        """
+        if CGroupsApi.is_unified_hierarchy():
+            return os.path.join(CGROUPS_FILE_SYSTEM_ROOT, relative_path)
+        return os.path.join(CGROUPS_FILE_SYSTEM_ROOT, controller, relative_path)
+
     @staticmethod
     def _foreach_controller(operation, message):
         """
@@ -100,9 +127,14 @@ class CGroupsApi(object):
         is not mounted or if an error occurs in the operation
         :return: Returns a list of error messages or an empty list if no errors occurred
         """
-        mounted_controllers = os.listdir(CGROUPS_FILE_SYSTEM_ROOT)
-
-        for controller in CGROUP_CONTROLLERS:
+        if CGroupsApi.is_unified_hierarchy():
+            mounted_controllers = fileutil.read_file(os.path.join(CGROUPS_FILE_SYSTEM_ROOT, 'cgroup.controllers')).split()
+            controllers = CGROUP_V2_CONTROLLERS
+        else:
+            mounted_controllers = os.listdir(CGROUPS_FILE_SYSTEM_ROOT)
+            controllers = CGROUP_CONTROLLERS
+
+        for controller in controllers:
             try:
                 if controller not in mounted_controllers:
                     logger.warn('Cgroup controller "{0}" is not mounted. {1}', controller, message)
@@ -388,13 +420,28 @@ class SystemdCgroupsApi(CGroupsApi):
 
     def create_agent_cgroups(self):
         try:
+            unified_hierarchy = CGroupsApi.is_unified_hierarchy()
+            # in the unified hierarchy /proc/self/cgroup has a single "0::<path>" entry
+            hierarchy = "" if unified_hierarchy else "name=systemd"
+
             cgroup_unit = None
             cgroup_paths = fileutil.read_file("/proc/self/cgroup")
             for entry in cgroup_paths.splitlines():
                 fields = entry.split(':')
-                if fields[1] == "name=systemd":
+                if fields[1] == hierarchy:
                     cgroup_unit = fields[2].lstrip(os.path.sep)
 
+            if unified_hierarchy:
+                cgroups = []
+
+                def create_cgroup(controller):
+                    cgroups.append(CGroup.create(self._get_cgroup_path(controller, cgroup_unit), controller,
+                                                 VM_AGENT_CGROUP_NAME, unified_hierarchy=True))
+
+                self._foreach_controller(create_cgroup, 'Cannot retrieve cgroup for the VM Agent; resource usage will not be tracked.')
+
+                return cgroups
+
             cpu_cgroup_path = os.path.join(CGROUPS_FILE_SYSTEM_ROOT, 'cpu', cgroup_unit)
             memory_cgroup_path = os.path.join(CGROUPS_FILE_SYSTEM_ROOT, 'memory', cgroup_unit)
 
@@ -455,10 +502,11 @@ After=system-{1}.slice""".format(extension_name, EXTENSIONS_ROOT_CGROUP_NAME)
         slice_name = self._get_extension_cgroup_name(extension_name)
 
         cgroups = []
+        unified_hierarchy = CGroupsApi.is_unified_hierarchy()
 
         def create_cgroup(controller):
-            cpu_cgroup_path = os.path.join(CGROUPS_FILE_SYSTEM_ROOT, controller, 'system.slice', slice_name)
-            cgroups.append(CGroup.create(cpu_cgroup_path, controller, extension_name))
+            cgroup_path = self._get_cgroup_path(controller, os.path.join('system.slice', slice_name))
+            cgroups.append(CGroup.create(cgroup_path, controller, extension_name, unified_hierarchy=unified_hierarchy))
 
         self._foreach_controller(create_cgroup, 'Cannot retrieve cgroup for extension {0}; resource usage will not be tracked.'.format(extension_name))
 
@@ -473,8 +521,14 @@ After=system-{1}.slice""".format(extension_name, EXTENSIONS_ROOT_CGROUP_NAME)
                                 error_code=ExtensionErrorCodes.PluginUnknownFailure):
         scope_name = "{0}_{1}".format(self._get_extension_cgroup_name(extension_name), uuid.uuid4())
 
+        # On the unified hierarchy systemd enables a controller for a unit only if the corresponding accounting is on,
+        # and IO accounting (and, on older versions, CPU and memory accounting) is off by default
+        properties = ""
+        if CGroupsApi.is_unified_hierarchy():
+            properties = " ".join("--property={0}=yes".format(p) for p in SYSTEMD_V2_ACCOUNTING_PROPERTIES) + " "
+
         process = subprocess.Popen(
-            "systemd-run --unit={0} --scope {1}".format(scope_name, command),
+            "systemd-run --unit={0} --scope {1}{2}".format(scope_name, properties, command),
             shell=shell,
             cwd=cwd,
             stdout=stdout,
@@ -484,10 +538,11 @@ After=system-{1}.slice""".format(extension_name, EXTENSIONS_ROOT_CGROUP_NAME)
 
         logger.info("Started extension using scope '{0}'", scope_name)
         extension_cgroups = []
+        unified_hierarchy = CGroupsApi.is_unified_hierarchy()
 
         def create_cgroup(controller):
-            cgroup_path = os.path.join(CGROUPS_FILE_SYSTEM_ROOT, controller, 'system.slice', scope_name + ".scope")
-            extension_cgroups.append(CGroup.create(cgroup_path, controller, extension_name))
+            cgroup_path = self._get_cgroup_path(controller, os.path.join('system.slice', scope_name + ".scope"))
+            extension_cgroups.append(CGroup.create(cgroup_path, controller, extension_name, unified_hierarchy=unified_hierarchy))
 
         self._foreach_controller(create_cgroup, 'Cannot create cgroup for extension {0}; '
                                                 'resource usage will not be tracked.'.format(extension_name))
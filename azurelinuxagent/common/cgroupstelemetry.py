@@ -19,10 +19,11 @@ from collections import namedtuple
 from datetime import datetime as dt
 
 from azurelinuxagent.common import logger
-from azurelinuxagent.common.cgroup import CpuCgroup, CGroupContollers
+from azurelinuxagent.common.cgroup import CpuCgroup, CpuCgroupV2, MemoryCgroupV2, CGroupContollers
 from azurelinuxagent.common.exception import CGroupsException
 from azurelinuxagent.common.future import ustr
 from azurelinuxagent.common.logger import EVERY_SIX_HOURS
+from azurelinuxagent.common.osutil import get_osutil
 from azurelinuxagent.common.resourceusage import MemoryResourceUsage, ProcessInfo
 
 MetricValue = namedtuple('Metric', ['category', 'counter', 'instance', 'value'])
@@ -32,10 +33,19 @@ DELIM = " | "
 DEFAULT_PROCESS_NAME = "NO_PROCESS_FOUND"
 DEFAULT_PROCESS_COMMANDLINE = "NO_CMDLINE_FOUND"
 
+# Maximum number of samples kept by each Metric between reports. With the default polling and reporting periods a
+# metric gets 6 samples per report, so the limit only matters if the reports are delayed.
+MAX_METRIC_SAMPLES = 128
+
+# Maximum number of processes per cgroup whose memory usage is summarized in each report; extensions that start many
+# short-lived processes would otherwise accumulate an entry for each of them.
+MAX_PROCESSES_PER_CGROUP = 64
+
 
 class MetricsCategory(object):
     MEMORY_CATEGORY = "Memory"
     PROCESS_CATEGORY = "Process"
+    IO_CATEGORY = "IO"
 
 
 class MetricsCounter(object):
@@ -43,6 +53,27 @@ class MetricsCounter(object):
     TOTAL_MEM_USAGE = "Total Memory Usage"
     MAX_MEM_USAGE = "Max Memory Usage"
     MEM_USED_BY_PROCESS = "Memory Used by Process"
+    # The counters below are reported only for cgroups in the unified hierarchy (cgroup v2)
+    THROTTLED_TIME = "Throttled Time"
+    ANON_MEM_USAGE = "Anonymous Memory Usage"
+    FILE_MEM_USAGE = "Page Cache Usage"
+    BYTES_READ = "Bytes Read"
+    BYTES_WRITTEN = "Bytes Written"
+    # Pressure stall information: percentage of time over the last 5 minutes in which some (or all, for the "full"
+    # counters) of the tasks in the cgroup were stalled waiting for the resource
+    CPU_PRESSURE = "CPU Pressure"
+    MEMORY_PRESSURE = "Memory Pressure"
+    MEMORY_FULL_PRESSURE = "Memory Full Pressure"
+    IO_PRESSURE = "IO Pressure"
+    IO_FULL_PRESSURE = "IO Full Pressure"
+
+
+# Category and counters of the pressure stall information reported for each controller
+_PRESSURE_COUNTERS = {
+    CGroupContollers.CPU: (MetricsCategory.PROCESS_CATEGORY, MetricsCounter.CPU_PRESSURE, None),
+    CGroupContollers.MEMORY: (MetricsCategory.MEMORY_CATEGORY, MetricsCounter.MEMORY_PRESSURE, MetricsCounter.MEMORY_FULL_PRESSURE),
+    CGroupContollers.IO: (MetricsCategory.IO_CATEGORY, MetricsCounter.IO_PRESSURE, MetricsCounter.IO_FULL_PRESSURE),
+}
 
 
 class CGroupsTelemetry(object):
@@ -51,6 +82,29 @@ class CGroupsTelemetry(object):
     _tracked = []
     _cgroup_metrics = {}
     _rlock = threading.RLock()
+    # Cache of the process summaries, indexed by pid; each item is a tuple with the start time of the process (used to
+    # detect pid reuse) and its summary
+    _process_info_summaries = {}
+
+    @staticmethod
+    def _get_cached_process_info_summary(process_id):
+        """
+        Same as get_process_info_summary(), but the summary is cached for as long as the process is running, to avoid
+        reading its comm and cmdline on each poll.
+        """
+        try:
+            start_time = ProcessInfo.get_proc_start_time(process_id)
+        except Exception:
+            # the process may have exited; do not cache its summary
+            return CGroupsTelemetry.get_process_info_summary(process_id)
+
+        cached = CGroupsTelemetry._process_info_summaries.get(process_id)
+        if cached is not None and cached[0] == start_time:
+            return cached[1]
+
+        summary = CGroupsTelemetry.get_process_info_summary(process_id)
+        CGroupsTelemetry._process_info_summaries[process_id] = (start_time, summary)
+        return summary
 
     @staticmethod
     def get_process_info_summary(process_id):
@@ -121,19 +175,20 @@ class CGroupsTelemetry(object):
             cgroup.initialize_cpu_usage()
 
         with CGroupsTelemetry._rlock:
-            if not CGroupsTelemetry.is_tracked(cgroup.path):
+            if not CGroupsTelemetry.is_tracked(cgroup.path, cgroup.controller):
                 CGroupsTelemetry._tracked.append(cgroup)
                 logger.info("Started tracking new cgroup: {0}, path: {1}".format(cgroup.name, cgroup.path))
 
     @staticmethod
-    def is_tracked(path):
+    def is_tracked(path, controller=None):
         """
-        Returns true if the given item is in the list of tracked items
+        Returns true if the given item is in the list of tracked items; in the unified hierarchy (cgroup v2) all the
+        controllers of a cgroup share the same path, so the controller can be given to tell them apart.
         O(n) operation. But limited to few cgroup objects we have.
         """
         with CGroupsTelemetry._rlock:
             for cgroup in CGroupsTelemetry._tracked:
-                if path == cgroup.path:
+                if path == cgroup.path and (controller is None or controller == cgroup.controller):
                     return True
 
         return False
@@ -176,20 +231,62 @@ class CGroupsTelemetry(object):
 
         return collected_metrics
 
+    @staticmethod
+    def _get_total_cpu_ticks_since_boot():
+        """
+        Returns the system CPU ticks used to compute the CPU usage of all the cgroups in a poll, or None if they could
+        not be read; in that case each cgroup reads them on its own and reports any errors.
+        """
+        try:
+            return get_osutil().get_total_cpu_ticks_since_boot()
+        except Exception:
+            return None
+
+    @staticmethod
+    def _get_cgroup_cpu_ticks(cgroup):
+        """
+        Returns the CPU ticks of the cgroup, or None if they could not be read; in that case get_cpu_usage() reads them
+        again and reports any errors.
+        """
+        try:
+            return cgroup.get_cpu_ticks()
+        except Exception:
+            return None
+
     @staticmethod
     def poll_all_tracked():
         metrics = []
 
         with CGroupsTelemetry._rlock:
-            for cgroup in CGroupsTelemetry._tracked[:]:
+            tracked = CGroupsTelemetry._tracked[:]
+
+            # The CPU ticks of all the CPU cgroups are read first, and then /proc/stat is read once for all of them, so
+            # that the system delta of each cgroup covers the same period as its own delta
+            cgroup_cpu = {}
+            system_cpu = None
+            for cgroup in tracked:
+                if cgroup.controller == CGroupContollers.CPU:
+                    cgroup_cpu[cgroup.path] = CGroupsTelemetry._get_cgroup_cpu_ticks(cgroup)
+            if len(cgroup_cpu) > 0:
+                system_cpu = CGroupsTelemetry._get_total_cpu_ticks_since_boot()
+
+            polled_pids = set()
+
+            for cgroup in tracked:
                 if cgroup.name not in CGroupsTelemetry._cgroup_metrics:
                     CGroupsTelemetry._cgroup_metrics[cgroup.name] = CgroupMetrics()
                 try:
                     if cgroup.controller == CGroupContollers.CPU:
-                        current_cpu_usage = cgroup.get_cpu_usage()
+                        current_cpu_usage = cgroup.get_cpu_usage(system_cpu, cgroup_cpu=cgroup_cpu.get(cgroup.path))
                         CGroupsTelemetry._cgroup_metrics[cgroup.name].add_cpu_usage(current_cpu_usage)
                         metrics.append(MetricValue(MetricsCategory.PROCESS_CATEGORY, MetricsCounter.
                                                    PROCESSOR_PERCENT_TIME, cgroup.name, current_cpu_usage))
+
+                        if isinstance(cgroup, CpuCgroupV2):
+                            throttled_time = cgroup.get_throttled_time()
+                            if throttled_time is not None:
+                                metrics.append(MetricValue(MetricsCategory.PROCESS_CATEGORY, MetricsCounter.
+                                                           THROTTLED_TIME, cgroup.name, throttled_time))
                     elif cgroup.controller == CGroupContollers.MEMORY:
                         current_memory_usage = cgroup.get_memory_usage()
                         CGroupsTelemetry._cgroup_metrics[cgroup.name].add_memory_usage(current_memory_usage)
@@ -201,22 +298,47 @@ class CGroupsTelemetry(object):
                         metrics.append(MetricValue(MetricsCategory.MEMORY_CATEGORY, MetricsCounter.MAX_MEM_USAGE,
                                                    cgroup.name, max_memory_usage))
 
+                        if isinstance(cgroup, MemoryCgroupV2):
+                            memory_stat = cgroup.get_memory_stat()
+                            if 'anon' in memory_stat:
+                                metrics.append(MetricValue(MetricsCategory.MEMORY_CATEGORY, MetricsCounter.
+                                                           ANON_MEM_USAGE, cgroup.name, memory_stat['anon']))
+                            if 'file' in memory_stat:
+                                metrics.append(MetricValue(MetricsCategory.MEMORY_CATEGORY, MetricsCounter.
+                                                           FILE_MEM_USAGE, cgroup.name, memory_stat['file']))
+
                         pids = cgroup.get_tracked_processes()
                         for pid in pids:
+                            polled_pids.add(pid)
                             try:
                                 mem_usage_from_procstatm = MemoryResourceUsage.get_memory_usage_from_proc_statm(pid)
+                                process_info_summary = CGroupsTelemetry._get_cached_process_info_summary(pid)
                                 metrics.append(MetricValue(MetricsCategory.MEMORY_CATEGORY, MetricsCounter.
-                                                           MEM_USED_BY_PROCESS, CGroupsTelemetry.get_process_info_summary(pid),
+                                                           MEM_USED_BY_PROCESS, process_info_summary,
                                                            mem_usage_from_procstatm))
                                 CGroupsTelemetry._cgroup_metrics[cgroup.name].add_proc_statm_memory(
-                                    CGroupsTelemetry.get_process_info_summary(pid), mem_usage_from_procstatm)
+                                    process_info_summary, mem_usage_from_procstatm)
                             except Exception as e:
                                 if not isinstance(e, (IOError, OSError)) or e.errno != errno.ENOENT:
                                     logger.periodic_warn(logger.EVERY_HOUR, "[PERIODIC] Could not collect proc_statm "
                                                                             "for pid {0}. Error : {1}", pid, ustr(e))
+                    elif cgroup.controller == CGroupContollers.IO:
+                        io_usage = cgroup.get_io_usage()
+                        if io_usage is not None:
+                            metrics.append(MetricValue(MetricsCategory.IO_CATEGORY, MetricsCounter.BYTES_READ,
+                                                       cgroup.name, io_usage[0]))
+                            metrics.append(MetricValue(MetricsCategory.IO_CATEGORY, MetricsCounter.BYTES_WRITTEN,
+                                                       cgroup.name, io_usage[1]))
                     else:
                         raise CGroupsException('CGroup controller {0} is not supported for cgroup {1}'.format(
                             cgroup.controller, cgroup.name))
+
+                    pressure = cgroup.get_pressure()
+                    if pressure is not None:
+                        category, some_counter, full_counter = _PRESSURE_COUNTERS[cgroup.controller]
+                        metrics.append(MetricValue(category, some_counter, cgroup.name, pressure["some"]))
+                        if full_counter is not None and "full" in pressure:
+                            metrics.append(MetricValue(category, full_counter, cgroup.name, pressure["full"]))
                 except Exception as e:
                     # There can be scenarios when the CGroup has been deleted by the time we are fetching the values
                     # from it. This would raise IOError with file entry not found (ERRNO: 2). We do not want to log
@@ -229,6 +351,10 @@ class CGroupsTelemetry(object):
                     CGroupsTelemetry.stop_tracking(cgroup)
                     CGroupsTelemetry._cgroup_metrics[cgroup.name].marked_for_delete = True
 
+            # drop the summaries of the processes that are no longer running
+            for pid in [pid for pid in CGroupsTelemetry._process_info_summaries if pid not in polled_pids]:
+                del CGroupsTelemetry._process_info_summaries[pid]
+
         return metrics
 
     @staticmethod
@@ -243,6 +369,7 @@ class CGroupsTelemetry(object):
         with CGroupsTelemetry._rlock:
             CGroupsTelemetry._tracked *= 0  # emptying the list
             CGroupsTelemetry._cgroup_metrics = {}
+            CGroupsTelemetry._process_info_summaries = {}
 
 
 class CgroupMetrics(object):
@@ -269,6 +396,8 @@ class CgroupMetrics(object):
     def add_proc_statm_memory(self, pid, usage):
         if not self.marked_for_delete:
             if pid not in self._proc_statm_mem:
+                if len(self._proc_statm_mem) >= MAX_PROCESSES_PER_CGROUP:
+                    return
                 self._proc_statm_mem[pid] = Metric()
             self._proc_statm_mem[pid].append(usage)
 
@@ -295,8 +424,21 @@ class CgroupMetrics(object):
 
 
 class Metric(object):
+    """
+    The samples of a metric since the last report.
+
+    The samples are kept in a ring buffer of MAX_METRIC_SAMPLES items. The count, average, min and max are computed
+    as the samples are added, so they cover all the samples; the median is computed over the samples in the buffer
+    (i.e. it is approximate only if more than MAX_METRIC_SAMPLES samples were added since the last report).
+    """
     def __init__(self):
+        self._max_samples = MAX_METRIC_SAMPLES
         self._data = []
+        self._next = 0  # index of the oldest sample, once the buffer is full
+        self._count = 0
+        self._sum = 0
+        self._min = None
+        self._max = None
         self._first_poll_time = None
         self._last_poll_time = None
 
@@ -305,22 +447,44 @@ class Metric(object):
             #  We only want to do it first time.
             self._first_poll_time = dt.utcnow()
 
-        self._data.append(data)
+        if len(self._data) < self._max_samples:
+            self._data.append(data)
+        else:
+            self._data[self._next] = data
+            self._next = (self._next + 1) % self._max_samples
+
+        self._count += 1
+        self._sum += data
+        if self._min is None or data < self._min:
+            self._min = data
+        if self._max is None or data > self._max:
+            self._max = data
         self._last_poll_time = dt.utcnow()
 
     def clear(self):
         self._first_poll_time = None
         self._last_poll_time = None
         self._data *= 0
+        self._next = 0
+        self._count = 0
+        self._sum = 0
+        self._min = None
+        self._max = None
+
+    def values(self):
+        """
+        Returns the samples in the buffer, oldest first
+        """
+        return self._data[self._next:] + self._data[:self._next]
 
     def average(self):
-        return float(sum(self._data)) / float(len(self._data)) if self._data else None
+        return float(self._sum) / float(self._count) if self._count > 0 else None
 
     def max(self):
-        return max(self._data) if self._data else None
+        return self._max
 
     def min(self):
-        return min(self._data) if self._data else None
+        return self._min
 
     def median(self):
         data = sorted(self._data)
@@ -333,7 +497,7 @@ class Metric(object):
             return data[int((l_len - 1) / 2)]
 
     def count(self):
-        return len(self._data)
+        return self._count
 
     def first_poll_time(self):
         return str(self._first_poll_time)
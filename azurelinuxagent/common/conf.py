@@ -97,6 +97,8 @@ __SWITCH_OPTIONS__ = {
     "OS.CheckRdmaDriver": False,
     "Logs.Verbose": False,
     "Logs.Console": True,
+    "Logs.Buffered": False,
+    "Logs.WriterThread": False,
     "Extensions.Enabled": True,
     "Provisioning.AllowResetSysUser": False,
     "Provisioning.RegenerateSshHostKeyPair": False,
@@ -142,7 +144,10 @@ __INTEGER_OPTIONS__ = {
     "Provisioning.PasswordCryptSaltLength": 10,
     "HttpProxy.Port": None,
     "ResourceDisk.SwapSizeMB": 0,
-    "Autoupdate.Frequency": 3600
+    "Autoupdate.Frequency": 3600,
+    "Extensions.ManifestCachePeriod": 3600,
+    "Extensions.MaxParallelHandlers": 1,
+    "Extensions.StatusHeartbeatPeriod": 60
 }
 
 
@@ -186,6 +191,14 @@ def get_logs_console(conf=__conf__):
     return conf.get_switch("Logs.Console", True)
 
 
+def get_logs_buffered(conf=__conf__):
+    return conf.get_switch("Logs.Buffered", False)
+
+
+def get_logs_writer_thread(conf=__conf__):
+    return conf.get_switch("Logs.WriterThread", False)
+
+
 def get_lib_dir(conf=__conf__):
     return conf.get("Lib.Dir", "/var/lib/waagent")
 
@@ -275,6 +288,18 @@ def get_extensions_enabled(conf=__conf__):
     return conf.get_switch("Extensions.Enabled", True)
 
 
+def get_extensions_manifest_cache_period(conf=__conf__):
+    return conf.get_int("Extensions.ManifestCachePeriod", 3600)
+
+
+def get_extensions_max_parallel_handlers(conf=__conf__):
+    return max(1, conf.get_int("Extensions.MaxParallelHandlers", 1))
+
+
+def get_extensions_status_heartbeat_period(conf=__conf__):
+    return conf.get_int("Extensions.StatusHeartbeatPeriod", 60)
+
+
 def get_allow_reset_sys_user(conf=__conf__):
     return conf.get_switch("Provisioning.AllowResetSysUser", False)
 
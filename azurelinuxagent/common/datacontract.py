@@ -26,7 +26,8 @@ Base class for data contracts between guest and host and utilities to manipulate
 
 
 class DataContract(object):
-    pass
+    # Allows subclasses to define __slots__ (subclasses that do not define them still get a __dict__)
+    __slots__ = ()
 
 
 class DataContractList(list):
@@ -66,10 +67,20 @@ def set_properties(name, obj, data):
         return data
 
 
+def _get_slot_properties(obj):
+    props = {}
+    for cls in type(obj).__mro__:
+        for name in getattr(cls, "__slots__", ()):
+            # private slots are not part of the contract
+            if not name.startswith("_") and hasattr(obj, name):
+                props[name] = getattr(obj, name)
+    return props
+
+
 def get_properties(obj):
     if isinstance(obj, DataContract):
         data = {}
-        props = vars(obj)
+        props = vars(obj) if hasattr(obj, "__dict__") else _get_slot_properties(obj)
         for prob_name, prob in list(props.items()):
             data[prob_name] = get_properties(prob)
         return data
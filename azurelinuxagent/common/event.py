@@ -30,13 +30,13 @@ import azurelinuxagent.common.conf as conf
 import azurelinuxagent.common.logger as logger
 from azurelinuxagent.common.exception import EventError, OSUtilError
 from azurelinuxagent.common.future import ustr
-from azurelinuxagent.common.datacontract import get_properties, set_properties
 from azurelinuxagent.common.osutil import get_osutil
-from azurelinuxagent.common.telemetryevent import TelemetryEventParam, TelemetryEvent
-from azurelinuxagent.common.utils import fileutil, textutil
+from azurelinuxagent.common.telemetryevent import TelemetryEventParam, TelemetryEvent, TelemetryEventParamList
+from azurelinuxagent.common.utils import textutil
+from azurelinuxagent.common.utils.spoolutil import Spool
 from azurelinuxagent.common.utils.textutil import parse_doc, findall, find, getattrib
 from azurelinuxagent.common.version import CURRENT_VERSION, CURRENT_AGENT, DISTRO_NAME, DISTRO_VERSION, DISTRO_CODE_NAME, AGENT_EXECUTION_MODE
-from azurelinuxagent.common.telemetryevent import TelemetryEventList
+from azurelinuxagent.common.telemetryevent import TelemetryEventList, TelemetryEventEncoder
 from azurelinuxagent.common.protocol.goal_state import GoalState
 from azurelinuxagent.common.protocol.imds import get_imds_client
 
@@ -56,9 +56,16 @@ TELEMETRY_LOG_EVENT_ID = 7
 #
 SEND_LOGS_TO_TELEMETRY = False
 
+# Maximum number of event files (written by extensions, or by previous versions of the agent) kept in the events directory
 MAX_NUMBER_OF_EVENTS = 1000
 
-AGENT_EVENT_FILE_EXTENSION = '.waagent.tld'
+# Regexes used to remove the timestamp and level from the log messages sent to telemetry (see
+# EventLogger._clean_up_message). Most of the logs would have the level included in the log itself, but if it doesn't
+# have it, the second regex is a catch all case and will work for all the cases.
+_LOG_LEVEL_FORMAT_PARSER = re.compile(r"^.*(INFO|WARNING|ERROR|VERBOSE)\s*(.*)$")
+_LOG_FORMAT_PARSER = re.compile(r"^[0-9:/\-TZ\s.]*\s(.*)$")
+
+AGENT_EVENT_FILE_EXTENSION = '.waagent.tld'  # event files created by previous versions of the agent
 EVENT_FILE_REGEX = re.compile(r'(?P<agent_event>\.waagent)?\.tld$')
 
 def send_logs_to_telemetry():
@@ -183,9 +190,7 @@ __event_status_operations__ = [
 
 
 def parse_json_event(data_str):
-    data = json.loads(data_str)
-    event = TelemetryEvent()
-    set_properties("TelemetryEvent", event, data)
+    event = TelemetryEvent.from_json(data_str)
     event.file_type = "json"
     return event
 
@@ -278,6 +283,7 @@ class EventLogger(object):
     def __init__(self):
         self.event_dir = None
         self.periodic_events = {}
+        self._spool = None
 
         #
         # All events should have these parameters.
@@ -320,6 +326,10 @@ class EventLogger(object):
         self._common_parameters.append(TelemetryEventParam('VMId', "VMId_UNINITIALIZED"))
         self._common_parameters.append(TelemetryEventParam('ImageOrigin', 0))
 
+        # The JSON encoding of the common parameters that do not change from event to event (see
+        # _get_common_parameters_fragments()); it is computed on first use and reset when those parameters change.
+        self._common_parameters_fragments = None
+
     @staticmethod
     def _get_os_version():
         return "{0}:{1}-{2}-{3}:{4}".format(platform.system(), DISTRO_NAME, DISTRO_VERSION, DISTRO_CODE_NAME, platform.release())
@@ -369,39 +379,25 @@ class EventLogger(object):
         except Exception as e:
             logger.warn("Failed to get IMDS info; will be missing from telemetry: {0}", ustr(e))
 
+        self._common_parameters_fragments = None
+
     def save_event(self, data):
+        """
+        Appends the event to the spool in the events directory; the spool is read by collect_events()
+        """
         if self.event_dir is None:
             logger.warn("Cannot save event -- Event reporter is not initialized.")
             return
 
-        try:
-            fileutil.mkdir(self.event_dir, mode=0o700)
-        except (IOError, OSError) as e:
-            msg = "Failed to create events folder {0}. Error: {1}".format(self.event_dir, ustr(e))
-            raise EventError(msg)
-
-        try:
-            existing_events = os.listdir(self.event_dir)
-            if len(existing_events) >= MAX_NUMBER_OF_EVENTS:
-                logger.periodic_warn(logger.EVERY_MINUTE, "[PERIODIC] Too many files under: {0}, current count:  {1}, "
-                                                          "removing oldest event files".format(self.event_dir,
-                                                                                               len(existing_events)))
-                existing_events.sort()
-                oldest_files = existing_events[:-999]
-                for event_file in oldest_files:
-                    os.remove(os.path.join(self.event_dir, event_file))
-        except (IOError, OSError) as e:
-            msg = "Failed to remove old events from events folder {0}. Error: {1}".format(self.event_dir, ustr(e))
-            raise EventError(msg)
+        if self._spool is None or self._spool.directory != self.event_dir:
+            if self._spool is not None:
+                self._spool.close()
+            self._spool = Spool(self.event_dir)
 
-        filename = os.path.join(self.event_dir,
-                                ustr(int(time.time() * 1000000)))
         try:
-            with open(filename + ".tmp", 'wb+') as hfile:
-                hfile.write(data.encode("utf-8"))
-            os.rename(filename + ".tmp", filename + AGENT_EVENT_FILE_EXTENSION)
+            self._spool.append(data.encode("utf-8"))
         except (IOError, OSError) as e:
-            msg = "Failed to write events to file: {0}".format(e)
+            msg = "Failed to save event to {0}. Error: {1}".format(self.event_dir, ustr(e))
             raise EventError(msg)
 
     def reset_periodic(self):
@@ -426,33 +422,31 @@ class EventLogger(object):
         if (not is_success) and log_event:
             _log_event(name, op, message, duration, is_success=is_success)
 
-        event = TelemetryEvent(TELEMETRY_EVENT_EVENT_ID, TELEMETRY_EVENT_PROVIDER_ID)
-        event.parameters.append(TelemetryEventParam('Name', str(name)))
-        event.parameters.append(TelemetryEventParam('Version', str(version)))
-        event.parameters.append(TelemetryEventParam('Operation', str(op)))
-        event.parameters.append(TelemetryEventParam('OperationSuccess', bool(is_success)))
-        event.parameters.append(TelemetryEventParam('Message', str(message)))
-        event.parameters.append(TelemetryEventParam('Duration', int(duration)))
-        self._add_common_event_parameters(event, datetime.utcnow())
+        parameters = [
+            ('Name', str(name)),
+            ('Version', str(version)),
+            ('Operation', str(op)),
+            ('OperationSuccess', bool(is_success)),
+            ('Message', str(message)),
+            ('Duration', int(duration))
+        ]
 
-        data = get_properties(event)
         try:
-            self.save_event(json.dumps(data))
+            self.save_event(self._encode_event(TELEMETRY_EVENT_EVENT_ID, TELEMETRY_EVENT_PROVIDER_ID, parameters, datetime.utcnow()))
         except EventError as e:
             logger.periodic_error(logger.EVERY_FIFTEEN_MINUTES, "[PERIODIC] {0}".format(ustr(e)))
 
     def add_log_event(self, level, message):
-        event = TelemetryEvent(TELEMETRY_LOG_EVENT_ID, TELEMETRY_LOG_PROVIDER_ID)
-        event.parameters.append(TelemetryEventParam('EventName', WALAEventOperation.Log))
-        event.parameters.append(TelemetryEventParam('CapabilityUsed', logger.LogLevel.STRINGS[level]))
-        event.parameters.append(TelemetryEventParam('Context1', self._clean_up_message(message)))
-        event.parameters.append(TelemetryEventParam('Context2', ''))
-        event.parameters.append(TelemetryEventParam('Context3', ''))
-        self._add_common_event_parameters(event, datetime.utcnow())
-
-        data = get_properties(event)
+        parameters = [
+            ('EventName', WALAEventOperation.Log),
+            ('CapabilityUsed', logger.LogLevel.STRINGS[level]),
+            ('Context1', self._clean_up_message(message)),
+            ('Context2', ''),
+            ('Context3', '')
+        ]
+
         try:
-            self.save_event(json.dumps(data))
+            self.save_event(self._encode_event(TELEMETRY_LOG_EVENT_ID, TELEMETRY_LOG_PROVIDER_ID, parameters, datetime.utcnow()))
         except EventError:
             pass
 
@@ -471,16 +465,15 @@ class EventLogger(object):
             message = "Metric {0}/{1} [{2}] = {3}".format(category, counter, instance, value)
             _log_event(AGENT_NAME, "METRIC", message, 0)
 
-        event = TelemetryEvent(TELEMETRY_METRICS_EVENT_ID, TELEMETRY_EVENT_PROVIDER_ID)
-        event.parameters.append(TelemetryEventParam('Category', str(category)))
-        event.parameters.append(TelemetryEventParam('Counter', str(counter)))
-        event.parameters.append(TelemetryEventParam('Instance', str(instance)))
-        event.parameters.append(TelemetryEventParam('Value', float(value)))
-        self._add_common_event_parameters(event, datetime.utcnow())
+        parameters = [
+            ('Category', str(category)),
+            ('Counter', str(counter)),
+            ('Instance', str(instance)),
+            ('Value', float(value))
+        ]
 
-        data = get_properties(event)
         try:
-            self.save_event(json.dumps(data))
+            self.save_event(self._encode_event(TELEMETRY_METRICS_EVENT_ID, TELEMETRY_EVENT_PROVIDER_ID, parameters, datetime.utcnow()))
         except EventError as e:
             logger.periodic_error(logger.EVERY_FIFTEEN_MINUTES, "[PERIODIC] {0}".format(ustr(e)))
 
@@ -507,19 +500,13 @@ class EventLogger(object):
         if not message:
             return message
 
-        # Adding two regexs to simplify the handling of logs and to keep it maintainable. Most of the logs would have
-        # level includent in the log itself, but if it doesn't have, the second regex is a catch all case and will work
-        # for all the cases.
-        log_level_format_parser = re.compile(r"^.*(INFO|WARNING|ERROR|VERBOSE)\s*(.*)$")
-        log_format_parser = re.compile(r"^[0-9:/\-TZ\s.]*\s(.*)$")
-
         # Parsing the log messages containing levels in it
-        extract_level_message = log_level_format_parser.search(message)
+        extract_level_message = _LOG_LEVEL_FORMAT_PARSER.search(message)
         if extract_level_message:
             return extract_level_message.group(2)  # The message bit
         else:
             # Parsing the log messages without levels in it.
-            extract_message = log_format_parser.search(message)
+            extract_message = _LOG_FORMAT_PARSER.search(message)
             if extract_message:
                 return extract_message.group(1)  # The message bit
             else:
@@ -543,6 +530,48 @@ class EventLogger(object):
         event.parameters.extend(common_params)
         event.parameters.extend(self._common_parameters)
 
+    @staticmethod
+    def _encode_parameters(parameters):
+        """
+        Returns the JSON encoding of the given (name, value) pairs as TelemetryEventParams, without the enclosing brackets
+        """
+        return json.dumps([{'name': name, 'value': value} for name, value in parameters])[1:-1]
+
+    def _get_common_parameters_fragments(self):
+        """
+        Returns the JSON encoding of the common parameters that come before and after the parameters computed for each
+        event (see _add_common_event_parameters). These change only with the goal state (ContainerId) or when the VM info
+        is initialized, so they are encoded once and reused.
+        """
+        container_id = GoalState.ContainerID
+        fragments = self._common_parameters_fragments
+        if fragments is None or fragments[0] != container_id:
+            before = self._encode_parameters([('GAVersion', CURRENT_AGENT), ('ContainerId', container_id)])
+            after = self._encode_parameters(
+                [('KeywordName', ''), ('ExtensionType', ''), ('IsInternal', False)] +
+                [(p.name, p.value) for p in self._common_parameters])
+            fragments = (container_id, before, after)
+            self._common_parameters_fragments = fragments
+        return fragments[1], fragments[2]
+
+    def _encode_event(self, event_id, provider_id, parameters, event_timestamp):
+        """
+        Returns the JSON encoding of a TelemetryEvent with the given parameters plus the common parameters; this is
+        equivalent to creating the event, calling _add_common_event_parameters() on it, and encoding it with
+        get_properties() and json.dumps().
+        """
+        before, after = self._get_common_parameters_fragments()
+        current_thread = threading.current_thread()
+        per_event_parameters = self._encode_parameters([
+            ('OpcodeName', event_timestamp.strftime(u'%Y-%m-%dT%H:%M:%S.%fZ')),
+            ('EventTid', current_thread.ident),
+            ('EventPid', os.getpid()),
+            ('TaskName', current_thread.getName())])
+
+        return '{"eventId": ' + json.dumps(event_id) + ', "providerId": ' + json.dumps(provider_id) + \
+               ', "parameters": [' + self._encode_parameters(parameters) + ', ' + before + ', ' + \
+               per_event_parameters + ', ' + after + '], "file_type": ""}'
+
     @staticmethod
     def _trim_extension_event_parameters(event):
         """
@@ -555,7 +584,7 @@ class EventLogger(object):
         :return: Trimmed extension event; containing only extension-specific parameters.
         """
         params_to_keep = dict().fromkeys(['Name', 'Version', 'Operation', 'OperationSuccess', 'Message', 'Duration'])
-        trimmed_params = []
+        trimmed_params = TelemetryEventParamList()
 
         for param in event.parameters:
             if param.name in params_to_keep:
@@ -565,57 +594,178 @@ class EventLogger(object):
 
     def collect_events(self):
         """
-        Retuns a list of events that need to be sent to the telemetry pipeline and deletes the corresponding files
-        from the events directory.
+        Retuns a list of events that need to be sent to the telemetry pipeline and acknowledges them (see
+        collect_event_batches)
         """
         event_list = TelemetryEventList()
+        for batch, acknowledge in self.collect_event_batches():
+            event_list.events.extend(batch.events)
+            acknowledge()
+        return event_list
+
+    def collect_event_batches(self, max_batch_size=None):
+        """
+        Generator that returns the events that need to be sent to the telemetry pipeline, in batches that are sent to
+        the WireServer in a single request: the events in a batch have the same provider, and their encoded size is
+        less than 'max_batch_size' bytes (unless the batch has a single event; there is no limit if 'max_batch_size' is
+        None). Those are the events appended to the spool, plus the events in the event files created by extensions
+        (and by previous versions of the agent).
+
+        Each item is a tuple with a TelemetryEventList and a function that acknowledges the batch. Acknowledging a batch
+        of spooled events marks them as read, along with the spooled events of the previous batches; acknowledging a
+        batch of event files deletes only the files of that batch. Batches that are not acknowledged are returned again
+        the next time events are collected, so callers should acknowledge each batch once it has been sent, and stop at
+        the first batch they do not acknowledge.
+
+        The events are encoded to compute the size of the batches; the encoded events are kept in the TelemetryEventList
+        (see TelemetryEventList.get_encoded_events) so that WireClient.report_event does not need to encode them again.
+        """
         event_directory_full_path = os.path.join(conf.get_lib_dir(), EVENTS_DIRECTORY)
-        event_files = os.listdir(event_directory_full_path)
+        encoder = TelemetryEventEncoder()
 
-        for event_file in event_files:
-            try:
-                match = EVENT_FILE_REGEX.search(event_file)
-                if match is None:
+        spool_batches = Spool(event_directory_full_path).read_batches(max_batch_size)
+        try:
+            for records, acknowledge in spool_batches:
+                events = []
+                # number of records up to (and including) each event; used to acknowledge the first part of the batch
+                record_counts = []
+                for i, event_data in enumerate(records):
+                    try:
+                        events.append(parse_event(event_data.decode("utf-8")))
+                        record_counts.append(i + 1)
+                    except Exception as e:
+                        logger.warn("Failed to process spooled event: {0}", ustr(e))
+                if len(events) == 0:
+                    acknowledge()
                     continue
+                encoded_events = [encoder.encode(event) for event in events]
+                for start, end in EventLogger._split_events(events, encoded_events, max_batch_size):
+                    event_list = EventLogger._create_event_list(events[start:end], encoded_events[start:end])
+                    if end == len(events):
+                        yield event_list, acknowledge
+                    else:
+                        yield event_list, EventLogger._get_partial_acknowledge_function(acknowledge, record_counts[end - 1])
+        finally:
+            spool_batches.close()
+
+        event_files = [f for f in os.listdir(event_directory_full_path) if EVENT_FILE_REGEX.search(f) is not None]
+        event_files.sort()
+
+        if len(event_files) > MAX_NUMBER_OF_EVENTS:
+            logger.periodic_warn(logger.EVERY_MINUTE, "[PERIODIC] Too many files under: {0}, current count:  {1}, "
+                                                      "removing oldest event files".format(event_directory_full_path,
+                                                                                           len(event_files)))
+            for event_file in event_files[:-MAX_NUMBER_OF_EVENTS]:
+                EventLogger._remove_event_file(os.path.join(event_directory_full_path, event_file))
+            event_files = event_files[-MAX_NUMBER_OF_EVENTS:]
 
-                event_file_path = os.path.join(event_directory_full_path, event_file)
-
-                try:
-                    logger.verbose("Processing event file: {0}", event_file_path)
+        event_list = TelemetryEventList()
+        batch_files = []
+        batch_size = 0
 
-                    with open(event_file_path, "rb") as fd:
-                        event_data = fd.read().decode("utf-8")
+        for event_file in event_files:
+            event_file_path = os.path.join(event_directory_full_path, event_file)
+            try:
+                logger.verbose("Processing event file: {0}", event_file_path)
 
-                    event = parse_event(event_data)
+                with open(event_file_path, "rb") as fd:
+                    event_data = fd.read().decode("utf-8")
 
-                    # "legacy" events are events produced by previous versions of the agent (<= 2.2.46) and extensions;
-                    # they do not include all the telemetry fields, so we add them here
-                    is_legacy_event = match.group('agent_event') is None
+                event = parse_event(event_data)
 
-                    if is_legacy_event:
-                        # We'll use the file creation time for the event's timestamp
-                        event_file_creation_time_epoch = os.path.getmtime(event_file_path)
-                        event_file_creation_time = datetime.fromtimestamp(event_file_creation_time_epoch)
+                # "legacy" events are events produced by previous versions of the agent (<= 2.2.46) and extensions;
+                # they do not include all the telemetry fields, so we add them here
+                is_legacy_event = EVENT_FILE_REGEX.search(event_file).group('agent_event') is None
 
-                        if event.is_extension_event():
-                            EventLogger._trim_extension_event_parameters(event)
-                            self._add_common_event_parameters(event, event_file_creation_time)
-                        else:
-                            self._update_legacy_agent_event(event, event_file_creation_time)
+                if is_legacy_event:
+                    # We'll use the file creation time for the event's timestamp
+                    event_file_creation_time_epoch = os.path.getmtime(event_file_path)
+                    event_file_creation_time = datetime.fromtimestamp(event_file_creation_time_epoch)
 
-                    event_list.events.append(event)
-                finally:
-                    os.remove(event_file_path)
+                    if event.is_extension_event():
+                        EventLogger._trim_extension_event_parameters(event)
+                        self._add_common_event_parameters(event, event_file_creation_time)
+                    else:
+                        self._update_legacy_agent_event(event, event_file_creation_time)
             except Exception as e:
                 logger.warn("Failed to process event file {0}: {1}", event_file, ustr(e))
+                # invalid event files are never sent, so they are removed right away
+                EventLogger._remove_event_file(event_file_path)
+                continue
+
+            event_list.events.append(event)
+            batch_files.append(event_file_path)
+            batch_size += len(event_data)
 
+            if max_batch_size is not None and batch_size >= max_batch_size:
+                for batch in EventLogger._split_event_file_batch(event_list.events, batch_files, max_batch_size, encoder):
+                    yield batch
+                event_list = TelemetryEventList()
+                batch_files = []
+                batch_size = 0
+
+        for batch in EventLogger._split_event_file_batch(event_list.events, batch_files, max_batch_size, encoder):
+            yield batch
+
+    @staticmethod
+    def _split_events(events, encoded_events, max_batch_size):
+        """
+        Generator that returns the (start, end) ranges of 'events' that WireClient.report_event sends in a single
+        request when 'max_batch_size' is MAX_EVENT_BUFFER_SIZE: it sends the events of each provider separately, in
+        requests of less than MAX_EVENT_BUFFER_SIZE bytes. 'encoded_events' are the events encoded by
+        TelemetryEventEncoder.
+        """
+        start = 0
+        size = 0
+        for i in range(len(events)):
+            event_size = len(encoded_events[i])
+            if i > start and (events[i].providerId != events[start].providerId or
+                              (max_batch_size is not None and size + event_size >= max_batch_size)):
+                yield start, i
+                start = i
+                size = 0
+            size += event_size
+        if start < len(events):
+            yield start, len(events)
+
+    @staticmethod
+    def _split_event_file_batch(events, event_files, max_batch_size, encoder):
+        encoded_events = [encoder.encode(event) for event in events]
+        for start, end in EventLogger._split_events(events, encoded_events, max_batch_size):
+            yield EventLogger._create_event_list(events[start:end], encoded_events[start:end]), \
+                EventLogger._get_remove_event_files_function(event_files[start:end])
+
+    @staticmethod
+    def _create_event_list(events, encoded_events):
+        event_list = TelemetryEventList()
+        event_list.events.extend(events)
+        event_list.set_encoded_events(encoded_events)
         return event_list
 
+    @staticmethod
+    def _get_partial_acknowledge_function(acknowledge, count):
+        def acknowledge_partially():
+            acknowledge(count)
+        return acknowledge_partially
+
+    @staticmethod
+    def _remove_event_file(event_file_path):
+        try:
+            os.remove(event_file_path)
+        except (IOError, OSError) as e:
+            logger.warn("Failed to remove event file {0}: {1}", event_file_path, ustr(e))
+
+    @staticmethod
+    def _get_remove_event_files_function(event_files):
+        def remove_event_files():
+            for event_file_path in event_files:
+                EventLogger._remove_event_file(event_file_path)
+        return remove_event_files
+
     def _update_legacy_agent_event(self, event, event_creation_time):
         # Ensure that if an agent event is missing a field from the schema defined since 2.2.47, the missing fields
         # will be appended, ensuring the event schema is complete before the event is reported.
         new_event = TelemetryEvent()
-        new_event.parameters = []
         self._add_common_event_parameters(new_event, event_creation_time)
 
         event_params = dict([(param.name, param.value) for param in event.parameters])
@@ -732,6 +882,10 @@ def collect_events(reporter=__event_logger__):
     return reporter.collect_events()
 
 
+def collect_event_batches(max_batch_size=None, reporter=__event_logger__):
+    return reporter.collect_event_batches(max_batch_size)
+
+
 def mark_event_status(name, version, op, status):
     if op in __event_status_operations__:
         __event_status__.mark_event_status(name, version, op, status)
@@ -145,6 +145,15 @@ class ProtocolError(AgentError):
         super(ProtocolError, self).__init__(msg, inner)
 
 
+class ThrottlingError(ProtocolError):
+    """
+    The server is throttling the agent's requests (e.g. status code 429 or 503); the request should be retried later
+    """
+
+    def __init__(self, msg=None, inner=None):
+        super(ThrottlingError, self).__init__(msg, inner)
+
+
 class ProtocolNotFoundError(ProtocolError):
     """
     Azure protocol endpoint not found
@@ -25,6 +25,8 @@ if sys.version_info[0] == 3:
 
     from collections import OrderedDict
 
+    import queue
+
 elif sys.version_info[0] == 2:
     import httplib as httpclient
     from urlparse import urlparse
@@ -38,6 +40,8 @@ elif sys.version_info[0] == 2:
         from collections import OrderedDict  # For Py 2.7+
     else:
         from ordereddict import OrderedDict  # Works only on 2.6
+
+    import Queue as queue
 else:
     raise ImportError("Unknown python version: {0}".format(sys.version_info))
 
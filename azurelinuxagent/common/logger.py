@@ -17,11 +17,16 @@
 """
 Log utils
 """
+import atexit
+import os
+import re
 import sys
+import threading
+import time
 from datetime import datetime, timedelta
 from threading import currentThread
 
-from azurelinuxagent.common.future import ustr
+from azurelinuxagent.common.future import ustr, queue
 
 EVERY_DAY = timedelta(days=1)
 EVERY_HALF_DAY = timedelta(hours=12)
@@ -31,6 +36,21 @@ EVERY_HALF_HOUR = timedelta(minutes=30)
 EVERY_FIFTEEN_MINUTES = timedelta(minutes=15)
 EVERY_MINUTE = timedelta(minutes=1)
 
+# Log messages are written as ASCII; any other characters are replaced by their backslash escapes
+_NON_ASCII_PATTERN = re.compile(u'[^\u0000-\u007f]')
+
+# Maximum number of (level, thread name, prefix) headers cached by each logger
+_MAX_CACHED_HEADERS = 64
+
+# The buffer of a BufferedFileAppender is flushed when an ERROR is logged, when it reaches this size (in characters),
+# and at least once per this period (in seconds)
+BUFFERED_APPENDER_MAX_BUFFER_SIZE = 64 * 1024
+BUFFERED_APPENDER_FLUSH_PERIOD = 1
+
+# Maximum number of messages queued for the writer thread of a BufferedFileAppender; when the queue is full the
+# callers wait for the writer thread
+BUFFERED_APPENDER_MAX_QUEUE_SIZE = 1024
+
 
 class Logger(object):
     """
@@ -41,6 +61,10 @@ class Logger(object):
         self.logger = self if logger is None else logger
         self.periodic_messages = {}
         self.prefix = prefix
+        # the header of the log messages (level, thread name and prefix), indexed by (level, thread name, prefix)
+        self._headers = {}
+        # the timestamp of the last log message, truncated to seconds, and its formatted value
+        self._timestamp = (None, None)
 
     def reset_periodic(self):
         self.logger.periodic_messages = {}
@@ -83,6 +107,10 @@ class Logger(object):
         self.log(LogLevel.ERROR, msg_format, *args)
 
     def log(self, level, msg_format, *args):
+        # Skip the formatting of the message if none of the appenders would write it
+        if not self._is_level_enabled(level):
+            return
+
         def write_log(log_appender):
             """
             The appender_lock flag is used to signal if the logger is currently in use. This prevents a subsequent log
@@ -127,17 +155,11 @@ class Logger(object):
             msg = msg_format.format(*args)
         else:
             msg = msg_format
-            # This format is based on ISO-8601, Z represents UTC (Zero offset)
-        time = datetime.utcnow().strftime(u'%Y-%m-%dT%H:%M:%S.%fZ')
-        level_str = LogLevel.STRINGS[level]
-        thread_name = currentThread().getName()
-        if self.prefix is not None:
-            log_item = u"{0} {1} {2} {3} {4}\n".format(time, level_str, thread_name, self.prefix, msg)
-        else:
-            log_item = u"{0} {1} {2} {3}\n".format(time, level_str, thread_name, msg)
 
-        log_item = ustr(log_item.encode('ascii', "backslashreplace"), 
-                        encoding="ascii")
+        if _NON_ASCII_PATTERN.search(msg) is not None:
+            msg = _to_ascii(msg)
+
+        log_item = u"{0} {1}{2}\n".format(self._format_timestamp(datetime.utcnow()), self._get_header(level), msg)
 
         for appender in self.appenders:
             appender.write(level, log_item)
@@ -158,6 +180,41 @@ class Logger(object):
                 # TODO: call write_log instead (see comment above)
                 #
 
+    def _is_level_enabled(self, level):
+        for appender in self.appenders:
+            if appender.level <= level:
+                return True
+        if self.logger != self:
+            for appender in self.logger.appenders:
+                if appender.level <= level:
+                    return True
+        return False
+
+    def _format_timestamp(self, timestamp):
+        # This format is based on ISO-8601, Z represents UTC (Zero offset). The part up to the seconds changes at most
+        # once per second, so it is formatted only when it changes.
+        seconds = timestamp.replace(microsecond=0)
+        cached_seconds, formatted_seconds = self._timestamp
+        if seconds != cached_seconds:
+            formatted_seconds = seconds.strftime(u'%Y-%m-%dT%H:%M:%S')
+            self._timestamp = (seconds, formatted_seconds)
+        return u"{0}.{1:06d}Z".format(formatted_seconds, timestamp.microsecond)
+
+    def _get_header(self, level):
+        thread_name = currentThread().name
+        key = (level, thread_name, self.prefix)
+        header = self._headers.get(key)
+        if header is None:
+            if self.prefix is not None:
+                header = u"{0} {1} {2} ".format(LogLevel.STRINGS[level], thread_name, self.prefix)
+            else:
+                header = u"{0} {1} ".format(LogLevel.STRINGS[level], thread_name)
+            header = _to_ascii(header)
+            if len(self._headers) >= _MAX_CACHED_HEADERS:
+                self._headers = {}
+            self._headers[key] = header
+        return header
+
     def add_appender(self, appender_type, level, path):
         appender = _create_logger_appender(appender_type, level, path)
         self.appenders.append(appender)
@@ -171,6 +228,12 @@ class Appender(object):
     def write(self, level, msg):
         pass
 
+    def flush(self):
+        pass
+
+    def reopen(self):
+        pass
+
 
 class ConsoleAppender(Appender):
     def __init__(self, level, path):
@@ -200,6 +263,193 @@ class FileAppender(Appender):
                 pass
 
 
+class BufferedFileAppender(Appender):
+    """
+    Appender that keeps the log file open and writes the messages in batches (see BUFFERED_APPENDER_* for the flush
+    policy). The file is reopened when it is rotated (i.e. the path refers to a different file) or after reopen() is
+    called, e.g. on SIGHUP.
+
+    If use_writer_thread is True, the callers only add the messages to a bounded queue and a background thread writes
+    them to the file; otherwise, the messages are buffered on the caller's thread and the background thread only
+    flushes the buffer periodically.
+
+    A message written while the same thread is already inside the appender (e.g. by a signal handler that interrupted
+    a write) is appended directly to the file, since waiting for the lock or the queue would deadlock.
+    """
+    def __init__(self, level, path, use_writer_thread=False):
+        super(BufferedFileAppender, self).__init__(level)
+        self.path = path
+        self._use_writer_thread = use_writer_thread
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._init_state()
+
+    def _init_state(self):
+        self._lock = threading.RLock()
+        self._active = threading.local()
+        self._queue = queue.Queue(BUFFERED_APPENDER_MAX_QUEUE_SIZE) if self._use_writer_thread else None
+        self._buffer = []
+        self._buffer_size = 0
+        self._last_flush = time.time()
+        self._file = None
+        self._reopen = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def write(self, level, msg):
+        if self.level <= level:
+            if self._pid != os.getpid():
+                with self._start_lock:
+                    if self._pid != os.getpid():
+                        self._start()
+
+            if not self._enter():
+                self._write_unbuffered(msg)
+                return
+            try:
+                if self._queue is not None and not self._stop.is_set():
+                    try:
+                        # blocks while the queue is full; if the writer thread is stuck, the caller writes the message
+                        self._queue.put((level, msg), timeout=BUFFERED_APPENDER_FLUSH_PERIOD)
+                        return
+                    except queue.Full:
+                        pass
+
+                with self._lock:
+                    # write any messages still in the queue first, to keep the messages in order
+                    self._drain_queue()
+                    self._append(level, msg)
+            finally:
+                self._exit()
+
+    def flush(self):
+        if not self._enter():
+            return
+        try:
+            with self._lock:
+                self._drain_queue()
+                self._flush()
+        finally:
+            self._exit()
+
+    def reopen(self):
+        # Only sets a flag, since this can be called from a signal handler; the file is reopened on the next flush
+        self._reopen = True
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None and self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+        if not self._enter():
+            return
+        try:
+            with self._lock:
+                self._drain_queue()
+                self._flush()
+                self._close_file()
+        finally:
+            self._exit()
+
+    def _enter(self):
+        """
+        Marks the calling thread as being inside the appender; returns False if it already was (i.e. the appender
+        was re-entered, for example from a signal handler)
+        """
+        if getattr(self._active, "value", False):
+            return False
+        self._active.value = True
+        return True
+
+    def _exit(self):
+        self._active.value = False
+
+    def _write_unbuffered(self, msg):
+        try:
+            with open(self.path, "a") as log_file:
+                log_file.write(msg)
+        except IOError:
+            pass
+
+    def _start(self):
+        # The appender may have been inherited from the parent process; the parent flushes its own buffer
+        if self._pid is not None:
+            self._init_state()
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setName("BufferedLogWriter")
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self._queue is not None:
+                try:
+                    level, msg = self._queue.get(timeout=BUFFERED_APPENDER_FLUSH_PERIOD)
+                    with self._lock:
+                        self._append(level, msg)
+                    continue
+                except queue.Empty:
+                    pass
+            else:
+                self._stop.wait(BUFFERED_APPENDER_FLUSH_PERIOD)
+            self.flush()
+
+    def _drain_queue(self):
+        # NOTE: must be called with the lock held
+        if self._queue is None:
+            return
+        while True:
+            try:
+                level, msg = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            self._append(level, msg)
+
+    def _append(self, level, msg):
+        # NOTE: must be called with the lock held
+        self._buffer.append(msg)
+        self._buffer_size += len(msg)
+        if level >= LogLevel.ERROR or self._buffer_size >= BUFFERED_APPENDER_MAX_BUFFER_SIZE or \
+                time.time() - self._last_flush >= BUFFERED_APPENDER_FLUSH_PERIOD:
+            self._flush()
+
+    def _flush(self):
+        # NOTE: must be called with the lock held
+        self._last_flush = time.time()
+        if len(self._buffer) == 0:
+            return
+
+        data = u"".join(self._buffer)
+        self._buffer = []
+        self._buffer_size = 0
+
+        try:
+            if self._file is None or self._is_file_rotated():
+                self._close_file()
+                self._file = open(self.path, "a")
+            self._file.write(data)
+            self._file.flush()
+        except (IOError, OSError):
+            self._close_file()
+
+    def _is_file_rotated(self):
+        if self._reopen:
+            self._reopen = False
+            return True
+        try:
+            return os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino
+        except (IOError, OSError):
+            return True
+
+    def _close_file(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except (IOError, OSError):
+                pass
+            self._file = None
+
+
 class StdoutAppender(Appender):
     def __init__(self, level):
         super(StdoutAppender, self).__init__(level)
@@ -247,6 +497,9 @@ class AppenderType(object):
     CONSOLE = 1
     STDOUT = 2
     TELEMETRY = 3
+    BUFFERED_FILE = 4
+    # A BUFFERED_FILE written from a background thread
+    ASYNC_FILE = 5
 
 
 def add_logger_appender(appender_type, level=LogLevel.INFO, path=None):
@@ -257,6 +510,23 @@ def reset_periodic():
     DEFAULT_LOGGER.reset_periodic()
 
 
+def flush():
+    for appender in DEFAULT_LOGGER.appenders:
+        appender.flush()
+
+
+def reopen():
+    """
+    Reopens the log files of the buffered appenders (e.g. after they were rotated); this can be called from a signal
+    handler.
+    """
+    for appender in DEFAULT_LOGGER.appenders:
+        appender.reopen()
+
+
+atexit.register(flush)
+
+
 def set_prefix(prefix):
     DEFAULT_LOGGER.set_prefix(prefix)
 
@@ -313,6 +583,10 @@ def log(level, msg_format, *args):
     DEFAULT_LOGGER.log(level, msg_format, args)
 
 
+def _to_ascii(text):
+    return ustr(ustr(text).encode('ascii', "backslashreplace"), encoding="ascii")
+
+
 def _create_logger_appender(appender_type, level=LogLevel.INFO, path=None):
     if appender_type == AppenderType.CONSOLE:
         return ConsoleAppender(level, path)
@@ -322,6 +596,10 @@ def _create_logger_appender(appender_type, level=LogLevel.INFO, path=None):
         return StdoutAppender(level)
     elif appender_type == AppenderType.TELEMETRY:
         return TelemetryAppender(level, path)
+    elif appender_type == AppenderType.BUFFERED_FILE:
+        return BufferedFileAppender(level, path)
+    elif appender_type == AppenderType.ASYNC_FILE:
+        return BufferedFileAppender(level, path, use_writer_thread=True)
     else:
         raise ValueError("Unknown appender type")
 
@@ -326,6 +326,9 @@ class DefaultOSUtil(object):
             elif not os.path.isdir(self._cgroup_path()):
                 logger.error("Could not mount cgroups: ordinary file at {0}", path)
                 return
+            elif os.path.exists(self._cgroup_path("cgroup.controllers")):
+                # the unified hierarchy (cgroup v2) is already mounted and includes all the controllers
+                return
 
             controllers_to_mount = ['cpu,cpuacct', 'memory']
             errors = 0
@@ -19,12 +19,14 @@
 import json
 import os
 import re
+import threading
 
 import azurelinuxagent.common.conf as conf
 import azurelinuxagent.common.logger as logger
 from azurelinuxagent.common.datacontract import set_properties, DataContract, DataContractList
 from azurelinuxagent.common.utils import fileutil
 from azurelinuxagent.common.utils.cryptutil import CryptUtil
+from azurelinuxagent.common.utils.parallelutil import run_in_parallel
 from azurelinuxagent.common.utils.textutil import parse_doc, findall, find, findtext, getattrib, gettext
 from azurelinuxagent.common.protocol.restapi import *
 
@@ -35,6 +37,9 @@ PEM_FILE_NAME = "Certificates.pem"
 TRANSPORT_CERT_FILE_NAME = "TransportCert.pem"
 TRANSPORT_PRV_FILE_NAME = "TransportPrivate.pem"
 
+# Maximum number of nested documents of the goal state (ExtensionsConfig, Certificates, etc) fetched concurrently
+MAX_CONCURRENT_FETCHES = 3
+
 
 class GoalState(object):
     #
@@ -43,7 +48,15 @@ class GoalState(object):
     #
     ContainerID = "00000000-0000-0000-0000-000000000000"
 
-    def __init__(self, wire_client, full_goal_state=False, base_incarnation=None):
+    #
+    # The most recent goal states fetched by any thread (e.g. ExtHandler and Monitor). The WireClients of all the
+    # threads share these objects, so a goal state that has not changed is not parsed (or fetched) again.
+    #
+    _shared_lock = threading.RLock()
+    _shared_goal_state = None
+    _shared_full_goal_state = None
+
+    def __init__(self, wire_client, full_goal_state=False, base_incarnation=None, conditional=False, xml_text=None):
         """
         Fetches the goal state using the given wire client.
 
@@ -53,13 +66,37 @@ class GoalState(object):
         If 'base_incarnation' is given, it fetches the full goal state if the new incarnation is different than
         the given value, otherwise it fetches only the goal state itself.
 
+        If 'conditional' is True, the goal state and its nested components are fetched using conditional requests
+        and the components of the last full goal state are reused when their content has not changed.
+
+        If 'xml_text' is given, it is used as the goal state document instead of fetching it again.
+
         For better code readability, use the static fetch_* methods below instead of instantiating GoalState
         directly.
 
         """
-        uri = GOAL_STATE_URI.format(wire_client.get_endpoint())
-        self.xml_text = wire_client.fetch_config(uri, wire_client.get_header())
-        xml_doc = parse_doc(self.xml_text)
+        if xml_text is None:
+            uri = GOAL_STATE_URI.format(wire_client.get_endpoint())
+            xml_text, _ = GoalState._fetch(wire_client, uri, wire_client.get_header(), conditional)
+        self.xml_text = xml_text
+        self._parse(self.xml_text)
+
+        fetch_full_goal_state = False
+        if full_goal_state:
+            fetch_full_goal_state = True
+            reason = 'force update'
+        elif base_incarnation is not None and self.incarnation != base_incarnation:
+            fetch_full_goal_state = True
+            reason = 'new incarnation'
+
+        if not fetch_full_goal_state:
+            self._init_nested_components()
+            return
+
+        self._fetch_nested_components(wire_client, reason, conditional)
+
+    def _parse(self, xml_text):
+        xml_doc = parse_doc(xml_text)
 
         self.incarnation = findtext(xml_doc, "Incarnation")
         self.expected_state = findtext(xml_doc, "ExpectedState")
@@ -72,61 +109,128 @@ class GoalState(object):
         lbprobe_ports = find(xml_doc, "LBProbePorts")
         self.load_balancer_probe_port = findtext(lbprobe_ports, "Port")
 
-        GoalState.ContainerID = self.container_id
+        self._hosting_env_uri = findtext(xml_doc, "HostingEnvironmentConfig")
+        self._shared_conf_uri = findtext(xml_doc, "SharedConfig")
+        self._certs_uri = findtext(xml_doc, "Certificates")
+        self._ext_conf_uri = findtext(xml_doc, "ExtensionsConfig")
+        self._remote_access_uri = findtext(container, "RemoteAccessInfo")
 
-        fetch_full_goal_state = False
-        if full_goal_state:
-            fetch_full_goal_state = True
-            reason = 'force update'
-        elif base_incarnation is not None and self.incarnation != base_incarnation:
-            fetch_full_goal_state = True
-            reason = 'new incarnation'
+        GoalState.ContainerID = self.container_id
 
-        if not fetch_full_goal_state:
-            self.hosting_env = None
-            self.shared_conf = None
-            self.certs = None
-            self.ext_conf = None
-            self.remote_access = None
-            return
+    def _init_nested_components(self):
+        self._is_full_goal_state = False
+        self.hosting_env = None
+        self.shared_conf = None
+        self.certs = None
+        self.ext_conf = None
+        self.remote_access = None
 
+    def _fetch_nested_components(self, wire_client, reason, conditional):
         logger.info('Fetching new goal state [incarnation {0} ({1})]', self.incarnation, reason)
 
-        try:
-            uri = findtext(xml_doc, "HostingEnvironmentConfig")
-            xml_text = wire_client.fetch_config(uri, wire_client.get_header())
-            self.hosting_env = HostingEnv(xml_text)
+        # Components that have not changed since the last full goal state are reused; the ExtensionsConfig is
+        # always parsed again since the extension handlers update the objects created from it.
+        base = GoalState._get_shared_full_goal_state() if conditional else None
 
-            uri = findtext(xml_doc, "SharedConfig")
-            xml_text = wire_client.fetch_config(uri, wire_client.get_header())
-            self.shared_conf = SharedConfig(xml_text)
+        def fetch(uri, headers, base_component, create_component):
+            xml_text, _ = GoalState._fetch(wire_client, uri, headers, conditional)
+            if base_component is not None and base_component.xml_text == xml_text:
+                return base_component
+            return create_component(xml_text)
 
-            uri = findtext(xml_doc, "Certificates")
+        def fetch_optional(uri, headers, base_component, create_component):
             if uri is None:
-                self.certs = None
-            else:
-                xml_text = wire_client.fetch_config(uri, wire_client.get_header_for_cert())
-                self.certs = Certificates(xml_text)
+                return None
+            return fetch(uri, headers, base_component, create_component)
+
+        def fetch_ext_conf():
+            if self._ext_conf_uri is None:
+                return ExtensionsConfig(None)
+            return fetch(self._ext_conf_uri, wire_client.get_header(), None, ExtensionsConfig)
+
+        # The nested documents are independent of each other, so they are downloaded concurrently; this also
+        # overlaps the decryption of the certificates with the download of the ExtensionsConfig.
+        tasks = [
+            lambda: fetch(self._hosting_env_uri, wire_client.get_header(),
+                          base.hosting_env if base is not None else None,
+                          HostingEnv),
+            lambda: fetch(self._shared_conf_uri, wire_client.get_header(),
+                          base.shared_conf if base is not None else None,
+                          SharedConfig),
+            lambda: fetch_optional(self._certs_uri, wire_client.get_header_for_cert(),
+                                   base.certs if base is not None else None,
+                                   Certificates),
+            fetch_ext_conf,
+            lambda: fetch_optional(self._remote_access_uri, wire_client.get_header_for_cert(),
+                                   base.remote_access if base is not None else None,
+                                   RemoteAccess)
+        ]
 
-            uri = findtext(xml_doc, "ExtensionsConfig")
-            if uri is None:
-                self.ext_conf = ExtensionsConfig(None)
-            else:
-                xml_text = wire_client.fetch_config(uri, wire_client.get_header())
-                self.ext_conf = ExtensionsConfig(xml_text)
+        try:
+            results = run_in_parallel(tasks, MAX_CONCURRENT_FETCHES, name="FetchGoalState")
 
-            uri = findtext(container, "RemoteAccessInfo")
-            if uri is None:
-                self.remote_access = None
-            else:
-                xml_text = wire_client.fetch_config(uri, wire_client.get_header_for_cert())
-                self.remote_access = RemoteAccess(xml_text)
+            # Any failure fails the whole goal state; report the first one, in document order
+            for result in results:
+                if not result.succeeded:
+                    raise result.exception
+
+            self.hosting_env, self.shared_conf, self.certs, self.ext_conf, self.remote_access = \
+                [result.value for result in results]
         except Exception as e:
             logger.warn("Fetching the goal state failed: {0}", ustr(e))
             raise
         finally:
             logger.info('Fetch goal state completed')
 
+        self._is_full_goal_state = True
+
+    def is_full_goal_state(self):
+        return self._is_full_goal_state
+
+    @staticmethod
+    def _fetch(wire_client, uri, headers, conditional):
+        if conditional:
+            return wire_client.fetch_config_if_modified(uri, headers)
+        return wire_client.fetch_config(uri, headers), True
+
+    @staticmethod
+    def _get_shared_full_goal_state():
+        with GoalState._shared_lock:
+            return GoalState._shared_full_goal_state
+
+    @staticmethod
+    def _fetch_shared_goal_state_if_unchanged(wire_client):
+        """
+        Fetches the goal state document using a conditional request and returns a tuple (goal_state, xml_text),
+        where goal_state is the shared goal state if the document has not changed, or None otherwise.
+        """
+        uri = GOAL_STATE_URI.format(wire_client.get_endpoint())
+        xml_text, _ = wire_client.fetch_config_if_modified(uri, wire_client.get_header())
+
+        with GoalState._shared_lock:
+            for goal_state in [GoalState._shared_full_goal_state, GoalState._shared_goal_state]:
+                if goal_state is not None and goal_state.xml_text == xml_text:
+                    GoalState.ContainerID = goal_state.container_id
+                    return goal_state, xml_text
+
+        return None, xml_text
+
+    @staticmethod
+    def share(goal_state):
+        """
+        Makes the given goal state available to the WireClients of all threads
+        """
+        with GoalState._shared_lock:
+            GoalState._shared_goal_state = goal_state
+            if goal_state.is_full_goal_state():
+                GoalState._shared_full_goal_state = goal_state
+
+    @staticmethod
+    def clear_shared_goal_state():
+        with GoalState._shared_lock:
+            GoalState._shared_goal_state = None
+            GoalState._shared_full_goal_state = None
+
     @staticmethod
     def fetch_goal_state(wire_client):
         """
@@ -134,6 +238,19 @@ class GoalState(object):
         """
         return GoalState(wire_client)
 
+    @staticmethod
+    def fetch_goal_state_if_modified(wire_client):
+        """
+        Fetches the goal state, not including any nested properties (such as extension config), using a
+        conditional request. If the goal state has not changed, the shared goal state is returned instead of
+        parsing the document again.
+        """
+        goal_state, xml_text = GoalState._fetch_shared_goal_state_if_unchanged(wire_client)
+        if goal_state is None:
+            goal_state = GoalState(wire_client, xml_text=xml_text)
+            GoalState.share(goal_state)
+        return goal_state
+
     @staticmethod
     def fetch_full_goal_state(wire_client):
         """
@@ -145,8 +262,18 @@ class GoalState(object):
     def fetch_full_goal_state_if_incarnation_different_than(wire_client, incarnation):
         """
         Fetches the full goal state if the new incarnation is different than 'incarnation', otherwise returns None.
+
+        The request for the goal state is conditional; if the goal state has not changed and another thread
+        already fetched it in full, that goal state is returned instead of fetching it again.
         """
-        goal_state = GoalState(wire_client, base_incarnation=incarnation)
+        goal_state, xml_text = GoalState._fetch_shared_goal_state_if_unchanged(wire_client)
+        if goal_state is not None:
+            if goal_state.incarnation == incarnation:
+                return None
+            if goal_state.is_full_goal_state():
+                return goal_state
+
+        goal_state = GoalState(wire_client, base_incarnation=incarnation, conditional=True, xml_text=xml_text)
         return goal_state if goal_state.incarnation != incarnation else None
 
 
@@ -169,6 +296,7 @@ class SharedConfig(object):
 
 class Certificates(object):
     def __init__(self, xml_text):
+        self.xml_text = xml_text
         self.cert_list = CertList()
 
         # Save the certificates
@@ -305,7 +433,7 @@ class ExtensionsConfig(object):
         plugins_list = find(xml_doc, "Plugins")
         plugins = findall(plugins_list, "Plugin")
         plugin_settings_list = find(xml_doc, "PluginSettings")
-        plugin_settings = findall(plugin_settings_list, "Plugin")
+        plugin_settings = ExtensionsConfig._index_plugin_settings(findall(plugin_settings_list, "Plugin"))
 
         for plugin in plugins:
             ext_handler = ExtensionsConfig._parse_plugin(plugin)
@@ -335,21 +463,29 @@ class ExtensionsConfig(object):
         return ext_handler
 
     @staticmethod
-    def _parse_plugin_settings(ext_handler, plugin_settings):
-        if plugin_settings is None:
-            return
+    def _index_plugin_settings(plugin_settings):
+        """
+        Returns a dictionary that maps the (name, version) of each plugin to its settings; if the same plugin
+        appears more than once, only its first settings are used.
+        """
+        index = {}
+        for settings in plugin_settings:
+            key = (getattrib(settings, "name"), getattrib(settings, "version"))
+            if key not in index:
+                index[key] = settings
+        return index
 
+    @staticmethod
+    def _parse_plugin_settings(ext_handler, plugin_settings):
         name = ext_handler.name
         version = ext_handler.properties.version
-        settings = [x for x in plugin_settings \
-                    if getattrib(x, "name") == name and \
-                    getattrib(x, "version") == version]
+        settings = plugin_settings.get((name, version))
 
-        if settings is None or len(settings) == 0:
+        if settings is None:
             return
 
         runtime_settings = None
-        runtime_settings_node = find(settings[0], "RuntimeSettings")
+        runtime_settings_node = find(settings, "RuntimeSettings")
         seqNo = getattrib(runtime_settings_node, "seqNo")
         runtime_settings_str = gettext(runtime_settings_node)
         try:
@@ -359,8 +495,8 @@ class ExtensionsConfig(object):
             return
 
         depends_on_level = 0
-        depends_on_node = find(settings[0], "DependsOn")
-        if depends_on_node != None:
+        depends_on_node = find(settings, "DependsOn")
+        if depends_on_node is not None:
             try:
                 depends_on_level = int(getattrib(depends_on_node, "dependencyLevel"))
             except (ValueError, TypeError):
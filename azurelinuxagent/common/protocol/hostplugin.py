@@ -20,6 +20,7 @@
 import base64
 import datetime
 import json
+import threading
 
 from azurelinuxagent.common import logger
 from azurelinuxagent.common.errorstate import ErrorState, ERROR_STATE_HOST_PLUGIN_FAILURE
@@ -68,6 +69,9 @@ class HostPluginProtocol(object):
         self.status_error_state = ErrorState(min_timedelta=ERROR_STATE_HOST_PLUGIN_FAILURE)
         self.fetch_last_timestamp = None
         self.status_last_timestamp = None
+        self._page_blob = None  # (sas_url, size) of the last page blob created through the host plugin
+        # the initialization and the health state may be updated by concurrent requests (e.g. extension downloads)
+        self._lock = threading.RLock()
 
     @staticmethod
     def is_default_channel():
@@ -87,14 +91,15 @@ class HostPluginProtocol(object):
         self.manifest_uri = new_manifest_uri
 
     def ensure_initialized(self):
-        if not self.is_initialized:
-            self.api_versions = self.get_api_versions()
-            self.is_available = API_VERSION in self.api_versions
-            self.is_initialized = self.is_available
-            from azurelinuxagent.common.event import WALAEventOperation, report_event
-            report_event(WALAEventOperation.InitializeHostPlugin,
-                         is_success=self.is_available)
-        return self.is_available
+        with self._lock:
+            if not self.is_initialized:
+                self.api_versions = self.get_api_versions()
+                self.is_available = API_VERSION in self.api_versions
+                self.is_initialized = self.is_available
+                from azurelinuxagent.common.event import WALAEventOperation, report_event
+                report_event(WALAEventOperation.InitializeHostPlugin,
+                             is_success=self.is_available)
+            return self.is_available
 
     def get_health(self):
         """
@@ -157,15 +162,16 @@ class HostPluginProtocol(object):
         if uri != URI_FORMAT_GET_EXTENSION_ARTIFACT.format(self.endpoint, HOST_PLUGIN_PORT):
             return
 
-        if self.should_report(is_healthy,
-                              self.fetch_error_state,
-                              self.fetch_last_timestamp,
-                              HostPluginProtocol.FETCH_REPORTING_PERIOD):
-            self.fetch_last_timestamp = datetime.datetime.utcnow()
-            health_signal = self.fetch_error_state.is_triggered() is False
-            self.health_service.report_host_plugin_extension_artifact(is_healthy=health_signal,
-                                                                      source=source,
-                                                                      response=response)
+        with self._lock:
+            if self.should_report(is_healthy,
+                                  self.fetch_error_state,
+                                  self.fetch_last_timestamp,
+                                  HostPluginProtocol.FETCH_REPORTING_PERIOD):
+                self.fetch_last_timestamp = datetime.datetime.utcnow()
+                health_signal = self.fetch_error_state.is_triggered() is False
+                self.health_service.report_host_plugin_extension_artifact(is_healthy=health_signal,
+                                                                          source=source,
+                                                                          response=response)
 
     def report_status_health(self, is_healthy, response=''):
         if self.should_report(is_healthy,
@@ -228,11 +234,12 @@ class HostPluginProtocol(object):
     def _put_block_blob_status(self, sas_url, status_blob):
         url = URI_FORMAT_PUT_VM_STATUS.format(self.endpoint, HOST_PLUGIN_PORT)
 
+        status = self._encode_status(status_blob.data)
         response = restutil.http_put(url,
                                      data=self._build_status_data(
                                          sas_url,
-                                         status_blob.get_block_blob_headers(len(status_blob.data)),
-                                         bytearray(status_blob.data, encoding='utf-8')),
+                                         status_blob.get_block_blob_headers(len(status)),
+                                         status),
                                      headers=self._build_status_headers())
 
         if restutil.request_failed(response):
@@ -248,52 +255,53 @@ class HostPluginProtocol(object):
     def _put_page_blob_status(self, sas_url, status_blob):
         url = URI_FORMAT_PUT_VM_STATUS.format(self.endpoint, HOST_PLUGIN_PORT)
 
-        # Convert the status into a blank-padded string whose length is modulo 512
-        status = bytearray(status_blob.data, encoding='utf-8')
-        status_size = int((len(status) + 511) / 512) * 512
-        status = bytearray(status_blob.data.ljust(status_size), encoding='utf-8')
+        # Convert the status into a blank-padded byte string whose length is modulo 512
+        status = self._encode_status(status_blob.data, alignment=512)
+        status_size = len(status)
 
-        # First, initialize an empty blob
-        response = restutil.http_put(url,
-                                     data=self._build_status_data(
-                                         sas_url,
-                                         status_blob.get_page_blob_create_headers(status_size)),
-                                     headers=self._build_status_headers())
+        # First, initialize an empty blob; the pages below overwrite the whole blob, so an
+        # existing blob of the same size does not need to be created again
+        if self._page_blob != (sas_url, status_size):
+            self._page_blob = None
+
+            response = restutil.http_put(url,
+                                         data=self._build_status_data(
+                                             sas_url,
+                                             status_blob.get_page_blob_create_headers(status_size)),
+                                         headers=self._build_status_headers())
+
+            if restutil.request_failed(response):
+                error_response = restutil.read_response_error(response)
+                is_healthy = not restutil.request_failed_at_hostplugin(response)
+                self.report_status_health(is_healthy=is_healthy, response=error_response)
+                raise HttpError("HostGAPlugin: Failed PageBlob clean-up: {0}"
+                                .format(error_response))
+            else:
+                self.report_status_health(is_healthy=True)
+                logger.verbose("HostGAPlugin: PageBlob clean-up succeeded")
+
+            self._page_blob = (sas_url, status_size)
 
-        if restutil.request_failed(response):
-            error_response = restutil.read_response_error(response)
-            is_healthy = not restutil.request_failed_at_hostplugin(response)
-            self.report_status_health(is_healthy=is_healthy, response=error_response)
-            raise HttpError("HostGAPlugin: Failed PageBlob clean-up: {0}"
-                            .format(error_response))
-        else:
-            self.report_status_health(is_healthy=True)
-            logger.verbose("HostGAPlugin: PageBlob clean-up succeeded")
-        
         # Then, upload the blob in pages
-        if sas_url.count("?") <= 0:
-            sas_url = "{0}?comp=page".format(sas_url)
-        else:
-            sas_url = "{0}&comp=page".format(sas_url)
+        page_url = "{0}?comp=page".format(sas_url) if sas_url.count("?") <= 0 else "{0}&comp=page".format(sas_url)
+
+        # Pages are views into the padded status; since both the status size and the maximum page
+        # size are multiples of 512, every page is already aligned and no copies are needed
+        pages = memoryview(status) if PY_VERSION_MAJOR > 2 else status
 
         start = 0
-        end = 0
-        while start < len(status):
-            # Create the next page
-            end = start + min(len(status) - start, MAXIMUM_PAGEBLOB_PAGE_SIZE)
-            page_size = int((end - start + 511) / 512) * 512
-            buf = bytearray(page_size)
-            buf[0: end - start] = status[start: end]
-
-            # Send the page
+        while start < status_size:
+            end = min(start + MAXIMUM_PAGEBLOB_PAGE_SIZE, status_size)
+
             response = restutil.http_put(url,
                                          data=self._build_status_data(
-                                             sas_url,
+                                             page_url,
                                              status_blob.get_page_blob_page_headers(start, end),
-                                             buf),
+                                             pages[start:end]),
                                          headers=self._build_status_headers())
 
             if restutil.request_failed(response):
+                self._page_blob = None
                 error_response = restutil.read_response_error(response)
                 is_healthy = not restutil.request_failed_at_hostplugin(response)
                 self.report_status_health(is_healthy=is_healthy, response=error_response)
@@ -303,7 +311,18 @@ class HostPluginProtocol(object):
 
             # Advance to the next page (if any)
             start = end
-        
+
+    @staticmethod
+    def _encode_status(data, alignment=1):
+        """
+        Returns the status as UTF-8 bytes, blank-padded to a multiple of the given alignment
+        """
+        status = data.encode('utf-8')
+        padding = -len(status) % alignment
+        if padding > 0:
+            status += b' ' * padding
+        return status
+
     def _build_status_data(self, sas_url, blob_headers, content=None):
         headers = []
         for name in iter(blob_headers.keys()):
@@ -312,14 +331,19 @@ class HostPluginProtocol(object):
                 'headerValue': blob_headers[name]
             })
 
-        data = {
+        data = json.dumps({
             'requestUri': sas_url,
             'headers': headers
-        }
-        if not content is None:
-            data['content'] = self._base64_encode(content)
-        return json.dumps(data, sort_keys=True)
-    
+        }, sort_keys=True)
+
+        if content is None:
+            return data
+
+        # The content is the largest member of the envelope, so rather than passing it through
+        # json.dumps it is spliced in directly: base64 needs no escaping and "content" sorts first,
+        # which produces the same document json.dumps would
+        return '{"content": "' + self._base64_encode(content) + '", ' + data[1:]
+
     def _build_status_headers(self):
         return {
             HEADER_VERSION: API_VERSION,
@@ -329,7 +353,9 @@ class HostPluginProtocol(object):
         }
     
     def _base64_encode(self, data):
-        s = base64.b64encode(bytes(data))
         if PY_VERSION_MAJOR > 2:
+            # b64encode takes the pages of the status (memoryviews) without copying them; memoryview is not
+            # available on Python 2.6
+            s = base64.b64encode(data if isinstance(data, (bytes, memoryview)) else bytes(data))
             return s.decode('utf-8')
-        return s
+        return base64.b64encode(bytes(data))
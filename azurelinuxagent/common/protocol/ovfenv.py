@@ -22,7 +22,6 @@ Copy and parse ovf-env.xml from provisioning ISO and local cache
 import os
 import re
 import shutil
-import xml.dom.minidom as minidom
 import azurelinuxagent.common.logger as logger
 from azurelinuxagent.common.exception import ProtocolError
 from azurelinuxagent.common.future import ustr
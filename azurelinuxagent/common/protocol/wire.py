@@ -17,9 +17,12 @@
 # Requires Python 2.6+ and Openssl 1.0+
 
 import datetime
+import hashlib
 import json
 import os
 import random
+import re
+import threading
 import time
 import xml.sax.saxutils as saxutils
 from datetime import datetime
@@ -30,16 +33,17 @@ import azurelinuxagent.common.utils.textutil as textutil
 from azurelinuxagent.common.datacontract import validate_param
 from azurelinuxagent.common.event import add_periodic, WALAEventOperation, EVENTS_DIRECTORY
 from azurelinuxagent.common.exception import ProtocolNotFoundError, \
-    ResourceGoneError, ExtensionDownloadError, InvalidContainerError, ProtocolError, HttpError
-from azurelinuxagent.common.future import httpclient, bytebuffer
+    ResourceGoneError, ExtensionDownloadError, InvalidContainerError, ProtocolError, HttpError, ThrottlingError
+from azurelinuxagent.common.future import httpclient, bytebuffer, OrderedDict
 from azurelinuxagent.common.protocol.goal_state import GoalState, TRANSPORT_CERT_FILE_NAME, TRANSPORT_PRV_FILE_NAME
 from azurelinuxagent.common.protocol.hostplugin import HostPluginProtocol
 from azurelinuxagent.common.protocol.imds import ComputeInfo
 from azurelinuxagent.common.protocol.restapi import *
-from azurelinuxagent.common.telemetryevent import TelemetryEventList
+from azurelinuxagent.common.telemetryevent import TelemetryEventList, TelemetryEventEncoder
 from azurelinuxagent.common.utils import fileutil, restutil
 from azurelinuxagent.common.utils.archive import StateFlusher
 from azurelinuxagent.common.utils.cryptutil import CryptUtil
+from azurelinuxagent.common.utils.flexible_version import FlexibleVersion
 from azurelinuxagent.common.utils.textutil import parse_doc, findall, find, \
     findtext, gettext, remove_bom, get_bytes_from_pem, parse_json
 from azurelinuxagent.common.version import AGENT_NAME, CURRENT_VERSION
@@ -57,6 +61,9 @@ SHARED_CONF_FILE_NAME = "SharedConfig.xml"
 REMOTE_ACCESS_FILE_NAME = "RemoteAccess.{0}.xml"
 EXT_CONF_FILE_NAME = "ExtensionsConfig.{0}.xml"
 MANIFEST_FILE_NAME = "{0}.{1}.manifest.xml"
+MANIFEST_CACHE_DIR_NAME = "ManifestCache"
+# cached manifests that have not been downloaded for this number of cache periods are removed
+MANIFEST_CACHE_MAX_AGE_PERIODS = 4
 
 PROTOCOL_VERSION = "2012-11-30"
 ENDPOINT_FINE_NAME = "WireServer"
@@ -65,6 +72,18 @@ SHORT_WAITING_INTERVAL = 1  # 1 second
 
 MAX_EVENT_BUFFER_SIZE = 2 ** 16 - 2 ** 10
 
+IF_NONE_MATCH_HEADER = "If-None-Match"
+IF_MODIFIED_SINCE_HEADER = "If-Modified-Since"
+ETAG_HEADER = "ETag"
+LAST_MODIFIED_HEADER = "Last-Modified"
+RANGE_HEADER = "Range"
+CONTENT_RANGE_HEADER = "Content-Range"
+CONTENT_LENGTH_HEADER = "Content-Length"
+CERT_HEADER = "x-ms-guest-agent-public-x509-cert"
+
+# e.g. "bytes 1024-2047/4096" (the total size can be "*" if unknown)
+CONTENT_RANGE_REGEX = re.compile(r'^bytes\s+(\d+)-(\d+)/(\d+|\*)$')
+
 
 class UploadError(HttpError):
     pass
@@ -147,20 +166,35 @@ class WireProtocol(Protocol):
         logger.verbose("Get In-VM Artifacts Profile")
         return self.client.get_artifacts_profile()
 
-    def _download_ext_handler_pkg_through_host(self, uri, destination):
+    def _download_ext_handler_pkg_through_host(self, uri, destination, resume=False, cancel=None):
         host = self.client.get_host_plugin()
-        uri, headers = host.get_artifact_request(uri, host.manifest_uri)
-        success = self.client.stream(uri, destination, headers=headers, use_proxy=False)
+        uri, headers = host.get_artifact_request(uri, self.client.get_package_manifest_uri(uri))
+        success = self.client.stream(uri, destination, headers=headers, use_proxy=False, resume=resume, cancel=cancel)
         return success
 
-    def download_ext_handler_pkg(self, uri, destination, headers=None, use_proxy=True):
-        direct_func = lambda: self.client.stream(uri, destination, headers=None, use_proxy=True)
+    def download_ext_handler_pkg(self, uri, destination, headers=None, use_proxy=True, resume=False, cancel=None):
+        # A cancelled download must not fall back to the host plugin (nor make it the default channel)
+        def raise_if_cancelled():
+            if cancel is not None and cancel.is_set():
+                raise _DownloadCancelledError()
+
+        def direct_func():
+            success = self.client.stream(uri, destination, headers=None, use_proxy=True, resume=resume, cancel=cancel)
+            if not success:
+                raise_if_cancelled()
+            return success
+
         # NOTE: the host_func may be called after refreshing the goal state, be careful about any goal state data
-        # in the lambda.
-        host_func = lambda: self._download_ext_handler_pkg_through_host(uri, destination)
+        # in the function.
+        def host_func():
+            raise_if_cancelled()
+            return self._download_ext_handler_pkg_through_host(uri, destination, resume=resume, cancel=cancel)
 
         try:
             success = self.client.send_request_using_appropriate_channel(direct_func, host_func)
+        except _DownloadCancelledError:
+            logger.verbose("The download of {0} was cancelled", uri)
+            success = False
         except Exception:
             success = False
 
@@ -289,10 +323,11 @@ def ext_substatus_to_v1(sub_status_list):
     return status_list
 
 
-def ext_status_to_v1(ext_name, ext_status):
+def ext_status_to_v1(ext_name, ext_status, timestamp=None):
     if ext_status is None:
         return None
-    timestamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    if timestamp is None:
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
     v1_sub_status = ext_substatus_to_v1(ext_status.substatusList)
     v1_ext_status = {
         "status": {
@@ -332,7 +367,7 @@ def ext_handler_status_to_v1(handler_status, ext_statuses, timestamp):
         # Currently, no more than one extension per handler
         ext_name = handler_status.extensions[0]
         ext_status = ext_statuses.get(ext_name)
-        v1_ext_status = ext_status_to_v1(ext_name, ext_status)
+        v1_ext_status = ext_status_to_v1(ext_name, ext_status, timestamp)
         if ext_status is not None and v1_ext_status is not None:
             v1_handler_status["runtimeSettingsStatus"] = {
                 'settingsStatus': v1_ext_status,
@@ -341,8 +376,9 @@ def ext_handler_status_to_v1(handler_status, ext_statuses, timestamp):
     return v1_handler_status
 
 
-def vm_status_to_v1(vm_status, ext_statuses):
-    timestamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+def vm_status_to_v1(vm_status, ext_statuses, timestamp=None):
+    if timestamp is None:
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
 
     v1_ga_guest_info = ga_status_to_guest_info(vm_status.vmAgent)
     v1_ga_status = ga_status_to_v1(vm_status.vmAgent)
@@ -373,6 +409,12 @@ class StatusBlob(object):
         self.client = client
         self.type = None
         self.data = None
+        # hash of the status, excluding its timestamp
+        self.digest = None
+        self._body = None
+        # (url, type, digest) of the last status uploaded successfully, and the time of the upload
+        self._last_upload = None
+        self._last_upload_time = None
 
     def set_vm_status(self, vm_status):
         validate_param("vmAgent", vm_status, VMStatus)
@@ -388,11 +430,38 @@ class StatusBlob(object):
 
     __storage_version__ = "2014-02-14"
 
+    # Placeholder for the timestamps of the status (the timestamp of the VM status and those of the extension
+    # statuses); the control characters make it unlikely to match any of the values reported by the extensions
+    _TIMESTAMP_PLACEHOLDER = json.dumps(u"\x00timestampUTC\x00")
+
     def prepare(self, blob_type):
         logger.verbose("Prepare status blob")
-        self.data = self.to_json()
+
+        # The digest of the status excludes the timestamps, which change on every call. The report is serialized with
+        # a placeholder for the timestamps; if it did not change, the previous serialization (and its digest) is
+        # reused, and the current timestamp is substituted for the placeholder to create the data of the blob.
+        report = vm_status_to_v1(self.vm_status, self.ext_statuses, json.loads(StatusBlob._TIMESTAMP_PLACEHOLDER))
+        body = json.dumps(report)
+        if body != self._body:
+            self._body = body
+            self.digest = hashlib.sha256(body.encode('utf-8')).hexdigest()
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        self.data = self._body.replace(StatusBlob._TIMESTAMP_PLACEHOLDER, json.dumps(timestamp))
         self.type = blob_type
 
+    def is_upload_needed(self, url):
+        """
+        Returns True if the prepared status is different from the last status uploaded to the given url (or if the
+        period in Extensions.StatusHeartbeatPeriod has elapsed since that upload)
+        """
+        if self._last_upload != (url, self.type, self.digest):
+            return True
+        return time.time() - self._last_upload_time >= conf.get_extensions_status_heartbeat_period()
+
+    def mark_uploaded(self, url):
+        self._last_upload = (url, self.type, self.digest)
+        self._last_upload_time = time.time()
+
     def upload(self, url):
         try:
             if not self.type in ["BlockBlob", "PageBlob"]:
@@ -486,41 +555,218 @@ class StatusBlob(object):
 
 
 def event_param_to_v1(param):
-    param_format = '<Param Name="{0}" Value={1} T="{2}" />'
-    param_type = type(param.value)
-    attr_type = ""
-    if param_type is int:
-        attr_type = 'mt:uint64'
-    elif param_type is str:
-        attr_type = 'mt:wstr'
-    elif ustr(param_type).count("'unicode'") > 0:
-        attr_type = 'mt:wstr'
-    elif param_type is bool:
-        attr_type = 'mt:bool'
-    elif param_type is float:
-        attr_type = 'mt:float64'
-    return param_format.format(param.name,
-                               saxutils.quoteattr(ustr(param.value)),
-                               attr_type)
+    return param.to_v1_xml()
 
 
 def event_to_v1(event):
-    params = ""
-    for param in event.parameters:
-        params += event_param_to_v1(param)
-    event_str = ('<Event id="{0}">'
-                 '<![CDATA[{1}]]>'
-                 '</Event>').format(event.eventId, params)
-    return event_str
+    return event.to_v1_xml()
+
+
+class _ConditionalRequestCache(object):
+    """
+    Keeps the validators (ETag, Last-Modified) and the content of the config documents fetched from the WireServer
+    (goal state, HostingEnvironmentConfig, SharedConfig, Certificates, ExtensionsConfig, etc.) so that they can be
+    requested again using conditional requests. The cache is shared by the WireClients of all threads.
+    """
+    MAX_ENTRIES = 32
+
+    _lock = threading.RLock()
+    _entries = OrderedDict()
+
+    class _Entry(object):
+        def __init__(self, etag, last_modified, content):
+            self.etag = etag
+            self.last_modified = last_modified
+            self.content = content
+
+    @staticmethod
+    def get_key(uri, headers):
+        # Certificates and RemoteAccess are encrypted with the transport certificate, so it is part of the key
+        cert = headers.get(CERT_HEADER) if headers is not None else None
+        return uri, cert
+
+    @staticmethod
+    def get(key):
+        with _ConditionalRequestCache._lock:
+            return _ConditionalRequestCache._entries.get(key)
+
+    @staticmethod
+    def set(key, etag, last_modified, content):
+        with _ConditionalRequestCache._lock:
+            if key in _ConditionalRequestCache._entries:
+                del _ConditionalRequestCache._entries[key]
+            if etag is None and last_modified is None:
+                return
+            _ConditionalRequestCache._entries[key] = _ConditionalRequestCache._Entry(etag, last_modified, content)
+            while len(_ConditionalRequestCache._entries) > _ConditionalRequestCache.MAX_ENTRIES:
+                _ConditionalRequestCache._entries.popitem(last=False)
+
+    @staticmethod
+    def clear():
+        with _ConditionalRequestCache._lock:
+            _ConditionalRequestCache._entries = OrderedDict()
+
+
+def _get_validator(resp, header):
+    try:
+        value = resp.getheader(header)
+    except Exception:
+        return None
+    if isinstance(value, (str, ustr)) and len(value) > 0:
+        return value
+    return None
+
+
+class _ExtensionManifestCache(object):
+    """
+    Keeps the extension manifests, keyed by their URIs (location and failover location), both in memory and on disk
+    (under the lib directory), so they are not downloaded again on each goal state. The entries expire after the
+    period given by Extensions.ManifestCachePeriod.
+
+    Each entry keeps a hash of the content of the manifest, so the manifest is parsed only once per version of its
+    content, even if it is downloaded again after the entry expires. Entries that have not been refreshed for
+    MANIFEST_CACHE_MAX_AGE_PERIODS periods (e.g. the manifests of extensions that were removed) are removed.
+    """
+    _lock = threading.RLock()
+    _entries = {}
+
+    class _Entry(object):
+        def __init__(self, uri, digest, timestamp, xml_text, manifest=None):
+            self.uri = uri  # the URI the manifest was downloaded from
+            self.digest = digest
+            self.timestamp = timestamp
+            self.xml_text = xml_text
+            self._manifest = manifest
+
+        def is_expired(self):
+            return time.time() - self.timestamp >= conf.get_extensions_manifest_cache_period()
+
+        def get_manifest(self):
+            if self._manifest is None:
+                self._manifest = ExtensionManifest(self.xml_text)
+            return self._manifest
+
+    @staticmethod
+    def get_key(version_uris):
+        return tuple(sorted(set(v.uri for v in version_uris if v.uri is not None)))
+
+    @staticmethod
+    def _get_digest(xml_text):
+        return hashlib.sha256(xml_text.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _get_file_path(key):
+        file_name = "{0}.json".format(hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest())
+        return os.path.join(conf.get_lib_dir(), MANIFEST_CACHE_DIR_NAME, file_name)
+
+    @staticmethod
+    def get(key):
+        """
+        Returns the cached entry for the given key (which may be expired), or None if there is no entry
+        """
+        with _ExtensionManifestCache._lock:
+            entry = _ExtensionManifestCache._entries.get(key)
+            if entry is None:
+                entry = _ExtensionManifestCache._load(key)
+                if entry is not None:
+                    _ExtensionManifestCache._entries[key] = entry
+            return entry
+
+    @staticmethod
+    def set(key, uri, xml_text):
+        """
+        Caches the given manifest and returns its entry; the parsed manifest is reused if its content did not change
+        """
+        digest = _ExtensionManifestCache._get_digest(xml_text)
+
+        with _ExtensionManifestCache._lock:
+            entry = _ExtensionManifestCache._entries.get(key)
+            if entry is not None and entry.digest == digest:
+                entry.uri = uri
+                entry.timestamp = time.time()
+            else:
+                entry = _ExtensionManifestCache._Entry(uri, digest, time.time(), xml_text)
+                _ExtensionManifestCache._entries[key] = entry
+            _ExtensionManifestCache._save(key, entry)
+            _ExtensionManifestCache._prune(key)
+            return entry
+
+    @staticmethod
+    def _prune(current_key):
+        # NOTE: must be called with the lock held
+        max_age = MANIFEST_CACHE_MAX_AGE_PERIODS * conf.get_extensions_manifest_cache_period()
+        now = time.time()
+
+        for key, entry in list(_ExtensionManifestCache._entries.items()):
+            if key != current_key and now - entry.timestamp > max_age:
+                del _ExtensionManifestCache._entries[key]
+
+        # the files are rewritten each time their entry is refreshed, so their age is given by their modification time
+        current_path = _ExtensionManifestCache._get_file_path(current_key)
+        cache_dir = os.path.dirname(current_path)
+        try:
+            file_names = os.listdir(cache_dir)
+        except (IOError, OSError) as e:
+            logger.warn("Failed to list the cached manifests in {0}: {1}", cache_dir, ustr(e))
+            return
+        for file_name in file_names:
+            path = os.path.join(cache_dir, file_name)
+            if path == current_path:
+                continue
+            try:
+                if now - os.path.getmtime(path) > max_age:
+                    logger.verbose("Removing stale cached manifest {0}", path)
+                    os.remove(path)
+            except (IOError, OSError) as e:
+                logger.warn("Failed to remove the cached manifest {0}: {1}", path, ustr(e))
+
+    @staticmethod
+    def _load(key):
+        path = _ExtensionManifestCache._get_file_path(key)
+        if not os.path.isfile(path):
+            return None
+        try:
+            data = json.loads(fileutil.read_file(path))
+            if data["digest"] != _ExtensionManifestCache._get_digest(data["xml_text"]):
+                logger.warn("The cached manifest {0} is corrupt; ignoring it", path)
+                return None
+            return _ExtensionManifestCache._Entry(data["uri"], data["digest"], float(data["timestamp"]), data["xml_text"])
+        except Exception as e:
+            logger.warn("Failed to load the cached manifest {0}: {1}", path, ustr(e))
+            return None
+
+    @staticmethod
+    def _save(key, entry):
+        path = _ExtensionManifestCache._get_file_path(key)
+        try:
+            fileutil.mkdir(os.path.dirname(path), mode=0o700)
+            data = {"uri": entry.uri, "digest": entry.digest, "timestamp": entry.timestamp, "xml_text": entry.xml_text}
+            fileutil.write_file(path, json.dumps(data))
+        except (IOError, OSError) as e:
+            logger.warn("Failed to save the manifest to the cache {0}: {1}", path, ustr(e))
+
+    @staticmethod
+    def clear():
+        with _ExtensionManifestCache._lock:
+            _ExtensionManifestCache._entries = {}
+
+
+class _DownloadCancelledError(Exception):
+    pass
 
 
 class WireClient(object):
+    # the default channel is shared by all the WireClients
+    _default_channel_lock = threading.Lock()
 
     def __init__(self, endpoint):
         logger.info("Wire server endpoint:{0}", endpoint)
         self._endpoint = endpoint
         self._goal_state = None
         self._host_plugin = None
+        # the host plugin may be used (and refreshed) by concurrent requests, e.g. the downloads of an extension package
+        self._host_plugin_lock = threading.RLock()
+        self._package_manifest_uris = {}  # see get_package_manifest_uri()
         self.status_blob = StatusBlob(self)
         self.goal_state_flusher = StateFlusher(conf.get_lib_dir())
 
@@ -533,14 +779,17 @@ class WireClient(object):
             kwargs['use_proxy'] = False
             resp = http_req(*args, **kwargs)
 
-            if restutil.request_failed(resp):
+            # NOT_MODIFIED (304) is returned only for conditional requests and indicates success
+            if restutil.request_failed(resp) and not restutil.request_not_modified(resp):
                 msg = "[Wireserver Failed] URI {0} ".format(args[0])
                 if resp is not None:
                     msg += " [HTTP Failed] Status Code {0}".format(resp.status)
+                    if restutil.request_throttled(resp):
+                        raise ThrottlingError(msg)
                 raise ProtocolError(msg)
 
-        # If the GoalState is stale, pass along the exception to the caller
-        except ResourceGoneError:
+        # If the GoalState is stale, or the WireServer is throttling the agent, pass along the exception to the caller
+        except (ResourceGoneError, ThrottlingError):
             raise
 
         except Exception as e:
@@ -562,6 +811,40 @@ class WireClient(object):
                                     headers=headers)
         return self.decode_config(resp.read())
 
+    def fetch_config_if_modified(self, uri, headers):
+        """
+        Fetches the config document at 'uri' using a conditional request (If-None-Match/If-Modified-Since) based on
+        the validators of the previous response for the same document.
+
+        Returns a tuple (xml_text, modified); if the WireServer responds with 304 (Not Modified) xml_text is the
+        cached copy of the document and modified is False.
+        """
+        key = _ConditionalRequestCache.get_key(uri, headers)
+        cached = _ConditionalRequestCache.get(key)
+
+        request_headers = dict(headers) if headers is not None else {}
+        if cached is not None:
+            if cached.etag is not None:
+                request_headers[IF_NONE_MATCH_HEADER] = cached.etag
+            if cached.last_modified is not None:
+                request_headers[IF_MODIFIED_SINCE_HEADER] = cached.last_modified
+
+        resp = self.call_wireserver(restutil.http_get,
+                                    uri,
+                                    headers=request_headers)
+
+        if restutil.request_not_modified(resp):
+            if cached is None:
+                raise ProtocolError("[Wireserver Failed] URI {0} returned Not Modified for an unconditional request".format(uri))
+            # the body of a 304 is empty; reading it frees the connection so that it can be reused for the next poll
+            resp.read()
+            logger.verbose("Config [{0}] has not been modified", uri)
+            return cached.content, False
+
+        xml_text = self.decode_config(resp.read())
+        _ConditionalRequestCache.set(key, _get_validator(resp, ETAG_HEADER), _get_validator(resp, LAST_MODIFIED_HEADER), xml_text)
+        return xml_text, True
+
     def fetch_cache(self, local_file):
         if not os.path.isfile(local_file):
             raise ProtocolError("{0} is missing.".format(local_file))
@@ -592,6 +875,12 @@ class WireClient(object):
         return response
 
     def fetch_manifest(self, version_uris):
+        return self._fetch_manifest(version_uris)[0]
+
+    def _fetch_manifest(self, version_uris):
+        """
+        Returns the manifest and the URI it was fetched from
+        """
         logger.verbose("Fetch manifest")
         version_uris_shuffled = version_uris
         random.shuffle(version_uris_shuffled)
@@ -614,31 +903,88 @@ class WireClient(object):
                 if response:
                     host = self.get_host_plugin()
                     host.update_manifest_uri(version.uri)
-                    return response
+                    return response, version.uri
             except Exception as e:
                 logger.warn("Exception when fetching manifest. Error: {0}".format(ustr(e)))
 
         raise ExtensionDownloadError("Failed to fetch manifest from all sources")
 
-    def stream(self, uri, destination, headers=None, use_proxy=None):
-        success = False
-        logger.verbose("Fetch [{0}] with headers [{1}] to file [{2}]", uri, headers, destination)
+    def stream(self, uri, destination, headers=None, use_proxy=None, resume=False, cancel=None):
+        """
+        Downloads 'uri' to the file 'destination'. Returns True only if the complete content was downloaded, i.e. the
+        size of the file matches the size reported by the server.
+
+        If 'resume' is True and 'destination' already exists, the file is assumed to be a partial download of 'uri' and
+        only the remaining content is requested (using an HTTP Range request); the partial file is kept when the
+        download is interrupted, so that it can be resumed later.
 
-        response = self._fetch_response(uri, headers, use_proxy)
-        if response is not None:
-            chunk_size = 1024 * 1024  # 1MB buffer
-            try:
-                with open(destination, 'wb', chunk_size) as destination_fh:
-                    complete = False
-                    while not complete:
-                        chunk = response.read(chunk_size)
-                        destination_fh.write(chunk)
-                        complete = len(chunk) < chunk_size
-                success = True
-            except Exception as e:
-                logger.error('Error streaming {0} to {1}: {2}'.format(uri, destination, ustr(e)))
+        'cancel' is an optional threading.Event; the download stops (and returns False) when the event is set.
+        """
+        if cancel is not None and cancel.is_set():
+            return False
 
-        return success
+        offset = os.path.getsize(destination) if resume and os.path.isfile(destination) else 0
+
+        request_headers = headers
+        if offset > 0:
+            request_headers = dict(headers) if headers is not None else {}
+            request_headers[RANGE_HEADER] = "bytes={0}-".format(offset)
+
+        logger.verbose("Fetch [{0}] with headers [{1}] to file [{2}]", uri, request_headers, destination)
+
+        response = self._fetch_response(uri, request_headers, use_proxy, allow_partial_content=offset > 0)
+        if response is None:
+            return False
+
+        if offset > 0 and response.status == httpclient.REQUESTED_RANGE_NOT_SATISFIABLE:
+            logger.info("Cannot resume the download of {0}; downloading it again", uri)
+            os.remove(destination)
+            return self.stream(uri, destination, headers=headers, use_proxy=use_proxy, cancel=cancel)
+
+        if restutil.request_failed(response, ok_codes=restutil.OK_CODES + [httpclient.PARTIAL_CONTENT]):
+            return False
+
+        if response.status == httpclient.PARTIAL_CONTENT:
+            start, expected_size = WireClient._parse_content_range(response.getheader(CONTENT_RANGE_HEADER))
+            if start != offset:
+                logger.warn("Cannot resume the download of {0}: requested offset {1}, got {2}", uri, offset, start)
+                os.remove(destination)
+                return False
+            mode = 'ab'
+        else:
+            # the server ignored the range request (or no range was requested); download the entire content
+            offset = 0
+            content_length = response.getheader(CONTENT_LENGTH_HEADER)
+            expected_size = int(content_length) if content_length is not None else None
+            mode = 'wb'
+
+        try:
+            with open(destination, mode, restutil.RESPONSE_CHUNK_SIZE) as destination_fh:
+                if restutil.read_response_to_file(response, destination_fh, cancel=cancel) is None:
+                    logger.verbose("Download of {0} was cancelled", uri)
+                    return False
+        except Exception as e:
+            logger.error('Error streaming {0} to {1}: {2}'.format(uri, destination, ustr(e)))
+            return False
+
+        size = os.path.getsize(destination)
+        if expected_size is not None and size != expected_size:
+            logger.warn("Incomplete download of {0}: expected {1} bytes, got {2}", uri, expected_size, size)
+            return False
+
+        return True
+
+    @staticmethod
+    def _parse_content_range(content_range):
+        """
+        Returns the start offset and total size (None if unknown) in the given Content-Range header, or (None, None)
+        if the header is missing or invalid
+        """
+        match = CONTENT_RANGE_REGEX.match(content_range.strip()) if content_range is not None else None
+        if match is None:
+            return None, None
+        total = match.group(3)
+        return int(match.group(1)), int(total) if total != '*' else None
 
     def fetch(self, uri, headers=None, use_proxy=None, decode=True):
         logger.verbose("Fetch [{0}] with headers [{1}]", uri, headers)
@@ -649,18 +995,25 @@ class WireClient(object):
             content = self.decode_config(response_content) if decode else response_content
         return content
 
-    def _fetch_response(self, uri, headers=None, use_proxy=None):
+    def _fetch_response(self, uri, headers=None, use_proxy=None, allow_partial_content=False):
         resp = None
+        ok_codes = restutil.OK_CODES
+        kwargs = {}
+        if allow_partial_content:
+            # the response to a range request is PARTIAL_CONTENT, which should not be retried
+            ok_codes = restutil.OK_CODES + [httpclient.PARTIAL_CONTENT]
+            kwargs['retry_codes'] = [code for code in restutil.RETRY_CODES if code != httpclient.PARTIAL_CONTENT]
         try:
             resp = self.call_storage_service(
                 restutil.http_get,
                 uri,
                 headers=headers,
-                use_proxy=use_proxy)
+                use_proxy=use_proxy,
+                **kwargs)
 
             host_plugin = self.get_host_plugin()
 
-            if restutil.request_failed(resp):
+            if restutil.request_failed(resp, ok_codes=ok_codes):
                 error_response = restutil.read_response_error(resp)
                 msg = "Fetch failed from [{0}]: {1}".format(uri, error_response)
                 logger.warn(msg)
@@ -712,7 +1065,7 @@ class WireClient(object):
         for retry in range(1, max_retry + 1):
             try:
                 if refresh_type == WireClient._UpdateType.HostPlugin:
-                    goal_state = GoalState.fetch_goal_state(self)
+                    goal_state = GoalState.fetch_goal_state_if_modified(self)
                     self._update_host_plugin(goal_state.container_id, goal_state.role_config_name)
                     return
 
@@ -722,6 +1075,7 @@ class WireClient(object):
                     new_goal_state = GoalState.fetch_full_goal_state_if_incarnation_different_than(self, self._goal_state.incarnation)
 
                 if new_goal_state is not None:
+                    GoalState.share(new_goal_state)
                     self._goal_state = new_goal_state
                     self._save_goal_state()
                     self._update_host_plugin(new_goal_state.container_id, new_goal_state.role_config_name)
@@ -743,9 +1097,10 @@ class WireClient(object):
         raise ProtocolError("Exceeded max retry updating goal state")
 
     def _update_host_plugin(self, container_id, role_config_name):
-        if self._host_plugin is not None:
-            self._host_plugin.update_container_id(container_id)
-            self._host_plugin.update_role_config_name(role_config_name)
+        with self._host_plugin_lock:
+            if self._host_plugin is not None:
+                self._host_plugin.update_container_id(container_id)
+                self._host_plugin.update_role_config_name(role_config_name)
 
     def _save_goal_state(self):
         try:
@@ -812,12 +1167,51 @@ class WireClient(object):
         local_file = os.path.join(conf.get_lib_dir(), local_file)
 
         try:
-            xml_text = self.fetch_manifest(ext_handler.versionUris)
-            self.save_cache(local_file, xml_text)
-            return ExtensionManifest(xml_text)
+            key = _ExtensionManifestCache.get_key(ext_handler.versionUris)
+            entry = _ExtensionManifestCache.get(key)
+
+            # The cached manifest is used only if it has not expired and it includes the requested version
+            if entry is not None and not entry.is_expired() and \
+                    WireClient._manifest_includes_version(entry.get_manifest(), ext_handler.properties.version):
+                logger.verbose("Using cached manifest for {0} [{1}]", ext_handler.name, entry.uri)
+                self.get_host_plugin().update_manifest_uri(entry.uri)
+                if not os.path.isfile(local_file):
+                    self.save_cache(local_file, entry.xml_text)
+            else:
+                xml_text, manifest_uri = self._fetch_manifest(ext_handler.versionUris)
+                self.save_cache(local_file, xml_text)
+                entry = _ExtensionManifestCache.set(key, manifest_uri, xml_text)
+
+            manifest = entry.get_manifest()
+            self._set_package_manifest_uris(manifest, entry.uri)
+            return manifest
         except Exception as e:
             raise ExtensionDownloadError("Failed to retrieve extension manifest. Error: {0}".format(ustr(e)))
 
+    def _set_package_manifest_uris(self, manifest, manifest_uri):
+        with self._host_plugin_lock:
+            for pkg in manifest.pkg_list.versions:
+                for pkg_uri in pkg.uris:
+                    self._package_manifest_uris[pkg_uri.uri] = manifest_uri
+
+    def get_package_manifest_uri(self, package_uri):
+        """
+        Returns the URI of the manifest that lists the given extension package; the host plugin requires it to download
+        the package. The manifest_uri of the host plugin cannot be used for this, since the handlers may be processed
+        concurrently and it may have been updated by a different handler.
+        """
+        with self._host_plugin_lock:
+            manifest_uri = self._package_manifest_uris.get(package_uri)
+        return manifest_uri if manifest_uri is not None else self.get_host_plugin().manifest_uri
+
+    @staticmethod
+    def _manifest_includes_version(manifest, version):
+        try:
+            requested_version = FlexibleVersion(str(version))
+            return any(requested_version.matches(FlexibleVersion(pkg.version)) for pkg in manifest.pkg_list.versions)
+        except ValueError:
+            return False
+
     def get_remote_access(self):
         if self._goal_state is None:
             raise ProtocolError("Trying to fetch Remote Access before initialization!")
@@ -888,19 +1282,20 @@ class WireClient(object):
         try:
             ret = host_func()
         except (ResourceGoneError, InvalidContainerError) as e:
-            host_plugin = self.get_host_plugin()
-            old_container_id = host_plugin.container_id
-            old_role_config_name = host_plugin.role_config_name
+            with self._host_plugin_lock:
+                host_plugin = self.get_host_plugin()
+                old_container_id = host_plugin.container_id
+                old_role_config_name = host_plugin.role_config_name
 
-            msg = "[PERIODIC] Request failed with the current host plugin configuration. " \
-                  "ContainerId: {0}, role config file: {1}. Fetching new goal state and retrying the call." \
-                  "Error: {2}".format(old_container_id, old_role_config_name, ustr(e))
-            logger.periodic_info(logger.EVERY_SIX_HOURS, msg)
+                msg = "[PERIODIC] Request failed with the current host plugin configuration. " \
+                      "ContainerId: {0}, role config file: {1}. Fetching new goal state and retrying the call." \
+                      "Error: {2}".format(old_container_id, old_role_config_name, ustr(e))
+                logger.periodic_info(logger.EVERY_SIX_HOURS, msg)
 
-            self.update_host_plugin_from_goal_state()
+                self.update_host_plugin_from_goal_state()
 
-            new_container_id = host_plugin.container_id
-            new_role_config_name = host_plugin.role_config_name
+                new_container_id = host_plugin.container_id
+                new_role_config_name = host_plugin.role_config_name
             msg = "[PERIODIC] Host plugin reconfigured with new parameters. " \
                   "ContainerId: {0}, role config file: {1}.".format(new_container_id, new_role_config_name)
             logger.periodic_info(logger.EVERY_SIX_HOURS, msg)
@@ -934,10 +1329,11 @@ class WireClient(object):
                              log_event=True)
                 raise
 
-        if not HostPluginProtocol.is_default_channel():
-            logger.info("Setting host plugin as default channel from now on. "
-                        "Restart the agent to reset the default channel.")
-            HostPluginProtocol.set_default_channel(True)
+        with WireClient._default_channel_lock:
+            if not HostPluginProtocol.is_default_channel():
+                logger.info("Setting host plugin as default channel from now on. "
+                            "Restart the agent to reset the default channel.")
+                HostPluginProtocol.set_default_channel(True)
 
         return ret
 
@@ -962,6 +1358,10 @@ class WireClient(object):
         except Exception as e:
             raise ProtocolError("Exception creating status blob: {0}", ustr(e))
 
+        if not self.status_blob.is_upload_needed(ext_conf.status_upload_blob):
+            logger.verbose("The status has not changed since the last upload; skipping the upload")
+            return
+
         # Swap the order of use for the HostPlugin vs. the "direct" route.
         # Prefer the use of HostPlugin. If HostPlugin fails fall back to the
         # direct route.
@@ -974,6 +1374,7 @@ class WireClient(object):
         try:
             host = self.get_host_plugin()
             host.put_vm_status(self.status_blob, ext_conf.status_upload_blob, ext_conf.status_upload_blob_type)
+            self.status_blob.mark_uploaded(ext_conf.status_upload_blob)
             return
         except ResourceGoneError:
             # refresh the host plugin client and try again on the next iteration of the main loop
@@ -986,6 +1387,7 @@ class WireClient(object):
 
         try:
             if self.status_blob.upload(ext_conf.status_upload_blob):
+                self.status_blob.mark_uploaded(ext_conf.status_upload_blob)
                 return
         except Exception as e:
             msg = "Exception uploading status blob: {0}".format(ustr(e))
@@ -1065,12 +1467,19 @@ class WireClient(object):
                 "Failed to send events:{0}".format(resp.status))
 
     def report_event(self, event_list):
+        # The events may have been encoded already when they were split in batches (see EventLogger.collect_event_batches)
+        encoded_events = event_list.get_encoded_events()
+        if encoded_events is None:
+            encoder = TelemetryEventEncoder()
+            encoded_events = [encoder.encode(event) for event in event_list.events]
+
+        # Group events by providerId; for each provider we keep the list of encoded events and their total length
         buf = {}
-        # Group events by providerId
-        for event in event_list.events:
+        buf_size = {}
+        for event, event_str in zip(event_list.events, encoded_events):
             if event.providerId not in buf:
-                buf[event.providerId] = ""
-            event_str = event_to_v1(event)
+                buf[event.providerId] = []
+                buf_size[event.providerId] = 0
             if len(event_str) >= MAX_EVENT_BUFFER_SIZE:
                 details_of_event = [ustr(x.name) + ":" + ustr(x.value) for x in event.parameters if x.name in
                                     ["Name", "Version", "Operation", "OperationSuccess"]]
@@ -1078,15 +1487,17 @@ class WireClient(object):
                                      "Single event too large: {0}, with the length: {1} more than the limit({2})"
                                      .format(str(details_of_event), len(event_str), MAX_EVENT_BUFFER_SIZE))
                 continue
-            if len(buf[event.providerId] + event_str) >= MAX_EVENT_BUFFER_SIZE:
-                self.send_event(event.providerId, buf[event.providerId])
-                buf[event.providerId] = ""
-            buf[event.providerId] = buf[event.providerId] + event_str
+            if buf_size[event.providerId] + len(event_str) >= MAX_EVENT_BUFFER_SIZE:
+                self.send_event(event.providerId, "".join(buf[event.providerId]))
+                buf[event.providerId] = []
+                buf_size[event.providerId] = 0
+            buf[event.providerId].append(event_str)
+            buf_size[event.providerId] += len(event_str)
 
         # Send out all events left in buffer.
         for provider_id in list(buf.keys()):
-            if len(buf[provider_id]) > 0:
-                self.send_event(provider_id, buf[provider_id])
+            if buf_size[provider_id] > 0:
+                self.send_event(provider_id, "".join(buf[provider_id]))
 
     def report_status_event(self, message, is_success):
         from azurelinuxagent.common.event import report_event, \
@@ -1123,12 +1534,13 @@ class WireClient(object):
         }
 
     def get_host_plugin(self):
-        if self._host_plugin is None:
-            goal_state = GoalState.fetch_goal_state(self)
-            self._set_host_plugin(HostPluginProtocol(self.get_endpoint(),
-                                                     goal_state.container_id,
-                                                     goal_state.role_config_name))
-        return self._host_plugin
+        with self._host_plugin_lock:
+            if self._host_plugin is None:
+                goal_state = GoalState.fetch_goal_state_if_modified(self)
+                self._set_host_plugin(HostPluginProtocol(self.get_endpoint(),
+                                                         goal_state.container_id,
+                                                         goal_state.role_config_name))
+            return self._host_plugin
 
     def has_artifacts_profile_blob(self):
         ext_conf = self.get_ext_conf()
@@ -43,7 +43,7 @@ def setup_rdma_device(nd_version, shared_conf):
         logger.error("Could not parse SharedConfig XML document")
         return
     instance_elem = find(xml_doc, "Instance")
-    if not instance_elem:
+    if instance_elem is None:
         logger.error("Could not find <Instance> in SharedConfig document")
         return
 
@@ -28,6 +28,7 @@ PROC_STATM_FILENAME_FORMAT = "/proc/{0}/statm"
 PROC_CMDLINE_FILENAME_FORMAT = "/proc/{0}/cmdline"
 PROC_COMM_FILENAME_FORMAT = "/proc/{0}/comm"
 PROC_STATUS_FILENAME_FORMAT = "/proc/{0}/status"
+PROC_STAT_FILENAME_FORMAT = "/proc/{0}/stat"
 
 
 class ResourceUsage(object):
@@ -83,6 +84,32 @@ class ProcessInfo(object):
         proc_pid_rss = ProcessInfo._get_proc_cmdline(process_id)
         return proc_pid_rss
 
+    @staticmethod
+    def get_proc_start_time(process_id):
+        """
+        /proc/<pid>/stat field 22 is the time the process started after system boot (in clock ticks); together with
+        the pid, it identifies the process even if the pid is reused.
+
+        The second field is the command name in parentheses, which can include spaces and parentheses, so the fields
+        are counted from the last ')'.
+
+        Here an example:
+        root@vm:/# cat /proc/1392/stat
+        1392 (python) S 1 1392 1392 0 -1 4194560 3522 0 0 0 10 3 0 0 20 0 1 0 1937 ...
+
+        :return: start time of the process
+        """
+        stat_file_name = PROC_STAT_FILENAME_FORMAT.format(process_id)
+        try:
+            pid_stat = fileutil.read_file(stat_file_name)
+            start_time = int(pid_stat[pid_stat.rindex(')') + 2:].split()[19])
+        except Exception as e:
+            if isinstance(e, (IOError, OSError)):
+                raise
+            raise ProcessInfoException("Could not get contents from {0}".format(stat_file_name), e)
+
+        return start_time
+
     @classmethod
     def _get_proc_cmdline(cls, process_id):
         """
@@ -17,11 +17,37 @@
 # Requires Python 2.6+ and Openssl 1.0+
 #
 
-from azurelinuxagent.common.datacontract import DataContract, DataContractList
+import json
+import re
+import xml.sax.saxutils as saxutils
+
+import azurelinuxagent.common.logger as logger
+from azurelinuxagent.common.datacontract import DataContract, DataContractList, validate_param
+from azurelinuxagent.common.future import ustr
 from azurelinuxagent.common.version import AGENT_NAME
 
+# Type tags of the event parameters in the v1 XML format, indexed by the type of their value
+_PARAM_TYPE_TAGS = {
+    int: 'mt:uint64',
+    str: 'mt:wstr',
+    ustr: 'mt:wstr',
+    bool: 'mt:bool',
+    float: 'mt:float64'
+}
+
+# Characters that saxutils.quoteattr() escapes
+_XML_ATTRIBUTE_SPECIAL_CHARACTERS = re.compile(r'[&<>"\'\n\r\t]')
+
+
+def _quote_xml_attribute(value):
+    if _XML_ATTRIBUTE_SPECIAL_CHARACTERS.search(value) is None:
+        return '"' + value + '"'
+    return saxutils.quoteattr(value)
+
 
 class TelemetryEventParam(DataContract):
+    __slots__ = ('name', 'value')
+
     def __init__(self, name=None, value=None):
         self.name = name
         self.value = value
@@ -29,34 +55,211 @@ class TelemetryEventParam(DataContract):
     def __eq__(self, other):
         return isinstance(other, TelemetryEventParam) and other.name == self.name and other.value == self.value
 
+    def to_v1_xml(self):
+        return '<Param Name="' + ustr(self.name) + '" Value=' + _quote_xml_attribute(ustr(self.value)) + \
+               ' T="' + _PARAM_TYPE_TAGS.get(type(self.value), "") + '" />'
+
+
+class TelemetryEventParamList(DataContractList):
+    """
+    List of TelemetryEventParams that keeps an index of the parameters by name, for constant-time lookups.
+    If there are several parameters with the same name, the index refers to the first one.
+    """
+    def __init__(self, parameters=None):
+        DataContractList.__init__(self, TelemetryEventParam)
+        self._index = {}
+        if parameters is not None:
+            self.extend(parameters)
+
+    def find(self, name):
+        """
+        Returns the first parameter with the given name, or None if there is no such parameter
+        """
+        return self._index.get(name)
+
+    def append(self, parameter):
+        list.append(self, parameter)
+        if parameter.name not in self._index:
+            self._index[parameter.name] = parameter
+
+    def extend(self, parameters):
+        for p in parameters:
+            self.append(p)
+
+    def __iadd__(self, parameters):
+        self.extend(parameters)
+        return self
+
+    def _update_index(self):
+        self._index = {}
+        for p in self:
+            if p.name not in self._index:
+                self._index[p.name] = p
+
+    # Other operations that modify the list are uncommon, so they simply re-create the index
+    def insert(self, position, parameter):
+        list.insert(self, position, parameter)
+        self._update_index()
+
+    def remove(self, parameter):
+        list.remove(self, parameter)
+        self._update_index()
+
+    def pop(self, *args):
+        parameter = list.pop(self, *args)
+        self._update_index()
+        return parameter
+
+    def __setitem__(self, key, value):
+        list.__setitem__(self, key, value)
+        self._update_index()
+
+    def __delitem__(self, key):
+        list.__delitem__(self, key)
+        self._update_index()
+
+    # Python 2 uses these for slices
+    def __setslice__(self, i, j, sequence):
+        list.__setslice__(self, i, j, sequence)
+        self._update_index()
+
+    def __delslice__(self, i, j):
+        list.__delslice__(self, i, j)
+        self._update_index()
+
 
 class TelemetryEvent(DataContract):
+    __slots__ = ('eventId', 'providerId', 'parameters', 'file_type')
+
     def __init__(self, eventId=None, providerId=None):
         self.eventId = eventId
         self.providerId = providerId
-        self.parameters = DataContractList(TelemetryEventParam)
+        self.parameters = TelemetryEventParamList()
         self.file_type = ""
 
+    def find_parameter(self, param_name):
+        """
+        Returns the first parameter with the given name, or None if the event does not have that parameter
+        """
+        if isinstance(self.parameters, TelemetryEventParamList):
+            return self.parameters.find(param_name)
+        # the parameters may have been replaced with a regular list
+        for param in self.parameters:
+            if param.name == param_name:
+                return param
+        return None
+
     # Checking if the particular param name is in the TelemetryEvent.
     def __contains__(self, param_name):
-        return param_name in [param.name for param in self.parameters]
+        return self.find_parameter(param_name) is not None
 
     def is_extension_event(self):
         # Events originating from the agent have "WALinuxAgent" as the Name parameter, or they don't have a Name
         # parameter, in the case of log and metric events. So, in case the Name parameter exists and it is not
         # "WALinuxAgent", it is an extension event.
-        for param in self.parameters:
-            if param.name == "Name":
-                return param.value != AGENT_NAME
-        return False
+        param = self.find_parameter("Name")
+        return param is not None and param.value != AGENT_NAME
 
     def get_version(self):
-        for param in self.parameters:
-            if param.name == "Version":
-                return param.value
-        return None
+        param = self.find_parameter("Version")
+        return param.value if param is not None else None
+
+    def to_json(self):
+        """
+        Equivalent to json.dumps(get_properties(event)), without the overhead of reflection
+        """
+        return json.dumps({
+            'eventId': self.eventId,
+            'providerId': self.providerId,
+            'parameters': [{'name': p.name, 'value': p.value} for p in self.parameters],
+            'file_type': self.file_type
+        })
+
+    @staticmethod
+    def from_json(data_str):
+        """
+        Equivalent to set_properties("TelemetryEvent", TelemetryEvent(), json.loads(data_str)), without the overhead
+        of reflection. Raises ValueError if the data is not valid JSON, and ProtocolError if it is not a valid event.
+        """
+        data = json.loads(data_str)
+        validate_param("Property 'TelemetryEvent'", data, dict)
+
+        event = TelemetryEvent()
+        for name, value in data.items():
+            if name == 'parameters':
+                validate_param("List 'TelemetryEvent.parameters'", value, list)
+                for param_data in value:
+                    validate_param("Property 'TelemetryEvent.parameters'", param_data, dict)
+                    param = TelemetryEventParam()
+                    for param_property, param_value in param_data.items():
+                        if param_property == 'name':
+                            param.name = param_value
+                        elif param_property == 'value':
+                            param.value = param_value
+                        else:
+                            logger.warn("Unknown property: TelemetryEvent.parameters.{0}", param_property)
+                    event.parameters.append(param)
+            elif name in ('eventId', 'providerId', 'file_type'):
+                setattr(event, name, value)
+            else:
+                logger.warn("Unknown property: TelemetryEvent.{0}", name)
+        return event
+
+    def to_v1_xml(self):
+        return '<Event id="' + ustr(self.eventId) + '"><![CDATA[' + \
+               ''.join([param.to_v1_xml() for param in self.parameters]) + \
+               ']]></Event>'
 
 
 class TelemetryEventList(DataContract):
+    # '_encoded_events' is not part of the contract (see get_encoded_events)
+    __slots__ = ('events', '_encoded_events')
+
     def __init__(self):
         self.events = DataContractList(TelemetryEvent)
+        self._encoded_events = None
+
+    def get_encoded_events(self):
+        """
+        Returns the events encoded by TelemetryEventEncoder, or None if they have not been encoded; the list is
+        parallel to 'events'.
+        """
+        return self._encoded_events
+
+    def set_encoded_events(self, encoded_events):
+        self._encoded_events = encoded_events
+
+
+class TelemetryEventEncoder(object):
+    """
+    Encodes events in the format expected by the telemetry endpoint of the WireServer (the same format as
+    TelemetryEvent.to_v1_xml).
+
+    Most of the parameters of the events (the common parameters added by the EventLogger) have the same values across
+    events, so the encoder keeps the encoded parameters and reuses them for subsequent events. An encoder is meant to
+    be used for a single flush of the events.
+    """
+    # Only short values are cached; longer values (e.g. messages) are unlikely to repeat
+    _MAX_CACHED_VALUE_LENGTH = 256
+    _CACHEABLE_TYPES = (int, str, ustr, bool, float)
+
+    def __init__(self):
+        self._params = {}
+
+    def encode(self, event):
+        parts = ['<Event id="', ustr(event.eventId), '"><![CDATA[']
+        for param in event.parameters:
+            value = param.value
+            value_type = type(value)
+            if value_type not in TelemetryEventEncoder._CACHEABLE_TYPES or \
+                    (value_type in (str, ustr) and len(value) > TelemetryEventEncoder._MAX_CACHED_VALUE_LENGTH):
+                parts.append(param.to_v1_xml())
+                continue
+            key = (param.name, value_type, value)
+            encoded = self._params.get(key)
+            if encoded is None:
+                encoded = param.to_v1_xml()
+                self._params[key] = encoded
+            parts.append(encoded)
+        parts.append(']]></Event>')
+        return ''.join(parts)
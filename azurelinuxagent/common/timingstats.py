@@ -0,0 +1,287 @@
+# Microsoft Azure Linux Agent
+#
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import azurelinuxagent.common.logger as logger
+from azurelinuxagent.common.future import ustr
+from azurelinuxagent.common.utils import fileutil
+
+TIMING_STATS_FILE_NAME = "waagent_timing_stats.json"
+
+# Upper bounds (in seconds) of the buckets of the histograms of durations; the last bucket has no upper bound
+HISTOGRAM_BUCKETS = [0.01, 0.1, 1, 10, 60, 600]
+
+# Operations beyond this number are not recorded; the names of the operations should not depend on user data
+MAX_OPERATIONS = 256
+
+_MAX_ERROR_LENGTH = 256
+
+# Category and counters of the metrics reported by the monitor thread for each operation
+METRICS_CATEGORY = "Agent Timing"
+
+
+class TimingMetricsCounter(object):
+    COUNT = "Count"
+    ERROR_COUNT = "Error Count"
+    WALL_TIME = "Wall Time"
+    CPU_TIME = "CPU Time"
+
+
+def _get_thread_cpu_time():
+    """
+    Returns the CPU time (in seconds) used by the current thread, or None if the platform cannot report it
+    """
+    if hasattr(time, "thread_time"):  # Python 3.7+
+        return time.thread_time()
+    if hasattr(time, "clock_gettime") and hasattr(time, "CLOCK_THREAD_CPUTIME_ID"):  # Python 3.3+
+        return time.clock_gettime(time.CLOCK_THREAD_CPUTIME_ID)
+    return None
+
+
+class OperationStats(object):
+    """
+    Statistics of the executions of an operation: number of executions and errors, histogram of their durations, total
+    wall and CPU time, and the last error. The CPU time is the time used by the thread that executed the operation (it
+    does not include, for example, the time used by child processes).
+    """
+    def __init__(self):
+        self.count = 0
+        self.error_count = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.max_wall_time = 0.0
+        self.histogram = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        self.last_error = None
+        self.last_error_time = None
+
+    def add(self, wall_time, cpu_time, error):
+        self.count += 1
+        self.wall_time += wall_time
+        if cpu_time is not None:
+            self.cpu_time += cpu_time
+        self.max_wall_time = max(self.max_wall_time, wall_time)
+
+        bucket = 0
+        while bucket < len(HISTOGRAM_BUCKETS) and wall_time > HISTOGRAM_BUCKETS[bucket]:
+            bucket += 1
+        self.histogram[bucket] += 1
+
+        if error is not None:
+            self.error_count += 1
+            self.last_error = error[:_MAX_ERROR_LENGTH]
+            self.last_error_time = datetime.utcnow().isoformat()
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "error_count": self.error_count,
+            "wall_time": round(self.wall_time, 6),
+            "cpu_time": round(self.cpu_time, 6),
+            "max_wall_time": round(self.max_wall_time, 6),
+            "histogram": list(self.histogram),
+            "last_error": self.last_error,
+            "last_error_time": self.last_error_time
+        }
+
+
+class _Timer(object):
+    """
+    Context manager that records the execution of a block of code as an execution of the given operation; the
+    execution is recorded as an error if the block raises an exception, or if 'error' is set within the block.
+    """
+    def __init__(self, registry, name):
+        self._registry = registry
+        self._name = name
+        self._start_wall_time = None
+        self._start_cpu_time = None
+        self.error = None
+
+    def __enter__(self):
+        self._start_wall_time = time.time()
+        self._start_cpu_time = _get_thread_cpu_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall_time = max(0.0, time.time() - self._start_wall_time)
+        cpu_time = None
+        if self._start_cpu_time is not None:
+            cpu_time = max(0.0, _get_thread_cpu_time() - self._start_cpu_time)
+
+        error = self.error
+        if exc_value is not None:
+            error = "{0}: {1}".format(exc_type.__name__, ustr(exc_value))
+
+        self._registry.record(self._name, wall_time, cpu_time=cpu_time, error=error)
+        return False
+
+
+class TimingRegistry(object):
+    """
+    Thread-safe registry of the OperationStats of the operations executed by the agent.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._operations = {}
+        # values of (count, error_count, wall_time, cpu_time) returned by the previous call to get_interval_stats()
+        self._reported = {}
+        self._start_time = datetime.utcnow().isoformat()
+
+    def timed(self, name):
+        return _Timer(self, name)
+
+    def record(self, name, wall_time, cpu_time=None, error=None):
+        with self._lock:
+            stats = self._operations.get(name)
+            if stats is None:
+                if len(self._operations) >= MAX_OPERATIONS:
+                    return
+                stats = self._operations[name] = OperationStats()
+            stats.add(wall_time, cpu_time, error)
+
+    def get_stats(self):
+        """
+        Returns a dictionary with the statistics of all the operations, suitable for serialization as JSON
+        """
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "start_time": self._start_time,
+                "timestamp": datetime.utcnow().isoformat(),
+                "histogram_buckets": HISTOGRAM_BUCKETS,
+                "operations": dict((name, stats.to_dict()) for name, stats in self._operations.items())
+            }
+
+    def get_interval_stats(self):
+        """
+        Returns a dictionary with the number of executions and errors, and the wall and CPU time, of each operation
+        executed since the previous call to this function
+        """
+        interval_stats = {}
+        with self._lock:
+            for name, stats in self._operations.items():
+                current = (stats.count, stats.error_count, stats.wall_time, stats.cpu_time)
+                previous = self._reported.get(name, (0, 0, 0.0, 0.0))
+                if current[0] > previous[0]:
+                    interval_stats[name] = {
+                        "count": current[0] - previous[0],
+                        "error_count": current[1] - previous[1],
+                        "wall_time": round(current[2] - previous[2], 6),
+                        "cpu_time": round(current[3] - previous[3], 6)
+                    }
+                self._reported[name] = current
+        return interval_stats
+
+    def save(self, path):
+        """
+        Writes the statistics to the given file; the file is replaced atomically, so readers never see partial data
+        """
+        try:
+            fileutil.write_file(path + ".tmp", json.dumps(self.get_stats(), sort_keys=True))
+            os.rename(path + ".tmp", path)
+        except (IOError, OSError) as e:
+            logger.warn("Failed to save the timing statistics to {0}: {1}", path, ustr(e))
+
+    def reset(self):
+        with self._lock:
+            self._operations = {}
+            self._reported = {}
+
+
+__registry__ = TimingRegistry()
+
+
+def timed(name, registry=__registry__):
+    """
+    Returns a context manager that records the execution of a block of code, e.g.
+
+        with timingstats.timed("EnvHandler.Loop"):
+            ...
+    """
+    return registry.timed(name)
+
+
+def record(name, wall_time, cpu_time=None, error=None, registry=__registry__):
+    registry.record(name, wall_time, cpu_time=cpu_time, error=error)
+
+
+def get_stats(registry=__registry__):
+    return registry.get_stats()
+
+
+def get_interval_stats(registry=__registry__):
+    return registry.get_interval_stats()
+
+
+def save_stats(path, registry=__registry__):
+    registry.save(path)
+
+
+def load_stats(path):
+    """
+    Reads the statistics saved by save_stats()
+    """
+    return json.loads(fileutil.read_file(path))
+
+
+def format_stats(stats):
+    """
+    Formats the statistics returned by get_stats() (or load_stats()) as a table, sorting the operations by their CPU
+    time and then by their wall time
+    """
+    lines = ["Timing statistics of process {0} (started {1}, saved {2})".format(
+        stats.get("pid"), stats.get("start_time"), stats.get("timestamp"))]
+
+    operations = stats.get("operations", {})
+    if len(operations) == 0:
+        lines.append("No operations have been recorded")
+        return "\n".join(lines)
+
+    row_format = "{0:<40} {1:>8} {2:>7} {3:>12} {4:>10} {5:>10} {6:>12}"
+    lines.append(row_format.format("Operation", "Count", "Errors", "Wall (s)", "Avg (s)", "Max (s)", "CPU (s)"))
+
+    def sort_key(item):
+        return -item[1]["cpu_time"], -item[1]["wall_time"], item[0]
+
+    for name, operation in sorted(operations.items(), key=sort_key):
+        average = operation["wall_time"] / operation["count"] if operation["count"] > 0 else 0.0
+        lines.append(row_format.format(name, operation["count"], operation["error_count"],
+                                       "{0:.3f}".format(operation["wall_time"]), "{0:.3f}".format(average),
+                                       "{0:.3f}".format(operation["max_wall_time"]),
+                                       "{0:.3f}".format(operation["cpu_time"])))
+
+    buckets = stats.get("histogram_buckets", HISTOGRAM_BUCKETS)
+    labels = ["<={0}s".format(b) for b in buckets] + [">{0}s".format(buckets[-1])]
+    lines.append("")
+    lines.append("Histograms of durations ({0}):".format(", ".join(labels)))
+    for name, operation in sorted(operations.items(), key=sort_key):
+        lines.append("    {0}: {1}".format(name, " ".join(str(c) for c in operation["histogram"])))
+
+    errors = [(name, operation) for name, operation in sorted(operations.items()) if operation["last_error"] is not None]
+    if len(errors) > 0:
+        lines.append("")
+        lines.append("Last errors:")
+        for name, operation in errors:
+            lines.append("    {0} [{1}]: {2}".format(name, operation["last_error_time"], operation["last_error"]))
+
+    return "\n".join(lines)
@@ -0,0 +1,135 @@
+# Microsoft Azure Linux Agent
+#
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+import errno
+import os
+import select
+import threading
+import time
+
+import azurelinuxagent.common.logger as logger
+from azurelinuxagent.common.future import ustr
+
+# inotify(7) constants
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+
+# Events for files that have been completely written (written and closed, or renamed into the directory)
+_WATCH_MASK = _IN_CLOSE_WRITE | _IN_MOVED_TO
+
+
+class _Inotify(object):
+    """
+    Minimal wrapper for the inotify API of libc (loaded with ctypes on first use)
+    """
+    _lock = threading.Lock()
+    _libc = None
+    _initialized = False
+
+    @staticmethod
+    def get_libc():
+        with _Inotify._lock:
+            if not _Inotify._initialized:
+                _Inotify._initialized = True
+                try:
+                    import ctypes
+                    libc = ctypes.CDLL("libc.so.6", use_errno=True)
+                    if hasattr(libc, "inotify_init1") and hasattr(libc, "inotify_add_watch"):
+                        _Inotify._libc = libc
+                except Exception as e:
+                    logger.verbose("inotify is not available: {0}", ustr(e))
+            return _Inotify._libc
+
+
+class DirectoryWatcher(object):
+    """
+    Waits for files to be written to a directory.
+
+    Uses inotify when available; otherwise (or if the directory cannot be watched) it falls back to polling, with an
+    interval that starts at 'min_poll_interval' and doubles after each wait, up to 'max_poll_interval'.
+
+    Note that wait() can return before any changes happen (e.g. when the timeout elapses), so callers must check
+    the files they are waiting on after each wait.
+    """
+    def __init__(self, path, min_poll_interval=0.1, max_poll_interval=5):
+        self._path = path
+        self._poll_interval = min_poll_interval
+        self._max_poll_interval = max_poll_interval
+        self._fd = None
+        self._start_inotify()
+
+    def _start_inotify(self):
+        libc = _Inotify.get_libc()
+        if libc is None:
+            return
+        fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if fd < 0:
+            return
+        path = self._path if isinstance(self._path, bytes) else self._path.encode('utf-8')
+        if libc.inotify_add_watch(fd, path, _WATCH_MASK) < 0:
+            os.close(fd)
+            return
+        self._fd = fd
+
+    def is_using_inotify(self):
+        return self._fd is not None
+
+    def wait(self, timeout):
+        """
+        Waits until a file is written to the directory or the given timeout (in seconds) elapses; when polling the
+        wait is also limited by the polling interval. Returns True if a change was detected, False otherwise (when
+        polling, it always returns False).
+        """
+        if self._fd is None:
+            time.sleep(max(0, min(timeout, self._poll_interval)))
+            self._poll_interval = min(self._poll_interval * 2, self._max_poll_interval)
+            return False
+
+        try:
+            readable, _, _ = select.select([self._fd], [], [], max(0, min(timeout, self._max_poll_interval)))
+        except (select.error, OSError, IOError) as e:
+            logger.verbose("Error waiting for changes in {0}: {1}", self._path, ustr(e))
+            return False
+        if len(readable) == 0:
+            return False
+        self._drain_events()
+        return True
+
+    def _drain_events(self):
+        while True:
+            try:
+                if len(os.read(self._fd, 4096)) == 0:
+                    return
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    logger.verbose("Error reading changes in {0}: {1}", self._path, ustr(e))
+                return
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
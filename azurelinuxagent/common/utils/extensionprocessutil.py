@@ -19,6 +19,7 @@
 
 from azurelinuxagent.common.exception import ExtensionErrorCodes, ExtensionOperationError, ExtensionError
 from azurelinuxagent.common.future import ustr
+import errno
 import os
 import signal
 import time
@@ -26,6 +27,16 @@ import time
 TELEMETRY_MESSAGE_MAX_LEN = 3200
 
 
+# The interval used to poll for process completion starts at _MIN_POLL_INTERVAL and doubles on each iteration up to
+# _MAX_POLL_INTERVAL, so short commands are detected as completed within a few milliseconds while long running commands
+# are not polled too frequently
+_MIN_POLL_INTERVAL = 0.01
+_MAX_POLL_INTERVAL = 0.5
+
+# Maximum time to wait for the children forked by the process (if any) after the process completes
+_FORKED_CHILDREN_WAIT = 1
+
+
 def wait_for_process_completion_or_timeout(process, timeout):
     """
     Utility function that waits for the process to complete within the given time frame. This function will terminate
@@ -34,20 +45,56 @@ def wait_for_process_completion_or_timeout(process, timeout):
     :param timeout: Number of seconds to wait for the process to complete before killing it
     :return: Two parameters: boolean for if the process timed out and the return code of the process (None if timed out)
     """
-    while timeout > 0 and process.poll() is None:
-        time.sleep(1)
-        timeout -= 1
+    process_group = _get_own_process_group(process)
+
+    remaining = _wait_while(lambda: process.poll() is None, timeout)
+    timed_out = remaining <= 0
 
     return_code = None
 
-    if timeout == 0:
+    if timed_out:
         os.killpg(os.getpgid(process.pid), signal.SIGKILL)
     else:
-        # process completed or forked; sleep 1 sec to give the child process (if any) a chance to start
-        time.sleep(1)
         return_code = process.wait()
+        # the process may have forked; give the child processes (if any) a chance to start
+        if process_group is not None:
+            _wait_while(lambda: _process_group_exists(process_group), _FORKED_CHILDREN_WAIT)
 
-    return timeout == 0, return_code
+    return timed_out, return_code
+
+
+def _wait_while(condition, timeout):
+    """
+    Polls the given condition, with increasing intervals, while it is True and the timeout (in seconds) has not elapsed.
+    Returns the remaining time (0 or less if the timeout elapsed).
+    """
+    interval = _MIN_POLL_INTERVAL
+    while timeout > 0 and condition():
+        interval = min(interval, timeout)
+        time.sleep(interval)
+        timeout -= interval
+        interval = min(interval * 2, _MAX_POLL_INTERVAL)
+    return timeout
+
+
+def _get_own_process_group(process):
+    """
+    Returns the process group of the given process if the process is the leader of its own group (e.g. it was started
+    with os.setsid), or None otherwise
+    """
+    try:
+        process_group = os.getpgid(process.pid)
+    except OSError:
+        return None
+    return process_group if process_group == process.pid else None
+
+
+def _process_group_exists(process_group):
+    try:
+        os.killpg(process_group, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
 
 
 def handle_process_completion(process, command, timeout, stdout, stderr, error_code):
@@ -0,0 +1,81 @@
+# Microsoft Azure Linux Agent
+#
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+import threading
+
+
+class TaskResult(object):
+    """
+    Outcome of a task executed by run_in_parallel: either the value returned by the task or the exception it raised
+    """
+    def __init__(self):
+        self.value = None
+        self.exception = None
+
+    @property
+    def succeeded(self):
+        return self.exception is None
+
+
+def run_in_parallel(tasks, max_workers, name="ParallelTask"):
+    """
+    Executes the given callables using at most 'max_workers' threads and waits for all of them to complete.
+
+    Exceptions raised by a task do not stop the execution of the other tasks; they are returned in the
+    corresponding TaskResult instead. The results are returned in the same order as the tasks.
+    When there is a single worker (or a single task) the tasks are executed sequentially on the calling thread.
+    """
+    results = [TaskResult() for _ in tasks]
+
+    def execute(index):
+        try:
+            results[index].value = tasks[index]()
+        except Exception as e:
+            results[index].exception = e
+
+    worker_count = min(max_workers, len(tasks))
+
+    if worker_count <= 1:
+        for i in range(len(tasks)):
+            execute(i)
+        return results
+
+    lock = threading.Lock()
+    pending = list(range(len(tasks)))
+    pending.reverse()
+
+    def worker():
+        while True:
+            with lock:
+                if len(pending) == 0:
+                    return
+                index = pending.pop()
+            execute(index)
+
+    threads = []
+    for i in range(worker_count):
+        thread = threading.Thread(target=worker, name="{0}-{1}".format(name, i))
+        thread.daemon = True
+        threads.append(thread)
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    return results
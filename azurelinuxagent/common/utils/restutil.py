@@ -17,16 +17,20 @@
 # Requires Python 2.6+ and Openssl 1.0+
 #
 
+import errno
 import os
 import re
+import select
 import threading
 import time
 import traceback
 import socket
 import struct
+from io import BytesIO
 
 import azurelinuxagent.common.conf as conf
 import azurelinuxagent.common.logger as logger
+import azurelinuxagent.common.timingstats as timingstats
 import azurelinuxagent.common.utils.textutil as textutil
 
 from azurelinuxagent.common.exception import HttpError, ResourceGoneError, InvalidContainerError
@@ -101,6 +105,17 @@ REQUEST_ROLE_CONFIG_FILE_NOT_FOUND = "RequestRoleConfigFileNotFound"
 KNOWN_WIRESERVER_IP = '168.63.129.16'
 HOST_PLUGIN_PORT = 32526
 
+HTTP_CONNECTION_TIMEOUT = 10
+MAX_IDLE_CONNECTIONS_PER_HOST = 4
+MAX_IDLE_CONNECTION_SECONDS = 60
+# Responses up to this size are read as soon as they arrive, so that their connection can be reused
+MAX_DRAINED_RESPONSE_SIZE = 8 * 1024
+
+# Requests with these methods can be sent again if a reused connection is closed before their response arrives
+IDEMPOTENT_METHODS = ["GET", "HEAD"]
+
+RESPONSE_CHUNK_SIZE = 1024 * 1024  # 1MB
+
 
 class IOErrorCounter(object):
     _lock = threading.RLock()
@@ -286,38 +301,197 @@ def redact_sas_tokens_in_urls(url):
     return SAS_TOKEN_RETRIEVAL_REGEX.sub(r"\1" + REDACTED_TEXT + r"\3", url)
 
 
-def _http_request(method, host, rel_uri, port=None, data=None, secure=False,
-                  headers=None, proxy_host=None, proxy_port=None):
+class HttpConnectionPool(object):
+    """
+    Keeps the keep-alive connections that can be reused for subsequent requests. Connections are keyed by
+    (scheme, host, port, proxy host, proxy port).
 
-    headers = {} if headers is None else headers
-    headers['Connection'] = 'close'
+    Only connections whose response has already been read completely are added to the pool (see
+    _release_connection). A connection is handed out again if it has not been idle for longer than
+    MAX_IDLE_CONNECTION_SECONDS and the server has not closed the socket.
+    """
+    _lock = threading.RLock()
+    _idle = {}
 
-    use_proxy = proxy_host is not None and proxy_port is not None
+    @staticmethod
+    def acquire(key):
+        """
+        Returns an idle connection for the given key, or None if there are no connections that can be reused
+        """
+        with HttpConnectionPool._lock:
+            entries = HttpConnectionPool._idle.get(key)
+            if not entries:
+                return None
+
+            now = time.time()
+            conn = None
+            while len(entries) > 0:
+                entry_conn, entry_time = entries.pop()
+                if now - entry_time > MAX_IDLE_CONNECTION_SECONDS or _is_connection_dropped(entry_conn):
+                    HttpConnectionPool._discard(entry_conn)
+                else:
+                    conn = entry_conn
+                    break
 
-    if port is None:
-        port = 443 if secure else 80
+            if len(entries) == 0:
+                del HttpConnectionPool._idle[key]
+
+            return conn
+
+    @staticmethod
+    def release(key, conn):
+        """
+        Adds the connection to the pool; the response to the last request on the connection must have been read
+        completely
+        """
+        with HttpConnectionPool._lock:
+            entries = HttpConnectionPool._idle.setdefault(key, [])
+            entries.append((conn, time.time()))
+            while len(entries) > MAX_IDLE_CONNECTIONS_PER_HOST:
+                oldest_conn, _ = entries.pop(0)
+                HttpConnectionPool._discard(oldest_conn)
+
+    @staticmethod
+    def clear():
+        with HttpConnectionPool._lock:
+            for entries in HttpConnectionPool._idle.values():
+                for conn, _ in entries:
+                    HttpConnectionPool._discard(conn)
+            HttpConnectionPool._idle = {}
+
+    @staticmethod
+    def get_idle_count(key=None):
+        with HttpConnectionPool._lock:
+            if key is not None:
+                return len(HttpConnectionPool._idle.get(key, []))
+            return sum(len(entries) for entries in HttpConnectionPool._idle.values())
+
+    @staticmethod
+    def _discard(conn):
+        try:
+            conn.close()
+        except Exception as e:
+            logger.verbose("Error closing HTTP connection: {0}", ustr(e))
+
+
+class _DrainedResponse(object):
+    """
+    Wraps a response whose body was read by _release_connection; the body is served from memory and any other
+    attribute (status, reason, getheader(), etc) is taken from the original response.
+    """
+    def __init__(self, resp, body):
+        self._resp = resp
+        self._body = BytesIO(body)
+
+    def read(self, amt=None):
+        if amt is None:
+            return self._body.read()
+        return self._body.read(amt)
+
+    def close(self):
+        self._body.close()
+
+    def __getattr__(self, name):
+        return getattr(self._resp, name)
+
+
+def _get_content_length(resp):
+    try:
+        return int(resp.getheader("Content-Length"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _release_connection(key, method, conn, resp):
+    """
+    Adds the connection to the pool if the response can be read right away without delaying the caller: responses
+    without a body (HEAD, 204, 304) and responses whose Content-Length is at most MAX_DRAINED_RESPONSE_SIZE. The
+    body of the latter is read here and served from memory to the caller. Any other connection is not reused; its
+    socket is closed when the caller reads the response to the end or closes it.
+
+    Returns the response that should be returned to the caller.
+    """
+    if getattr(resp, "will_close", False) is True:
+        # The server will close the connection after this response
+        return resp
+
+    if method == "HEAD" or resp.status in (httpclient.NO_CONTENT, httpclient.NOT_MODIFIED):
+        resp.read()
+        HttpConnectionPool.release(key, conn)
+        return resp
+
+    content_length = _get_content_length(resp)
+    if content_length is None or content_length > MAX_DRAINED_RESPONSE_SIZE:
+        return resp
+
+    body = resp.read()
+    HttpConnectionPool.release(key, conn)
+    return _DrainedResponse(resp, body)
 
-    if 'User-Agent' not in headers:
-        headers['User-Agent'] = HTTP_USER_AGENT
+
+def _is_connection_dropped(conn):
+    """
+    An idle keep-alive socket should have nothing to read; if it is readable the server either closed it or
+    sent unexpected data, and the connection cannot be reused.
+    """
+    sock = getattr(conn, "sock", None)
+    if sock is None:
+        # the connection will be re-opened on the next request
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return len(readable) > 0
+    except Exception:
+        return True
+
+
+def _is_stale_connection_error(e):
+    """
+    Returns True if the error indicates that the server closed the connection (BrokenPipeError/ConnectionResetError
+    on Python 3)
+    """
+    return isinstance(e, (socket.error, IOError)) and getattr(e, "errno", None) in (errno.EPIPE, errno.ECONNRESET)
+
+
+def _create_connection(host, port, secure, proxy_host, proxy_port):
+    use_proxy = proxy_host is not None and proxy_port is not None
 
     if use_proxy:
         conn_host, conn_port = proxy_host, proxy_port
-        scheme = "https" if secure else "http"
-        url = "{0}://{1}:{2}{3}".format(scheme, host, port, rel_uri)
     else:
         conn_host, conn_port = host, port
-        url = rel_uri
 
     if secure:
         conn = httpclient.HTTPSConnection(conn_host,
                                           conn_port,
-                                          timeout=10)
+                                          timeout=HTTP_CONNECTION_TIMEOUT)
         if use_proxy:
             conn.set_tunnel(host, port)
     else:
         conn = httpclient.HTTPConnection(conn_host,
                                          conn_port,
-                                         timeout=10)
+                                         timeout=HTTP_CONNECTION_TIMEOUT)
+    return conn
+
+
+def _http_request(method, host, rel_uri, port=None, data=None, secure=False,
+                  headers=None, proxy_host=None, proxy_port=None):
+
+    headers = {} if headers is None else headers
+
+    use_proxy = proxy_host is not None and proxy_port is not None
+
+    if port is None:
+        port = 443 if secure else 80
+
+    if 'User-Agent' not in headers:
+        headers['User-Agent'] = HTTP_USER_AGENT
+
+    scheme = "https" if secure else "http"
+    if use_proxy:
+        url = "{0}://{1}:{2}{3}".format(scheme, host, port, rel_uri)
+    else:
+        url = rel_uri
 
     logger.verbose("HTTP connection [{0}] [{1}] [{2}] [{3}]",
                    method,
@@ -325,8 +499,36 @@ def _http_request(method, host, rel_uri, port=None, data=None, secure=False,
                    data,
                    headers)
 
+    pool_key = (scheme, host, port, proxy_host, proxy_port)
+
+    conn = HttpConnectionPool.acquire(pool_key)
+    if conn is not None:
+        # The server may close an idle connection at any time. The request is retried on a new connection only if it
+        # failed because the connection was stale and the server could not have processed it: either sending it failed,
+        # or (for idempotent methods only) the connection was closed before any part of the response arrived. Any
+        # other error (e.g. a timeout waiting for the response) is raised to the caller.
+        try:
+            conn.request(method=method, url=url, body=data, headers=headers)
+        except (httpclient.HTTPException, IOError) as e:
+            conn.close()
+            if not _is_stale_connection_error(e):
+                raise
+            logger.verbose("Sending a request on a reused HTTP connection failed, retrying on a new connection: {0}", ustr(e))
+        else:
+            try:
+                resp = conn.getresponse()
+            except (httpclient.HTTPException, IOError) as e:
+                conn.close()
+                if method not in IDEMPOTENT_METHODS or not isinstance(e, httpclient.BadStatusLine):
+                    raise
+                logger.verbose("A reused HTTP connection was closed before the response, retrying on a new connection: {0}", ustr(e))
+            else:
+                return _release_connection(pool_key, method, conn, resp)
+
+    conn = _create_connection(host, port, secure, proxy_host, proxy_port)
     conn.request(method=method, url=url, body=data, headers=headers)
-    return conn.getresponse()
+    resp = conn.getresponse()
+    return _release_connection(pool_key, method, conn, resp)
 
 
 def http_request(method,
@@ -403,15 +605,18 @@ def http_request(method,
         attempt += 1
 
         try:
-            resp = _http_request(method,
-                                 host,
-                                 rel_uri,
-                                 port=port,
-                                 data=data,
-                                 secure=secure,
-                                 headers=headers,
-                                 proxy_host=proxy_host,
-                                 proxy_port=proxy_port)
+            with timingstats.timed("HttpRequest.{0}".format(method)) as timer:
+                resp = _http_request(method,
+                                     host,
+                                     rel_uri,
+                                     port=port,
+                                     data=data,
+                                     secure=secure,
+                                     headers=headers,
+                                     proxy_host=proxy_host,
+                                     proxy_port=proxy_port)
+                if request_failed(resp):
+                    timer.error = "HTTP status {0}".format(resp.status)
             logger.verbose("[HTTP Response] Status Code {0}", resp.status)
 
             if request_failed(resp):
@@ -544,6 +749,10 @@ def request_not_modified(resp):
     return resp is not None and resp.status in NOT_MODIFIED_CODES
 
 
+def request_throttled(resp):
+    return resp is not None and _is_throttle_status(resp.status)
+
+
 def request_failed_at_hostplugin(resp, upstream_failure_codes=HOSTPLUGIN_UPSTREAM_FAILURE_CODES):
     """
     Host plugin will return 502 for any upstream issue, so a failure is any 5xx except 502
@@ -551,6 +760,24 @@ def request_failed_at_hostplugin(resp, upstream_failure_codes=HOSTPLUGIN_UPSTREA
     return resp is not None and resp.status >= 500 and resp.status not in upstream_failure_codes
 
 
+def read_response_to_file(resp, file_object, cancel=None):
+    """
+    Copies the body of the response to the given file object in chunks of RESPONSE_CHUNK_SIZE, so that the body is
+    never held in memory in full. Returns the number of bytes written, or None if 'cancel' (an optional
+    threading.Event) was set before the body was read completely.
+    """
+    size = 0
+    while True:
+        if cancel is not None and cancel.is_set():
+            resp.close()
+            return None
+        chunk = resp.read(RESPONSE_CHUNK_SIZE)
+        if not chunk:
+            return size
+        file_object.write(chunk)
+        size += len(chunk)
+
+
 def read_response_error(resp):
     result = ''
     if resp is not None:
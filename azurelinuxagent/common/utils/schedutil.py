@@ -0,0 +1,155 @@
+# Microsoft Azure Linux Agent
+#
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+import heapq
+import random
+import threading
+import time
+
+import azurelinuxagent.common.logger as logger
+from azurelinuxagent.common.future import ustr
+
+
+class PeriodicTask(object):
+    """
+    An operation executed periodically by a Scheduler, together with the statistics of its executions.
+
+    The times are in seconds. The first execution happens 'initial_delay' seconds after the task is added to the
+    scheduler; the following ones every 'period' seconds, each delayed by a random amount of up to 'jitter' seconds
+    (the jitter does not accumulate across executions). An execution that takes longer than 'timeout' seconds is
+    reported as a warning; the operation cannot be interrupted, but the executions it caused to miss are skipped
+    instead of being run back to back.
+    """
+    def __init__(self, name, operation, period, jitter=0, timeout=None, initial_delay=0):
+        self.name = name
+        self.operation = operation
+        self.period = period
+        self.jitter = jitter
+        self.timeout = timeout
+        self.initial_delay = initial_delay
+
+        self.run_count = 0
+        self.failure_count = 0
+        self.timeout_count = 0
+        self.total_run_time = 0.0
+        self.max_run_time = 0.0
+        self.last_run_time = None
+
+        # the time at which the task is due, before applying the jitter
+        self._scheduled_time = None
+
+    @property
+    def average_run_time(self):
+        return self.total_run_time / self.run_count if self.run_count > 0 else 0.0
+
+    def get_statistics(self):
+        return {
+            "name": self.name,
+            "run_count": self.run_count,
+            "failure_count": self.failure_count,
+            "timeout_count": self.timeout_count,
+            "average_run_time": round(self.average_run_time, 3),
+            "max_run_time": round(self.max_run_time, 3),
+            "last_run_time": None if self.last_run_time is None else round(self.last_run_time, 3)
+        }
+
+    def _run(self):
+        start_time = time.time()
+        try:
+            self.operation()
+        except Exception as e:
+            self.failure_count += 1
+            logger.warn("Error in periodic task {0}: {1}", self.name, ustr(e))
+        run_time = max(0.0, time.time() - start_time)
+
+        self.run_count += 1
+        self.total_run_time += run_time
+        self.max_run_time = max(self.max_run_time, run_time)
+        self.last_run_time = run_time
+
+        if self.timeout is not None and run_time > self.timeout:
+            self.timeout_count += 1
+            logger.warn("Periodic task {0} took {1:.3f} seconds, exceeding its timeout of {2} seconds "
+                        "(average: {3:.3f} seconds, maximum: {4:.3f} seconds)",
+                        self.name, run_time, self.timeout, self.average_run_time, self.max_run_time)
+
+
+class Scheduler(object):
+    """
+    Executes a set of PeriodicTasks on the thread that calls run(), each on its own period.
+
+    The tasks are kept in a priority queue ordered by the time of their next execution, and the thread sleeps until
+    the first of them is due (or until stop() is called); tasks that are due at the same time are executed in the order
+    in which they were added.
+    """
+    def __init__(self):
+        self._tasks = []
+        self._queue = []  # heap of (due time, sequence number, task)
+        self._sequence = 0
+        self._stop_event = threading.Event()
+
+    def add_task(self, task):
+        self._tasks.append(task)
+        task._scheduled_time = time.time() + task.initial_delay
+        self._push(task._scheduled_time, task)
+
+    def get_statistics(self):
+        """
+        Returns a list with the statistics of each task, in the order in which they were added
+        """
+        return [task.get_statistics() for task in self._tasks]
+
+    def stop(self):
+        self._stop_event.set()
+
+    def is_stopped(self):
+        return self._stop_event.is_set()
+
+    def run(self):
+        """
+        Executes the tasks until stop() is called
+        """
+        while not self.is_stopped() and len(self._queue) > 0:
+            due_time, _, task = self._queue[0]
+            now = time.time()
+
+            if due_time > now:
+                if task._scheduled_time - now > task.initial_delay + task.period:
+                    # the system clock was set back; the task would not be executed for longer than its period
+                    heapq.heappop(self._queue)
+                    task._scheduled_time = now
+                    self._push(now, task)
+                    continue
+                self._stop_event.wait(due_time - now)
+                continue
+
+            heapq.heappop(self._queue)
+            task._run()
+
+            task._scheduled_time += task.period
+            now = time.time()
+            if task._scheduled_time <= now:
+                # skip the executions missed while the task (or a previous one) was running
+                missed = int((now - task._scheduled_time) / task.period) + 1 if task.period > 0 else 0
+                task._scheduled_time += missed * task.period
+            self._push(task._scheduled_time + random.uniform(0, task.jitter), task)
+
+    def _push(self, due_time, task):
+        heapq.heappush(self._queue, (due_time, self._sequence, task))
+        self._sequence += 1
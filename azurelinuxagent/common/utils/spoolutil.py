@@ -0,0 +1,323 @@
+# Microsoft Azure Linux Agent
+#
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+import errno
+import json
+import os
+import re
+import threading
+import time
+
+import azurelinuxagent.common.logger as logger
+from azurelinuxagent.common.future import ustr
+from azurelinuxagent.common.utils import fileutil
+
+SEGMENT_FILE_EXTENSION = ".waagent.spool"
+SEGMENT_FILE_REGEX = re.compile(r'^(?P<timestamp>\d+)-(?P<pid>\d+)\.waagent\.spool$')
+CURSOR_FILE_NAME = "waagent.spool.cursor"
+
+# A segment is closed when it reaches this size or age (in seconds), and a new one is started
+SEGMENT_MAX_SIZE = 128 * 1024
+SEGMENT_MAX_AGE = 5 * 60
+
+# When a new segment is started, the oldest segments are removed to keep at most this number of them
+MAX_NUMBER_OF_SEGMENTS = 16
+
+# Closed segments are removed once they have been read and they have not been modified for this long (in seconds);
+# the margin guards against a writer that checked the age of the segment just before appending to it.
+_SEGMENT_REMOVAL_MARGIN = 60
+
+# Records are "<length>\n<data>\n"; the length is the number of bytes in <data>
+_MAX_RECORD_HEADER_SIZE = 11
+
+# The segment must not be inherited by the extensions started by the agent
+_O_CLOEXEC = getattr(os, "O_CLOEXEC", 0)
+
+
+class Spool(object):
+    """
+    An append-only, on-disk queue of records (byte strings).
+
+    Each process appends to its own segment file, which is kept open and is replaced by a new segment when it reaches
+    SEGMENT_MAX_SIZE bytes or SEGMENT_MAX_AGE seconds. read() returns the records that have been appended since the
+    previous call to read(); the position of the reader within each segment is persisted in a cursor file, so records
+    are not returned twice across restarts. Segments are removed once they have been completely read and are no
+    longer written to.
+
+    Records are written with a single write(), so a reader may see a partial record at the end of a segment only while
+    it is being appended (or if the writer crashed in the middle of the write); read() leaves those records for the
+    next call, and discards them once the segment is closed.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._fd = None
+        self._pid = None
+        self._segment_size = 0
+        self._segment_creation_time = 0
+
+    def append(self, data):
+        """
+        Appends the given bytes to the spool. Raises IOError/OSError on failure.
+        """
+        record = "{0}\n".format(len(data)).encode("ascii") + data + b"\n"
+
+        with self._lock:
+            if self._should_start_segment(len(record)):
+                self._start_segment()
+
+            written = 0
+            while written < len(record):
+                written += os.write(self._fd, record[written:])
+            self._segment_size += len(record)
+
+    def close(self):
+        with self._lock:
+            self._close_segment()
+
+    def read(self):
+        """
+        Returns the records appended since the previous call, oldest segments first.
+        """
+        records = []
+        for batch, acknowledge in self.read_batches():
+            records.extend(batch)
+            acknowledge()
+        return records
+
+    def read_batches(self, max_batch_size=None):
+        """
+        Generator that returns the records appended since they were last acknowledged, oldest segments first, in
+        batches of about 'max_batch_size' bytes (or in a single batch, if 'max_batch_size' is None).
+
+        Each item is a tuple with the list of records in the batch and a function that acknowledges the batch (and any
+        batches before it); the records that are not acknowledged are returned again on the next read. The function
+        takes an optional 'count' to acknowledge only the first 'count' records of the batch.
+        """
+        try:
+            segments = [f for f in os.listdir(self.directory) if SEGMENT_FILE_REGEX.match(f) is not None]
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                logger.warn("Failed to list the spool directory {0}: {1}", self.directory, ustr(e))
+            return
+
+        if len(segments) == 0:
+            return
+
+        segments.sort(key=Spool._get_segment_sort_key)
+        saved_cursor = self._load_cursor()
+        # drop the segments that no longer exist from the cursor
+        cursor = dict((s, saved_cursor[s]) for s in segments if s in saved_cursor)
+
+        batch = []
+        batch_size = 0
+        # offsets within each segment after the records returned so far, and closed segments that have been read completely
+        offsets = {}
+        read_segments = []
+        has_records = False
+        # (segment, end offset) of each record in the batch, the segments completed during the batch (along with the
+        # number of records of the batch at that point) and the state of the reader when the batch was started
+        batch_ends = []
+        batch_segments = []
+        batch_start = (dict(offsets), list(read_segments))
+
+        for segment in segments:
+            path = os.path.join(self.directory, segment)
+            offset = cursor.get(segment, 0)
+            try:
+                is_closed = time.time() - os.path.getmtime(path) > SEGMENT_MAX_AGE + _SEGMENT_REMOVAL_MARGIN
+
+                with open(path, "rb") as segment_file:
+                    segment_file.seek(offset)
+                    data = segment_file.read()
+            except (IOError, OSError) as e:
+                if e.errno != errno.ENOENT:
+                    logger.warn("Failed to read spool segment {0}: {1}", path, ustr(e))
+                continue
+
+            segment_records, consumed, is_corrupt = Spool._parse_records(data)
+
+            for record, end in segment_records:
+                has_records = True
+                batch.append(record)
+                batch_size += len(record)
+                batch_ends.append((segment, offset + end))
+                offsets[segment] = offset + end
+                if max_batch_size is not None and batch_size >= max_batch_size:
+                    yield batch, self._get_acknowledge_function(cursor, offsets, read_segments, batch_start, batch_ends, batch_segments)
+                    batch = []
+                    batch_size = 0
+                    batch_ends = []
+                    batch_segments = []
+                    batch_start = (dict(offsets), list(read_segments))
+
+            if is_corrupt:
+                logger.warn("Spool segment {0} is corrupt at offset {1}; skipping the rest of the segment", path, offset + consumed)
+                offsets[segment] = offset + len(data)
+            elif is_closed and consumed < len(data):
+                logger.warn("Discarding incomplete record at the end of spool segment {0}", path)
+
+            if is_closed:
+                read_segments.append(segment)
+                batch_segments.append((segment, len(batch_ends)))
+
+        acknowledge = self._get_acknowledge_function(cursor, offsets, read_segments, batch_start, batch_ends, batch_segments)
+        if len(batch) > 0:
+            yield batch, acknowledge
+        elif not has_records:
+            # there are no records to return, but the cursor may need to be updated (e.g. to skip corrupt data, or to
+            # remove segments that have been read completely)
+            if len(offsets) > 0 or len(read_segments) > 0 or cursor != saved_cursor:
+                acknowledge()
+
+    def _get_acknowledge_function(self, cursor, offsets, read_segments, batch_start, batch_ends, batch_segments):
+        offsets = dict(offsets)
+        read_segments = list(read_segments)
+        batch_ends = list(batch_ends)
+        batch_segments = list(batch_segments)
+
+        def acknowledge(count=None):
+            if count is None or count >= len(batch_ends):
+                acknowledged_offsets, acknowledged_segments = offsets, read_segments
+            else:
+                # only the segments whose records have all been acknowledged are removed
+                acknowledged_offsets = dict(batch_start[0])
+                acknowledged_offsets.update(batch_ends[:count])
+                acknowledged_segments = batch_start[1] + [s for s, records in batch_segments if records <= count]
+            cursor.update(acknowledged_offsets)
+            for segment in acknowledged_segments:
+                try:
+                    os.remove(os.path.join(self.directory, segment))
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        logger.warn("Failed to remove spool segment {0}: {1}", segment, ustr(e))
+                        continue
+                cursor.pop(segment, None)
+            self._save_cursor(cursor)
+        return acknowledge
+
+    def _should_start_segment(self, record_size):
+        if self._fd is None or self._pid != os.getpid():
+            return True
+        if self._segment_size > 0 and self._segment_size + record_size > SEGMENT_MAX_SIZE:
+            return True
+        if time.time() - self._segment_creation_time >= SEGMENT_MAX_AGE:
+            return True
+        # the segment may have been removed (e.g. by the reader, or if the directory was deleted)
+        return os.fstat(self._fd).st_nlink == 0
+
+    def _start_segment(self):
+        self._close_segment()
+
+        fileutil.mkdir(self.directory, mode=0o700)
+
+        timestamp = int(time.time() * 1000000)
+        while True:
+            path = os.path.join(self.directory, "{0}-{1}{2}".format(timestamp, os.getpid(), SEGMENT_FILE_EXTENSION))
+            try:
+                self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_EXCL | _O_CLOEXEC, 0o600)
+                break
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+                timestamp += 1
+
+        self._pid = os.getpid()
+        self._segment_size = 0
+        self._segment_creation_time = time.time()
+
+        self._remove_oldest_segments()
+
+    def _close_segment(self):
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+            self._fd = None
+
+    def _remove_oldest_segments(self):
+        segments = [f for f in os.listdir(self.directory) if SEGMENT_FILE_REGEX.match(f) is not None]
+        if len(segments) <= MAX_NUMBER_OF_SEGMENTS:
+            return
+
+        segments.sort(key=Spool._get_segment_sort_key)
+        oldest = segments[:-MAX_NUMBER_OF_SEGMENTS]
+        logger.periodic_warn(logger.EVERY_MINUTE, "[PERIODIC] Too many segments in spool {0}, current count: {1}, "
+                                                  "removing the oldest segments".format(self.directory, len(segments)))
+        for segment in oldest:
+            try:
+                os.remove(os.path.join(self.directory, segment))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+    @staticmethod
+    def _get_segment_sort_key(segment):
+        match = SEGMENT_FILE_REGEX.match(segment)
+        return int(match.group('timestamp')), int(match.group('pid'))
+
+    @staticmethod
+    def _parse_records(data):
+        """
+        Returns a tuple with the complete records in 'data' (as a list of (record, end offset) pairs), the number of bytes
+        they use, and whether a corrupt record was found
+        """
+        records = []
+        position = 0
+        while position < len(data):
+            header_end = data.find(b"\n", position, position + _MAX_RECORD_HEADER_SIZE)
+            if header_end < 0:
+                # the header is incomplete, unless there is enough data for the longest header
+                return records, position, len(data) - position >= _MAX_RECORD_HEADER_SIZE
+
+            header = data[position:header_end]
+            if not header.isdigit():
+                return records, position, True
+
+            record_start = header_end + 1
+            record_end = record_start + int(header)
+            if record_end + 1 > len(data):
+                return records, position, False
+            if data[record_end:record_end + 1] != b"\n":
+                return records, position, True
+
+            position = record_end + 1
+            records.append((data[record_start:record_end], position))
+
+        return records, position, False
+
+    def _load_cursor(self):
+        path = os.path.join(self.directory, CURSOR_FILE_NAME)
+        if not os.path.exists(path):
+            return {}
+        try:
+            cursor = json.loads(fileutil.read_file(path))
+            return dict((ustr(segment), int(offset)) for segment, offset in cursor.items())
+        except Exception as e:
+            logger.warn("Failed to load the spool cursor {0}; the spool will be read from the start: {1}", path, ustr(e))
+            return {}
+
+    def _save_cursor(self, cursor):
+        path = os.path.join(self.directory, CURSOR_FILE_NAME)
+        try:
+            fileutil.write_file(path + ".tmp", json.dumps(cursor))
+            os.rename(path + ".tmp", path)
+        except (IOError, OSError) as e:
+            logger.warn("Failed to save the spool cursor {0}: {1}", path, ustr(e))
@@ -25,42 +25,73 @@ import string
 import struct
 import sys
 import zlib
-import xml.dom.minidom as minidom
+from xml.parsers.expat import ExpatError
+
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
 
 
 def parse_doc(xml_text):
     """
-    Parse xml document from string
+    Parse xml document from string.
+
+    The document is parsed with ElementTree; the helpers below (findall, find, findtext, gettext, getattrib) operate on
+    the resulting tree. Syntax errors are reported as ExpatError, same as the previous (minidom) implementation.
     """
-    # The minidom lib has some issue with unicode in python2.
+    # ElementTree has some issues with unicode in python2.
     # Encode the string into utf-8 first
     xml_text = xml_text.encode('utf-8')
-    return minidom.parseString(xml_text)
+    try:
+        return ElementTree.ElementTree(ElementTree.fromstring(xml_text))
+    except SyntaxError as e:  # ElementTree.ParseError is a subclass of SyntaxError
+        error = ExpatError(str(e))
+        error.code = getattr(e, "code", None)
+        error.lineno, error.offset = getattr(e, "position", (None, None))
+        raise error
+
+
+def _qualified_name(tag, namespace):
+    if namespace is None:
+        return tag
+    return "{{{0}}}{1}".format(namespace, tag)
+
+
+def _iter_descendants(root, name):
+    """
+    Iterates, in document order, over the nodes named 'name' under the given node. When 'root' is the document (i.e.
+    the value returned by parse_doc) the search includes the root element of the document.
+    """
+    iterator = root.iter(name) if hasattr(root, "iter") else root.getiterator(name)  # iter() is not available on 2.6
+    for node in iterator:
+        if node is not root:
+            yield node
 
 
 def findall(root, tag, namespace=None):
     """
     Get all nodes by tag and namespace under Node root.
+
+    Note that, unlike minidom, the nodes of a namespace are found only when the namespace is specified.
     """
     if root is None:
         return []
 
-    if namespace is None:
-        return root.getElementsByTagName(tag)
-    else:
-        return root.getElementsByTagNameNS(namespace, tag)
+    return list(_iter_descendants(root, _qualified_name(tag, namespace)))
 
 
 def find(root, tag, namespace=None):
     """
     Get first node by tag and namespace under Node root.
     """
-    nodes = findall(root, tag, namespace=namespace)
-    if nodes is not None and len(nodes) >= 1:
-        return nodes[0]
-    else:
+    if root is None:
         return None
 
+    for node in _iter_descendants(root, _qualified_name(tag, namespace)):
+        return node
+    return None
+
 
 def gettext(node):
     """
@@ -69,9 +100,13 @@ def gettext(node):
     if node is None:
         return None
 
-    for child in node.childNodes:
-        if child.nodeType == child.TEXT_NODE:
-            return child.data
+    # the first text child of the node is either the text before its first child element or the text
+    # following one of its child elements
+    if node.text is not None:
+        return node.text
+    for child in node:
+        if child.tail is not None:
+            return child.tail
     return None
 
 
@@ -85,10 +120,10 @@ def findtext(root, tag, namespace=None):
 
 def getattrib(node, attr_name):
     """
-    Get attribute of xml node
+    Get attribute of xml node; returns an empty string if the node does not have the attribute.
     """
     if node is not None:
-        return node.getAttribute(attr_name)
+        return node.get(attr_name, "")
     else:
         return None
 
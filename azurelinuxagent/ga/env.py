@@ -26,6 +26,7 @@ import datetime
 
 import azurelinuxagent.common.conf as conf
 import azurelinuxagent.common.logger as logger
+import azurelinuxagent.common.timingstats as timingstats
 
 from azurelinuxagent.common.dhcp import get_dhcp_handler
 from azurelinuxagent.common.event import add_periodic, WALAEventOperation
@@ -106,38 +107,39 @@ class EnvHandler(object):
         protocol = self.protocol_util.get_protocol()
         reset_firewall_fules = False
         while not self.stopped:
-            self.osutil.remove_rules_files()
-
-            if conf.enable_firewall():
-                # If the rules ever change we must reset all rules and start over again.
-                #
-                # There was a rule change at 2.2.26, which started dropping non-root traffic
-                # to WireServer.  The previous rules allowed traffic.  Having both rules in
-                # place negated the fix in 2.2.26.
-                if not reset_firewall_fules:
-                    self.osutil.remove_firewall(dst_ip=protocol.get_endpoint(), uid=os.getuid())
-                    reset_firewall_fules = True
-
-                success = self.osutil.enable_firewall(dst_ip=protocol.get_endpoint(), uid=os.getuid())
-
-                add_periodic(
-                    logger.EVERY_HOUR,
-                    AGENT_NAME,
-                    version=CURRENT_VERSION,
-                    op=WALAEventOperation.Firewall,
-                    is_success=success,
-                    log_event=False)
-
-            timeout = conf.get_root_device_scsi_timeout()
-            if timeout is not None:
-                self.osutil.set_scsi_disks_timeout(timeout)
-
-            if conf.get_monitor_hostname():
-                self.handle_hostname_update()
-
-            self.handle_dhclient_restart()
-
-            self.archive_history()
+            with timingstats.timed("EnvHandler.Loop"):
+                self.osutil.remove_rules_files()
+
+                if conf.enable_firewall():
+                    # If the rules ever change we must reset all rules and start over again.
+                    #
+                    # There was a rule change at 2.2.26, which started dropping non-root traffic
+                    # to WireServer.  The previous rules allowed traffic.  Having both rules in
+                    # place negated the fix in 2.2.26.
+                    if not reset_firewall_fules:
+                        self.osutil.remove_firewall(dst_ip=protocol.get_endpoint(), uid=os.getuid())
+                        reset_firewall_fules = True
+
+                    success = self.osutil.enable_firewall(dst_ip=protocol.get_endpoint(), uid=os.getuid())
+
+                    add_periodic(
+                        logger.EVERY_HOUR,
+                        AGENT_NAME,
+                        version=CURRENT_VERSION,
+                        op=WALAEventOperation.Firewall,
+                        is_success=success,
+                        log_event=False)
+
+                timeout = conf.get_root_device_scsi_timeout()
+                if timeout is not None:
+                    self.osutil.set_scsi_disks_timeout(timeout)
+
+                if conf.get_monitor_hostname():
+                    self.handle_hostname_update()
+
+                self.handle_dhclient_restart()
+
+                self.archive_history()
 
             time.sleep(5)
 
@@ -19,6 +19,8 @@
 
 import datetime
 import glob
+import hashlib
+import itertools
 import json
 import operator
 import os
@@ -28,12 +30,15 @@ import shutil
 import stat
 import sys
 import tempfile
+import threading
 import time
 import traceback
 import zipfile
+from contextlib import closing
 
 import azurelinuxagent.common.conf as conf
 import azurelinuxagent.common.logger as logger
+import azurelinuxagent.common.timingstats as timingstats
 import azurelinuxagent.common.utils.fileutil as fileutil
 import azurelinuxagent.common.version as version
 from azurelinuxagent.common.cgroupconfigurator import CGroupConfigurator
@@ -47,7 +52,9 @@ from azurelinuxagent.common.protocol.restapi import ExtHandlerStatus, \
     ExtensionStatus, \
     ExtensionSubStatus, \
     VMStatus, ExtHandler
+from azurelinuxagent.common.utils.dirwatchutil import DirectoryWatcher
 from azurelinuxagent.common.utils.flexible_version import FlexibleVersion
+from azurelinuxagent.common.utils.parallelutil import run_in_parallel
 from azurelinuxagent.common.version import AGENT_NAME, CURRENT_VERSION, GOAL_STATE_AGENT_VERSION, \
     DISTRO_NAME, DISTRO_VERSION, PY_VERSION_MAJOR, PY_VERSION_MINOR, PY_VERSION_MICRO
 
@@ -72,6 +79,15 @@ AGENT_STATUS_FILE = "waagent_status.json"
 
 NUMBER_OF_DOWNLOAD_RETRIES = 5
 
+# The delay between download attempts starts at DOWNLOAD_RETRY_MIN_DELAY seconds and doubles on each attempt up to
+# DOWNLOAD_RETRY_MAX_DELAY seconds (partial downloads are resumed, so there is no need to wait long before retrying)
+DOWNLOAD_RETRY_MIN_DELAY = 5
+DOWNLOAD_RETRY_MAX_DELAY = 60
+
+# Number of package URIs that are downloaded concurrently; the first download to complete is used and the others
+# are cancelled
+NUMBER_OF_CONCURRENT_DOWNLOADS = 2
+
 # This is the default value for the env variables, whenever we call a command which is not an update scenario, we
 # set the env variable value to NOT_RUN to reduce ambiguity for the extension publishers
 NOT_RUN = "NOT_RUN"
@@ -205,6 +221,62 @@ class ExtHandlerState(object):
     FailedUpgrade = "FailedUpgrade"
 
 
+class ExtHandlerFingerprints(object):
+    """
+    Keeps a fingerprint of the configuration (version, state, sequence number, settings, dependency level, etc) of
+    each handler that was processed successfully, together with the version selected for it, so that handlers whose
+    configuration did not change are not processed again on a new goal state.
+
+    The fingerprints are kept only in memory: on a restart of the agent (or of the VM) all the handlers are processed
+    again, since the extensions rely on being enabled at startup.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()  # the handlers may be processed concurrently
+        self._fingerprints = {}
+
+    @staticmethod
+    def compute(ext_handler):
+        """
+        Returns the fingerprint of the configuration of the given handler; it must be computed before the version of
+        the handler is decided
+        """
+        properties = json.dumps(get_properties(ext_handler), sort_keys=True)
+        return hashlib.sha256(properties.encode('utf-8')).hexdigest()
+
+    def is_processed(self, ext_handler, fingerprint):
+        """
+        Returns True if the handler was already processed with a configuration that matches the given fingerprint and
+        with the version currently selected for it (a newer version in the manifest is processed as an upgrade)
+        """
+        with self._lock:
+            record = self._fingerprints.get(ext_handler.name)
+        if record is None or record["fingerprint"] != fingerprint or record["version"] != ext_handler.properties.version:
+            return False
+
+        # the handler must still be installed (unless it was uninstalled)
+        if ext_handler.properties.state != u"uninstall":
+            if not os.path.isdir(os.path.join(conf.get_lib_dir(), "{0}-{1}".format(ext_handler.name, record["version"]))):
+                return False
+
+        return True
+
+    def set(self, ext_handler_name, fingerprint, version):
+        with self._lock:
+            self._fingerprints[ext_handler_name] = {"fingerprint": fingerprint, "version": version}
+
+    def remove(self, ext_handler_name):
+        with self._lock:
+            self._fingerprints.pop(ext_handler_name, None)
+
+    def retain(self, ext_handler_names):
+        """
+        Removes the fingerprints of the handlers not included in the given list
+        """
+        with self._lock:
+            for name in [name for name in self._fingerprints if name not in ext_handler_names]:
+                del self._fingerprints[name]
+
+
 def get_exthandlers_handler(protocol):
     return ExtHandlersHandler(protocol)
 
@@ -220,6 +292,9 @@ class ExtHandlersHandler(object):
 
         self.report_status_error_state = ErrorState()
         self.get_artifact_error_state = ErrorState(min_timedelta=ERROR_STATE_DELTA_INSTALL)
+        self.fingerprints = ExtHandlerFingerprints()
+        # protects the state above that is updated by the handlers processed concurrently (see handle_ext_handler)
+        self._lock = threading.RLock()
 
     def run(self):
         self.ext_handlers, etag = None, None
@@ -347,23 +422,37 @@ class ExtHandlersHandler(object):
             logger.verbose("No extension handler config found")
             return
 
+        self.fingerprints.retain([handler.name for handler in self.ext_handlers.extHandlers])
+
         wait_until = datetime.datetime.utcnow() + datetime.timedelta(minutes=DEFAULT_EXT_TIMEOUT_MINUTES)
         max_dep_level = max([handler.sort_key() for handler in self.ext_handlers.extHandlers])
 
         self.ext_handlers.extHandlers.sort(key=operator.methodcaller('sort_key'))
-        for ext_handler in self.ext_handlers.extHandlers:
-            self.handle_ext_handler(ext_handler, etag)
+
+        # The handlers with the same dependency level are processed concurrently (up to Extensions.MaxParallelHandlers
+        # at a time); each level acts as a barrier for the next one.
+        for dep_level, ext_handlers in itertools.groupby(self.ext_handlers.extHandlers, key=operator.methodcaller('sort_key')):
+            ext_handlers = list(ext_handlers)
+            self.handle_ext_handlers_in_parallel(ext_handlers, etag)
 
             # Wait for the extension installation until it is handled.
             # This is done for the install and enable. Not for the uninstallation.
-            # If handled successfully, proceed with the current handler.
+            # If all the handlers in the level are handled successfully, proceed with the next level.
             # Otherwise, skip the rest of the extension installation.
-            dep_level = ext_handler.sort_key()
             if dep_level >= 0 and dep_level < max_dep_level:
-                if not self.wait_for_handler_successful_completion(ext_handler, wait_until):
+                if not all(self.wait_for_handler_successful_completion(h, wait_until) for h in ext_handlers):
                     logger.warn("An extension failed or timed out, will skip processing the rest of the extensions")
                     break
 
+    def handle_ext_handlers_in_parallel(self, ext_handlers, etag):
+        tasks = [lambda h=h: self.handle_ext_handler(h, etag) for h in ext_handlers]
+
+        results = run_in_parallel(tasks, conf.get_extensions_max_parallel_handlers(), name="ExtHandler")
+
+        for result in results:
+            if not result.succeeded:
+                raise result.exception
+
     def wait_for_handler_successful_completion(self, ext_handler, wait_until):
         '''
         Check the status of the extension being handled.
@@ -374,10 +463,15 @@ class ExtHandlersHandler(object):
         for ext in ext_handler.properties.extensions:
             ext_completed, status = handler_i.is_ext_handling_complete(ext)
 
-            # Keep polling for the extension status until it becomes success or times out
-            while not ext_completed and datetime.datetime.utcnow() <= wait_until:
-                time.sleep(5)
-                ext_completed, status = handler_i.is_ext_handling_complete(ext)
+            # Keep checking the extension status until it becomes success or times out; the status is checked
+            # again as soon as a file is written to the status directory (or periodically, if that cannot be
+            # detected)
+            if not ext_completed:
+                with DirectoryWatcher(handler_i.get_status_dir()) as watcher:
+                    while not ext_completed and datetime.datetime.utcnow() <= wait_until:
+                        remaining = wait_until - datetime.datetime.utcnow()
+                        watcher.wait(remaining.days * 86400 + remaining.seconds + remaining.microseconds / 1e6)
+                        ext_completed, status = handler_i.is_ext_handling_complete(ext)
 
             # In case of timeout or terminal error state, we log it and return false
             # so that the extensions waiting on this one can be skipped processing
@@ -405,6 +499,9 @@ class ExtHandlersHandler(object):
         return True
 
     def handle_ext_handler(self, ext_handler, etag):
+        # decide_version() updates the version of the handler, so the fingerprint is computed first
+        fingerprint = ExtHandlerFingerprints.compute(ext_handler)
+
         ext_handler_i = ExtHandlerInstance(ext_handler, self.protocol)
 
         try:
@@ -418,16 +515,25 @@ class ExtHandlersHandler(object):
                 ext_handler_i.report_event(message=ustr(err_msg), is_success=False)
                 return
 
-            self.get_artifact_error_state.reset()
-            if self.last_etag == etag:
-                if self.log_etag:
-                    ext_handler_i.logger.verbose("Version {0} is current for etag {1}",
-                                                 ext_handler_i.pkg.version,
-                                                 etag)
-                    self.log_etag = False
+            with self._lock:
+                self.get_artifact_error_state.reset()
+                if self.last_etag == etag:
+                    if self.log_etag:
+                        ext_handler_i.logger.verbose("Version {0} is current for etag {1}",
+                                                     ext_handler_i.pkg.version,
+                                                     etag)
+                        self.log_etag = False
+                    return
+
+                self.log_etag = True
+
+            # Handlers whose configuration and version did not change since they were last processed successfully
+            # are skipped
+            if self.fingerprints.is_processed(ext_handler, fingerprint):
+                ext_handler_i.logger.verbose("The handler configuration did not change [incarnation {0}]", etag)
                 return
 
-            self.log_etag = True
+            self.fingerprints.remove(ext_handler.name)
 
             ext_handler_i.logger.info("Target handler state: {0} [incarnation {1}]", state, etag)
             if state == u"enabled":
@@ -439,6 +545,8 @@ class ExtHandlersHandler(object):
             else:
                 message = u"Unknown ext handler state:{0}".format(state)
                 raise ExtensionError(message)
+
+            self.fingerprints.set(ext_handler.name, fingerprint, ext_handler_i.ext_handler.properties.version)
         except ExtensionUpdateError as e:
             # Not reporting the error as it has already been reported from the old version
             self.handle_ext_handler_error(ext_handler_i, e, e.code, report_telemetry_event=False)
@@ -460,12 +568,13 @@ class ExtHandlersHandler(object):
         msg = ustr(e)
         ext_handler_i.set_handler_status(message=msg, code=code)
 
-        self.get_artifact_error_state.incr()
-        if self.get_artifact_error_state.is_triggered():
-            report_event(op=WALAEventOperation.Download, is_success=False, log_event=True,
-                         message="Failed to get artifact for over "
-                                 "{0}: {1}".format(self.get_artifact_error_state.min_timedelta, msg))
-            self.get_artifact_error_state.reset()
+        with self._lock:
+            self.get_artifact_error_state.incr()
+            if self.get_artifact_error_state.is_triggered():
+                report_event(op=WALAEventOperation.Download, is_success=False, log_event=True,
+                             message="Failed to get artifact for over "
+                                     "{0}: {1}".format(self.get_artifact_error_state.min_timedelta, msg))
+                self.get_artifact_error_state.reset()
 
     def handle_enable(self, ext_handler_i):
         self.log_process = True
@@ -678,6 +787,7 @@ class ExtHandlerInstance(object):
         self.pkg = None
         self.pkg_file = None
         self.logger = None
+        self._largest_seq_no_cache = None  # (modification time of the config directory, largest sequence number)
         self.set_logger()
 
         try:
@@ -712,8 +822,9 @@ class ExtHandlerInstance(object):
         # - Separate the public packages
         selected_pkg = None
         installed_pkg = None
-        pkg_list.versions.sort(key=lambda p: FlexibleVersion(p.version))
-        for pkg in pkg_list.versions:
+        # The manifest may be shared with other handlers (see the manifest cache in WireClient), which may be processed
+        # concurrently; sort a copy of its packages
+        for pkg in sorted(pkg_list.versions, key=lambda p: FlexibleVersion(p.version)):
             pkg_version = FlexibleVersion(pkg.version)
             if pkg_version == installed_version:
                 installed_pkg = pkg
@@ -814,15 +925,72 @@ class ExtHandlerInstance(object):
         add_event(name=self.ext_handler.name, version=ext_handler_version, message=message,
                   op=self.operation, is_success=is_success, duration=duration, log_event=log_event)
 
-    def _download_extension_package(self, source_uri, target_file):
+    def _download_extension_package(self, source_uri, target_file, cancel=None):
         self.logger.info("Downloading extension package: {0}", source_uri)
         try:
-            if not self.protocol.download_ext_handler_pkg(source_uri, target_file):
+            # a partial download of the package (from a previous attempt) is resumed
+            if not self.protocol.download_ext_handler_pkg(source_uri, target_file, resume=True, cancel=cancel):
                 raise Exception("Failed to download extension package - no error information is available")
         except Exception as exception:
             self.logger.info("Error downloading extension package: {0}", ustr(exception))
-            if os.path.exists(target_file):
-                os.remove(target_file)
+            return False
+        return True
+
+    def _download_extension_package_from_any(self, uris, destination):
+        """
+        Downloads the package from the given URIs, NUMBER_OF_CONCURRENT_DOWNLOADS at a time, into a partial file per
+        URI. The first valid package is moved to 'destination' and the other downloads are cancelled.
+        Returns True if the package was downloaded.
+        """
+        lock = threading.Lock()
+        cancel = threading.Event()
+
+        def download(index, uri):
+            partial_file = self._get_partial_package_file(destination, index)
+            if not self._download_extension_package(uri, partial_file, cancel=cancel):
+                return False
+            if not self._is_valid_extension_package(partial_file):
+                if os.path.exists(partial_file):
+                    os.remove(partial_file)
+                return False
+            with lock:
+                if cancel.is_set():
+                    return False
+                os.rename(partial_file, destination)
+                cancel.set()
+                return True
+
+        for i in range(0, len(uris), NUMBER_OF_CONCURRENT_DOWNLOADS):
+            batch = uris[i:i + NUMBER_OF_CONCURRENT_DOWNLOADS]
+            tasks = [lambda index=index, uri=uri: download(index, uri) for index, uri in batch]
+            run_in_parallel(tasks, len(tasks), name="DownloadExtension")
+            if cancel.is_set():
+                return True
+        return False
+
+    @staticmethod
+    def _get_partial_package_file(destination, index):
+        return "{0}.{1}.part".format(destination, index)
+
+    def _remove_partial_package_files(self, destination):
+        for partial_file in glob.glob(self._get_partial_package_file(destination, "*")):
+            try:
+                os.remove(partial_file)
+            except OSError as e:
+                self.logger.warn("Failed to remove partial download {0}: {1}", partial_file, ustr(e))
+
+    def _is_valid_extension_package(self, package_file):
+        """
+        Checks the integrity of the package (the CRC of each file in the ZIP archive) before it is expanded
+        """
+        try:
+            with closing(zipfile.ZipFile(package_file)) as package:
+                bad_file = package.testzip()
+            if bad_file is not None:
+                self.logger.info("The extension package {0} is corrupt (invalid file: {1})", package_file, bad_file)
+                return False
+        except Exception as exception:
+            self.logger.info("The extension package {0} is invalid: {1}", package_file, ustr(exception))
             return False
         return True
 
@@ -857,25 +1025,26 @@ class ExtHandlerInstance(object):
 
         if not package_exists:
             downloaded = False
-            i = 0
-            while i < NUMBER_OF_DOWNLOAD_RETRIES:
-                uris_shuffled = self.pkg.uris
-                random.shuffle(uris_shuffled)
-
-                for uri in uris_shuffled:
-                    if not self._download_extension_package(uri.uri, destination):
-                        continue
-
-                    if self._unzip_extension_package(destination, self.get_base_dir()):
-                        downloaded = True
-                        break
-
-                if downloaded:
-                    break
-
-                self.logger.info("Failed to download the extension package from all uris, will retry after a minute")
-                time.sleep(60)
-                i += 1
+            try:
+                delay = DOWNLOAD_RETRY_MIN_DELAY
+                i = 0
+                while i < NUMBER_OF_DOWNLOAD_RETRIES:
+                    # the index of the URI identifies its partial download, so it can be resumed on the next attempt
+                    uris_shuffled = [(index, uri.uri) for index, uri in enumerate(self.pkg.uris)]
+                    random.shuffle(uris_shuffled)
+
+                    if self._download_extension_package_from_any(uris_shuffled, destination):
+                        if self._unzip_extension_package(destination, self.get_base_dir()):
+                            downloaded = True
+                            break
+
+                    i += 1
+                    if i < NUMBER_OF_DOWNLOAD_RETRIES:
+                        self.logger.info("Failed to download the extension package from all uris, will retry after {0} seconds", delay)
+                        time.sleep(delay)
+                        delay = min(delay * 2, DOWNLOAD_RETRY_MAX_DELAY)
+            finally:
+                self._remove_partial_package_files(destination)
 
             if not downloaded:
                 raise ExtensionDownloadError("Failed to download extension",
@@ -1039,8 +1208,17 @@ class ExtHandlerInstance(object):
         self.set_handler_state(ExtHandlerState.Installed)
 
     def get_largest_seq_no(self):
-        seq_no = -1
         conf_dir = self.get_conf_dir()
+
+        # The config directory is scanned again only if it changed (i.e. if its modification time changed)
+        try:
+            mtime = os.stat(conf_dir).st_mtime
+        except OSError:
+            mtime = None
+        if mtime is not None and self._largest_seq_no_cache is not None and self._largest_seq_no_cache[0] == mtime:
+            return self._largest_seq_no_cache[1]
+
+        seq_no = -1
         for item in os.listdir(conf_dir):
             item_path = os.path.join(conf_dir, item)
             if os.path.isfile(item_path):
@@ -1053,6 +1231,12 @@ class ExtHandlerInstance(object):
                 except (ValueError, IndexError, TypeError):
                     self.logger.verbose("Failed to parse file name: {0}", item)
                     continue
+
+        # Some file systems have a granularity of 1 second for the modification time, so the result is cached only
+        # if the directory did not change during the last second
+        if mtime is not None and time.time() - mtime > 1:
+            self._largest_seq_no_cache = (mtime, seq_no)
+
         return seq_no
 
     def get_status_file_path(self, extension=None):
@@ -1211,16 +1395,19 @@ class ExtHandlerInstance(object):
                     # as root-relative. (Issue #1170)
                     full_path = os.path.join(base_dir, cmd.lstrip(os.path.sep))
 
-                    process_output = CGroupConfigurator.get_instance().start_extension_command(
-                        extension_name=self.get_full_name(),
-                        command=full_path,
-                        timeout=timeout,
-                        shell=True,
-                        cwd=base_dir,
-                        env=env,
-                        stdout=stdout,
-                        stderr=stderr,
-                        error_code=extension_error_code)
+                    # the CPU time of the command itself is not included in the timing statistics (only the time
+                    # used by the agent's thread)
+                    with timingstats.timed("ExtensionCommand"):
+                        process_output = CGroupConfigurator.get_instance().start_extension_command(
+                            extension_name=self.get_full_name(),
+                            command=full_path,
+                            timeout=timeout,
+                            shell=True,
+                            cwd=base_dir,
+                            env=env,
+                            stdout=stdout,
+                            stderr=stderr,
+                            error_code=extension_error_code)
 
                 except OSError as e:
                     raise ExtensionError("Failed to launch '{0}': {1}".format(full_path, e.strerror),
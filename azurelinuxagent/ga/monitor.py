@@ -16,21 +16,26 @@
 #
 
 import datetime
+import os
 import threading
-import time
 import uuid
 
+import azurelinuxagent.common.conf as conf
 import azurelinuxagent.common.logger as logger
+import azurelinuxagent.common.timingstats as timingstats
 import azurelinuxagent.common.utils.networkutil as networkutil
 from azurelinuxagent.common.cgroupstelemetry import CGroupsTelemetry
 from azurelinuxagent.common.errorstate import ErrorState
-from azurelinuxagent.common.event import add_event, WALAEventOperation, report_metric, collect_events
+from azurelinuxagent.common.event import add_event, WALAEventOperation, report_metric, collect_event_batches
+from azurelinuxagent.common.exception import ThrottlingError
 from azurelinuxagent.common.future import ustr
 from azurelinuxagent.common.osutil import get_osutil
 from azurelinuxagent.common.protocol.util import get_protocol_util
+from azurelinuxagent.common.protocol.wire import MAX_EVENT_BUFFER_SIZE
 from azurelinuxagent.common.protocol.healthservice import HealthService
 from azurelinuxagent.common.protocol.imds import get_imds_client
 from azurelinuxagent.common.utils.restutil import IOErrorCounter
+from azurelinuxagent.common.utils.schedutil import PeriodicTask, Scheduler
 from azurelinuxagent.common.utils.textutil import hash_strings
 from azurelinuxagent.common.version import AGENT_NAME, CURRENT_VERSION
 
@@ -62,15 +67,31 @@ class MonitorHandler(object):
     # imds
     IMDS_HEARTBEAT_PERIOD = datetime.timedelta(minutes=1)
     IMDS_HEALTH_PERIOD = datetime.timedelta(minutes=3)
+    # goal state (host plugin parameters) and network configuration checks
+    HOST_PLUGIN_UPDATE_PERIOD = datetime.timedelta(minutes=1)
+    NETWORK_CONFIGURATION_CHECK_PERIOD = datetime.timedelta(minutes=1)
 
     # Resetting loggers period
     RESET_LOGGERS_PERIOD = datetime.timedelta(hours=12)
 
+    # timing statistics of the agent's operations (see timingstats)
+    TIMING_STATS_SAVE_PERIOD = datetime.timedelta(minutes=5)
+    TIMING_STATS_REPORTING_PERIOD = datetime.timedelta(minutes=30)
+
+    # Each execution of a periodic task is delayed by a random amount of up to this fraction of its period, so that the
+    # requests of the agents in different VMs are spread out
+    PERIODIC_TASK_JITTER = 0.05
+    # Executions of a periodic task that take longer than this are reported as warnings
+    PERIODIC_TASK_TIMEOUT = datetime.timedelta(seconds=30)
+
     def __init__(self):
         self.osutil = get_osutil()
         self.imds_client = None
 
         self.event_thread = None
+        self.scheduler = None
+        self.health_thread = None
+        self.health_scheduler = None
         self.last_reset_loggers_time = None
         self.last_event_collection = None
         self.last_telemetry_heartbeat = None
@@ -80,11 +101,11 @@ class MonitorHandler(object):
         self.last_imds_heartbeat = None
         self.protocol = None
         self.protocol_util = None
+        self.health_protocol = None
         self.health_service = None
         self.last_route_table_hash = b''
         self.last_nic_state = {}
 
-        self.should_run = True
         self.heartbeat_id = str(uuid.uuid4()).upper()
         self.host_plugin_errorstate = ErrorState(min_timedelta=MonitorHandler.HOST_PLUGIN_HEALTH_PERIOD)
         self.imds_errorstate = ErrorState(min_timedelta=MonitorHandler.IMDS_HEALTH_PERIOD)
@@ -93,9 +114,12 @@ class MonitorHandler(object):
         self.start(init_data=True)
 
     def stop(self):
-        self.should_run = False
-        if self.is_alive():
-            self.event_thread.join()
+        for scheduler in (self.scheduler, self.health_scheduler):
+            if scheduler is not None:
+                scheduler.stop()
+        for thread in (self.event_thread, self.health_thread):
+            if thread is not None and thread.is_alive():
+                thread.join()
 
     def init_protocols(self):
         # The initialization of ProtocolUtil for the Monitor thread should be done within the thread itself rather
@@ -103,112 +127,171 @@ class MonitorHandler(object):
         # thread would now have its own ProtocolUtil object as per the SingletonPerThread model.
         self.protocol_util = get_protocol_util()
         self.protocol = self.protocol_util.get_protocol()
-        self.health_service = HealthService(self.protocol.get_endpoint())
 
-    def init_imds_client(self):
-        wireserver_endpoint = self.protocol_util.get_wireserver_endpoint()
-        self.imds_client = get_imds_client(wireserver_endpoint)
+    def init_health_protocols(self):
+        # Same as init_protocols(), but for the health thread: the heartbeats use their own protocol (and hence their
+        # own WireClient and host plugin) so that they do not share them with the tasks of the Monitor thread.
+        protocol_util = get_protocol_util()
+        self.health_protocol = protocol_util.get_protocol()
+        self.health_service = HealthService(self.health_protocol.get_endpoint())
+        self.imds_client = get_imds_client(protocol_util.get_wireserver_endpoint())
 
     def is_alive(self):
-        return self.event_thread is not None and self.event_thread.is_alive()
+        return all(thread is not None and thread.is_alive() for thread in (self.event_thread, self.health_thread))
 
     def start(self, init_data=False):
-        self.event_thread = threading.Thread(target=self.daemon, args=(init_data,))
-        self.event_thread.setDaemon(True)
-        self.event_thread.setName("MonitorHandler")
-        self.event_thread.start()
+        # Only the threads that are not running are started, so that start() can be used to restart the monitor when
+        # one of them has died
+        if self.event_thread is None or not self.event_thread.is_alive():
+            self.scheduler = self._create_scheduler()
+            self.event_thread = MonitorHandler._start_thread("MonitorHandler", self.daemon, init_data)
+        if self.health_thread is None or not self.health_thread.is_alive():
+            self.health_scheduler = self._create_health_scheduler()
+            self.health_thread = MonitorHandler._start_thread("MonitorHealth", self.health_daemon, init_data)
+
+    @staticmethod
+    def _start_thread(name, target, init_data):
+        thread = threading.Thread(target=target, args=(init_data,))
+        thread.setDaemon(True)
+        thread.setName(name)
+        thread.start()
+        return thread
 
     def collect_and_send_events(self):
         """
-        Periodically send any events located in the events folder
+        Send any events located in the events folder; invoked every EVENT_COLLECTION_PERIOD
         """
         try:
-            if self.last_event_collection is None:
-                self.last_event_collection = datetime.datetime.utcnow() - MonitorHandler.EVENT_COLLECTION_PERIOD
-
-            if datetime.datetime.utcnow() >= (self.last_event_collection + MonitorHandler.EVENT_COLLECTION_PERIOD):
+            # Events are sent in batches of a single request each; the events in a batch are removed only after the batch
+            # has been sent, so if WireServer is throttling the agent the remaining events are left for the next
+            # collection period (and the events that were already sent are not sent again).
+            for event_list, acknowledge in collect_event_batches(max_batch_size=MAX_EVENT_BUFFER_SIZE):
                 try:
-                    event_list = collect_events()
-
-                    if len(event_list.events) > 0:
-                        self.protocol.report_event(event_list)
+                    self.protocol.report_event(event_list)
+                    acknowledge()
+                except ThrottlingError as e:
+                    logger.warn("Failed to send events; will retry later: {0}", ustr(e))
+                    break
                 except Exception as e:
                     logger.warn("{0}", ustr(e))
+                    # the events in the batch are dropped, so that they are not re-sent over and over
+                    acknowledge()
+                    break
         except Exception as e:
             logger.warn("Failed to send events: {0}", ustr(e))
 
         self.last_event_collection = datetime.datetime.utcnow()
 
+    def _create_scheduler(self):
+        """
+        Creates the scheduler for the periodic tasks of the monitor thread; the periods are read when the scheduler is
+        created.
+        """
+        # (name, operation, period, initial delay); the tasks that are due at the same time are executed in this order.
+        # As before the scheduler was introduced, the cgroup metrics are first polled (and reported) and the loggers
+        # reset one period after the thread starts.
+        no_delay = datetime.timedelta(0)
+        tasks = [
+            ("UpdateHostPlugin", lambda: self.protocol.update_host_plugin_from_goal_state(), MonitorHandler.HOST_PLUGIN_UPDATE_PERIOD, no_delay),
+            ("TelemetryHeartbeat", self.send_telemetry_heartbeat, MonitorHandler.TELEMETRY_HEARTBEAT_PERIOD, no_delay),
+            ("PollTelemetryMetrics", self.poll_telemetry_metrics, MonitorHandler.CGROUP_TELEMETRY_POLLING_PERIOD, MonitorHandler.CGROUP_TELEMETRY_POLLING_PERIOD),
+            # This will be removed in favor of poll_telemetry_metrics() and it'll directly send the perf data for
+            # each cgroup.
+            ("SendTelemetryMetrics", self.send_telemetry_metrics, MonitorHandler.CGROUP_TELEMETRY_REPORTING_PERIOD, MonitorHandler.CGROUP_TELEMETRY_REPORTING_PERIOD),
+            ("CollectAndSendEvents", self.collect_and_send_events, MonitorHandler.EVENT_COLLECTION_PERIOD, no_delay),
+            ("LogNetworkConfiguration", self.log_altered_network_configuration, MonitorHandler.NETWORK_CONFIGURATION_CHECK_PERIOD, no_delay),
+            ("ResetLoggers", self.reset_loggers, MonitorHandler.RESET_LOGGERS_PERIOD, MonitorHandler.RESET_LOGGERS_PERIOD),
+            ("SaveTimingStats", self.save_timing_stats, MonitorHandler.TIMING_STATS_SAVE_PERIOD, MonitorHandler.TIMING_STATS_SAVE_PERIOD),
+            ("SendTimingStats", self.send_timing_stats, MonitorHandler.TIMING_STATS_REPORTING_PERIOD, MonitorHandler.TIMING_STATS_REPORTING_PERIOD),
+        ]
+        return MonitorHandler._create_periodic_task_scheduler(tasks)
+
+    def _create_health_scheduler(self):
+        """
+        Creates the scheduler for the heartbeats of the health thread. The heartbeats call HostGAPlugin and IMDS, which
+        may take up to the timeouts of their requests to respond, so they run on their own thread and do not delay the
+        tasks of the monitor thread (e.g. sending events).
+        """
+        no_delay = datetime.timedelta(0)
+        tasks = [
+            ("HostPluginHeartbeat", self.send_host_plugin_heartbeat, MonitorHandler.HOST_PLUGIN_HEARTBEAT_PERIOD, no_delay),
+            ("ImdsHeartbeat", self.send_imds_heartbeat, MonitorHandler.IMDS_HEARTBEAT_PERIOD, no_delay),
+        ]
+        return MonitorHandler._create_periodic_task_scheduler(tasks)
+
+    @staticmethod
+    def _create_periodic_task_scheduler(tasks):
+        def seconds(delta):
+            return delta.days * 86400 + delta.seconds + delta.microseconds / 1000000.0
+
+        def timed(name, operation):
+            def timed_operation():
+                with timingstats.timed("Monitor.{0}".format(name)):
+                    operation()
+            return timed_operation
+
+        scheduler = Scheduler()
+        for name, operation, period, initial_delay in tasks:
+            scheduler.add_task(PeriodicTask(name,
+                                            timed(name, operation),
+                                            seconds(period),
+                                            jitter=seconds(period) * MonitorHandler.PERIODIC_TASK_JITTER,
+                                            timeout=seconds(MonitorHandler.PERIODIC_TASK_TIMEOUT),
+                                            initial_delay=seconds(initial_delay)))
+        return scheduler
+
     def daemon(self, init_data=False):
 
         if init_data:
             self.init_protocols()
-            self.init_imds_client()
-
-        min_delta = min(MonitorHandler.TELEMETRY_HEARTBEAT_PERIOD,
-                        MonitorHandler.CGROUP_TELEMETRY_POLLING_PERIOD,
-                        MonitorHandler.CGROUP_TELEMETRY_REPORTING_PERIOD,
-                        MonitorHandler.EVENT_COLLECTION_PERIOD,
-                        MonitorHandler.HOST_PLUGIN_HEARTBEAT_PERIOD,
-                        MonitorHandler.IMDS_HEARTBEAT_PERIOD).seconds
-        while self.should_run:
-            try:
-                self.protocol.update_host_plugin_from_goal_state()
-                self.send_telemetry_heartbeat()
-                self.poll_telemetry_metrics()
-                # This will be removed in favor of poll_telemetry_metrics() and it'll directly send the perf data for
-                # each cgroup.
-                self.send_telemetry_metrics()
-                self.collect_and_send_events()
-                self.send_host_plugin_heartbeat()
-                self.send_imds_heartbeat()
-                self.log_altered_network_configuration()
-                self.reset_loggers()
-            except Exception as e:
-                logger.warn("An error occurred in the monitor thread main loop; will skip the current iteration.\n{0}", ustr(e))
-            time.sleep(min_delta)
+
+        if self.scheduler is None:
+            self.scheduler = self._create_scheduler()
+
+        # each task is executed on its own period; the thread sleeps until the next task is due, or until stop() is called
+        self.scheduler.run()
+
+    def health_daemon(self, init_data=False):
+
+        if init_data:
+            self.init_health_protocols()
+
+        if self.health_scheduler is None:
+            self.health_scheduler = self._create_health_scheduler()
+
+        self.health_scheduler.run()
 
     def reset_loggers(self):
         """
-        The loggers maintain hash-tables in memory and they need to be cleaned up from time to time.
-        For reference, please check azurelinuxagent.common.logger.Logger and
+        The loggers maintain hash-tables in memory and they need to be cleaned up from time to time (every
+        RESET_LOGGERS_PERIOD). For reference, please check azurelinuxagent.common.logger.Logger and
         azurelinuxagent.common.event.EventLogger classes
         """
         try:
-            time_now = datetime.datetime.utcnow()
-            if not self.last_reset_loggers_time:
-                self.last_reset_loggers_time = time_now
-
-            if time_now >= (self.last_reset_loggers_time + MonitorHandler.RESET_LOGGERS_PERIOD):
-                logger.reset_periodic()
-
+            logger.reset_periodic()
         except Exception as e:
             logger.warn("Failed to clear periodic loggers: {0}", ustr(e))
 
-        self.last_reset_loggers_time = time_now
+        self.last_reset_loggers_time = datetime.datetime.utcnow()
 
     def send_imds_heartbeat(self):
         """
-        Send a health signal every IMDS_HEARTBEAT_PERIOD. The signal is 'Healthy' when we have
+        Send a health signal; invoked every IMDS_HEARTBEAT_PERIOD. The signal is 'Healthy' when we have
         successfully called and validated a response in the last IMDS_HEALTH_PERIOD.
         """
 
         try:
-            if self.last_imds_heartbeat is None:
-                self.last_imds_heartbeat = datetime.datetime.utcnow() - MonitorHandler.IMDS_HEARTBEAT_PERIOD
-
-            if datetime.datetime.utcnow() >= (self.last_imds_heartbeat + MonitorHandler.IMDS_HEARTBEAT_PERIOD):
-                is_currently_healthy, response = self.imds_client.validate()
+            is_currently_healthy, response = self.imds_client.validate()
 
-                if is_currently_healthy:
-                    self.imds_errorstate.reset()
-                else:
-                    self.imds_errorstate.incr()
+            if is_currently_healthy:
+                self.imds_errorstate.reset()
+            else:
+                self.imds_errorstate.incr()
 
-                is_healthy = self.imds_errorstate.is_triggered() is False
-                logger.verbose("IMDS health: {0} [{1}]", is_healthy, response)
+            is_healthy = self.imds_errorstate.is_triggered() is False
+            logger.verbose("IMDS health: {0} [{1}]", is_healthy, response)
 
-                self.health_service.report_imds_status(is_healthy, response)
+            self.health_service.report_imds_status(is_healthy, response)
 
         except Exception as e:
             msg = "Exception sending imds heartbeat: {0}".format(ustr(e))
@@ -224,37 +307,32 @@ class MonitorHandler(object):
 
     def send_host_plugin_heartbeat(self):
         """
-        Send a health signal every HOST_PLUGIN_HEARTBEAT_PERIOD. The signal is 'Healthy' when we have been able to
-        communicate with HostGAPlugin at least once in the last HOST_PLUGIN_HEALTH_PERIOD.
+        Send a health signal; invoked every HOST_PLUGIN_HEARTBEAT_PERIOD. The signal is 'Healthy' when we have been
+        able to communicate with HostGAPlugin at least once in the last HOST_PLUGIN_HEALTH_PERIOD.
         """
         try:
-            if self.last_host_plugin_heartbeat is None:
-                self.last_host_plugin_heartbeat = datetime.datetime.utcnow() - MonitorHandler.HOST_PLUGIN_HEARTBEAT_PERIOD
-
-            if datetime.datetime.utcnow() >= (
-                self.last_host_plugin_heartbeat + MonitorHandler.HOST_PLUGIN_HEARTBEAT_PERIOD):
-                host_plugin = self.protocol.client.get_host_plugin()
-                host_plugin.ensure_initialized()
-                is_currently_healthy = host_plugin.get_health()
-
-                if is_currently_healthy:
-                    self.host_plugin_errorstate.reset()
-                else:
-                    self.host_plugin_errorstate.incr()
-
-                is_healthy = self.host_plugin_errorstate.is_triggered() is False
-                logger.verbose("HostGAPlugin health: {0}", is_healthy)
-
-                self.health_service.report_host_plugin_heartbeat(is_healthy)
-
-                if not is_healthy:
-                    add_event(
-                        name=AGENT_NAME,
-                        version=CURRENT_VERSION,
-                        op=WALAEventOperation.HostPluginHeartbeatExtended,
-                        is_success=False,
-                        message='{0} since successful heartbeat'.format(self.host_plugin_errorstate.fail_time),
-                        log_event=False)
+            host_plugin = self.health_protocol.client.get_host_plugin()
+            host_plugin.ensure_initialized()
+            is_currently_healthy = host_plugin.get_health()
+
+            if is_currently_healthy:
+                self.host_plugin_errorstate.reset()
+            else:
+                self.host_plugin_errorstate.incr()
+
+            is_healthy = self.host_plugin_errorstate.is_triggered() is False
+            logger.verbose("HostGAPlugin health: {0}", is_healthy)
+
+            self.health_service.report_host_plugin_heartbeat(is_healthy)
+
+            if not is_healthy:
+                add_event(
+                    name=AGENT_NAME,
+                    version=CURRENT_VERSION,
+                    op=WALAEventOperation.HostPluginHeartbeatExtended,
+                    is_success=False,
+                    message='{0} since successful heartbeat'.format(self.host_plugin_errorstate.fail_time),
+                    log_event=False)
 
         except Exception as e:
             msg = "Exception sending host plugin heartbeat: {0}".format(ustr(e))
@@ -266,29 +344,28 @@ class MonitorHandler(object):
                 message=msg,
                 log_event=False)
 
-            self.last_host_plugin_heartbeat = datetime.datetime.utcnow()
+        self.last_host_plugin_heartbeat = datetime.datetime.utcnow()
 
     def send_telemetry_heartbeat(self):
+        """
+        Report the HTTP errors since the previous heartbeat; invoked every TELEMETRY_HEARTBEAT_PERIOD
+        """
         try:
-            if self.last_telemetry_heartbeat is None:
-                self.last_telemetry_heartbeat = datetime.datetime.utcnow() - MonitorHandler.TELEMETRY_HEARTBEAT_PERIOD
-
-            if datetime.datetime.utcnow() >= (self.last_telemetry_heartbeat + MonitorHandler.TELEMETRY_HEARTBEAT_PERIOD):
-                io_errors = IOErrorCounter.get_and_reset()
-                hostplugin_errors = io_errors.get("hostplugin")
-                protocol_errors = io_errors.get("protocol")
-                other_errors = io_errors.get("other")
-
-                if hostplugin_errors > 0 or protocol_errors > 0 or other_errors > 0:
-                    msg = "hostplugin:{0};protocol:{1};other:{2}".format(hostplugin_errors, protocol_errors,
-                                                                         other_errors)
-                    add_event(
-                        name=AGENT_NAME,
-                        version=CURRENT_VERSION,
-                        op=WALAEventOperation.HttpErrors,
-                        is_success=True,
-                        message=msg,
-                        log_event=False)
+            io_errors = IOErrorCounter.get_and_reset()
+            hostplugin_errors = io_errors.get("hostplugin")
+            protocol_errors = io_errors.get("protocol")
+            other_errors = io_errors.get("other")
+
+            if hostplugin_errors > 0 or protocol_errors > 0 or other_errors > 0:
+                msg = "hostplugin:{0};protocol:{1};other:{2}".format(hostplugin_errors, protocol_errors,
+                                                                     other_errors)
+                add_event(
+                    name=AGENT_NAME,
+                    version=CURRENT_VERSION,
+                    op=WALAEventOperation.HttpErrors,
+                    is_success=True,
+                    message=msg,
+                    log_event=False)
         except Exception as e:
             logger.warn("Failed to send heartbeat: {0}", ustr(e))
 
@@ -296,22 +373,17 @@ class MonitorHandler(object):
 
     def poll_telemetry_metrics(self):
         """
-        This method polls the tracked cgroups to get data from the cgroups filesystem and send the data directly.
+        This method polls the tracked cgroups to get data from the cgroups filesystem and send the data directly;
+        invoked every CGROUP_TELEMETRY_POLLING_PERIOD.
 
         :return: List of Metrics (which would be sent to PerfCounterMetrics directly.
         """
         try:  # If there is an issue in reporting, it should not take down whole monitor thread.
-            time_now = datetime.datetime.utcnow()
-            if not self.last_cgroup_polling_telemetry:
-                self.last_cgroup_polling_telemetry = time_now
-
-            if time_now >= (self.last_cgroup_polling_telemetry +
-                            MonitorHandler.CGROUP_TELEMETRY_POLLING_PERIOD):
-                metrics = CGroupsTelemetry.poll_all_tracked()
+            metrics = CGroupsTelemetry.poll_all_tracked()
 
-                if metrics:
-                    for metric in metrics:
-                        report_metric(metric.category, metric.counter, metric.instance, metric.value)
+            if metrics:
+                for metric in metrics:
+                    report_metric(metric.category, metric.counter, metric.instance, metric.value)
         except Exception as e:
             logger.warn("Could not poll all the tracked telemetry due to {0}", ustr(e))
 
@@ -319,33 +391,50 @@ class MonitorHandler(object):
 
     def send_telemetry_metrics(self):
         """
-        The send_telemetry_metrics would soon be removed in favor of sending performance metrics directly.
+        The send_telemetry_metrics would soon be removed in favor of sending performance metrics directly; invoked
+        every CGROUP_TELEMETRY_REPORTING_PERIOD.
 
         :return:
         """
         try:  # If there is an issue in reporting, it should not take down whole monitor thread.
-            time_now = datetime.datetime.utcnow()
-
-            if not self.last_cgroup_report_telemetry:
-                self.last_cgroup_report_telemetry = time_now
-
-            if time_now >= (self.last_cgroup_report_telemetry + MonitorHandler.CGROUP_TELEMETRY_REPORTING_PERIOD):
-                performance_metrics = CGroupsTelemetry.report_all_tracked()
-
-                if performance_metrics:
-                    message = generate_extension_metrics_telemetry_dictionary(schema_version=1.0,
-                                                                              performance_metrics=performance_metrics)
-                    add_event(name=AGENT_NAME,
-                              version=CURRENT_VERSION,
-                              op=WALAEventOperation.ExtensionMetricsData,
-                              is_success=True,
-                              message=ustr(message),
-                              log_event=False)
+            performance_metrics = CGroupsTelemetry.report_all_tracked()
+
+            if performance_metrics:
+                message = generate_extension_metrics_telemetry_dictionary(schema_version=1.0,
+                                                                          performance_metrics=performance_metrics)
+                add_event(name=AGENT_NAME,
+                          version=CURRENT_VERSION,
+                          op=WALAEventOperation.ExtensionMetricsData,
+                          is_success=True,
+                          message=ustr(message),
+                          log_event=False)
         except Exception as e:
             logger.warn("Could not report all the tracked telemetry due to {0}", ustr(e))
 
         self.last_cgroup_report_telemetry = datetime.datetime.utcnow()
 
+    def save_timing_stats(self):
+        """
+        Saves the timing statistics of the agent's operations to the lib directory, where 'waagent -show-stats' reads
+        them; invoked every TIMING_STATS_SAVE_PERIOD
+        """
+        timingstats.save_stats(os.path.join(conf.get_lib_dir(), timingstats.TIMING_STATS_FILE_NAME))
+
+    def send_timing_stats(self):
+        """
+        Reports the timing statistics of the operations executed since the previous report as metrics; invoked every
+        TIMING_STATS_REPORTING_PERIOD
+        """
+        try:
+            for name, stats in timingstats.get_interval_stats().items():
+                report_metric(timingstats.METRICS_CATEGORY, timingstats.TimingMetricsCounter.COUNT, name, stats["count"])
+                report_metric(timingstats.METRICS_CATEGORY, timingstats.TimingMetricsCounter.WALL_TIME, name, stats["wall_time"])
+                report_metric(timingstats.METRICS_CATEGORY, timingstats.TimingMetricsCounter.CPU_TIME, name, stats["cpu_time"])
+                if stats["error_count"] > 0:
+                    report_metric(timingstats.METRICS_CATEGORY, timingstats.TimingMetricsCounter.ERROR_COUNT, name, stats["error_count"])
+        except Exception as e:
+            logger.warn("Could not report the timing statistics due to {0}", ustr(e))
+
     def log_altered_network_configuration(self):
         """
         Check various pieces of network configuration and, if altered since the last check, log the new state.
@@ -33,10 +33,12 @@ import traceback
 import uuid
 import zipfile
 
+from contextlib import closing
 from datetime import datetime, timedelta
 
 import azurelinuxagent.common.conf as conf
 import azurelinuxagent.common.logger as logger
+import azurelinuxagent.common.timingstats as timingstats
 import azurelinuxagent.common.utils.fileutil as fileutil
 import azurelinuxagent.common.utils.restutil as restutil
 import azurelinuxagent.common.utils.textutil as textutil
@@ -314,48 +316,50 @@ class UpdateHandler(object):
                 #
                 # Process the goal state
                 #
-                goal_state_fetched = False
-                try:
-                    protocol.update_goal_state()
-                    goal_state_fetched = True
-                except Exception as e:
-                    msg = u"Exception retrieving the goal state: {0}".format(ustr(traceback.format_exc()))
-                    add_event(AGENT_NAME, op=WALAEventOperation.FetchGoalState, version=CURRENT_VERSION, is_success=False, message=msg)
-
-                if goal_state_fetched:
-                    if self._upgrade_available(protocol):
-                        available_agent = self.get_latest_agent()
-                        if available_agent is None:
-                            logger.info(
-                                "Agent {0} is reverting to the installed agent -- exiting",
-                                CURRENT_AGENT)
-                        else:
-                            logger.info(
-                                u"Agent {0} discovered update {1} -- exiting",
-                                CURRENT_AGENT,
-                                available_agent.name)
-                        break
-
-                    utc_start = datetime.utcnow()
-
-                    last_etag = exthandlers_handler.last_etag
-                    exthandlers_handler.run()
-
-                    remote_access_handler.run()
-
-                    if last_etag != exthandlers_handler.last_etag:
-                        self._ensure_readonly_files()
-                        duration = elapsed_milliseconds(utc_start)
-                        logger.info('ProcessGoalState completed [incarnation {0}; {1} ms]',
-                                    exthandlers_handler.last_etag,
-                                    duration)
-                        add_event(
-                            AGENT_NAME,
-                            op=WALAEventOperation.ProcessGoalState,
-                            duration=duration,
-                            message="Incarnation {0}".format(exthandlers_handler.last_etag))
-
-                self._send_heartbeat_telemetry(protocol)
+                with timingstats.timed("UpdateHandler.GoalStateLoop") as timer:
+                    goal_state_fetched = False
+                    try:
+                        protocol.update_goal_state()
+                        goal_state_fetched = True
+                    except Exception as e:
+                        timer.error = u"Exception retrieving the goal state: {0}".format(ustr(e))
+                        msg = u"Exception retrieving the goal state: {0}".format(ustr(traceback.format_exc()))
+                        add_event(AGENT_NAME, op=WALAEventOperation.FetchGoalState, version=CURRENT_VERSION, is_success=False, message=msg)
+
+                    if goal_state_fetched:
+                        if self._upgrade_available(protocol):
+                            available_agent = self.get_latest_agent()
+                            if available_agent is None:
+                                logger.info(
+                                    "Agent {0} is reverting to the installed agent -- exiting",
+                                    CURRENT_AGENT)
+                            else:
+                                logger.info(
+                                    u"Agent {0} discovered update {1} -- exiting",
+                                    CURRENT_AGENT,
+                                    available_agent.name)
+                            break
+
+                        utc_start = datetime.utcnow()
+
+                        last_etag = exthandlers_handler.last_etag
+                        exthandlers_handler.run()
+
+                        remote_access_handler.run()
+
+                        if last_etag != exthandlers_handler.last_etag:
+                            self._ensure_readonly_files()
+                            duration = elapsed_milliseconds(utc_start)
+                            logger.info('ProcessGoalState completed [incarnation {0}; {1} ms]',
+                                        exthandlers_handler.last_etag,
+                                        duration)
+                            add_event(
+                                AGENT_NAME,
+                                op=WALAEventOperation.ProcessGoalState,
+                                duration=duration,
+                                message="Incarnation {0}".format(exthandlers_handler.last_etag))
+
+                    self._send_heartbeat_telemetry(protocol)
 
                 time.sleep(goal_state_interval)
 
@@ -922,17 +926,15 @@ class GuestAgent(object):
             raise UpdateError(msg)
 
     def _fetch(self, uri, headers=None, use_proxy=True):
-        package = None
+        downloaded = False
         try:
             is_healthy = True
             error_response = ''
             resp = restutil.http_get(uri, use_proxy=use_proxy, headers=headers)
             if restutil.request_succeeded(resp):
-                package = resp.read()
-                fileutil.write_file(self.get_agent_pkg_path(),
-                                    bytearray(package),
-                                    asbin=True)
-                logger.verbose(u"Agent {0} downloaded from {1}", self.name, uri)
+                downloaded = self._save_package(resp, uri)
+                if downloaded:
+                    logger.verbose(u"Agent {0} downloaded from {1}", self.name, uri)
             else:
                 error_response = restutil.read_response_error(resp)
                 logger.verbose("Fetch was unsuccessful [{0}]", error_response)
@@ -950,7 +952,39 @@ class GuestAgent(object):
                            uri,
                            http_error)
 
-        return package is not None
+        return downloaded
+
+    def _save_package(self, resp, uri):
+        """
+        Streams the package in the response to a temporary file and, if the package is complete and valid, moves it
+        to the package path; the package is never held in memory in full.
+        """
+        package_path = self.get_agent_pkg_path()
+        temp_path = package_path + ".tmp"
+        try:
+            with open(temp_path, "wb") as temp_file:
+                size = restutil.read_response_to_file(resp, temp_file)
+
+            content_length = resp.getheader("Content-Length")
+            if content_length is not None and int(content_length) != size:
+                logger.warn(u"Agent {0} download from {1} is incomplete: expected {2} bytes, got {3}",
+                            self.name, uri, content_length, size)
+                return False
+
+            with closing(zipfile.ZipFile(temp_path)) as package:
+                bad_file = package.testzip()
+            if bad_file is not None:
+                logger.warn(u"Agent {0} download from {1} is corrupt (invalid file: {2})", self.name, uri, bad_file)
+                return False
+
+            os.rename(temp_path, package_path)
+            return True
+        except Exception as e:
+            logger.warn(u"Agent {0} failed saving the package downloaded from {1}: {2}", self.name, uri, ustr(e))
+            return False
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
 
     def _load_error(self):
         try:
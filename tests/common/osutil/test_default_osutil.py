@@ -16,6 +16,7 @@
 #
 
 from azurelinuxagent.common.osutil.default import DefaultOSUtil, shellutil
+from azurelinuxagent.common.utils import fileutil
 from tests.tools import AgentTestCase, patch
 import os
 
@@ -82,6 +83,16 @@ class DefaultOsUtilTestCase(AgentTestCase):
             self.assertRegex(mount_commands, ';mount.* cpu,cpuacct ', 'The cpu controller was not mounted')
             self.assertRegex(mount_commands, ';mount.* memory ', 'The memory controller was not mounted')
 
+    def test_mount_cgroups_should_not_mount_the_v1_controllers_on_the_unified_hierarchy(self):
+        os.mkdir(self.cgroups_file_system_root)
+        fileutil.write_file(os.path.join(self.cgroups_file_system_root, 'cgroup.controllers'), 'cpu io memory pids\n')
+
+        with patch("azurelinuxagent.common.osutil.default.shellutil.run_get_output") as patch_run_get_output:
+            DefaultOSUtil().mount_cgroups()
+
+        self.assertEqual(0, patch_run_get_output.call_count, 'No file systems should have been mounted')
+        self.assertEqual(['cgroup.controllers'], os.listdir(self.cgroups_file_system_root))
+
     def test_mount_cgroups_should_not_mount_cgroup_controllers_when_they_already_exist(self):
         os.mkdir(self.cgroups_file_system_root)
         os.mkdir(os.path.join(self.cgroups_file_system_root, 'cpu,cpuacct'))
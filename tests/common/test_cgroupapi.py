@@ -21,6 +21,7 @@ import os
 import re
 import subprocess
 import tempfile
+from azurelinuxagent.common.cgroup import CpuCgroupV2, MemoryCgroupV2, IoCgroupV2
 from azurelinuxagent.common.cgroupapi import CGroupsApi, FileSystemCgroupsApi, SystemdCgroupsApi, CGROUPS_FILE_SYSTEM_ROOT, VM_AGENT_CGROUP_NAME
 from azurelinuxagent.common.exception import CGroupsException, ExtensionError, ExtensionErrorCodes
 from azurelinuxagent.common.future import ustr
@@ -606,6 +607,73 @@ class SystemdCgroupsApiTestCase(AgentTestCase):
 
 
 class SystemdCgroupsApiMockedFileSystemTestCase(_MockedFileSystemTestCase):
+    def _set_up_unified_hierarchy(self):
+        fileutil.write_file(os.path.join(self.cgroups_file_system_root, "cgroup.controllers"), "cpuset cpu io memory pids\n")
+
+    def test_create_should_not_return_a_FileSystemCgroupsApi_on_the_unified_hierarchy(self):
+        self._set_up_unified_hierarchy()
+
+        with patch("azurelinuxagent.common.cgroupapi.CGroupsApi._is_systemd", return_value=False):
+            with self.assertRaises(CGroupsException):
+                CGroupsApi.create()
+
+    def test_create_agent_cgroups_should_use_the_unified_hierarchy(self):
+        self._set_up_unified_hierarchy()
+
+        original_read_file = fileutil.read_file
+
+        def mock_read_file(filepath, **kwargs):
+            if filepath == "/proc/self/cgroup":
+                return "0::/system.slice/walinuxagent.service\n"
+            return original_read_file(filepath, **kwargs)
+
+        with patch("azurelinuxagent.common.utils.fileutil.read_file", side_effect=mock_read_file):
+            agent_cgroups = SystemdCgroupsApi().create_agent_cgroups()
+
+        expected_cgroup_path = os.path.join(self.cgroups_file_system_root, "system.slice", VM_AGENT_CGROUP_NAME)
+        self.assertEqual(["cpu", "memory", "io"], [cgroup.controller for cgroup in agent_cgroups])
+        self.assertTrue(all(cgroup.path == expected_cgroup_path for cgroup in agent_cgroups))
+        self.assertTrue(all(type(cgroup) in (CpuCgroupV2, MemoryCgroupV2, IoCgroupV2) for cgroup in agent_cgroups))
+
+    def test_get_extension_cgroups_should_skip_the_controllers_that_are_not_available_in_the_unified_hierarchy(self):
+        fileutil.write_file(os.path.join(self.cgroups_file_system_root, "cgroup.controllers"), "cpu memory\n")
+
+        extension_cgroups = SystemdCgroupsApi().get_extension_cgroups("Microsoft.Compute.TestExtension-1.2.3")
+
+        expected_cgroup_path = os.path.join(self.cgroups_file_system_root, "system.slice", "Microsoft.Compute.TestExtension_1.2.3")
+        self.assertEqual(["cpu", "memory"], [cgroup.controller for cgroup in extension_cgroups])
+        self.assertTrue(all(cgroup.path == expected_cgroup_path for cgroup in extension_cgroups))
+
+    def _get_systemd_run_command(self):
+        with patch("azurelinuxagent.common.cgroupapi.subprocess.Popen") as mock_popen:
+            with patch("azurelinuxagent.common.cgroupapi.handle_process_completion", return_value="output"):
+                with patch("azurelinuxagent.common.cgroupapi.CGroupsTelemetry.track_cgroup"):
+                    SystemdCgroupsApi().start_extension_command(
+                        extension_name="Microsoft.Compute.TestExtension-1.2.3",
+                        command="date",
+                        timeout=300,
+                        shell=True,
+                        cwd=self.tmp_dir,
+                        env={},
+                        stdout=None,
+                        stderr=None)
+        return mock_popen.call_args[0][0]
+
+    def test_start_extension_command_should_enable_accounting_on_the_unified_hierarchy(self):
+        self._set_up_unified_hierarchy()
+
+        command = self._get_systemd_run_command()
+
+        self.assertTrue(command.startswith("systemd-run --unit=Microsoft.Compute.TestExtension_1.2.3_"), command)
+        self.assertTrue(command.endswith(" --scope --property=CPUAccounting=yes --property=MemoryAccounting=yes "
+                                         "--property=IOAccounting=yes date"), command)
+
+    def test_start_extension_command_should_not_set_properties_on_the_legacy_hierarchy(self):
+        command = self._get_systemd_run_command()
+
+        self.assertTrue(command.endswith(" --scope date"), command)
+        self.assertNotIn("--property", command)
+
     def test_cleanup_legacy_cgroups_should_remove_legacy_cgroups(self):
         # Set up a mock /var/run/waagent.pid file
         daemon_pid_file = os.path.join(self.tmp_dir, "waagent.pid")
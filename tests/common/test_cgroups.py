@@ -20,8 +20,10 @@ from __future__ import print_function
 import errno
 import os
 import random
+import shutil
 
-from azurelinuxagent.common.cgroup import CpuCgroup, MemoryCgroup, CGroup
+from azurelinuxagent.common.cgroup import CpuCgroup, MemoryCgroup, CGroup, CpuCgroupV2, MemoryCgroupV2, IoCgroupV2, \
+    USER_HZ
 from azurelinuxagent.common.exception import CGroupsException
 from azurelinuxagent.common.utils import fileutil
 from tests.tools import AgentTestCase, patch, data_dir
@@ -197,6 +199,27 @@ class TestCpuCgroup(AgentTestCase):
 
         self.assertEquals(cpu_usage, 0.045)
 
+    def test_get_cpu_usage_should_use_the_given_system_cpu_ticks(self):
+        cgroup = CpuCgroup("test", "/sys/fs/cgroup/cpu/system.slice/test")
+
+        TestCpuCgroup.mock_read_file_map = {
+            "/proc/stat": os.path.join(data_dir, "cgroups", "proc_stat_t0"),
+            os.path.join(cgroup.path, "cpuacct.stat"): os.path.join(data_dir, "cgroups", "cpuacct.stat_t0")
+        }
+
+        cgroup.initialize_cpu_usage()
+
+        # /proc/stat should not be read when the system CPU ticks are given
+        TestCpuCgroup.mock_read_file_map = {
+            "/proc/stat": Exception("/proc/stat should not have been read"),
+            os.path.join(cgroup.path, "cpuacct.stat"): os.path.join(data_dir, "cgroups", "cpuacct.stat_t1")
+        }
+
+        cpu_usage = cgroup.get_cpu_usage(system_cpu=5496872 + 10000)
+
+        self.assertEquals(cgroup._current_system_cpu, 5496872 + 10000)
+        self.assertEquals(cpu_usage, round(100.0 * (cgroup._current_cgroup_cpu - 63763) / 10000, 3))
+
     def test_initialie_cpu_usage_should_set_the_cgroup_usage_to_0_when_the_cgroup_does_not_exist(self):
         cgroup = CpuCgroup("test", "/sys/fs/cgroup/cpu/system.slice/test")
 
@@ -260,3 +283,111 @@ class TestMemoryCgroup(AgentTestCase):
             test_mem_cg.get_max_memory_usage()
 
         self.assertEqual(e.exception.errno, errno.ENOENT)
+
+
+class TestCGroupV2(AgentTestCase):
+    def setUp(self):
+        AgentTestCase.setUp(self)
+        self.cgroup_path = os.path.join(self.tmp_dir, "extension.scope")
+        shutil.copytree(os.path.join(data_dir, "cgroups", "v2"), self.cgroup_path)
+
+    def _write_cgroup_file(self, file_name, contents):
+        fileutil.write_file(os.path.join(self.cgroup_path, file_name), contents)
+
+    def test_create_should_return_the_unified_hierarchy_cgroups(self):
+        self.assertIsInstance(CGroup.create(self.cgroup_path, "cpu", "test", unified_hierarchy=True), CpuCgroupV2)
+        self.assertIsInstance(CGroup.create(self.cgroup_path, "memory", "test", unified_hierarchy=True), MemoryCgroupV2)
+        self.assertIsInstance(CGroup.create(self.cgroup_path, "io", "test", unified_hierarchy=True), IoCgroupV2)
+
+        with self.assertRaises(CGroupsException):
+            CGroup.create(self.cgroup_path, "io", "test")
+
+    def test_get_cpu_usage_should_use_cpu_stat(self):
+        cgroup = CpuCgroupV2("test", self.cgroup_path)
+
+        cgroup.initialize_cpu_usage(system_cpu=1000)
+        self.assertEqual(2.5 * USER_HZ, cgroup._current_cgroup_cpu)
+        self.assertIsNone(cgroup.get_throttled_time())
+
+        self._write_cgroup_file("cpu.stat", "usage_usec 3500000\nthrottled_usec 100000\n")
+
+        cpu_usage = cgroup.get_cpu_usage(system_cpu=1000 + 10 * USER_HZ)
+
+        self.assertEqual(10.0, cpu_usage)
+        self.assertEqual(60.0, cgroup.get_throttled_time())
+
+    def test_get_cpu_usage_should_raise_an_exception_when_cpu_stat_is_invalid(self):
+        cgroup = CpuCgroupV2("test", self.cgroup_path)
+        cgroup.initialize_cpu_usage(system_cpu=1000)
+
+        self._write_cgroup_file("cpu.stat", "nr_periods 10\n")
+
+        with self.assertRaises(CGroupsException):
+            cgroup.get_cpu_usage(system_cpu=2000)
+
+    def test_get_memory_usage_should_use_memory_current_and_memory_peak(self):
+        cgroup = MemoryCgroupV2("test", self.cgroup_path)
+
+        self.assertEqual(104857600, cgroup.get_memory_usage())
+        self.assertEqual(209715200, cgroup.get_max_memory_usage())
+
+        memory_stat = cgroup.get_memory_stat()
+        self.assertEqual(52428800, memory_stat["anon"])
+        self.assertEqual(41943040, memory_stat["file"])
+
+    def test_get_max_memory_usage_should_return_the_maximum_polled_usage_when_memory_peak_does_not_exist(self):
+        cgroup = MemoryCgroupV2("test", self.cgroup_path)
+        os.remove(os.path.join(self.cgroup_path, "memory.peak"))
+
+        cgroup.get_memory_usage()
+        self._write_cgroup_file("memory.current", "1024\n")
+        cgroup.get_memory_usage()
+
+        self.assertEqual(104857600, cgroup.get_max_memory_usage())
+
+        shutil.rmtree(self.cgroup_path)
+
+        with self.assertRaises(IOError) as context_manager:
+            cgroup.get_max_memory_usage()
+        self.assertEqual(errno.ENOENT, context_manager.exception.errno)
+
+    def test_get_io_usage_should_return_the_bytes_transferred_since_the_previous_call(self):
+        cgroup = IoCgroupV2("test", self.cgroup_path)
+
+        self.assertIsNone(cgroup.get_io_usage())
+
+        self._write_cgroup_file("io.stat", "8:0 rbytes=2097152 wbytes=2097152 rios=20 wios=20 dbytes=0 dios=0\n"
+                                           "8:16 rbytes=2048 wbytes=4096 rios=2 wios=1 dbytes=0 dios=0\n")
+
+        self.assertEqual((1048576 + 1024, 4096), cgroup.get_io_usage())
+
+    def test_get_pressure_should_return_the_averages_over_5_minutes(self):
+        self.assertEqual({"some": 3.75, "full": 0.0}, CpuCgroupV2("test", self.cgroup_path).get_pressure())
+        self.assertEqual({"some": 0.3, "full": 0.05}, MemoryCgroupV2("test", self.cgroup_path).get_pressure())
+        self.assertEqual({"some": 6.0, "full": 3.0}, IoCgroupV2("test", self.cgroup_path).get_pressure())
+
+        # PSI is not reported in the v1 hierarchy
+        self.assertIsNone(CpuCgroup("test", self.cgroup_path).get_pressure())
+
+    def test_get_pressure_should_return_none_when_psi_is_not_available(self):
+        os.remove(os.path.join(self.cgroup_path, "cpu.pressure"))
+        self.assertIsNone(CpuCgroupV2("test", self.cgroup_path).get_pressure())
+
+        eopnotsupp = IOError()
+        eopnotsupp.errno = errno.EOPNOTSUPP
+        with patch("azurelinuxagent.common.cgroup.fileutil.read_file", side_effect=eopnotsupp):
+            self.assertIsNone(MemoryCgroupV2("test", self.cgroup_path).get_pressure())
+
+        self._write_cgroup_file("io.pressure", "invalid\n")
+        with self.assertRaises(CGroupsException):
+            IoCgroupV2("test", self.cgroup_path).get_pressure()
+
+    def test_is_active_should_use_cgroup_procs(self):
+        cgroup = MemoryCgroupV2("test", self.cgroup_path)
+        self.assertFalse(cgroup.is_active())
+
+        self._write_cgroup_file("cgroup.procs", "1234\n")
+        self.assertTrue(cgroup.is_active())
+
+        shutil.rmtree(self.cgroup_path)
+        self.assertFalse(cgroup.is_active())
@@ -17,11 +17,13 @@
 import errno
 import os
 import random
+import shutil
 import time
 
 from azurelinuxagent.common.cgroup import CGroup
 from azurelinuxagent.common.cgroupconfigurator import CGroupConfigurator
-from azurelinuxagent.common.cgroupstelemetry import CGroupsTelemetry, Metric
+from azurelinuxagent.common.cgroupstelemetry import CGroupsTelemetry, CgroupMetrics, Metric, MetricsCategory, \
+    MetricsCounter
 from azurelinuxagent.common.osutil.default import BASE_CGROUPS, DefaultOSUtil
 from azurelinuxagent.common.protocol.restapi import ExtHandler, ExtHandlerProperties
 from azurelinuxagent.common.utils import fileutil
@@ -161,12 +163,12 @@ class TestCGroupsTelemetry(AgentTestCase):
 
         processes_instances = [CGroupsTelemetry.get_process_info_summary(pid) for pid in proc_ids]
         for _, cgroup_metric in CGroupsTelemetry._cgroup_metrics.items():
-            self.assertListEqual(cgroup_metric.get_memory_metrics()._data, memory_usage)
-            self.assertListEqual(cgroup_metric.get_max_memory_metrics()._data, max_memory_usage)
-            self.assertListEqual(cgroup_metric.get_cpu_metrics()._data, cpu_usage)
+            self.assertListEqual(cgroup_metric.get_memory_metrics().values(), memory_usage)
+            self.assertListEqual(cgroup_metric.get_max_memory_metrics().values(), max_memory_usage)
+            self.assertListEqual(cgroup_metric.get_cpu_metrics().values(), cpu_usage)
             for kv_pair in cgroup_metric.get_proc_statm_memory_metrics():
                 self.assertIn(kv_pair.pid_name_cmdline, processes_instances)
-                self.assertListEqual(kv_pair.resource_metric._data, memory_statm_memory_usage)
+                self.assertListEqual(kv_pair.resource_metric.values(), memory_statm_memory_usage)
 
     def _assert_polled_metrics_equal(self, metrics, cpu_metric_value, memory_metric_value,
                                      max_memory_metric_value, proc_stat_memory_usage_value, pids=None):
@@ -279,6 +281,41 @@ class TestCGroupsTelemetry(AgentTestCase):
         self.assertEqual(CGroupsTelemetry._cgroup_metrics.__len__(), num_extensions)
         self._assert_calculated_resource_metrics_equal([], [], [], [], [])
 
+    def test_telemetry_polling_should_read_the_system_cpu_ticks_once_for_all_the_cpu_cgroups(self):
+        num_extensions = 3
+        self._track_new_extension_cgroups(num_extensions)
+
+        with patch("azurelinuxagent.common.osutil.default.DefaultOSUtil.get_total_cpu_ticks_since_boot", return_value=123456) as patch_get_cpu_ticks:
+            with patch("azurelinuxagent.common.cgroup.CpuCgroup.get_cpu_usage", return_value=10) as patch_get_cpu_usage:
+                with patch("azurelinuxagent.common.cgroup.CGroup.is_active", return_value=True):
+                    CGroupsTelemetry.poll_all_tracked()
+
+        self.assertEqual(1, patch_get_cpu_ticks.call_count, "/proc/stat should have been read once per poll")
+        self.assertEqual(num_extensions, patch_get_cpu_usage.call_count)
+        for call in patch_get_cpu_usage.call_args_list:
+            self.assertEqual((123456,), call[0], "All the cgroups should use the same system CPU ticks")
+
+    def test_telemetry_polling_should_read_the_cpu_cgroups_before_the_system_cpu_ticks(self):
+        num_extensions = 3
+        self._track_new_extension_cgroups(num_extensions)
+
+        reads = []
+
+        def get_cgroup_cpu_ticks(*_, **__):
+            reads.append("cgroup")
+            return 1000
+
+        def get_system_cpu_ticks(*_):
+            reads.append("system")
+            return 100000
+
+        with patch("azurelinuxagent.common.cgroup.CpuCgroup._get_cpu_ticks", side_effect=get_cgroup_cpu_ticks):
+            with patch("azurelinuxagent.common.osutil.default.DefaultOSUtil.get_total_cpu_ticks_since_boot", side_effect=get_system_cpu_ticks):
+                with patch("azurelinuxagent.common.cgroup.CGroup.is_active", return_value=True):
+                    CGroupsTelemetry.poll_all_tracked()
+
+        self.assertEqual(["cgroup"] * num_extensions + ["system"], reads)
+
     @patch("azurelinuxagent.common.cgroup.MemoryCgroup.get_max_memory_usage", side_effect=raise_ioerror)
     @patch("azurelinuxagent.common.cgroup.MemoryCgroup.get_memory_usage", side_effect=raise_ioerror)
     @patch("azurelinuxagent.common.cgroup.CpuCgroup.get_cpu_usage", side_effect=raise_ioerror)
@@ -592,6 +629,68 @@ class TestCGroupsTelemetry(AgentTestCase):
                 self.assertEqual(0, len(collected_metrics))
 
 
+    @patch("azurelinuxagent.common.cgroup.CGroup.is_active", return_value=True)
+    @patch("azurelinuxagent.common.cgroup.MemoryCgroup.get_max_memory_usage", return_value=1)
+    @patch("azurelinuxagent.common.cgroup.MemoryCgroup.get_memory_usage", return_value=1)
+    @patch("azurelinuxagent.common.cgroup.CpuCgroup.get_cpu_usage", return_value=1)
+    def test_telemetry_polling_should_cache_the_process_info_summaries_until_the_pid_is_reused(self, *_):
+        self._track_new_extension_cgroups(1)
+
+        start_times = dict((pid, 100) for pid in TestCGroupsTelemetry.TestProcessIds)
+
+        with patch("azurelinuxagent.common.resourceusage.ProcessInfo.get_proc_start_time", side_effect=lambda pid: start_times[pid]):
+            with patch("azurelinuxagent.common.cgroupstelemetry.CGroupsTelemetry.get_process_info_summary",
+                       side_effect=lambda pid: "summary " + pid) as patch_get_process_info_summary:
+                CGroupsTelemetry.poll_all_tracked()
+                CGroupsTelemetry.poll_all_tracked()
+
+                self.assertEqual(len(TestCGroupsTelemetry.TestProcessIds), patch_get_process_info_summary.call_count,
+                                 "The summaries should have been computed only on the first poll")
+
+                # pid reuse
+                start_times["1000"] = 200
+                CGroupsTelemetry.poll_all_tracked()
+
+                self.assertEqual(len(TestCGroupsTelemetry.TestProcessIds) + 1, patch_get_process_info_summary.call_count)
+                self.assertEqual("1000", patch_get_process_info_summary.call_args[0][0])
+
+    @patch("azurelinuxagent.common.cgroupstelemetry.MAX_PROCESSES_PER_CGROUP", 2)
+    def test_cgroup_metrics_should_limit_the_number_of_processes(self):
+        cgroup_metrics = CgroupMetrics()
+        for pid in ["1000", "1001", "1002"]:
+            cgroup_metrics.add_proc_statm_memory(pid, 1)
+        cgroup_metrics.add_proc_statm_memory("1000", 2)
+
+        metrics = dict((m.pid_name_cmdline, m.resource_metric.values()) for m in cgroup_metrics.get_proc_statm_memory_metrics())
+        self.assertEqual({"1000": [1, 2], "1001": [1]}, metrics)
+
+    def test_telemetry_polling_should_report_the_metrics_of_the_unified_hierarchy(self):
+        cgroup_path = os.path.join(self.tmp_dir, "extension.scope")
+        shutil.copytree(os.path.join(data_dir, "cgroups", "v2"), cgroup_path)
+        fileutil.write_file(os.path.join(cgroup_path, "cgroup.procs"), "{0}\n".format(os.getpid()))
+
+        for controller in ["cpu", "memory", "io"]:
+            CGroupsTelemetry.track_cgroup(CGroup.create(cgroup_path, controller, "extension", unified_hierarchy=True))
+
+        self.assertEqual(3, len(CGroupsTelemetry._tracked), "All the controllers should be tracked even if they share the same path")
+
+        CGroupsTelemetry.poll_all_tracked()
+        metrics = dict(((m.category, m.counter), m.value) for m in CGroupsTelemetry.poll_all_tracked() if m.instance == "extension")
+
+        self.assertEqual(0.0, metrics[(MetricsCategory.PROCESS_CATEGORY, MetricsCounter.THROTTLED_TIME)])
+        self.assertEqual(3.75, metrics[(MetricsCategory.PROCESS_CATEGORY, MetricsCounter.CPU_PRESSURE)])
+        self.assertEqual(104857600, metrics[(MetricsCategory.MEMORY_CATEGORY, MetricsCounter.TOTAL_MEM_USAGE)])
+        self.assertEqual(209715200, metrics[(MetricsCategory.MEMORY_CATEGORY, MetricsCounter.MAX_MEM_USAGE)])
+        self.assertEqual(52428800, metrics[(MetricsCategory.MEMORY_CATEGORY, MetricsCounter.ANON_MEM_USAGE)])
+        self.assertEqual(41943040, metrics[(MetricsCategory.MEMORY_CATEGORY, MetricsCounter.FILE_MEM_USAGE)])
+        self.assertEqual(0.3, metrics[(MetricsCategory.MEMORY_CATEGORY, MetricsCounter.MEMORY_PRESSURE)])
+        self.assertEqual(0.05, metrics[(MetricsCategory.MEMORY_CATEGORY, MetricsCounter.MEMORY_FULL_PRESSURE)])
+        self.assertEqual(0, metrics[(MetricsCategory.IO_CATEGORY, MetricsCounter.BYTES_READ)])
+        self.assertEqual(0, metrics[(MetricsCategory.IO_CATEGORY, MetricsCounter.BYTES_WRITTEN)])
+        self.assertEqual(6.0, metrics[(MetricsCategory.IO_CATEGORY, MetricsCounter.IO_PRESSURE)])
+        self.assertEqual(3.0, metrics[(MetricsCategory.IO_CATEGORY, MetricsCounter.IO_FULL_PRESSURE)])
+
+
 class TestMetric(AgentTestCase):
     def test_empty_metrics(self):
         test_metric = Metric()
@@ -624,3 +723,19 @@ class TestMetric(AgentTestCase):
         self.assertEqual(None, test_metric.max())
         self.assertEqual(None, test_metric.min())
         self.assertEqual(None, test_metric.average())
+
+    @patch("azurelinuxagent.common.cgroupstelemetry.MAX_METRIC_SAMPLES", 4)
+    def test_metrics_should_keep_the_latest_samples(self):
+        test_values = [5, 1, 9, 3, 7, 2]
+
+        test_metric = Metric()
+        for value in test_values:
+            test_metric.append(value)
+
+        # count, average, min and max include all the samples, while the median uses the latest 4
+        self.assertEqual([9, 3, 7, 2], test_metric.values())
+        self.assertEqual(6, test_metric.count())
+        self.assertEqual(float(sum(test_values)) / 6, test_metric.average())
+        self.assertEqual(1, test_metric.min())
+        self.assertEqual(9, test_metric.max())
+        self.assertEqual(5.0, test_metric.median())
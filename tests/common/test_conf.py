@@ -46,6 +46,8 @@ class TestConf(AgentTestCase):
         "ResourceDisk.SwapSizeMB": 0,
         "ResourceDisk.MountOptions": None,
         "Logs.Verbose": False,
+        "Logs.Buffered": False,
+        "Logs.WriterThread": False,
         "OS.EnableFIPS": True,
         "OS.RootDeviceScsiTimeout": '300',
         "OS.OpensslPath": '/usr/bin/openssl',
@@ -69,6 +71,9 @@ class TestConf(AgentTestCase):
         "OS.EnableFirewall": False,
         "CGroups.EnforceLimits": False,
         "CGroups.Excluded": "customscript,runcommand",
+        "Extensions.ManifestCachePeriod": 3600,
+        "Extensions.MaxParallelHandlers": 1,
+        "Extensions.StatusHeartbeatPeriod": 60,
     }
 
     def setUp(self):
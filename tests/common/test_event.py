@@ -17,6 +17,7 @@
 #
 from __future__ import print_function
 
+import json
 import os
 import re
 import shutil
@@ -25,8 +26,12 @@ from datetime import datetime, timedelta
 
 from azurelinuxagent.common import event, logger
 from azurelinuxagent.common.event import add_event, add_periodic, add_log_event, elapsed_milliseconds, report_metric, \
-    WALAEventOperation, parse_xml_event, parse_json_event, AGENT_EVENT_FILE_EXTENSION, EVENTS_DIRECTORY
+    WALAEventOperation, parse_xml_event, parse_json_event, AGENT_EVENT_FILE_EXTENSION, EVENTS_DIRECTORY, \
+    TELEMETRY_EVENT_EVENT_ID, TELEMETRY_EVENT_PROVIDER_ID, TELEMETRY_LOG_PROVIDER_ID
+from azurelinuxagent.common.datacontract import get_properties
 from azurelinuxagent.common.future import ustr
+from azurelinuxagent.common.telemetryevent import TelemetryEvent, TelemetryEventParam
+from azurelinuxagent.common.utils.spoolutil import SEGMENT_FILE_EXTENSION, Spool
 from azurelinuxagent.common.protocol.goal_state import GoalState
 from tests.protocol import mockwiredata
 from tests.protocol.mocks import mock_wire_protocol
@@ -126,7 +131,7 @@ class TestEvent(AgentTestCase):
                 # The exception should have been caught and logged
                 args = mock_logger_periodic_error.call_args
                 exception_message = args[0][1]
-                self.assertIn("[EventError] Failed to create events folder", exception_message)
+                self.assertIn("[EventError] Failed to save event to", exception_message)
 
     def test_event_status_event_marked(self):
         es = event.__event_status__
@@ -320,28 +325,41 @@ class TestEvent(AgentTestCase):
                                                message='test event', op=WALAEventOperation.Unknown,
                                                version=str(CURRENT_VERSION))
 
-    def test_collect_events_should_delete_event_files(self):
+    def test_collect_events_should_return_each_event_only_once(self):
         add_event(name='Event1')
         add_event(name='Event1')
         add_event(name='Event3')
 
-        event_files = os.listdir(self.event_dir)
-        self.assertEquals(len(event_files), 3, "Did not find all the event files that were created")
+        event_list = event.collect_events()
+        self.assertEquals(len(event_list.events), 3, "Did not collect all the events that were created")
 
         event_list = event.collect_events()
-        event_files = os.listdir(self.event_dir)
+        self.assertEquals(len(event_list.events), 0, "The events were collected more than once")
 
-        self.assertEquals(len(event_list.events), 3, "Did not collect all the events that were created")
-        self.assertEquals(len(event_files), 0, "The event files were not deleted")
+        add_event(name='Event4')
+
+        event_list = event.collect_events()
+        self.assertEquals(len(event_list.events), 1, "Did not collect the event created after the previous collection")
 
     def test_save_event(self):
         add_event('test', message='test event')
-        self.assertTrue(len(os.listdir(self.event_dir)) == 1)
+        add_event('test', message='another test event')
+
+        # both events should have been appended to the same segment of the spool
+        event_files = os.listdir(self.event_dir)
+        self.assertEquals(1, len(event_files), "Expected exactly 1 file in the events directory: {0}".format(event_files))
+        self.assertTrue(event_files[0].endswith(SEGMENT_FILE_EXTENSION),
+            'The spool segment does not have the correct extension ({0}): {1}'.format(SEGMENT_FILE_EXTENSION, event_files[0]))
 
-        # checking the extension of the file created.
-        for filename in os.listdir(self.event_dir):
-            self.assertTrue(filename.endswith(AGENT_EVENT_FILE_EXTENSION),
-                'Event file does not have the correct extension ({0}): {1}'.format(AGENT_EVENT_FILE_EXTENSION, filename))
+    def test_save_event_should_start_a_new_segment_when_the_current_one_is_full(self):
+        with patch("azurelinuxagent.common.utils.spoolutil.SEGMENT_MAX_SIZE", 1):
+            for i in range(3):
+                add_event('test', message='test event {0}'.format(i))
+
+        self.assertEquals(3, len(os.listdir(self.event_dir)), "Expected one segment per event")
+
+        event_list = event.collect_events()
+        self.assertEquals(['test event 0', 'test event 1', 'test event 2'], [TestEvent._get_event_message(e) for e in event_list.events])
 
     @staticmethod
     def _get_event_message(evt):
@@ -387,65 +405,103 @@ class TestEvent(AgentTestCase):
             assert_invalid_file_was_reported("custom_script_no_read_access.tld")
 
     def test_save_event_rollover(self):
-        # We keep 1000 events only, and the older ones are removed.
+        # We keep MAX_NUMBER_OF_SEGMENTS segments only, and the older ones are removed.
+        with patch("azurelinuxagent.common.utils.spoolutil.SEGMENT_MAX_SIZE", 1):
+            with patch("azurelinuxagent.common.utils.spoolutil.MAX_NUMBER_OF_SEGMENTS", 10):
+                add_event('test', message='first event')
+                for i in range(9):
+                    add_event('test', message='test event {0}'.format(i))
 
-        num_of_events = 999
-        add_event('test', message='first event')  # this makes number of events to num_of_events + 1.
-        for i in range(num_of_events):
-            add_event('test', message='test event {0}'.format(i))
+                self.assertEquals(10, len(os.listdir(self.event_dir)))
 
-        num_of_events += 1 # adding the first add_event.
+                add_event('test', message='last event')
+                # Adding the above event displaces the first event
 
-        events = os.listdir(self.event_dir)
-        events.sort()
-        self.assertTrue(len(events) == num_of_events, "{0} is not equal to {1}".format(len(events), num_of_events))
+                self.assertEquals(10, len(os.listdir(self.event_dir)))
 
-        first_event = os.path.join(self.event_dir, events[0])
-        with open(first_event) as first_fh:
-            first_event_text = first_fh.read()
-            self.assertTrue('first event' in first_event_text)
+        messages = [TestEvent._get_event_message(e) for e in event.collect_events().events]
+        self.assertEquals(['test event {0}'.format(i) for i in range(9)] + ['last event'], messages)
 
-        add_event('test', message='last event')
-        # Adding the above event displaces the first_event
-
-        events = os.listdir(self.event_dir)
-        events.sort()
-        self.assertTrue(len(events) == num_of_events,
-                        "{0} events found, {1} expected".format(len(events), num_of_events))
+    def test_collect_events_should_remove_the_oldest_event_files_when_there_are_too_many(self):
+        for i in range(0, 2000):
+            evt = os.path.join(self.event_dir, '{0}.tld'.format(ustr(1491004920536531 + i)))
+            with open(evt, 'w') as fh:
+                fh.write('{{"eventId": 1, "parameters": [{{"name": "Message", "value": "test event {0}"}}]}}'.format(i))
 
-        first_event = os.path.join(self.event_dir, events[0])
-        with open(first_event) as first_fh:
-            first_event_text = first_fh.read()
-            self.assertFalse('first event' in first_event_text, "'first event' not in {0}".format(first_event_text))
-            self.assertTrue('test event 0' in first_event_text)
+        event_list = event.collect_events()
 
-        last_event = os.path.join(self.event_dir, events[-1])
-        with open(last_event) as last_fh:
-            last_event_text = last_fh.read()
-            self.assertTrue('last event' in last_event_text)
+        messages = sorted([TestEvent._get_event_message(e) for e in event_list.events], key=lambda m: int(m.split()[-1]))
+        self.assertEquals(['test event {0}'.format(i) for i in range(1000, 2000)], messages)
+        self.assertEquals(0, len(os.listdir(self.event_dir)))
 
-    def test_save_event_cleanup(self):
-        for i in range(0, 2000):
+    def test_collect_event_batches_should_return_the_unacknowledged_events_on_the_next_collection(self):
+        for i in range(3):
+            add_event('test', message='spooled event {0}'.format(i))
+        for i in range(3):
             evt = os.path.join(self.event_dir, '{0}.tld'.format(ustr(1491004920536531 + i)))
             with open(evt, 'w') as fh:
-                fh.write('test event {0}'.format(i))
-
-        events = os.listdir(self.event_dir)
-        self.assertTrue(len(events) == 2000, "{0} events found, 2000 expected".format(len(events)))
-        add_event('test', message='last event')
-
-        events = os.listdir(self.event_dir)
-        events.sort()
-        self.assertTrue(len(events) == 1000, "{0} events found, 1000 expected".format(len(events)))
-        first_event = os.path.join(self.event_dir, events[0])
-        with open(first_event) as first_fh:
-            first_event_text = first_fh.read()
-            self.assertTrue('test event 1001' in first_event_text)
-
-        last_event = os.path.join(self.event_dir, events[-1])
-        with open(last_event) as last_fh:
-            last_event_text = last_fh.read()
-            self.assertTrue('last event' in last_event_text)
+                fh.write('{{"eventId": 1, "parameters": [{{"name": "Message", "value": "legacy event {0}"}}]}}'.format(i))
+
+        def get_messages(event_list):
+            return [TestEvent._get_event_message(e) for e in event_list.events]
+
+        # a batch size of 1 byte returns each event in its own batch
+        batches = list(event.collect_event_batches(max_batch_size=1))
+        self.assertEquals(
+            [['spooled event 0'], ['spooled event 1'], ['spooled event 2'], ['legacy event 0'], ['legacy event 1'], ['legacy event 2']],
+            [get_messages(b) for b, _ in batches])
+
+        # acknowledge only the first spooled and the first legacy events
+        batches[0][1]()
+        batches[3][1]()
+
+        self.assertEquals(
+            ['spooled event 1', 'spooled event 2', 'legacy event 1', 'legacy event 2'],
+            get_messages(event.collect_events()))
+        self.assertEquals(0, len(event.collect_events().events))
+
+    def test_collect_event_batches_should_return_batches_that_can_be_sent_in_a_single_request(self):
+        for i in range(4):
+            add_event('test', message='event {0} {1}'.format(i, 'x' * 1000))
+        event.__event_logger__.add_log_event(logger.LogLevel.WARNING, 'log event')
+        add_event('test', message='event 4')
+
+        # the spool is read as a single batch, which is split into batches that can hold 2 of the large events
+        event_size = len(list(event.collect_event_batches())[0][0].events[0].to_v1_xml())
+        max_batch_size = int(event_size * 2.5)
+
+        read_batches = Spool.read_batches
+        with patch("azurelinuxagent.common.event.Spool.read_batches", side_effect=lambda spool, *_: read_batches(spool), autospec=True):
+            batches = list(event.collect_event_batches(max_batch_size=max_batch_size))
+
+        self.assertEquals([2, 2, 1, 1], [len(b.events) for b, _ in batches])
+        self.assertEquals([TELEMETRY_EVENT_PROVIDER_ID, TELEMETRY_EVENT_PROVIDER_ID, TELEMETRY_LOG_PROVIDER_ID, TELEMETRY_EVENT_PROVIDER_ID],
+                          [b.events[0].providerId for b, _ in batches])
+        for batch, _ in batches:
+            self.assertTrue(len("".join([e.to_v1_xml() for e in batch.events])) < max_batch_size, "A batch exceeds the maximum size")
+            self.assertEquals([e.to_v1_xml() for e in batch.events], batch.get_encoded_events())
+
+        # acknowledging one of the batches acknowledges only the events up to it
+        batches[1][1]()
+
+        remaining = event.collect_events().events
+        self.assertEquals([TELEMETRY_LOG_PROVIDER_ID, TELEMETRY_EVENT_PROVIDER_ID], [e.providerId for e in remaining])
+        self.assertEquals('event 4', TestEvent._get_event_message(remaining[1]))
+        self.assertEquals(0, len(event.collect_events().events))
+
+    def test_encode_event_should_produce_the_same_event_as_add_common_event_parameters(self):
+        event_logger = event.__event_logger__
+        parameters = [('Name', 'Test'), ('OperationSuccess', True), ('Message', u'\u05e2 "message"'), ('Duration', 10), ('Value', 1.5)]
+        timestamp = datetime.utcnow()
+
+        expected = TelemetryEvent(TELEMETRY_EVENT_EVENT_ID, TELEMETRY_EVENT_PROVIDER_ID)
+        for name, value in parameters:
+            expected.parameters.append(TelemetryEventParam(name, value))
+        event_logger._add_common_event_parameters(expected, timestamp)
+
+        actual = event_logger._encode_event(TELEMETRY_EVENT_EVENT_ID, TELEMETRY_EVENT_PROVIDER_ID, parameters, timestamp)
+
+        self.assertEqual(get_properties(expected), json.loads(actual))
 
     def test_elapsed_milliseconds(self):
         utc_start = datetime.utcnow() + timedelta(days=1)
@@ -18,6 +18,7 @@
 import json
 import os
 import tempfile
+import threading
 from datetime import datetime, timedelta
 
 from azurelinuxagent.common.event import __event_logger__, add_log_event, MAX_NUMBER_OF_EVENTS, TELEMETRY_LOG_EVENT_ID,\
@@ -215,6 +216,41 @@ class TestLogger(AgentTestCase):
 
             self.assertEqual(ts_with_no_ms, time_in_file, "Timestamps dont match")
 
+    def test_logger_should_not_format_messages_that_no_appender_would_write(self):
+        class NotFormattable(object):
+            def __format__(self, format_spec):
+                raise AssertionError("The message should not have been formatted")
+
+        file_path = os.path.join(self.tmp_dir, "test.log")
+        test_logger = logger.Logger()
+        test_logger.add_appender(logger.AppenderType.FILE, logger.LogLevel.INFO, path=file_path)
+
+        test_logger.verbose("This message should not be formatted: {0}", NotFormattable())
+
+        self.assertFalse(os.path.exists(file_path), "The verbose message should not have been written")
+
+    def test_logger_should_escape_non_ascii_characters_and_use_the_current_thread_name_and_prefix(self):
+        file_path = os.path.join(self.tmp_dir, "test.log")
+        test_logger = logger.Logger()
+        test_logger.add_appender(logger.AppenderType.FILE, logger.LogLevel.INFO, path=file_path)
+
+        test_logger.info(u"Non-ASCII: \u05e2")
+        test_logger.set_prefix("Prefix")
+        test_logger.info("With prefix")
+        with patch("azurelinuxagent.common.logger.currentThread") as mock_current_thread:
+            mock_current_thread.return_value.name = "OtherThread"
+            test_logger.info("From another thread")
+
+        with open(file_path, "r") as log_file:
+            lines = [line.split(' ', 1)[1] for line in log_file.readlines()]
+
+        thread_name = threading.current_thread().name
+        self.assertEqual([
+            "INFO {0} Non-ASCII: \\u05e2\n".format(thread_name),
+            "INFO {0} Prefix With prefix\n".format(thread_name),
+            "INFO OtherThread Prefix From another thread\n"
+        ], lines)
+
     def test_telemetry_logger(self):
         mock = MagicMock()
         appender = logger.TelemetryAppender(logger.LogLevel.WARNING, mock)
@@ -552,6 +588,101 @@ class TestAppender(AgentTestCase):
 
         self.assertEqual(2, mock_add_log_event.call_count)
 
+    def _read_log_file(self, path=None):
+        with open(self.log_file if path is None else path) as logfile:
+            return logfile.readlines()
+
+    def test_buffered_file_appender(self):
+        appender = logger.BufferedFileAppender(logger.LogLevel.INFO, self.log_file)
+        try:
+            with patch("azurelinuxagent.common.logger.BUFFERED_APPENDER_FLUSH_PERIOD", 3600):
+                appender.write(logger.LogLevel.VERBOSE, "test-verbose\n")
+                appender.write(logger.LogLevel.INFO, "test-info\n")
+                appender.write(logger.LogLevel.WARNING, "test-warn\n")
+
+                self.assertEqual(0, len(self._read_log_file()), "The messages should have been buffered")
+
+                appender.write(logger.LogLevel.ERROR, "test-error\n")
+
+                # Levels are honored and errors are flushed immediately
+                self.assertEqual(["test-info\n", "test-warn\n", "test-error\n"], self._read_log_file())
+
+                appender.write(logger.LogLevel.INFO, "test-info-2\n")
+                appender.flush()
+
+                self.assertEqual(["test-info\n", "test-warn\n", "test-error\n", "test-info-2\n"], self._read_log_file())
+        finally:
+            appender.close()
+
+    def test_buffered_file_appender_should_reopen_the_log_file_when_it_is_rotated(self):
+        appender = logger.BufferedFileAppender(logger.LogLevel.INFO, self.log_file)
+        try:
+            appender.write(logger.LogLevel.ERROR, "before-rotation\n")
+            os.rename(self.log_file, self.log_file + ".1")
+
+            appender.write(logger.LogLevel.ERROR, "after-rotation\n")
+
+            self.assertEqual(["before-rotation\n"], self._read_log_file(self.log_file + ".1"))
+            self.assertEqual(["after-rotation\n"], self._read_log_file())
+        finally:
+            appender.close()
+
+    def test_buffered_file_appender_should_write_the_messages_in_order_from_the_writer_thread(self):
+        # use a small queue, so that the caller needs to wait for the writer thread
+        with patch("azurelinuxagent.common.logger.BUFFERED_APPENDER_MAX_QUEUE_SIZE", 4):
+            appender = logger.BufferedFileAppender(logger.LogLevel.INFO, self.log_file, use_writer_thread=True)
+        try:
+            for i in range(100):
+                appender.write(logger.LogLevel.INFO, "test-info-{0}\n".format(i))
+        finally:
+            appender.close()
+
+        self.assertEqual(["test-info-{0}\n".format(i) for i in range(100)], self._read_log_file())
+
+    def _write_reentrant_message(self, appender):
+        # simulates a signal handler that logs while the appender is writing a message on the same thread
+        thread = threading.Thread(target=appender.write, args=(logger.LogLevel.ERROR, "outer\n"))
+        thread.daemon = True
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive(), "The re-entrant write should not block")
+
+    def test_buffered_file_appender_should_not_deadlock_when_it_is_reentered(self):
+        appender = logger.BufferedFileAppender(logger.LogLevel.INFO, self.log_file)
+        original_append = appender._append
+
+        def append(level, msg):
+            if msg == "outer\n":
+                appender.write(logger.LogLevel.INFO, "reentrant\n")
+            original_append(level, msg)
+
+        try:
+            with patch.object(appender, "_append", side_effect=append):
+                self._write_reentrant_message(appender)
+        finally:
+            appender.close()
+
+        self.assertEqual(["reentrant\n", "outer\n"], self._read_log_file())
+
+    def test_buffered_file_appender_should_not_deadlock_when_it_is_reentered_while_queueing_a_message(self):
+        appender = logger.BufferedFileAppender(logger.LogLevel.INFO, self.log_file, use_writer_thread=True)
+        appender.write(logger.LogLevel.INFO, "first\n")
+        original_put = appender._queue.put
+
+        def put(item, *args, **kwargs):
+            if item[1] == "outer\n":
+                appender.write(logger.LogLevel.INFO, "reentrant\n")
+            original_put(item, *args, **kwargs)
+
+        try:
+            with patch.object(appender._queue, "put", side_effect=put):
+                self._write_reentrant_message(appender)
+        finally:
+            appender.close()
+
+        self.assertIn("reentrant\n", self._read_log_file())
+        self.assertIn("outer\n", self._read_log_file())
+
     @patch("azurelinuxagent.common.logger.sys.stdout.write")
     def test_stdout_appender(self, mock_sys_stdout):
         logger.add_logger_appender(logger.AppenderType.STDOUT, logger.LogLevel.ERROR)
@@ -84,3 +84,17 @@ class TestProcessInfo(AgentTestCase):
         # Other exception; _get_proc_cmdline throws exception.
         with self.assertRaises(ProcessInfoException):
             ProcessInfo._get_proc_comm(1000)
+
+    @patch("azurelinuxagent.common.resourceusage.fileutil")
+    def test_get_proc_start_time(self, patch_read_file):
+        # the command name can include spaces and parentheses
+        patch_read_file.read_file.return_value = "1392 (python (x) y) S 1 1392 1392 0 -1 4194560 3522 0 0 0 10 3 0 0 20 0 1 0 1937 19214336 1302 18446744073709551615"
+        self.assertEqual(1937, ProcessInfo.get_proc_start_time(1392))
+
+        patch_read_file.read_file.side_effect = raise_ioerror
+        with self.assertRaises(IOError):
+            ProcessInfo.get_proc_start_time(1392)
+
+        patch_read_file.read_file.side_effect = raise_exception
+        with self.assertRaises(ProcessInfoException):
+            ProcessInfo.get_proc_start_time(1392)
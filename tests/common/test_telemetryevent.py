@@ -14,7 +14,12 @@
 #
 # Requires Python 2.6+ and Openssl 1.0+
 #
+import json
+
+from azurelinuxagent.common.datacontract import get_properties, set_properties
+from azurelinuxagent.common.exception import ProtocolError
 from azurelinuxagent.common.telemetryevent import TelemetryEvent, TelemetryEventParam
+from azurelinuxagent.common.version import AGENT_NAME
 from tests.tools import AgentTestCase
 
 
@@ -46,4 +51,33 @@ class TestTelemetryEvent(AgentTestCase):
         self.assertTrue('ExtensionType' in test_event)
 
         self.assertFalse('GAVersion' in test_event)
-        self.assertFalse('ContainerId' in test_event)
\ No newline at end of file
+        self.assertFalse('ContainerId' in test_event)
+    def test_parameter_lookups_should_find_the_first_parameter_with_the_given_name(self):
+        test_event = get_test_event(name="FirstName", version="1.0")
+        test_event.parameters.append(TelemetryEventParam('Name', 'SecondName'))
+
+        self.assertEqual('FirstName', test_event.find_parameter('Name').value)
+        self.assertEqual('1.0', test_event.get_version())
+        self.assertTrue(test_event.is_extension_event())
+
+        del test_event.parameters[0]
+        self.assertEqual('SecondName', test_event.find_parameter('Name').value)
+
+        test_event.parameters = [TelemetryEventParam('Name', AGENT_NAME)]
+        self.assertFalse(test_event.is_extension_event())
+        self.assertIsNone(test_event.get_version())
+
+    def test_to_json_should_match_get_properties(self):
+        test_event = get_test_event(message=u'\u05e2 "message"', duration=1.5)
+
+        self.assertEqual(get_properties(test_event), json.loads(test_event.to_json()))
+
+    def test_from_json_should_match_set_properties(self):
+        event_json = get_test_event(message=u'\u05e2 "message"', duration=1.5).to_json()
+
+        expected = set_properties("TelemetryEvent", TelemetryEvent(), json.loads(event_json))
+        actual = TelemetryEvent.from_json(event_json)
+
+        self.assertEqual(get_properties(expected), get_properties(actual))
+        self.assertRaises(ValueError, TelemetryEvent.from_json, "<Event/>")
+        self.assertRaises(ProtocolError, TelemetryEvent.from_json, '{"parameters": {}}')
@@ -0,0 +1,119 @@
+# Copyright 2019 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+import os
+
+import azurelinuxagent.common.timingstats as timingstats
+from azurelinuxagent.common.timingstats import TimingRegistry
+from tests.tools import AgentTestCase, patch
+
+
+class TestTimingStats(AgentTestCase):
+    def test_timed_should_record_the_executions_of_an_operation(self):
+        registry = TimingRegistry()
+
+        for _ in range(3):
+            with timingstats.timed("TestOperation", registry=registry):
+                pass
+
+        stats = registry.get_stats()["operations"]["TestOperation"]
+        self.assertEqual(3, stats["count"])
+        self.assertEqual(0, stats["error_count"])
+        self.assertEqual(3, sum(stats["histogram"]))
+        self.assertEqual(None, stats["last_error"])
+
+    def test_timed_should_record_exceptions_as_errors(self):
+        registry = TimingRegistry()
+
+        try:
+            with timingstats.timed("TestOperation", registry=registry):
+                raise ValueError("test error")
+        except ValueError:
+            pass
+        else:
+            self.fail("timed() should not swallow exceptions")
+
+        with timingstats.timed("TestOperation", registry=registry) as timer:
+            timer.error = "HTTP status 500"
+
+        stats = registry.get_stats()["operations"]["TestOperation"]
+        self.assertEqual(2, stats["count"])
+        self.assertEqual(2, stats["error_count"])
+        self.assertEqual("HTTP status 500", stats["last_error"])
+
+    def test_record_should_update_the_histogram(self):
+        registry = TimingRegistry()
+
+        registry.record("TestOperation", 0.001)
+        registry.record("TestOperation", 0.5, cpu_time=0.25)
+        registry.record("TestOperation", 3600)
+
+        stats = registry.get_stats()["operations"]["TestOperation"]
+        self.assertEqual([1, 0, 1, 0, 0, 0, 1], stats["histogram"])
+        self.assertEqual(3600, stats["max_wall_time"])
+        self.assertEqual(0.25, stats["cpu_time"])
+
+    def test_record_should_limit_the_number_of_operations(self):
+        registry = TimingRegistry()
+
+        with patch("azurelinuxagent.common.timingstats.MAX_OPERATIONS", 2):
+            for i in range(3):
+                registry.record("Operation{0}".format(i), 0.1)
+            registry.record("Operation0", 0.1)
+
+        operations = registry.get_stats()["operations"]
+        self.assertEqual(["Operation0", "Operation1"], sorted(operations.keys()))
+        self.assertEqual(2, operations["Operation0"]["count"])
+
+    def test_get_interval_stats_should_return_the_executions_since_the_previous_call(self):
+        registry = TimingRegistry()
+
+        registry.record("Operation1", 1, cpu_time=0.5)
+        registry.record("Operation2", 2, error="test error")
+        interval_stats = registry.get_interval_stats()
+        self.assertEqual({"count": 1, "error_count": 0, "wall_time": 1, "cpu_time": 0.5}, interval_stats["Operation1"])
+        self.assertEqual({"count": 1, "error_count": 1, "wall_time": 2, "cpu_time": 0}, interval_stats["Operation2"])
+
+        registry.record("Operation1", 3, cpu_time=1)
+        interval_stats = registry.get_interval_stats()
+        self.assertEqual(["Operation1"], list(interval_stats.keys()))
+        self.assertEqual({"count": 1, "error_count": 0, "wall_time": 3, "cpu_time": 1}, interval_stats["Operation1"])
+
+        self.assertEqual({}, registry.get_interval_stats())
+
+    def test_save_stats_should_write_the_stats_to_the_given_file(self):
+        registry = TimingRegistry()
+        registry.record("Operation1", 0.5, cpu_time=0.1)
+        registry.record("Operation2", 1.5, error="test error")
+        path = os.path.join(self.tmp_dir, timingstats.TIMING_STATS_FILE_NAME)
+
+        timingstats.save_stats(path, registry=registry)
+
+        self.assertFalse(os.path.exists(path + ".tmp"))
+        stats = timingstats.load_stats(path)
+        self.assertEqual(os.getpid(), stats["pid"])
+        self.assertEqual(registry.get_stats()["operations"], stats["operations"])
+
+        formatted = timingstats.format_stats(stats)
+        lines = formatted.split("\n")
+        self.assertTrue(lines[2].startswith("Operation1"), "The operation with more CPU time should be listed first")
+        self.assertTrue(lines[3].startswith("Operation2"))
+        self.assertTrue("Operation2 [" in formatted and "]: test error" in formatted)
+
+    def test_format_stats_should_handle_empty_stats(self):
+        formatted = timingstats.format_stats(TimingRegistry().get_stats())
+        self.assertTrue("No operations have been recorded" in formatted)
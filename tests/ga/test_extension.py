@@ -16,7 +16,10 @@
 #
 
 import os.path
+import shutil
 import subprocess
+import threading
+import time
 import unittest
 
 from datetime import timedelta
@@ -29,7 +32,7 @@ from tests.protocol import mockwiredata
 from tests.tools import are_cgroups_enabled, AgentTestCase, data_dir, i_am_root, MagicMock, Mock, \
     skip_if_predicate_false, patch, is_trusty_in_travis, skip_if_predicate_true
 
-from azurelinuxagent.common.exception import ResourceGoneError
+from azurelinuxagent.common.exception import ResourceGoneError, ExtensionError
 from azurelinuxagent.common.protocol.restapi import Extension, ExtHandlerProperties
 from azurelinuxagent.ga.exthandlers import *
 from azurelinuxagent.common.protocol.wire import WireProtocol, InVMArtifactsProfile
@@ -1128,6 +1131,22 @@ class TestExtension(ExtensionTestCase):
         ExtHandlerInstance.get_ext_handling_status = MagicMock(return_value=status)
         self.assertFalse(self._helper_wait_for_handler_successful_completion(exthandlers_handler))
 
+    def test_wait_for_handler_successful_completion_should_return_as_soon_as_the_status_is_successful(self, *args):
+        test_data = mockwiredata.WireProtocolData(mockwiredata.DATA_FILE)
+        exthandlers_handler, protocol = self._create_mock(test_data, *args)
+
+        exthandler = ExtHandler(name="Handler")
+        exthandler.properties.extensions.append(Extension(name="Handler"))
+        wait_until = datetime.datetime.utcnow() + datetime.timedelta(seconds=60)
+
+        with patch.object(ExtHandlerInstance, "get_ext_handling_status", side_effect=["transitioning", "transitioning", "success"]):
+            start = time.time()
+            completed = exthandlers_handler.wait_for_handler_successful_completion(exthandler, wait_until)
+            elapsed = time.time() - start
+
+        self.assertTrue(completed, "The handler should have completed successfully")
+        self.assertTrue(elapsed < 5, "The wait should have ended when the status changed; it took {0}s".format(elapsed))
+
     def test_get_ext_handling_status(self, *args):
         '''
         Testing get_ext_handling_status() function with various cases and
@@ -1275,6 +1294,20 @@ class TestExtension(ExtensionTestCase):
             ext_handler_instance.decide_version()
             self.assertEqual(expected_version, ext_handler.properties.version)
 
+    def test_decide_version_should_not_modify_the_manifest(self, *args):
+        _, protocol = self._create_mock(mockwiredata.WireProtocolData(mockwiredata.DATA_FILE), *args)
+        ext_handlers, _ = protocol.get_ext_handlers()
+        ext_handler = ext_handlers.extHandlers[0]
+
+        # the manifest may be shared by handlers processed concurrently
+        pkg_list = protocol.get_ext_handler_pkgs(ext_handler)
+        versions = list(pkg_list.versions)
+
+        ExtHandlerInstance(ext_handler, protocol).decide_version()
+
+        self.assertIs(pkg_list, protocol.get_ext_handler_pkgs(ext_handler))
+        self.assertEqual(versions, pkg_list.versions)
+
     @patch('azurelinuxagent.common.conf.get_extensions_enabled', return_value=False)
     def test_extensions_disabled(self, _, *args):
         # test status is reported for no extensions
@@ -1807,9 +1840,11 @@ class TestExtension(ExtensionTestCase):
                 "The enable command call should have Uninstall Failed in env variable")
 
             # Initiating another run which shouldn't have any failed env variables in it if no failures
-            # Updating Incarnation
+            # Updating Incarnation (and discarding the fingerprint of the handler, since unchanged handlers are not
+            # processed again)
             test_data.set_incarnation(3)
             protocol.update_goal_state()
+            exthandlers_handler.fingerprints.remove("OSTCExtensions.ExampleHandlerLinux")
 
             exthandlers_handler.run()
             _, new_enable_kwargs = patch_start_cmd.call_args
@@ -1843,6 +1878,91 @@ class TestExtension(ExtensionTestCase):
 
         self._assert_handler_status(protocol.report_vm_status, "Ready", expected_ext_count=1, version="1.0.0")
 
+    def test_unchanged_handlers_should_not_be_processed_on_a_new_incarnation(self, *args):
+        test_data = mockwiredata.WireProtocolData(mockwiredata.DATA_FILE_EXT_SINGLE)
+        exthandlers_handler, protocol = self._create_mock(test_data, *args)
+        exthandlers_handler.run()
+        self._assert_handler_status(protocol.report_vm_status, "Ready", expected_ext_count=1, version="1.0.0")
+
+        # a new incarnation that does not change the handler (e.g. a certificate rotation)
+        test_data.set_incarnation(2)
+        protocol.update_goal_state()
+
+        with patch.object(CGroupConfigurator.get_instance(), "start_extension_command") as patch_start_cmd:
+            exthandlers_handler.run()
+
+        self.assertEqual(0, patch_start_cmd.call_count, "No extension commands should have been executed")
+        self._assert_handler_status(protocol.report_vm_status, "Ready", expected_ext_count=1, version="1.0.0")
+
+        # a new incarnation that changes the sequence number
+        test_data.set_incarnation(3)
+        test_data.set_extensions_config_sequence_number(1)
+        protocol.update_goal_state()
+
+        with patch.object(CGroupConfigurator.get_instance(), "start_extension_command") as patch_start_cmd:
+            exthandlers_handler.run()
+
+        self.assertTrue(any("-enable" in kwargs['command'] for _, kwargs in patch_start_cmd.call_args_list),
+                        "The handler should have been enabled")
+
+    def test_handlers_should_be_enabled_after_a_restart_of_the_agent(self, *args):
+        test_data = mockwiredata.WireProtocolData(mockwiredata.DATA_FILE_EXT_SINGLE)
+        exthandlers_handler, protocol = self._create_mock(test_data, *args)
+        exthandlers_handler.run()
+
+        # a new instance of the handler, e.g. after a restart of the agent
+        exthandlers_handler, protocol = self._create_mock(test_data, *args)
+        with patch.object(CGroupConfigurator.get_instance(), "start_extension_command") as patch_start_cmd:
+            exthandlers_handler.run()
+        self.assertTrue(any("-enable" in kwargs['command'] for _, kwargs in patch_start_cmd.call_args_list),
+                        "The handler should have been enabled")
+
+    def test_unchanged_handlers_should_be_processed_when_they_are_no_longer_installed(self, *args):
+        test_data = mockwiredata.WireProtocolData(mockwiredata.DATA_FILE_EXT_SINGLE)
+        exthandlers_handler, protocol = self._create_mock(test_data, *args)
+        exthandlers_handler.run()
+
+        shutil.rmtree(os.path.join(self.tmp_dir, "OSTCExtensions.ExampleHandlerLinux-1.0.0"))
+        test_data.set_incarnation(2)
+        protocol.update_goal_state()
+        with patch.object(CGroupConfigurator.get_instance(), "start_extension_command") as patch_start_cmd:
+            exthandlers_handler.run()
+        self.assertTrue(any("-enable" in kwargs['command'] for _, kwargs in patch_start_cmd.call_args_list),
+                        "The handler should have been enabled")
+
+    def test_unchanged_handlers_should_be_processed_when_a_newer_version_is_selected(self, *args):
+        test_data = mockwiredata.WireProtocolData(mockwiredata.DATA_FILE_EXT_SINGLE)
+        exthandlers_handler, protocol = self._create_mock(test_data, *args)
+        exthandlers_handler.run()
+
+        # the configuration of the handler does not change, but a newer version is selected from its manifest
+        def decide_version(ext_handler_i, target_state=None):
+            ext_handler_i.ext_handler.properties.version = "1.0.1"
+            return Mock()
+
+        test_data.set_incarnation(2)
+        protocol.update_goal_state()
+        with patch.object(ExtHandlerInstance, "decide_version", autospec=True, side_effect=decide_version):
+            with patch.object(ExtHandlersHandler, "handle_enable") as mock_handle_enable:
+                exthandlers_handler.run()
+
+        self.assertEqual(1, mock_handle_enable.call_count, "The handler should have been upgraded")
+
+    def test_handler_fingerprints_should_not_be_saved_when_processing_fails(self, *args):
+        test_data = mockwiredata.WireProtocolData(mockwiredata.DATA_FILE_EXT_SINGLE)
+        exthandlers_handler, protocol = self._create_mock(test_data, *args)
+
+        with patch("azurelinuxagent.ga.exthandlers.ExtHandlerInstance.enable", side_effect=ExtensionError("enable failed")):
+            exthandlers_handler.run()
+
+        test_data.set_incarnation(2)
+        protocol.update_goal_state()
+        with patch.object(CGroupConfigurator.get_instance(), "start_extension_command") as patch_start_cmd:
+            exthandlers_handler.run()
+
+        self.assertTrue(any("-enable" in kwargs['command'] for _, kwargs in patch_start_cmd.call_args_list),
+                        "The handler should have been enabled")
+
     @patch("azurelinuxagent.common.cgroupconfigurator.handle_process_completion", side_effect="Process Successful")
     def test_ext_sequence_no_should_be_set_for_every_command_call(self, _, *args):
         test_data = mockwiredata.WireProtocolData(mockwiredata.DATA_FILE_MULTIPLE_EXT)
@@ -2058,7 +2178,8 @@ class TestExtensionSequencing(AgentTestCase):
         Tests extension sequencing among multiple extensions with dependencies.
         This test introduces failure in all possible levels and extensions.
         Verifies that the sequencing is in the expected order and a failure in one extension
-        skips the rest of the extensions in the sequence.
+        skips the extensions in the following dependency levels (the extensions in the same level are
+        processed independently of each other).
         '''
         exthandlers_handler = self._create_mock(*args)
 
@@ -2069,33 +2190,49 @@ class TestExtensionSequencing(AgentTestCase):
         expected_sequence = ["D", "E", "F", "G", "B", "C", "A"]
         self._run_test(extensions_to_be_failed, expected_sequence, exthandlers_handler)
 
-        extensions_to_be_failed = ["D"]
-        expected_sequence = ["D"]
-        self._run_test(extensions_to_be_failed, expected_sequence, exthandlers_handler)
+        for failed_extension in ["D", "E", "F", "G"]:
+            extensions_to_be_failed = [failed_extension]
+            expected_sequence = ["D", "E", "F", "G"]
+            self._run_test(extensions_to_be_failed, expected_sequence, exthandlers_handler)
 
-        extensions_to_be_failed = ["E"]
-        expected_sequence = ["D", "E"]
-        self._run_test(extensions_to_be_failed, expected_sequence, exthandlers_handler)
+        for failed_extension in ["B", "C"]:
+            extensions_to_be_failed = [failed_extension]
+            expected_sequence = ["D", "E", "F", "G", "B", "C"]
+            self._run_test(extensions_to_be_failed, expected_sequence, exthandlers_handler)
 
-        extensions_to_be_failed = ["F"]
-        expected_sequence = ["D", "E", "F"]
+        extensions_to_be_failed = ["A"]
+        expected_sequence = ["D", "E", "F", "G", "B", "C", "A"]
         self._run_test(extensions_to_be_failed, expected_sequence, exthandlers_handler)
 
-        extensions_to_be_failed = ["G"]
-        expected_sequence = ["D", "E", "F", "G"]
-        self._run_test(extensions_to_be_failed, expected_sequence, exthandlers_handler)
+    def test_handle_ext_handlers_should_process_the_handlers_of_each_level_concurrently(self, *args):
+        exthandlers_handler = self._create_mock(*args)
+        self._set_dependency_levels([("A", 2), ("B", 1), ("C", 1), ("D", 1), ("E", 2)], exthandlers_handler)
 
-        extensions_to_be_failed = ["B"]
-        expected_sequence = ["D", "E", "F", "G", "B"]
-        self._run_test(extensions_to_be_failed, expected_sequence, exthandlers_handler)
+        lock = threading.Lock()
+        events = []
+        threads = set()
 
-        extensions_to_be_failed = ["C"]
-        expected_sequence = ["D", "E", "F", "G", "B", "C"]
-        self._run_test(extensions_to_be_failed, expected_sequence, exthandlers_handler)
+        def handle_ext_handler(ext_handler, _):
+            with lock:
+                events.append(("start", ext_handler.name))
+                threads.add(threading.current_thread().name)
+            time.sleep(0.05)
+            with lock:
+                events.append(("end", ext_handler.name))
 
-        extensions_to_be_failed = ["A"]
-        expected_sequence = ["D", "E", "F", "G", "B", "C", "A"]
-        self._run_test(extensions_to_be_failed, expected_sequence, exthandlers_handler)
+        ExtHandlerInstance.get_ext_handling_status = MagicMock(return_value="success")
+        exthandlers_handler.handle_ext_handler = MagicMock(side_effect=handle_ext_handler)
+
+        with patch("azurelinuxagent.common.conf.get_extensions_max_parallel_handlers", return_value=2):
+            exthandlers_handler.run()
+
+        self.assertEqual(5, exthandlers_handler.handle_ext_handler.call_count)
+        self.assertTrue(len(threads) > 1, "The handlers were not processed concurrently: {0}".format(threads))
+
+        # all the handlers of level 1 must complete before any handler of level 2 starts
+        first_level_2_start = min(events.index(("start", name)) for name in ["A", "E"])
+        last_level_1_end = max(events.index(("end", name)) for name in ["B", "C", "D"])
+        self.assertTrue(last_level_1_end < first_level_2_start, "The dependency levels were not honored: {0}".format(events))
 
     def test_handle_ext_handlers_with_uninstallation(self, *args):
         '''
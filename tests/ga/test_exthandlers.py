@@ -24,6 +24,7 @@ from azurelinuxagent.common.protocol.util import ProtocolUtil
 
 from azurelinuxagent.common.cgroupconfigurator import CGroupConfigurator
 from azurelinuxagent.common.event import WALAEventOperation, AGENT_EVENT_FILE_EXTENSION
+from azurelinuxagent.common.utils.spoolutil import SEGMENT_FILE_EXTENSION
 from azurelinuxagent.common.exception import ProtocolError, ExtensionError, ExtensionErrorCodes
 from azurelinuxagent.common.protocol.restapi import ExtensionStatus, Extension, ExtHandler, ExtHandlerProperties
 from azurelinuxagent.common.utils.extensionprocessutil import TELEMETRY_MESSAGE_MAX_LEN, format_stdout_stderr, \
@@ -219,6 +220,31 @@ class TestExtHandlers(AgentTestCase):
                                               disk_sequence_number=3,
                                               expected_sequence_number=-1)
 
+    def test_get_largest_seq_no_should_scan_the_config_directory_only_when_it_changes(self):
+        ext_handler_props = ExtHandlerProperties()
+        ext_handler_props.version = "1.2.3"
+        ext_handler = ExtHandler(name='foo')
+        ext_handler.properties = ext_handler_props
+        instance = ExtHandlerInstance(ext_handler=ext_handler, protocol=None)
+
+        conf_dir = instance.get_conf_dir()
+        os.makedirs(conf_dir)
+        for seq_no in [0, 1, 2]:
+            with open(os.path.join(conf_dir, "{0}.settings".format(seq_no)), "w") as settings_file:
+                settings_file.write("{}")
+        os.utime(conf_dir, (time.time() - 10, time.time() - 10))
+
+        with patch("azurelinuxagent.ga.exthandlers.os.listdir", wraps=os.listdir) as patch_listdir:
+            self.assertEqual(2, instance.get_largest_seq_no())
+            self.assertEqual(2, instance.get_largest_seq_no())
+            self.assertEqual(1, patch_listdir.call_count, "The config directory should have been scanned only once")
+
+            with open(os.path.join(conf_dir, "3.settings"), "w") as settings_file:
+                settings_file.write("{}")
+
+            self.assertEqual(3, instance.get_largest_seq_no())
+            self.assertEqual(2, patch_listdir.call_count, "The config directory should have been scanned again after it changed")
+
     @patch("azurelinuxagent.ga.exthandlers.add_event")
     @patch("azurelinuxagent.common.errorstate.ErrorState.is_triggered")
     def test_it_should_report_an_error_if_the_wireserver_cannot_be_reached(self, patch_is_triggered, patch_add_event):
@@ -312,7 +338,7 @@ sys.stderr.write("{1}")
 
         def list_directory():
             base_dir = self.ext_handler_instance.get_base_dir()
-            return [i for i in os.listdir(base_dir) if not i.endswith(AGENT_EVENT_FILE_EXTENSION)] # ignore telemetry files
+            return [i for i in os.listdir(base_dir) if not i.endswith(AGENT_EVENT_FILE_EXTENSION) and not i.endswith(SEGMENT_FILE_EXTENSION)] # ignore telemetry files
 
         files_before = list_directory()
 
@@ -5,7 +5,7 @@ import zipfile, time, os
 
 from azurelinuxagent.common.protocol.restapi import ExtHandler, ExtHandlerProperties, ExtHandlerPackage, ExtHandlerVersionUri
 from azurelinuxagent.common.protocol.wire import WireProtocol
-from azurelinuxagent.ga.exthandlers import ExtHandlerInstance, NUMBER_OF_DOWNLOAD_RETRIES
+from azurelinuxagent.ga.exthandlers import ExtHandlerInstance, NUMBER_OF_DOWNLOAD_RETRIES, NUMBER_OF_CONCURRENT_DOWNLOADS
 from azurelinuxagent.common.exception import ExtensionDownloadError, ExtensionErrorCodes
 from tests.tools import AgentTestCase, patch
 
@@ -96,7 +96,7 @@ class DownloadExtensionTestCase(AgentTestCase):
         self.assertTrue(os.path.exists(self._get_extension_command_file()), "The extension package was not expanded to the expected location")
 
     def test_it_should_download_and_expand_extension_package(self):
-        def download_ext_handler_pkg(_uri, destination):
+        def download_ext_handler_pkg(_uri, destination, **_):
             DownloadExtensionTestCase._create_zip_file(destination)
             return True
 
@@ -104,8 +104,8 @@ class DownloadExtensionTestCase(AgentTestCase):
             with patch("azurelinuxagent.ga.exthandlers.ExtHandlerInstance.report_event") as mock_report_event:
                 self.ext_handler_instance.download()
 
-        # first download attempt should succeed
-        mock_download_ext_handler_pkg.assert_called_once()
+        # first download attempt should succeed (the first uris are downloaded concurrently)
+        self.assertEquals(mock_download_ext_handler_pkg.call_count, NUMBER_OF_CONCURRENT_DOWNLOADS)
         mock_report_event.assert_called_once()
 
         self._assert_download_and_expand_succeeded()
@@ -123,7 +123,7 @@ class DownloadExtensionTestCase(AgentTestCase):
         self.assertTrue(os.path.exists(self._get_extension_command_file()), "The extension package was not expanded to the expected location")
 
     def test_it_should_ignore_existing_extension_package_when_it_is_invalid(self):
-        def download_ext_handler_pkg(_uri, destination):
+        def download_ext_handler_pkg(_uri, destination, **_):
             DownloadExtensionTestCase._create_zip_file(destination)
             return True
 
@@ -132,14 +132,14 @@ class DownloadExtensionTestCase(AgentTestCase):
         with patch("azurelinuxagent.common.protocol.wire.WireProtocol.download_ext_handler_pkg", side_effect=download_ext_handler_pkg) as mock_download_ext_handler_pkg:
             self.ext_handler_instance.download()
 
-        mock_download_ext_handler_pkg.assert_called_once()
+        self.assertEquals(mock_download_ext_handler_pkg.call_count, NUMBER_OF_CONCURRENT_DOWNLOADS)
 
         self._assert_download_and_expand_succeeded()
 
     def test_it_should_use_alternate_uris_when_download_fails(self):
         self.download_failures = 0
 
-        def download_ext_handler_pkg(_uri, destination):
+        def download_ext_handler_pkg(_uri, destination, **_):
             # fail a few times, then succeed
             if self.download_failures < 3:
                 self.download_failures += 1
@@ -157,7 +157,7 @@ class DownloadExtensionTestCase(AgentTestCase):
     def test_it_should_use_alternate_uris_when_download_raises_an_exception(self):
         self.download_failures = 0
 
-        def download_ext_handler_pkg(_uri, destination):
+        def download_ext_handler_pkg(_uri, destination, **_):
             # fail a few times, then succeed
             if self.download_failures < 3:
                 self.download_failures += 1
@@ -175,7 +175,7 @@ class DownloadExtensionTestCase(AgentTestCase):
     def test_it_should_use_alternate_uris_when_it_downloads_an_invalid_package(self):
         self.download_failures = 0
 
-        def download_ext_handler_pkg(_uri, destination):
+        def download_ext_handler_pkg(_uri, destination, **_):
             # fail a few times, then succeed
             if self.download_failures < 3:
                 self.download_failures += 1
@@ -191,9 +191,56 @@ class DownloadExtensionTestCase(AgentTestCase):
 
         self._assert_download_and_expand_succeeded()
 
+    def test_it_should_use_the_first_package_downloaded_and_cancel_the_other_downloads(self):
+        slow_download_cancelled = []
+
+        def download_ext_handler_pkg(uri, destination, cancel=None, **_):
+            if uri == self.pkg.uris[0].uri:
+                DownloadExtensionTestCase._create_zip_file(destination)
+                return True
+            # the other download completes only when it is cancelled
+            slow_download_cancelled.append(cancel.wait(5))
+            return False
+
+        self.pkg.uris = self.pkg.uris[0:2]
+
+        with patch("azurelinuxagent.common.protocol.wire.WireProtocol.download_ext_handler_pkg", side_effect=download_ext_handler_pkg) as mock_download_ext_handler_pkg:
+            self.ext_handler_instance.download()
+
+        self.assertEquals(mock_download_ext_handler_pkg.call_count, 2)
+        self.assertEquals(slow_download_cancelled, [True], "The slower download should have been cancelled")
+
+        self._assert_download_and_expand_succeeded()
+
+    def test_it_should_resume_partial_downloads_and_remove_them_when_done(self):
+        partial_files = []
+
+        def download_ext_handler_pkg(_uri, destination, resume=False, **_):
+            self.assertTrue(resume, "The download should be resumable")
+            if not os.path.exists(destination):
+                # first attempt: leave a partial download
+                with open(destination, "w") as partial_file:
+                    partial_file.write("partial")
+                partial_files.append(destination)
+                return False
+            DownloadExtensionTestCase._create_zip_file(destination)
+            return True
+
+        self.pkg.uris = self.pkg.uris[0:1]
+
+        with patch("time.sleep", lambda *_: None):
+            with patch("azurelinuxagent.common.protocol.wire.WireProtocol.download_ext_handler_pkg", side_effect=download_ext_handler_pkg) as mock_download_ext_handler_pkg:
+                self.ext_handler_instance.download()
+
+        self.assertEquals(mock_download_ext_handler_pkg.call_count, 2)
+        self.assertEquals(len(partial_files), 1)
+        self.assertFalse(os.path.exists(partial_files[0]), "The partial download was not removed")
+
+        self._assert_download_and_expand_succeeded()
+
     def test_it_should_raise_an_exception_when_all_downloads_fail(self):
-        def download_ext_handler_pkg(_uri, _destination):
-            DownloadExtensionTestCase._create_invalid_zip_file(self._get_extension_package_file())
+        def download_ext_handler_pkg(_uri, destination, **_):
+            DownloadExtensionTestCase._create_invalid_zip_file(destination)
             return True
 
         with patch("time.sleep", lambda *_: None):
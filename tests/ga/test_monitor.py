@@ -19,20 +19,22 @@ import json
 import os
 import platform
 import random
+import re
 import string
 import tempfile
+import threading
 import time
 from datetime import timedelta
 
 from azurelinuxagent.common.protocol.util import ProtocolUtil, get_protocol_util
 from nose.plugins.attrib import attr
 
-from azurelinuxagent.common import event, logger
+from azurelinuxagent.common import event, logger, timingstats
 from azurelinuxagent.common.cgroup import CGroup, CpuCgroup, MemoryCgroup
 from azurelinuxagent.common.cgroupstelemetry import CGroupsTelemetry, MetricValue
 from azurelinuxagent.common.datacontract import get_properties
 from azurelinuxagent.common.event import WALAEventOperation, EVENTS_DIRECTORY
-from azurelinuxagent.common.exception import HttpError
+from azurelinuxagent.common.exception import HttpError, ThrottlingError
 from azurelinuxagent.common.logger import Logger
 from azurelinuxagent.common.osutil import get_osutil
 from azurelinuxagent.common.protocol.wire import WireProtocol
@@ -99,6 +101,8 @@ class TestMonitor(AgentTestCase):
         MonitorHandler.EVENT_COLLECTION_PERIOD = timedelta(milliseconds=100)
         MonitorHandler.HOST_PLUGIN_HEARTBEAT_PERIOD = timedelta(milliseconds=100)
         MonitorHandler.IMDS_HEARTBEAT_PERIOD = timedelta(milliseconds=100)
+        MonitorHandler.CGROUP_TELEMETRY_POLLING_PERIOD = timedelta(milliseconds=100)
+        MonitorHandler.CGROUP_TELEMETRY_REPORTING_PERIOD = timedelta(milliseconds=100)
 
         self.assertEqual(0, patch_hostplugin_heartbeat.call_count)
         self.assertEqual(0, patch_send_events.call_count)
@@ -199,10 +203,113 @@ class TestMonitor(AgentTestCase):
 
             monitor_handler.stop()
 
+    @patch("azurelinuxagent.ga.monitor.MonitorHandler.send_telemetry_metrics")
+    @patch("azurelinuxagent.ga.monitor.MonitorHandler.poll_telemetry_metrics")
+    @patch("azurelinuxagent.ga.monitor.MonitorHandler.collect_and_send_events")
+    def test_monitor_tasks_should_run_independently_of_each_other(self, patch_collect_and_send_events, *args):
+        monitor_handler = get_monitor_handler()
+
+        MonitorHandler.EVENT_COLLECTION_PERIOD = timedelta(milliseconds=100)
+        MonitorHandler.HOST_PLUGIN_UPDATE_PERIOD = timedelta(minutes=1)
+
+        with patch.object(monitor_handler, 'protocol') as mock_protocol:
+            # a failure to refresh the host plugin should not prevent the events from being sent
+            mock_protocol.update_host_plugin_from_goal_state.side_effect = Exception("test error")
+
+            monitor_handler.start()
+            time.sleep(0.5)
+
+            start_time = time.time()
+            monitor_handler.stop()
+            self.assertLess(time.time() - start_time, 1, "stop() should not wait for the next task")
+
+        self.assertEqual(1, mock_protocol.update_host_plugin_from_goal_state.call_count)
+        self.assertGreaterEqual(patch_collect_and_send_events.call_count, 4)
+
+        statistics = dict((s["name"], s) for s in monitor_handler.scheduler.get_statistics())
+        self.assertEqual(1, statistics["UpdateHostPlugin"]["failure_count"])
+        self.assertEqual(patch_collect_and_send_events.call_count, statistics["CollectAndSendEvents"]["run_count"])
+
+    @patch("azurelinuxagent.ga.monitor.MonitorHandler.send_telemetry_metrics")
+    @patch("azurelinuxagent.ga.monitor.MonitorHandler.poll_telemetry_metrics")
+    @patch("azurelinuxagent.ga.monitor.MonitorHandler.send_host_plugin_heartbeat")
+    @patch("azurelinuxagent.ga.monitor.MonitorHandler.collect_and_send_events")
+    def test_slow_heartbeats_should_not_delay_the_collection_of_events(self, patch_collect_and_send_events, *args):
+        monitor_handler = get_monitor_handler()
+
+        MonitorHandler.EVENT_COLLECTION_PERIOD = timedelta(milliseconds=100)
+        MonitorHandler.IMDS_HEARTBEAT_PERIOD = timedelta(milliseconds=100)
+
+        imds_responded = threading.Event()
+
+        # the heartbeat takes much longer than the period of the event collection
+        with patch("azurelinuxagent.ga.monitor.MonitorHandler.send_imds_heartbeat", side_effect=lambda: imds_responded.wait(10)) as patch_imds_heartbeat:
+            with patch.object(monitor_handler, 'protocol'):
+                monitor_handler.start()
+                try:
+                    time.sleep(0.55)
+                    self.assertTrue(monitor_handler.is_alive())
+                    self.assertEqual(1, patch_imds_heartbeat.call_count)
+                    self.assertGreaterEqual(patch_collect_and_send_events.call_count, 5, "The events should be collected on their own period")
+                finally:
+                    imds_responded.set()
+                    monitor_handler.stop()
+
+        self.assertNotEqual(monitor_handler.event_thread.ident, monitor_handler.health_thread.ident)
+        self.assertIn("CollectAndSendEvents", [s["name"] for s in monitor_handler.scheduler.get_statistics()])
+        self.assertIn("ImdsHeartbeat", [s["name"] for s in monitor_handler.health_scheduler.get_statistics()])
+
+    @patch("azurelinuxagent.ga.monitor.report_metric")
+    def test_send_timing_stats_should_report_the_operations_executed_since_the_previous_report(self, patch_report_metric, *args):
+        monitor_handler = get_monitor_handler()
+        registry = timingstats.TimingRegistry()
+        registry.record("Operation1", 1.5, cpu_time=0.5)
+        registry.record("Operation2", 2, error="test error")
+
+        with patch("azurelinuxagent.ga.monitor.timingstats.get_interval_stats", side_effect=registry.get_interval_stats):
+            monitor_handler.send_timing_stats()
+
+            metrics = sorted(c[0] for c in patch_report_metric.call_args_list)
+            self.assertEqual([
+                ("Agent Timing", "CPU Time", "Operation1", 0.5),
+                ("Agent Timing", "CPU Time", "Operation2", 0),
+                ("Agent Timing", "Count", "Operation1", 1),
+                ("Agent Timing", "Count", "Operation2", 1),
+                ("Agent Timing", "Error Count", "Operation2", 1),
+                ("Agent Timing", "Wall Time", "Operation1", 1.5),
+                ("Agent Timing", "Wall Time", "Operation2", 2)], metrics)
+
+            patch_report_metric.reset_mock()
+            monitor_handler.send_timing_stats()
+            self.assertEqual(0, patch_report_metric.call_count)
+
+    def test_cgroup_metrics_should_be_polled_and_reported_one_period_after_the_thread_starts(self, *args):
+        monitor_handler = get_monitor_handler()
+        MonitorHandler.CGROUP_TELEMETRY_POLLING_PERIOD = timedelta(minutes=5)
+        MonitorHandler.CGROUP_TELEMETRY_REPORTING_PERIOD = timedelta(minutes=30)
+
+        tasks = dict((t.name, t) for t in monitor_handler._create_scheduler()._tasks)
+
+        self.assertEqual(5 * 60, tasks["PollTelemetryMetrics"].initial_delay)
+        self.assertEqual(30 * 60, tasks["SendTelemetryMetrics"].initial_delay)
+        self.assertEqual(0, tasks["CollectAndSendEvents"].initial_delay)
+
+    @patch("azurelinuxagent.ga.monitor.timingstats.save_stats")
+    def test_monitor_tasks_should_record_their_timing_stats(self, patch_save_stats, *args):
+        monitor_handler = get_monitor_handler()
+        scheduler = monitor_handler._create_scheduler()
+        task = [t for t in scheduler._tasks if t.name == "SaveTimingStats"][0]
+
+        with patch("azurelinuxagent.ga.monitor.timingstats.timed") as mock_timed:
+            task._run()
+
+        self.assertEqual("Monitor.SaveTimingStats", mock_timed.call_args[0][0])
+        self.assertEqual(os.path.join(self.tmp_dir, "waagent_timing_stats.json"), patch_save_stats.call_args[0][0])
+
     @patch("azurelinuxagent.common.protocol.healthservice.HealthService.report_host_plugin_heartbeat")
     def test_heartbeat_creates_signal(self, patch_report_heartbeat, *args):
         monitor_handler = get_monitor_handler()
-        monitor_handler.init_protocols()
+        monitor_handler.init_health_protocols()
         monitor_handler.last_host_plugin_heartbeat = datetime.datetime.utcnow() - timedelta(hours=1)
         monitor_handler.send_host_plugin_heartbeat()
         self.assertEqual(1, patch_report_heartbeat.call_count)
@@ -213,7 +320,7 @@ class TestMonitor(AgentTestCase):
     @patch("azurelinuxagent.common.protocol.healthservice.HealthService.report_host_plugin_heartbeat")
     def test_failed_heartbeat_creates_telemetry(self, patch_report_heartbeat, _, *args):
         monitor_handler = get_monitor_handler()
-        monitor_handler.init_protocols()
+        monitor_handler.init_health_protocols()
         monitor_handler.last_host_plugin_heartbeat = datetime.datetime.utcnow() - timedelta(hours=1)
         monitor_handler.send_host_plugin_heartbeat()
         self.assertEqual(1, patch_report_heartbeat.call_count)
@@ -433,6 +540,37 @@ class TestEventMonitoring(AgentTestCase):
             # The send_event call should never be called as the events are larger than 2**16.
             self.assertEqual(0, patch_send_event.call_count)
 
+    @patch("azurelinuxagent.common.conf.get_lib_dir")
+    def test_collect_and_send_events_should_not_send_the_same_events_twice_when_wireserver_throttles_the_agent(self, mock_lib_dir, *_):
+        mock_lib_dir.return_value = self.lib_dir
+
+        with mock_wire_protocol(DATA_FILE) as protocol:
+            monitor_handler = TestEventMonitoring._create_monitor_handler(protocol)
+
+            for _ in range(8):
+                self._create_extension_event(2 ** 14)
+
+            sent = []
+
+            def send_event(_, event_str):
+                if len(sent) == 1:
+                    raise ThrottlingError("Throttled")
+                sent.append(event_str)
+
+            with patch("azurelinuxagent.common.protocol.wire.WireClient.send_event", side_effect=send_event):
+                with patch("azurelinuxagent.common.logger.warn"):
+                    monitor_handler.collect_and_send_events()
+                self.assertEqual(1, len(sent), "Only the first batch should have been sent")
+                self.assertTrue(len(os.listdir(self.event_dir)) > 0, "The events that were not sent should have been kept")
+
+                sent.append("")  # the following requests succeed
+                monitor_handler.collect_and_send_events()
+
+            self.assertEqual(0, len(os.listdir(self.event_dir)))
+            messages = re.findall(r'<Param Name="Message" Value="([^"]*)"', "".join(sent))
+            self.assertEqual(8, len(messages))
+            self.assertEqual(8, len(set(messages)), "Each event should have been sent once")
+
     @patch("azurelinuxagent.common.conf.get_lib_dir")
     def test_collect_and_send_with_http_post_returning_503(self, mock_lib_dir, *_):
         mock_lib_dir.return_value = self.lib_dir
@@ -454,10 +592,14 @@ class TestEventMonitoring(AgentTestCase):
                         response="")
                     monitor_handler.collect_and_send_events()
                     self.assertEqual(1, mock_warn.call_count)
-                    self.assertEqual("[ProtocolError] [Wireserver Exception] [ProtocolError] [Wireserver Failed] "
+                    self.assertEqual("[ThrottlingError] [Wireserver Failed] "
                                      "URI http://{0}/machine?comp=telemetrydata  [HTTP Failed] Status Code 503".format(protocol.get_endpoint()),
                                      mock_warn.call_args[0][1])
-                    self.assertEqual(0, len(os.listdir(self.event_dir)))
+                    self.assertEqual(3, len(os.listdir(self.event_dir)), "The events should be kept until WireServer accepts them")
+
+            monitor_handler.last_event_collection = None
+            monitor_handler.collect_and_send_events()
+            self.assertEqual(0, len(os.listdir(self.event_dir)), "The events should have been sent on the next collection")
 
     @patch("azurelinuxagent.common.conf.get_lib_dir")
     def test_collect_and_send_with_send_event_generating_exception(self, mock_lib_dir, *args):
@@ -734,7 +876,7 @@ class TestMonitorFailure(AgentTestCase):
         protocol = WireProtocol('endpoint')
         protocol.update_goal_state = MagicMock()
         with patch('azurelinuxagent.common.protocol.util.ProtocolUtil.get_protocol', return_value=protocol):
-            monitor_handler.init_protocols()
+            monitor_handler.init_health_protocols()
             monitor_handler.last_host_plugin_heartbeat = datetime.datetime.utcnow() - timedelta(hours=1)
 
             patch_http_get.side_effect = IOError('client error')
@@ -502,6 +502,51 @@ class TestGuestAgent(UpdateTestCase):
 
         self.assertTrue(os.path.isfile(agent.get_agent_pkg_path()))
 
+    @patch("azurelinuxagent.ga.update.GuestAgent._ensure_downloaded")
+    @patch("azurelinuxagent.ga.update.GuestAgent._ensure_loaded")
+    @patch("azurelinuxagent.ga.update.restutil.http_get")
+    def test_download_should_stream_the_package_to_disk(self, mock_http_get, mock_loaded, mock_downloaded):
+        self.remove_agents()
+
+        agent_pkg = load_bin_data(os.path.join("ga", get_agent_file_name()))
+        response = ResponseMock(response=agent_pkg, headers={"Content-Length": str(len(agent_pkg))})
+        mock_http_get.return_value = response
+
+        pkg = ExtHandlerPackage(version=str(get_agent_version()))
+        pkg.uris.append(ExtHandlerPackageUri())
+        agent = GuestAgent(pkg=pkg)
+
+        with patch("azurelinuxagent.common.utils.restutil.RESPONSE_CHUNK_SIZE", 1024):
+            with patch.object(response, "read", wraps=response.read) as mock_read:
+                agent._download()
+
+        self.assertTrue(all(len(args) > 0 for args, _ in mock_read.call_args_list), "The package should have been read in chunks")
+        with open(agent.get_agent_pkg_path(), "rb") as package_file:
+            self.assertEqual(agent_pkg, package_file.read())
+        self.assertFalse(os.path.exists(agent.get_agent_pkg_path() + ".tmp"), "The temporary file was not removed")
+
+    @patch("azurelinuxagent.ga.update.GuestAgent._ensure_downloaded")
+    @patch("azurelinuxagent.ga.update.GuestAgent._ensure_loaded")
+    @patch("azurelinuxagent.ga.update.restutil.http_get")
+    def test_download_should_reject_incomplete_and_corrupt_packages(self, mock_http_get, mock_loaded, mock_downloaded):
+        self.remove_agents()
+
+        agent_pkg = load_bin_data(os.path.join("ga", get_agent_file_name()))
+        corrupt_pkg = agent_pkg[:len(agent_pkg) // 2] + b'\0' * 64 + agent_pkg[len(agent_pkg) // 2 + 64:]
+
+        pkg = ExtHandlerPackage(version=str(get_agent_version()))
+        pkg.uris.append(ExtHandlerPackageUri())
+        agent = GuestAgent(pkg=pkg)
+
+        for response in [
+                ResponseMock(response=agent_pkg[:-1024], headers={"Content-Length": str(len(agent_pkg))}),
+                ResponseMock(response=corrupt_pkg)]:
+            mock_http_get.return_value = response
+
+            self.assertRaises(UpdateError, agent._download)
+            self.assertFalse(os.path.isfile(agent.get_agent_pkg_path()))
+            self.assertFalse(os.path.exists(agent.get_agent_pkg_path() + ".tmp"), "The temporary file was not removed")
+
     @patch("azurelinuxagent.ga.update.GuestAgent._ensure_downloaded")
     @patch("azurelinuxagent.ga.update.GuestAgent._ensure_loaded")
     @patch("azurelinuxagent.ga.update.restutil.http_get")
@@ -1644,8 +1689,9 @@ class MonitorThreadTest(AgentTestCase):
             if ProtocolUtil.__name__ in inst:
                 singleton_instances[inst] = ProtocolUtil._instances[inst]
 
-        self.assertEqual(3, len(singleton_instances))
+        self.assertEqual(4, len(singleton_instances))
         self.assertIn("ProtocolUtil__MonitorHandler", singleton_instances)
+        self.assertIn("ProtocolUtil__MonitorHealth", singleton_instances)
         self.assertIn("ProtocolUtil__EnvHandler", singleton_instances)
         self.assertIn("ProtocolUtil__ExtHandler", singleton_instances)
 
@@ -1722,14 +1768,24 @@ class ProtocolMock(object):
 
 
 class ResponseMock(Mock):
-    def __init__(self, status=restutil.httpclient.OK, response=None, reason=None):
+    def __init__(self, status=restutil.httpclient.OK, response=None, reason=None, headers=None):
         Mock.__init__(self)
         self.status = status
         self.reason = reason
         self.response = response
-
-    def read(self):
-        return self.response
+        self.headers = headers if headers is not None else {}
+        self._offset = 0
+
+    def read(self, size=None):
+        if size is None or self.response is None:
+            return self.response
+        # reads of a given size consume the response, like the reads of a stream
+        data = self.response[self._offset:self._offset + size]
+        self._offset += len(data)
+        return data
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
 
 
 class TimeMock(Mock):
@@ -16,6 +16,7 @@
 #
 
 import re
+from io import BytesIO
 
 from tests.tools import load_bin_data, load_data, MagicMock, Mock
 from azurelinuxagent.common.exception import HttpError, ResourceGoneError
@@ -191,7 +192,9 @@ class WireProtocolData(object):
             elif "ExampleHandlerLinux" in url:
                 content = self.ext
                 self.call_counts["ExampleHandlerLinux"] += 1
-                resp.read = Mock(return_value=content)
+                # the package is streamed to disk, so reads need to consume the content
+                resp.read = BytesIO(content).read
+                resp.getheader = lambda name, default=None: str(len(content)) if name == "Content-Length" else default
                 return resp
             else:
                 raise Exception("Bad url {0}".format(url))
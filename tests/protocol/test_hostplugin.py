@@ -536,6 +536,82 @@ class TestHostPlugin(AgentTestCase):
                         test_goal_state,
                         exp_method, exp_url, exp_data)
 
+    def test_build_status_data_should_match_the_json_encoding_of_the_envelope(self):
+        host_client = wire.HostPluginProtocol(wireserver_url, "container_id", "role_config")
+        blob_headers = {"Content-Length": "512", "x-ms-blob-type": "PageBlob"}
+        content = bytearray(faux_status.ljust(512), encoding='utf-8')
+
+        expected = json.dumps(self._hostplugin_data(blob_headers, content), sort_keys=True)
+
+        self.assertEqual(expected, host_client._build_status_data(sas_url, blob_headers, content))
+        self.assertEqual(expected, host_client._build_status_data(sas_url, blob_headers, memoryview(bytes(content))))
+        self.assertEqual(json.dumps(self._hostplugin_data(blob_headers), sort_keys=True),
+                         host_client._build_status_data(sas_url, blob_headers))
+
+    def test_base64_encode_should_not_require_memoryview_on_python_2(self):
+        host_client = wire.HostPluginProtocol(wireserver_url, "container_id", "role_config")
+
+        # memoryview does not exist on Python 2.6
+        with patch("azurelinuxagent.common.protocol.hostplugin.PY_VERSION_MAJOR", 2):
+            with patch("azurelinuxagent.common.protocol.hostplugin.memoryview", None, create=True):
+                self.assertEqual(base64.b64encode(b"status"), host_client._base64_encode(bytearray(b"status")))
+
+    def test_put_page_blob_status_should_send_the_status_in_aligned_pages(self):
+        with mock_wire_protocol(DATA_FILE) as protocol:
+            test_goal_state = protocol.client._goal_state
+            host_client = wire.HostPluginProtocol(wireserver_url,
+                                                  test_goal_state.container_id,
+                                                  test_goal_state.role_config_name)
+
+            status_blob = protocol.client.status_blob
+            status_blob.data = u"\u00e9" * (hostplugin.MAXIMUM_PAGEBLOB_PAGE_SIZE // 2 + 100)
+            status_blob.type = page_blob_type
+            status_blob.vm_status = restapi.VMStatus(message="Ready", status="Ready")
+
+            status = status_blob.data.encode('utf-8')
+            status_size = int((len(status) + 511) / 512) * 512
+            status += b' ' * (status_size - len(status))
+
+            with patch.object(restutil, "http_request", return_value=MockResponse('', httpclient.OK)) as patch_http:
+                with patch.object(wire.HostPluginProtocol, "get_api_versions", return_value=api_versions):
+                    host_client.put_vm_status(status_blob, sas_url)
+
+            page_requests = [json.loads(args[0][2]) for args in patch_http.call_args_list if args[0][1] == hostplugin_status_url][1:]
+            self.assertEqual(2, len(page_requests), "Expected the status to be sent in 2 pages")
+
+            sent = b''.join(base64.b64decode(r['content']) for r in page_requests)
+            self.assertEqual(status, sent)
+            self.assertEqual(hostplugin.MAXIMUM_PAGEBLOB_PAGE_SIZE, len(base64.b64decode(page_requests[0]['content'])))
+            self.assertEqual(0, len(base64.b64decode(page_requests[1]['content'])) % 512)
+
+    def test_put_page_blob_status_should_create_the_blob_only_when_its_size_changes(self):
+        with mock_wire_protocol(DATA_FILE) as protocol:
+            test_goal_state = protocol.client._goal_state
+            host_client = wire.HostPluginProtocol(wireserver_url,
+                                                  test_goal_state.container_id,
+                                                  test_goal_state.role_config_name)
+
+            status_blob = protocol.client.status_blob
+            status_blob.type = page_blob_type
+            status_blob.vm_status = restapi.VMStatus(message="Ready", status="Ready")
+
+            def put_status(data, response_status=httpclient.OK):
+                status_blob.data = data
+                with patch.object(restutil, "http_request", return_value=MockResponse('', response_status)) as patch_http:
+                    with patch.object(wire.HostPluginProtocol, "get_api_versions", return_value=api_versions):
+                        try:
+                            host_client.put_vm_status(status_blob, sas_url)
+                        except HttpError:
+                            pass
+                requests = [json.loads(args[0][2]) for args in patch_http.call_args_list if args[0][1] == hostplugin_status_url]
+                return len([r for r in requests if 'content' not in r])
+
+            self.assertEqual(1, put_status(faux_status), "The first upload should create the blob")
+            self.assertEqual(0, put_status(faux_status.replace('data', 'DATA')), "An upload of the same size should not create the blob")
+            self.assertEqual(1, put_status(faux_status * 100), "An upload of a different size should create the blob")
+            self.assertEqual(0, put_status(faux_status * 100, httpclient.INTERNAL_SERVER_ERROR), "An upload of the same size should not create the blob")
+            self.assertEqual(1, put_status(faux_status * 100), "The blob should be created after a failed upload")
+
     def test_validate_get_extension_artifacts(self):
         with mock_wire_protocol(DATA_FILE) as protocol:
             test_goal_state = protocol.client._goal_state
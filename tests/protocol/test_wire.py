@@ -18,19 +18,25 @@
 
 import json
 import os
+import threading
 import time
 import unittest
 import uuid
 import contextlib
 
+import azurelinuxagent.common.conf as conf
 from azurelinuxagent.common.exception import InvalidContainerError, ResourceGoneError, ProtocolError, \
-    ExtensionDownloadError, HttpError
+    ExtensionDownloadError, HttpError, ThrottlingError
 from azurelinuxagent.common.future import httpclient
+from azurelinuxagent.common.protocol import wire
 from azurelinuxagent.common.protocol.hostplugin import HostPluginProtocol
-from azurelinuxagent.common.protocol.goal_state import ExtensionsConfig
+from azurelinuxagent.common.protocol.goal_state import ExtensionsConfig, GoalState
+from azurelinuxagent.common.protocol.restapi import ExtHandlerStatus, ExtensionStatus
 from azurelinuxagent.common.protocol.wire import WireProtocol, WireClient, \
     InVMArtifactsProfile, VMAgentManifestUri, StatusBlob, VMStatus, ExtHandlerVersionUri, DataContractList, socket
-from azurelinuxagent.common.telemetryevent import TelemetryEvent, TelemetryEventParam, TelemetryEventList
+from azurelinuxagent.common.datacontract import get_properties
+from azurelinuxagent.common.telemetryevent import TelemetryEvent, TelemetryEventParam, TelemetryEventList, \
+    TelemetryEventEncoder
 from azurelinuxagent.common.utils import restutil
 from azurelinuxagent.common.version import CURRENT_VERSION, DISTRO_NAME, DISTRO_VERSION
 from tests.ga.test_monitor import random_generator
@@ -38,7 +44,7 @@ from tests.protocol import mockwiredata
 from tests.protocol.mocks import mock_wire_protocol, mock_http_request
 from tests.protocol.mockwiredata import DATA_FILE_NO_EXT
 from tests.protocol.mockwiredata import WireProtocolData
-from tests.tools import ANY, MagicMock, Mock, patch, AgentTestCase, skip_if_predicate_true
+from tests.tools import ANY, MagicMock, Mock, patch, AgentTestCase, skip_if_predicate_true, load_data
 
 data_with_bom = b'\xef\xbb\xbfhehe'
 testurl = 'http://foo'
@@ -203,6 +209,14 @@ class TestWireProtocol(AgentTestCase):
                              'sig=hfRh7gzUE7sUtYwke78IOlZOrTRCYvkec4hGZ9zZzXo')
             self.assertEqual(protocol.client.get_ext_conf().status_upload_blob_type, u'BlockBlob')
 
+    def test_ext_conf_parsing_should_match_each_plugin_with_its_settings(self, *args):
+        ext_conf = ExtensionsConfig(load_data("wire/ext_conf_sequencing.xml"))
+
+        handlers = dict((h.name, h) for h in ext_conf.ext_handlers.extHandlers)
+        self.assertEqual(2, len(handlers))
+        self.assertEqual(2, handlers["OSTCExtensions.ExampleHandlerLinux"].properties.extensions[0].dependencyLevel)
+        self.assertEqual(1, handlers["OSTCExtensions.OtherExampleHandlerLinux"].properties.extensions[0].dependencyLevel)
+
     def test_get_host_ga_plugin(self, *args):
         with mock_wire_protocol(mockwiredata.DATA_FILE) as protocol:
             host_plugin = protocol.client.get_host_plugin()
@@ -252,6 +266,81 @@ class TestWireProtocol(AgentTestCase):
                     patch_prepare.assert_called_once_with("BlockBlob")
                     patch_default_upload.assert_called_once_with(testurl)
 
+    @staticmethod
+    def _create_vm_status_with_extension(status_blob):
+        vm_status = VMStatus(message="Ready", status="Ready")
+        handler_status = ExtHandlerStatus(name="OSTCExtensions.ExampleHandlerLinux", version="1.0.0", status="Ready")
+        handler_status.extensions.append("OSTCExtensions.ExampleHandlerLinux")
+        vm_status.vmAgent.extensionHandlers.append(handler_status)
+        status_blob.set_vm_status(vm_status)
+        status_blob.set_ext_status("OSTCExtensions.ExampleHandlerLinux",
+                                   ExtensionStatus(operation="Enable", status="success", seq_no=0, message="Enabled"))
+
+    def test_upload_status_blob_should_skip_the_upload_when_the_status_has_not_changed(self, *_):
+        with mock_wire_protocol(mockwiredata.DATA_FILE) as protocol:
+            def handler(url, *_, **__):
+                if protocol.get_endpoint() in url and url.endswith('/status'):
+                    return MockResponse(body=b'', status_code=200)
+                return None
+
+            with mock_http_request(http_put_handler=handler) as http_request:
+                TestWireProtocol._create_vm_status_with_extension(protocol.client.status_blob)
+
+                with patch("azurelinuxagent.common.protocol.wire.time.gmtime", return_value=time.gmtime(0)):
+                    protocol.client.upload_status_blob()
+                with patch("azurelinuxagent.common.protocol.wire.time.gmtime", return_value=time.gmtime(60)):
+                    protocol.client.upload_status_blob()
+                self.assertEqual(1, len(http_request.get_tracked_urls()), "The unchanged status should not have been uploaded again")
+
+                protocol.client.status_blob.vm_status = VMStatus(message="Not ready", status="NotReady")
+                protocol.client.upload_status_blob()
+                self.assertEqual(2, len(http_request.get_tracked_urls()), "The new status should have been uploaded")
+
+                with patch("azurelinuxagent.common.conf.get_extensions_status_heartbeat_period", return_value=0):
+                    protocol.client.upload_status_blob()
+                self.assertEqual(3, len(http_request.get_tracked_urls()), "The status should have been uploaded after the heartbeat period")
+
+    def test_status_blob_data_should_include_the_timestamp_but_the_digest_should_not(self, *_):
+        with create_mock_protocol(status_upload_blob=testurl, status_upload_blob_type=testtype) as protocol:
+            status_blob = protocol.client.status_blob
+            status_blob.vm_status = VMStatus(message="Ready", status="Ready")
+
+            with patch("azurelinuxagent.common.protocol.wire.time.gmtime", return_value=time.gmtime(0)):
+                status_blob.prepare("BlockBlob")
+            data, digest = status_blob.data, status_blob.digest
+
+            with patch("azurelinuxagent.common.protocol.wire.time.gmtime", return_value=time.gmtime(3600)):
+                status_blob.prepare("BlockBlob")
+
+            self.assertEqual(digest, status_blob.digest)
+            self.assertEqual("1970-01-01T00:00:00Z", json.loads(data)["timestampUTC"])
+            self.assertEqual("1970-01-01T01:00:00Z", json.loads(status_blob.data)["timestampUTC"])
+            self.assertEqual(json.loads(status_blob.to_json())["aggregateStatus"], json.loads(status_blob.data)["aggregateStatus"])
+
+    def test_status_blob_digest_should_not_include_the_timestamps_of_the_extension_statuses(self, *_):
+        status_blob = StatusBlob(None)
+        TestWireProtocol._create_vm_status_with_extension(status_blob)
+
+        with patch("azurelinuxagent.common.protocol.wire.time.gmtime", return_value=time.gmtime(0)):
+            status_blob.prepare("BlockBlob")
+        data, digest = status_blob.data, status_blob.digest
+
+        with patch("azurelinuxagent.common.protocol.wire.time.gmtime", return_value=time.gmtime(3600)):
+            status_blob.prepare("BlockBlob")
+
+        self.assertEqual(digest, status_blob.digest)
+        for status_data, timestamp in [(data, "1970-01-01T00:00:00Z"), (status_blob.data, "1970-01-01T01:00:00Z")]:
+            status = json.loads(status_data)
+            self.assertEqual(timestamp, status["timestampUTC"])
+            settings_status = status["aggregateStatus"]["handlerAggregateStatus"][0]["runtimeSettingsStatus"]["settingsStatus"]
+            self.assertEqual(timestamp, settings_status["timestampUTC"])
+            self.assertEqual("Enabled", settings_status["status"]["formattedMessage"]["message"])
+
+        status_blob.set_ext_status("OSTCExtensions.ExampleHandlerLinux",
+                                   ExtensionStatus(operation="Enable", status="error", seq_no=0, message="Failed"))
+        status_blob.prepare("BlockBlob")
+        self.assertNotEqual(digest, status_blob.digest, "The digest should change when the status changes")
+
     def test_upload_status_blob_reports_prepare_error(self, *_):
         with create_mock_protocol(status_upload_blob=testurl, status_upload_blob_type=testtype) as protocol:
             protocol.client.status_blob.vm_status = VMStatus(message="Ready", status="Ready")
@@ -434,6 +523,15 @@ class TestWireProtocol(AgentTestCase):
         # the body is not encoded, just check for equality
         self.assertIn(event_str, body_received)
 
+    @patch("azurelinuxagent.common.utils.restutil.http_request")
+    def test_send_event_should_raise_throttling_error_when_wireserver_throttles_the_request(self, mock_http_request, *args):
+        mock_http_request.return_value = MockResponse("", restutil.httpclient.SERVICE_UNAVAILABLE)
+
+        client = WireProtocol(WIRESERVER_URL).client
+        with patch("azurelinuxagent.common.utils.restutil.time.sleep"):
+            with self.assertRaises(ThrottlingError):
+                client.send_event("foo", u'a test string')
+
     @patch("azurelinuxagent.common.protocol.wire.WireClient.send_event")
     def test_report_event_small_event(self, patch_send_event, *args):
         event_list = TelemetryEventList()
@@ -470,6 +568,47 @@ class TestWireProtocol(AgentTestCase):
         # It merges the messages into one message
         self.assertEqual(patch_send_event.call_count, 2)
 
+    def test_event_encoder_should_produce_the_same_xml_as_event_to_v1(self, *args):
+        encoder = TelemetryEventEncoder()
+        events = [get_event(message='message with special characters: &<>"\'\n\t', duration=1.5, name=u'\u05e2'),
+                  get_event(message=random_generator(1000), is_success=False),
+                  get_event(message='message with special characters: &<>"\'\n\t', duration=1.5, name=u'\u05e2')]
+        events[1].parameters.append(TelemetryEventParam('Unknown', None))
+
+        for event in events:
+            self.assertEqual(wire.event_to_v1(event), encoder.encode(event))
+
+    @patch("azurelinuxagent.common.protocol.wire.WireClient.send_event")
+    def test_report_event_should_send_the_events_in_order(self, patch_send_event, *args):
+        event_list = TelemetryEventList()
+        for i in range(200):
+            event_list.events.append(get_event(message="{0} {1}".format(i, random_generator(1000))))
+        client = WireProtocol(WIRESERVER_URL).client
+
+        client.report_event(event_list)
+
+        self.assertTrue(patch_send_event.call_count > 1, "The events should have been sent in multiple batches")
+        sent = "".join([call[0][1] for call in patch_send_event.call_args_list])
+        self.assertEqual("".join([wire.event_to_v1(e) for e in event_list.events]), sent)
+        for call in patch_send_event.call_args_list:
+            self.assertTrue(len(call[0][1]) < wire.MAX_EVENT_BUFFER_SIZE, "A batch exceeds the maximum buffer size")
+
+    @patch("azurelinuxagent.common.protocol.wire.WireClient.send_event")
+    def test_report_event_should_not_encode_the_events_again_when_they_are_already_encoded(self, patch_send_event, *args):
+        event_list = TelemetryEventList()
+        event_list.events.append(get_event(message="event 1"))
+        event_list.events.append(get_event(message="event 2"))
+        event_list.set_encoded_events(["<encoded-1/>", "<encoded-2/>"])
+        client = WireProtocol(WIRESERVER_URL).client
+
+        with patch("azurelinuxagent.common.protocol.wire.TelemetryEventEncoder.encode") as mock_encode:
+            client.report_event(event_list)
+
+        self.assertEqual(0, mock_encode.call_count)
+        self.assertEqual(1, patch_send_event.call_count)
+        self.assertEqual("<encoded-1/><encoded-2/>", patch_send_event.call_args[0][1])
+        self.assertNotIn("_encoded_events", get_properties(event_list))
+
     @patch("azurelinuxagent.common.protocol.wire.WireClient.send_event")
     def test_report_event_large_event(self, patch_send_event, *args):
         event_list = TelemetryEventList()
@@ -600,6 +739,80 @@ class TestWireClient(AgentTestCase):
                 self.assertTrue(os.path.exists(target_file), 'The extension package was not downloaded')
                 self.assertEquals(HostPluginProtocol.is_default_channel(), True, "The host channel should have been set as the default")
 
+    def test_stream_should_resume_a_partial_download(self):
+        extension_url = 'https://fake_host/fake_extension.zip'
+        target_file = os.path.join(self.tmp_dir, 'fake_extension.zip')
+        with open(target_file, "wb") as partial_file:
+            partial_file.write(b'0123')
+
+        with mock_wire_protocol(mockwiredata.DATA_FILE) as protocol:
+            request_headers = []
+
+            def handler(url, *_, **kwargs):
+                if url == extension_url:
+                    request_headers.append(kwargs.get('headers'))
+                    return MockResponse(body=b'456789', status_code=httpclient.PARTIAL_CONTENT, headers={'Content-Range': 'bytes 4-9/10'})
+                return None
+
+            with mock_http_request(http_get_handler=handler):
+                success = protocol.client.stream(extension_url, target_file, resume=True)
+
+            self.assertTrue(success, 'The download should have succeeded')
+            self.assertEquals([{'Range': 'bytes=4-'}], request_headers)
+            with open(target_file, "rb") as downloaded_file:
+                self.assertEquals(b'0123456789', downloaded_file.read())
+
+    def test_stream_should_download_the_entire_content_when_the_server_does_not_support_ranges(self):
+        extension_url = 'https://fake_host/fake_extension.zip'
+        target_file = os.path.join(self.tmp_dir, 'fake_extension.zip')
+        with open(target_file, "wb") as partial_file:
+            partial_file.write(b'0123')
+
+        with mock_wire_protocol(mockwiredata.DATA_FILE) as protocol:
+            def handler(url, *_, **__):
+                if url == extension_url:
+                    return MockResponse(body=b'0123456789', status_code=200, headers={'Content-Length': '10'})
+                return None
+
+            with mock_http_request(http_get_handler=handler):
+                success = protocol.client.stream(extension_url, target_file, resume=True)
+
+            self.assertTrue(success, 'The download should have succeeded')
+            with open(target_file, "rb") as downloaded_file:
+                self.assertEquals(b'0123456789', downloaded_file.read())
+
+    def test_stream_should_fail_and_keep_the_partial_file_when_the_download_is_incomplete(self):
+        extension_url = 'https://fake_host/fake_extension.zip'
+        target_file = os.path.join(self.tmp_dir, 'fake_extension.zip')
+
+        with mock_wire_protocol(mockwiredata.DATA_FILE) as protocol:
+            def handler(url, *_, **__):
+                if url == extension_url:
+                    return MockResponse(body=b'01234', status_code=200, headers={'Content-Length': '10'})
+                return None
+
+            with mock_http_request(http_get_handler=handler):
+                success = protocol.client.stream(extension_url, target_file, resume=True)
+
+            self.assertFalse(success, 'The download should have failed')
+            with open(target_file, "rb") as downloaded_file:
+                self.assertEquals(b'01234', downloaded_file.read())
+
+    def test_stream_should_fail_when_the_request_fails(self):
+        extension_url = 'https://fake_host/fake_extension.zip'
+        target_file = os.path.join(self.tmp_dir, 'fake_extension.zip')
+
+        with mock_wire_protocol(mockwiredata.DATA_FILE) as protocol:
+            def handler(url, *_, **__):
+                if url == extension_url:
+                    return MockResponse(body=b'Not found', status_code=httpclient.NOT_FOUND)
+                return None
+
+            with mock_http_request(http_get_handler=handler):
+                success = protocol.client.stream(extension_url, target_file)
+
+            self.assertFalse(success, 'The download should have failed')
+
     def test_download_ext_handler_pkg_should_not_change_default_channel_when_all_channels_fail(self):
         extension_url = 'https://fake_host/fake_extension.zip'
 
@@ -631,6 +844,36 @@ class TestWireClient(AgentTestCase):
                 self.assertTrue(urls[3].endswith('/extensionArtifact'), "The third attempt should have been over the host channel")
                 self.assertEquals(HostPluginProtocol.is_default_channel(), False, "The host channel should not have been set as the default")
 
+    def test_download_ext_handler_pkg_should_not_use_host_channel_when_the_download_is_cancelled(self):
+        extension_url = 'https://fake_host/fake_extension.zip'
+        target_file = os.path.join(self.tmp_dir, 'fake_extension.zip')
+        cancel = threading.Event()
+
+        with mock_wire_protocol(mockwiredata.DATA_FILE) as protocol:
+            def handler(url, *_, **kwargs):
+                if url == extension_url:
+                    # e.g. a concurrent download of the same package completed
+                    cancel.set()
+                    return HttpError("Exception to fake an error on the direct channel")
+                if TestWireClient._is_extension_artifact_host_request(extension_url, url, **kwargs):
+                    self.fail('The host channel should not have been used')
+                return None
+
+            with mock_http_request(http_get_handler=handler) as http_request:
+                HostPluginProtocol.set_default_channel(False)
+
+                success = protocol.download_ext_handler_pkg(extension_url, target_file, cancel=cancel)
+
+                urls = http_request.get_tracked_urls()
+                self.assertEquals(success, False, 'The download should have been cancelled')
+                self.assertEquals(len(urls), 1, "Unexpected number of HTTP requests: [{0}]".format(urls))
+                self.assertEquals(HostPluginProtocol.is_default_channel(), False, "The host channel should not have been set as the default")
+
+                # a download that is already cancelled does not issue any requests
+                success = protocol.download_ext_handler_pkg(extension_url, target_file, cancel=cancel)
+                self.assertEquals(success, False, 'The download should have been cancelled')
+                self.assertEquals(len(http_request.get_tracked_urls()), 1, "No requests should have been issued")
+
     def test_fetch_manifest_should_not_invoke_host_channel_when_direct_channel_succeeds(self):
         manifest_url = 'https://fake_host/fake_manifest.xml'
         manifest_xml = '<?xml version="1.0" encoding="utf-8"?><PluginVersionManifest/>'
@@ -1093,13 +1336,279 @@ class UpdateHostPluginFromGoalStateTestCase(AgentTestCase):
                 self.assertEqual(protocol.client.get_shared_conf().xml_text, shared_conf_xml_text)
 
 
+class ConditionalGoalStateFetchTestCase(AgentTestCase):
+    """
+    Tests for the conditional requests (ETag/Last-Modified) used to fetch the goal state
+    """
+
+    def test_fetch_config_if_modified_should_send_the_validators_of_the_previous_response(self):
+        with mock_wire_protocol(mockwiredata.DATA_FILE) as protocol:
+            uri = "http://{0}/machine/?comp=goalstate".format(WIRESERVER_URL)
+            goal_state = protocol.mock_wire_data.goal_state
+            request_headers = []
+
+            def http_get_handler(url, *_, **kwargs):
+                if "goalstate" in url:
+                    headers = kwargs.get("headers", {})
+                    request_headers.append(headers)
+                    if headers.get(wire.IF_NONE_MATCH_HEADER) == '"etag-1"':
+                        return MockResponse(b"", httpclient.NOT_MODIFIED)
+                    return MockResponse(goal_state.encode("utf-8"), httpclient.OK,
+                                        headers={"ETag": '"etag-1"', "Last-Modified": "Mon, 01 Jun 2020 00:00:00 GMT"})
+                return None
+
+            with mock_http_request(http_get_handler=http_get_handler):
+                xml_text, modified = protocol.client.fetch_config_if_modified(uri, protocol.client.get_header())
+                self.assertEqual(goal_state, xml_text)
+                self.assertTrue(modified)
+                self.assertNotIn(wire.IF_NONE_MATCH_HEADER, request_headers[0])
+
+                xml_text, modified = protocol.client.fetch_config_if_modified(uri, protocol.client.get_header())
+                self.assertEqual(goal_state, xml_text)
+                self.assertFalse(modified)
+                self.assertEqual('"etag-1"', request_headers[1][wire.IF_NONE_MATCH_HEADER])
+                self.assertEqual("Mon, 01 Jun 2020 00:00:00 GMT", request_headers[1][wire.IF_MODIFIED_SINCE_HEADER])
+
+    def test_fetch_config_if_modified_should_read_the_not_modified_response(self):
+        client = WireClient(WIRESERVER_URL)
+        uri = "http://{0}/machine/?comp=goalstate".format(WIRESERVER_URL)
+        responses = [MockResponse(b"<GoalState/>", httpclient.OK, headers={"ETag": '"etag-1"'}),
+                     MockResponse(b"", httpclient.NOT_MODIFIED)]
+        responses[1].read = Mock(return_value=b"")
+
+        with patch.object(client, "call_wireserver", side_effect=responses):
+            client.fetch_config_if_modified(uri, None)
+            xml_text, modified = client.fetch_config_if_modified(uri, None)
+
+        self.assertEqual("<GoalState/>", xml_text)
+        self.assertFalse(modified)
+        self.assertEqual(1, responses[1].read.call_count)
+
+    def test_update_host_plugin_should_reuse_the_goal_state_when_it_is_not_modified(self):
+        with mock_wire_protocol(mockwiredata.DATA_FILE) as protocol:
+            goal_state = protocol.client.get_goal_state()
+
+            with patch("azurelinuxagent.common.protocol.goal_state.GoalState._parse") as mock_parse:
+                protocol.client.update_host_plugin_from_goal_state()
+                protocol.client.update_goal_state()
+
+            self.assertEqual(0, mock_parse.call_count)
+            self.assertIs(goal_state, protocol.client.get_goal_state())
+
+    def test_get_host_plugin_should_create_a_single_host_plugin_for_concurrent_callers(self):
+        with mock_wire_protocol(mockwiredata.DATA_FILE) as protocol:
+            protocol.client._host_plugin = None
+            host_plugins = []
+
+            def get_host_plugin():
+                host_plugins.append(protocol.client.get_host_plugin())
+
+            threads = [threading.Thread(target=get_host_plugin) for _ in range(5)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+            self.assertEqual(5, len(host_plugins))
+            self.assertTrue(all(h is host_plugins[0] for h in host_plugins), "All the callers should get the same host plugin")
+
+    def test_update_goal_state_should_reuse_a_goal_state_fetched_by_another_thread(self):
+        with mock_wire_protocol(mockwiredata.DATA_FILE) as protocol:
+            other_client = WireClient(WIRESERVER_URL)
+            other_client.update_goal_state()
+
+            protocol.mock_wire_data.set_incarnation("2")
+            protocol.client.update_goal_state()
+
+            call_counts = protocol.mock_wire_data.call_counts.copy()
+            other_client.update_goal_state()
+
+            self.assertIs(protocol.client.get_goal_state(), other_client.get_goal_state())
+            self.assertEqual("2", other_client.get_goal_state().incarnation)
+            for document in ["hostingenvuri", "sharedconfiguri", "certificatesuri", "extensionsconfiguri"]:
+                self.assertEqual(call_counts[document], protocol.mock_wire_data.call_counts[document], document)
+
+    def test_update_goal_state_should_reuse_the_nested_components_that_did_not_change(self):
+        with mock_wire_protocol(mockwiredata.DATA_FILE) as protocol:
+            hosting_env = protocol.client.get_hosting_env()
+            certs = protocol.client.get_certs()
+            ext_conf = protocol.client.get_ext_conf()
+
+            protocol.mock_wire_data.set_incarnation("2")
+            protocol.mock_wire_data.set_shared_config_deployment_name(str(uuid.uuid4()))
+            protocol.client.update_goal_state()
+
+            self.assertIs(hosting_env, protocol.client.get_hosting_env())
+            self.assertIs(certs, protocol.client.get_certs())
+            self.assertEqual(protocol.mock_wire_data.shared_config, protocol.client.get_shared_conf().xml_text)
+            # the extensions config is always parsed again
+            self.assertIsNot(ext_conf, protocol.client.get_ext_conf())
+
+
+
+class ConcurrentGoalStateFetchTestCase(AgentTestCase):
+    """
+    Tests for the concurrent fetch of the nested documents of the goal state
+    """
+
+    def test_update_goal_state_should_fetch_the_nested_documents_concurrently(self):
+        with mock_wire_protocol(mockwiredata.DATA_FILE) as protocol:
+            threads = set()
+            original_fetch = GoalState._fetch
+
+            def fetch(*args):
+                threads.add(threading.current_thread().name)
+                time.sleep(0.05)  # give the other workers a chance to pick up the remaining documents
+                return original_fetch(*args)
+
+            protocol.mock_wire_data.set_incarnation("2")
+            with patch("azurelinuxagent.common.protocol.goal_state.GoalState._fetch", side_effect=fetch):
+                protocol.client.update_goal_state()
+
+            self.assertEqual("2", protocol.client.get_goal_state().incarnation)
+            self.assertTrue(len(threads) > 1, "The nested documents were not fetched concurrently: {0}".format(threads))
+            self.assertTrue(all(t.startswith("FetchGoalState-") for t in threads), "Unexpected threads: {0}".format(threads))
+            self.assertIsNotNone(protocol.client.get_hosting_env())
+            self.assertIsNotNone(protocol.client.get_shared_conf())
+            self.assertIsNotNone(protocol.client.get_certs())
+            self.assertIsNotNone(protocol.client.get_ext_conf())
+
+    def test_update_goal_state_should_fail_when_any_of_the_nested_documents_cannot_be_fetched(self):
+        with mock_wire_protocol(mockwiredata.DATA_FILE) as protocol:
+            goal_state = protocol.client.get_goal_state()
+
+            def http_get_handler(url, *_, **__):
+                if "extensionsconfiguri" in url:
+                    return MockResponse(b"", httpclient.INTERNAL_SERVER_ERROR)
+                return None
+
+            protocol.mock_wire_data.set_incarnation("2")
+            with mock_http_request(http_get_handler=http_get_handler):
+                with patch("azurelinuxagent.common.utils.restutil.time.sleep"):
+                    with patch("azurelinuxagent.common.protocol.goal_state.logger.warn") as mock_warn:
+                        with self.assertRaises(ProtocolError):
+                            protocol.client.update_goal_state()
+
+            self.assertIs(goal_state, protocol.client.get_goal_state())
+            self.assertTrue(any("Fetching the goal state failed" in args[0] for args, _ in mock_warn.call_args_list),
+                            "The failure was not logged")
+
+
+
+class ExtensionManifestCacheTestCase(AgentTestCase):
+    """
+    Tests for the cache of extension manifests used by WireClient.get_ext_manifest
+    """
+
+    def test_set_should_remove_the_entries_that_were_not_refreshed_for_several_periods(self):
+        cache = wire._ExtensionManifestCache
+        stale_key = ("http://foo/stale_manifest.xml",)
+        recent_key = ("http://foo/recent_manifest.xml",)
+        current_key = ("http://foo/current_manifest.xml",)
+        max_age = wire.MANIFEST_CACHE_MAX_AGE_PERIODS * conf.get_extensions_manifest_cache_period()
+
+        with patch("azurelinuxagent.common.protocol.wire.time.time", return_value=time.time() - max_age - 60):
+            cache.set(stale_key, stale_key[0], "<PluginVersionManifest/>")
+        stale_file = cache._get_file_path(stale_key)
+        os.utime(stale_file, (time.time() - max_age - 60, time.time() - max_age - 60))
+        cache.set(recent_key, recent_key[0], "<PluginVersionManifest/>")
+
+        cache.set(current_key, current_key[0], "<PluginVersionManifest/>")
+
+        self.assertFalse(os.path.exists(stale_file), "The stale manifest should have been removed from disk")
+        self.assertNotIn(stale_key, cache._entries)
+        for key in [recent_key, current_key]:
+            self.assertTrue(os.path.exists(cache._get_file_path(key)), "{0} should be cached on disk".format(key))
+            self.assertIn(key, cache._entries)
+
+    def test_get_ext_manifest_should_use_the_cached_manifest_across_goal_states(self):
+        with mock_wire_protocol(mockwiredata.DATA_FILE) as protocol:
+            ext_handler = protocol.client.get_ext_conf().ext_handlers.extHandlers[0]
+
+            manifest = protocol.client.get_ext_manifest(ext_handler)
+            self.assertEqual(1, protocol.mock_wire_data.call_counts["manifest.xml"])
+
+            protocol.mock_wire_data.set_incarnation("2")
+            protocol.client.update_goal_state()
+            ext_handler = protocol.client.get_ext_conf().ext_handlers.extHandlers[0]
+
+            self.assertIs(manifest, protocol.client.get_ext_manifest(ext_handler))
+            self.assertEqual(1, protocol.mock_wire_data.call_counts["manifest.xml"])
+            # the manifest is still saved for the new incarnation
+            self.assertTrue(os.path.isfile(os.path.join(self.tmp_dir, "{0}.2.manifest.xml".format(ext_handler.name))))
+
+    def test_get_ext_manifest_should_use_the_manifest_cached_on_disk(self):
+        with mock_wire_protocol(mockwiredata.DATA_FILE) as protocol:
+            ext_handler = protocol.client.get_ext_conf().ext_handlers.extHandlers[0]
+            protocol.client.get_ext_manifest(ext_handler)
+
+            wire._ExtensionManifestCache.clear()  # e.g. after a restart of the agent
+            manifest = protocol.client.get_ext_manifest(ext_handler)
+
+            self.assertEqual(1, protocol.mock_wire_data.call_counts["manifest.xml"])
+            self.assertIn("1.0.0", [p.version for p in manifest.pkg_list.versions])
+
+    def test_get_ext_manifest_should_download_the_manifest_when_the_cached_one_expires(self):
+        with mock_wire_protocol(mockwiredata.DATA_FILE) as protocol:
+            ext_handler = protocol.client.get_ext_conf().ext_handlers.extHandlers[0]
+            manifest = protocol.client.get_ext_manifest(ext_handler)
+
+            with patch("azurelinuxagent.common.conf.get_extensions_manifest_cache_period", return_value=0):
+                # the content did not change, so the manifest is not parsed again
+                self.assertIs(manifest, protocol.client.get_ext_manifest(ext_handler))
+                self.assertEqual(2, protocol.mock_wire_data.call_counts["manifest.xml"])
+
+                protocol.mock_wire_data.set_manifest_version("9.9.9")
+                manifest = protocol.client.get_ext_manifest(ext_handler)
+                self.assertEqual(3, protocol.mock_wire_data.call_counts["manifest.xml"])
+                self.assertIn("9.9.9", [p.version for p in manifest.pkg_list.versions])
+
+    def test_get_ext_manifest_should_download_the_manifest_when_the_cached_one_does_not_include_the_requested_version(self):
+        with mock_wire_protocol(mockwiredata.DATA_FILE) as protocol:
+            ext_handler = protocol.client.get_ext_conf().ext_handlers.extHandlers[0]
+            protocol.client.get_ext_manifest(ext_handler)
+
+            protocol.mock_wire_data.set_manifest_version("9.9.9")
+            ext_handler.properties.version = "9.9.9"
+            manifest = protocol.client.get_ext_manifest(ext_handler)
+
+            self.assertEqual(2, protocol.mock_wire_data.call_counts["manifest.xml"])
+            self.assertIn("9.9.9", [p.version for p in manifest.pkg_list.versions])
+
+    def test_get_ext_manifest_should_record_the_manifest_uri_of_each_package(self):
+        with mock_wire_protocol(mockwiredata.DATA_FILE) as protocol:
+            ext_handler = protocol.client.get_ext_conf().ext_handlers.extHandlers[0]
+            manifest_uris = [v.uri for v in ext_handler.versionUris]
+            manifest = protocol.client.get_ext_manifest(ext_handler)
+            package_uri = manifest.pkg_list.versions[0].uris[0].uri
+
+            # e.g. a handler processed concurrently fetched a different manifest
+            protocol.client.get_host_plugin().update_manifest_uri("http://another/manifest.xml")
+
+            self.assertIn(protocol.client.get_package_manifest_uri(package_uri), manifest_uris)
+            self.assertEqual("http://another/manifest.xml", protocol.client.get_package_manifest_uri("http://unknown/package.zip"))
+
+
 class MockResponse:
-    def __init__(self, body, status_code):
+    def __init__(self, body, status_code, headers=None):
         self.body = body
         self.status = status_code
-
-    def read(self, *_):
-        return self.body
+        self.headers = headers if headers is not None else {}
+        self._offset = 0
+
+    def read(self, size=None):
+        if size is None or self.body is None:
+            return self.body
+        # reads of a given size consume the body, like the reads of a stream
+        data = self.body[self._offset:self._offset + size]
+        self._offset += len(data)
+        return data
+
+    def close(self):
+        pass
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
 
 
 if __name__ == '__main__':
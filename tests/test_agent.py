@@ -33,11 +33,16 @@ DetectScvmmEnv = False
 EnableOverProvisioning = True
 Extension.LogDir = /var/log/azure
 Extensions.Enabled = True
+Extensions.ManifestCachePeriod = 3600
+Extensions.MaxParallelHandlers = 1
+Extensions.StatusHeartbeatPeriod = 60
 HttpProxy.Host = None
 HttpProxy.Port = None
 Lib.Dir = /var/lib/waagent
+Logs.Buffered = False
 Logs.Console = True
 Logs.Verbose = False
+Logs.WriterThread = False
 OS.AllowHTTP = False
 OS.CheckRdmaDriver = False
 OS.EnableFIPS = True
@@ -99,6 +104,10 @@ class TestAgent(AgentTestCase):
         c, f, v, d, cfp = parse_args([])
         self.assertEqual(cfp, None)
 
+    def test_accepts_show_stats(self):
+        c, f, v, d, cfp = parse_args(["-show-stats"])
+        self.assertEqual(c, "show-stats")
+
     def test_agent_accepts_configuration_path(self):
         Agent(False,
                 conf_file_path=os.path.join(data_dir, "test_waagent.conf"))
@@ -187,6 +196,21 @@ class TestAgent(AgentTestCase):
         self.assertTrue("-start" in message)
         self.assertTrue("-run-exthandlers" in message)
         self.assertTrue("-show-configuration" in message)
+        self.assertTrue("-show-stats" in message)
 
         # sanity check
         self.assertFalse("-not-a-valid-option" in message)
+
+    def test_agent_show_stats_should_print_the_saved_timing_statistics(self):
+        agent = Agent(False, conf_file_path=os.path.join(data_dir, "test_waagent.conf"))
+        registry = timingstats.TimingRegistry()
+        registry.record("TestOperation", 0.5)
+
+        with patch("azurelinuxagent.agent.conf.get_lib_dir", return_value=self.tmp_dir):
+            with patch("azurelinuxagent.agent.print", create=True) as mock_print:
+                agent.show_stats()
+                self.assertTrue("No timing statistics are available" in mock_print.call_args[0][0])
+
+                timingstats.save_stats(os.path.join(self.tmp_dir, timingstats.TIMING_STATS_FILE_NAME), registry=registry)
+                agent.show_stats()
+                self.assertTrue("TestOperation" in mock_print.call_args[0][0])
@@ -37,7 +37,9 @@ import azurelinuxagent.common.logger as logger
 from azurelinuxagent.common.cgroupconfigurator import CGroupConfigurator
 from azurelinuxagent.common.osutil.factory import _get_osutil
 from azurelinuxagent.common.osutil.ubuntu import Ubuntu14OSUtil, Ubuntu16OSUtil
-from azurelinuxagent.common.utils import fileutil
+from azurelinuxagent.common.protocol import wire
+from azurelinuxagent.common.protocol.goal_state import GoalState
+from azurelinuxagent.common.utils import fileutil, restutil
 from azurelinuxagent.common.version import PY_VERSION_MAJOR
 
 try:
@@ -238,6 +240,11 @@ class AgentTestCase(unittest.TestCase):
 
         self.mock__get_osutil.stop()
 
+        restutil.HttpConnectionPool.clear()
+        GoalState.clear_shared_goal_state()
+        wire._ConditionalRequestCache.clear()
+        wire._ExtensionManifestCache.clear()
+
     def emulate_assertIn(self, a, b, msg=None):
         if a not in b:
             msg = msg if msg is not None else "{0} not found in {1}".format(_safe_repr(a), _safe_repr(b))
@@ -0,0 +1,72 @@
+# Copyright Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+import os
+import threading
+import time
+
+from azurelinuxagent.common.utils import fileutil
+from azurelinuxagent.common.utils.dirwatchutil import DirectoryWatcher, _Inotify
+from tests.tools import AgentTestCase, patch, skip_if_predicate_true
+
+
+class TestDirectoryWatcher(AgentTestCase):
+    @skip_if_predicate_true(lambda: _Inotify.get_libc() is None, "inotify is not available")
+    def test_wait_should_return_when_a_file_is_written_to_the_directory(self):
+        file_path = os.path.join(self.tmp_dir, "test.status")
+
+        with DirectoryWatcher(self.tmp_dir) as watcher:
+            self.assertTrue(watcher.is_using_inotify(), "The watcher should be using inotify")
+            writer = threading.Timer(0.1, lambda: fileutil.write_file(file_path, "status"))
+            writer.start()
+
+            start = time.time()
+            changed = watcher.wait(5)
+            elapsed = time.time() - start
+            writer.join()
+
+        self.assertTrue(changed, "The change was not detected")
+        self.assertTrue(elapsed < 4, "The wait took too long: {0}s".format(elapsed))
+
+    @skip_if_predicate_true(lambda: _Inotify.get_libc() is None, "inotify is not available")
+    def test_wait_should_return_when_a_file_is_renamed_into_the_directory(self):
+        temp_file = os.path.join(self.tmp_dir, "test.status.tmp")
+        fileutil.write_file(temp_file, "status")
+        watched_dir = os.path.join(self.tmp_dir, "status")
+        fileutil.mkdir(watched_dir)
+
+        with DirectoryWatcher(watched_dir) as watcher:
+            os.rename(temp_file, os.path.join(watched_dir, "test.status"))
+            self.assertTrue(watcher.wait(5), "The rename was not detected")
+
+    def test_wait_should_poll_with_increasing_intervals_when_inotify_is_not_available(self):
+        with patch.object(_Inotify, "get_libc", return_value=None):
+            with patch("azurelinuxagent.common.utils.dirwatchutil.time.sleep") as mock_sleep:
+                with DirectoryWatcher(self.tmp_dir, min_poll_interval=0.5, max_poll_interval=2) as watcher:
+                    self.assertFalse(watcher.is_using_inotify(), "The watcher should not be using inotify")
+                    for _ in range(4):
+                        self.assertFalse(watcher.wait(10))
+                    watcher.wait(1.5)
+
+        self.assertEqual([0.5, 1, 2, 2, 1.5], [args[0] for args, _ in mock_sleep.call_args_list])
+
+    def test_wait_should_poll_when_the_directory_does_not_exist(self):
+        with patch("azurelinuxagent.common.utils.dirwatchutil.time.sleep") as mock_sleep:
+            with DirectoryWatcher(os.path.join(self.tmp_dir, "does-not-exist")) as watcher:
+                self.assertFalse(watcher.is_using_inotify(), "The watcher should not be using inotify")
+                watcher.wait(1)
+
+        self.assertEqual(1, mock_sleep.call_count)
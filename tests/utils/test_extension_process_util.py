@@ -21,8 +21,10 @@ from azurelinuxagent.common.utils.extensionprocessutil import format_stdout_stde
 from tests.tools import AgentTestCase, patch
 import os
 import shutil
+import signal
 import subprocess
 import tempfile
+import time
 
 
 class TestProcessUtils(AgentTestCase):
@@ -70,12 +72,52 @@ class TestProcessUtils(AgentTestCase):
 
                 # We're mocking sleep to avoid prolonging the test execution time, but we still want to make sure
                 # we're "waiting" the correct amount of time before killing the process
-                self.assertEquals(mock_sleep.call_count, timeout)
+                self.assertAlmostEqual(sum(args[0] for args, _ in mock_sleep.call_args_list), timeout)
 
                 self.assertEquals(patch_kill.call_count, 1)
                 self.assertEquals(timed_out, True)
                 self.assertEquals(ret, None)
 
+    def test_wait_for_process_completion_or_timeout_should_detect_completion_in_less_than_a_second(self):
+        process = subprocess.Popen(
+            "date",
+            shell=True,
+            cwd=self.tmp_dir,
+            env={},
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            preexec_fn=os.setsid)
+
+        start = time.time()
+        timed_out, ret = wait_for_process_completion_or_timeout(process=process, timeout=5)
+        elapsed = time.time() - start
+
+        self.assertEquals(timed_out, False)
+        self.assertEquals(ret, 0)
+        self.assertLess(elapsed, 1, "The completion of the process took too long to be detected: {0}s".format(elapsed))
+
+    def test_wait_for_process_completion_or_timeout_should_wait_a_bounded_time_for_forked_children(self):
+        process = subprocess.Popen(
+            "sleep 3 &",
+            shell=True,
+            cwd=self.tmp_dir,
+            env={},
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            preexec_fn=os.setsid)
+
+        try:
+            start = time.time()
+            timed_out, ret = wait_for_process_completion_or_timeout(process=process, timeout=5)
+            elapsed = time.time() - start
+
+            self.assertEquals(timed_out, False)
+            self.assertEquals(ret, 0)
+            self.assertGreaterEqual(elapsed, 0.9, "Should have waited for the forked child: {0}s".format(elapsed))
+            self.assertLess(elapsed, 2.5, "Should not have waited for the forked child to complete: {0}s".format(elapsed))
+        finally:
+            os.killpg(process.pid, signal.SIGKILL)
+
     def test_handle_process_completion_should_return_nonzero_when_process_fails(self):
         process = subprocess.Popen(
             "ls folder_does_not_exist",
@@ -135,7 +177,7 @@ class TestProcessUtils(AgentTestCase):
 
                     # We're mocking sleep to avoid prolonging the test execution time, but we still want to make sure
                     # we're "waiting" the correct amount of time before killing the process and raising an exception
-                    self.assertEquals(mock_sleep.call_count, timeout)
+                    self.assertAlmostEqual(sum(args[0] for args, _ in mock_sleep.call_args_list), timeout)
 
                     self.assertEquals(context_manager.exception.code, ExtensionErrorCodes.PluginHandlerScriptTimedout)
                     self.assertIn("Timeout({0})".format(timeout), ustr(context_manager.exception))
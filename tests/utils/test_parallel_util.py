@@ -0,0 +1,72 @@
+# Copyright Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+import threading
+
+from azurelinuxagent.common.utils.parallelutil import run_in_parallel
+from tests.tools import AgentTestCase
+
+
+class TestParallelUtil(AgentTestCase):
+    def test_run_in_parallel_should_return_the_results_in_the_order_of_the_tasks(self):
+        tasks = [lambda i=i: i * 10 for i in range(10)]
+
+        results = run_in_parallel(tasks, 3)
+
+        self.assertEqual([i * 10 for i in range(10)], [r.value for r in results])
+        self.assertTrue(all(r.succeeded for r in results))
+
+    def test_run_in_parallel_should_capture_the_exceptions_of_each_task(self):
+        error = Exception("task failed")
+
+        def fail():
+            raise error
+
+        results = run_in_parallel([lambda: 1, fail, lambda: 3], 2)
+
+        self.assertEqual([1, None, 3], [r.value for r in results])
+        self.assertEqual([None, error, None], [r.exception for r in results])
+
+    def test_run_in_parallel_should_not_exceed_the_maximum_number_of_workers(self):
+        lock = threading.Lock()
+        state = {"running": 0, "max_running": 0}
+        threads = set()
+        barrier = threading.Event()
+
+        def task():
+            with lock:
+                state["running"] += 1
+                state["max_running"] = max(state["max_running"], state["running"])
+                threads.add(threading.current_thread().name)
+            barrier.wait(0.05)
+            with lock:
+                state["running"] -= 1
+
+        run_in_parallel([task] * 8, 3, name="TestWorker")
+
+        self.assertTrue(state["max_running"] <= 3, "Too many concurrent tasks: {0}".format(state["max_running"]))
+        self.assertTrue(len(threads) > 1, "The tasks were not executed concurrently")
+        self.assertTrue(all(t.startswith("TestWorker-") for t in threads), "Unexpected thread names: {0}".format(threads))
+
+    def test_run_in_parallel_should_use_the_calling_thread_when_there_is_a_single_worker(self):
+        threads = []
+
+        run_in_parallel([lambda: threads.append(threading.current_thread())] * 3, 1)
+
+        self.assertEqual([threading.current_thread()] * 3, threads)
+
+    def test_run_in_parallel_should_handle_an_empty_list_of_tasks(self):
+        self.assertEqual([], run_in_parallel([], 4))
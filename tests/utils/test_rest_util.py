@@ -15,8 +15,13 @@
 # Requires Python 2.6+ and Openssl 1.0+
 #
 
+import errno
 import os
+import socket
+import threading
+import time
 import unittest
+from io import BytesIO
 
 from azurelinuxagent.common.exception import HttpError, ResourceGoneError, InvalidContainerError
 import azurelinuxagent.common.utils.restutil as restutil
@@ -24,6 +29,13 @@ from azurelinuxagent.common.utils.restutil import HTTP_USER_AGENT
 from azurelinuxagent.common.future import httpclient, ustr
 from tests.tools import AgentTestCase, call, Mock, MagicMock, patch
 
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
 
 class TestIOErrorCounter(AgentTestCase):
     def test_increment_hostplugin(self):
@@ -340,7 +352,7 @@ class TestHttpOperations(AgentTestCase):
         ])
         HTTPSConnection.assert_not_called()
         mock_conn.request.assert_has_calls([
-            call(method="GET", url="/bar", body=None, headers={'User-Agent': HTTP_USER_AGENT, 'Connection': 'close'})
+            call(method="GET", url="/bar", body=None, headers={'User-Agent': HTTP_USER_AGENT})
         ])
         self.assertEqual(1, mock_conn.getresponse.call_count)
         self.assertNotEquals(None, resp)
@@ -363,7 +375,7 @@ class TestHttpOperations(AgentTestCase):
             call("foo", 443, timeout=10)
         ])
         mock_conn.request.assert_has_calls([
-            call(method="GET", url="/bar", body=None, headers={'User-Agent': HTTP_USER_AGENT, 'Connection': 'close'})
+            call(method="GET", url="/bar", body=None, headers={'User-Agent': HTTP_USER_AGENT})
         ])
         self.assertEqual(1, mock_conn.getresponse.call_count)
         self.assertNotEquals(None, resp)
@@ -387,7 +399,7 @@ class TestHttpOperations(AgentTestCase):
         ])
         HTTPSConnection.assert_not_called()
         mock_conn.request.assert_has_calls([
-            call(method="GET", url="http://foo:80/bar", body=None, headers={'User-Agent': HTTP_USER_AGENT, 'Connection': 'close'})
+            call(method="GET", url="http://foo:80/bar", body=None, headers={'User-Agent': HTTP_USER_AGENT})
         ])
         self.assertEqual(1, mock_conn.getresponse.call_count)
         self.assertNotEquals(None, resp)
@@ -520,7 +532,7 @@ class TestHttpOperations(AgentTestCase):
             call("foo.bar", 23333, timeout=10)
         ])
         mock_conn.request.assert_has_calls([
-            call(method="GET", url="https://foo:443/bar", body=None, headers={'User-Agent': HTTP_USER_AGENT, 'Connection': 'close'})
+            call(method="GET", url="https://foo:443/bar", body=None, headers={'User-Agent': HTTP_USER_AGENT})
         ])
         self.assertEqual(1, mock_conn.getresponse.call_count)
         self.assertNotEquals(None, resp)
@@ -804,5 +816,249 @@ class TestHttpOperations(AgentTestCase):
                 self.assertTrue(result in ustr(e))
 
 
+    def test_read_response_to_file_should_copy_the_response_in_chunks(self):
+        body = b'0123456789' * 10
+        response = MagicMock()
+        response.read = Mock(side_effect=BytesIO(body).read)
+        destination = BytesIO()
+
+        with patch("azurelinuxagent.common.utils.restutil.RESPONSE_CHUNK_SIZE", 32):
+            size = restutil.read_response_to_file(response, destination)
+
+        self.assertEqual(len(body), size)
+        self.assertEqual(body, destination.getvalue())
+        self.assertEqual([call(32)] * 5, response.read.call_args_list)
+
+    def test_read_response_to_file_should_stop_when_cancelled(self):
+        response = MagicMock()
+        cancel = threading.Event()
+        cancel.set()
+
+        self.assertIsNone(restutil.read_response_to_file(response, BytesIO(), cancel=cancel))
+        self.assertEqual(0, response.read.call_count)
+        self.assertEqual(1, response.close.call_count)
+
+class TestHttpConnectionPool(AgentTestCase):
+    @staticmethod
+    def _mock_connection(status=httpclient.OK, content_length="0", will_close=False, body=b""):
+        response = Mock(status=status, will_close=will_close)
+        response.getheader = Mock(return_value=content_length)
+        response.read = Mock(return_value=body)
+        return MagicMock(sock=None, getresponse=Mock(return_value=response))
+
+    @patch("azurelinuxagent.common.future.httpclient.HTTPConnection")
+    def test_http_request_should_reuse_connections_with_small_responses(self, HTTPConnection):
+        conn = self._mock_connection(content_length="3", body=b"foo")
+        HTTPConnection.return_value = conn
+
+        restutil._http_request("GET", "foo", "/bar")
+        resp = restutil._http_request("GET", "foo", "/baz")
+
+        self.assertEqual(1, HTTPConnection.call_count)
+        self.assertEqual(2, conn.request.call_count)
+        self.assertEqual(1, restutil.HttpConnectionPool.get_idle_count())
+        self.assertEqual(httpclient.OK, resp.status)
+        self.assertEqual(b"fo", resp.read(2))
+        self.assertEqual(b"o", resp.read())
+
+    @patch("azurelinuxagent.common.future.httpclient.HTTPConnection")
+    def test_http_request_should_reuse_connections_with_responses_without_body(self, HTTPConnection):
+        conn = self._mock_connection(status=httpclient.NOT_MODIFIED, content_length=None)
+        HTTPConnection.return_value = conn
+
+        restutil._http_request("GET", "foo", "/bar")
+        restutil._http_request("HEAD", "foo", "/bar")
+
+        self.assertEqual(1, HTTPConnection.call_count)
+        self.assertEqual(2, conn.request.call_count)
+        self.assertEqual(1, restutil.HttpConnectionPool.get_idle_count())
+
+    @patch("azurelinuxagent.common.future.httpclient.HTTPConnection")
+    def test_http_request_should_not_reuse_connections_with_large_responses(self, HTTPConnection):
+        connections = [self._mock_connection(content_length=str(restutil.MAX_DRAINED_RESPONSE_SIZE + 1)),
+                       self._mock_connection(content_length=None)]
+        HTTPConnection.side_effect = connections
+
+        restutil._http_request("GET", "foo", "/bar")
+        restutil._http_request("GET", "foo", "/baz")
+
+        self.assertEqual(2, HTTPConnection.call_count)
+        self.assertEqual(0, restutil.HttpConnectionPool.get_idle_count())
+        for conn in connections:
+            self.assertEqual(0, conn.getresponse().read.call_count)
+
+    @patch("azurelinuxagent.common.future.httpclient.HTTPConnection")
+    def test_http_request_should_not_pool_connections_closed_by_the_server(self, HTTPConnection):
+        HTTPConnection.side_effect = lambda *args, **kwargs: self._mock_connection(will_close=True)
+
+        restutil._http_request("GET", "foo", "/bar")
+        restutil._http_request("GET", "foo", "/baz")
+
+        self.assertEqual(2, HTTPConnection.call_count)
+        self.assertEqual(0, restutil.HttpConnectionPool.get_idle_count())
+
+    @patch("azurelinuxagent.common.future.httpclient.HTTPConnection")
+    def test_http_request_should_use_separate_connections_per_host_port_and_proxy(self, HTTPConnection):
+        HTTPConnection.side_effect = lambda *args, **kwargs: self._mock_connection()
+
+        restutil._http_request("GET", "foo", "/bar")
+        restutil._http_request("GET", "foo", "/bar", port=8080)
+        restutil._http_request("GET", "baz", "/bar")
+        restutil._http_request("GET", "foo", "/bar", proxy_host="foo.bar", proxy_port=23333)
+
+        self.assertEqual(4, HTTPConnection.call_count)
+        self.assertEqual(4, restutil.HttpConnectionPool.get_idle_count())
+
+    @patch("azurelinuxagent.common.future.httpclient.HTTPConnection")
+    def test_http_request_should_evict_idle_connections(self, HTTPConnection):
+        HTTPConnection.side_effect = lambda *args, **kwargs: self._mock_connection()
+
+        restutil._http_request("GET", "foo", "/bar")
+
+        with patch("azurelinuxagent.common.utils.restutil.time.time",
+                   return_value=time.time() + restutil.MAX_IDLE_CONNECTION_SECONDS + 1):
+            restutil._http_request("GET", "foo", "/bar")
+
+        self.assertEqual(2, HTTPConnection.call_count)
+        self.assertEqual(1, restutil.HttpConnectionPool.get_idle_count())
+
+    @patch("azurelinuxagent.common.future.httpclient.HTTPConnection")
+    def test_http_request_should_evict_connections_dropped_by_the_server(self, HTTPConnection):
+        HTTPConnection.side_effect = lambda *args, **kwargs: self._mock_connection()
+
+        restutil._http_request("GET", "foo", "/bar")
+
+        with patch("azurelinuxagent.common.utils.restutil._is_connection_dropped", return_value=True):
+            restutil._http_request("GET", "foo", "/bar")
+
+        self.assertEqual(2, HTTPConnection.call_count)
+        self.assertEqual(1, restutil.HttpConnectionPool.get_idle_count())
+
+    @patch("azurelinuxagent.common.future.httpclient.HTTPConnection")
+    def test_http_request_should_retry_on_a_new_connection_when_a_reused_connection_fails(self, HTTPConnection):
+        stale_conn = self._mock_connection()
+        new_conn = self._mock_connection()
+        HTTPConnection.side_effect = [stale_conn, new_conn]
+
+        restutil._http_request("GET", "foo", "/bar")
+
+        stale_conn.getresponse.side_effect = httpclient.BadStatusLine("")
+        resp = restutil._http_request("GET", "foo", "/bar")
+
+        self.assertEqual(2, HTTPConnection.call_count)
+        self.assertEqual(1, stale_conn.close.call_count)
+        self.assertEqual(1, new_conn.request.call_count)
+        self.assertEqual(httpclient.OK, resp.status)
+
+    @patch("azurelinuxagent.common.future.httpclient.HTTPConnection")
+    def test_http_request_should_retry_on_a_new_connection_when_sending_on_a_reused_connection_fails(self, HTTPConnection):
+        stale_conn = self._mock_connection()
+        new_conn = self._mock_connection()
+        HTTPConnection.side_effect = [stale_conn, new_conn]
+
+        restutil._http_request("POST", "foo", "/bar", data="data")
+
+        stale_conn.request.side_effect = socket.error(errno.EPIPE, "Broken pipe")
+        resp = restutil._http_request("POST", "foo", "/bar", data="data")
+
+        self.assertEqual(2, HTTPConnection.call_count)
+        self.assertEqual(1, new_conn.request.call_count)
+        self.assertEqual(httpclient.OK, resp.status)
+
+    @patch("azurelinuxagent.common.future.httpclient.HTTPConnection")
+    def test_http_request_should_not_retry_non_idempotent_requests_after_they_are_sent(self, HTTPConnection):
+        stale_conn = self._mock_connection()
+        HTTPConnection.side_effect = [stale_conn, self._mock_connection()]
+
+        restutil._http_request("POST", "foo", "/bar", data="data")
+
+        stale_conn.getresponse.side_effect = httpclient.BadStatusLine("")
+        self.assertRaises(httpclient.BadStatusLine, restutil._http_request, "POST", "foo", "/bar", data="data")
+
+        self.assertEqual(1, HTTPConnection.call_count)
+        self.assertEqual(1, stale_conn.close.call_count)
+
+    @patch("azurelinuxagent.common.future.httpclient.HTTPConnection")
+    def test_http_request_should_not_retry_on_a_new_connection_after_a_timeout(self, HTTPConnection):
+        stale_conn = self._mock_connection()
+        HTTPConnection.side_effect = [stale_conn, self._mock_connection()]
+
+        restutil._http_request("GET", "foo", "/bar")
+
+        stale_conn.getresponse.side_effect = socket.timeout("timed out")
+        self.assertRaises(socket.timeout, restutil._http_request, "GET", "foo", "/bar")
+
+        self.assertEqual(1, HTTPConnection.call_count)
+
+    def test_pool_should_limit_the_number_of_idle_connections(self):
+        key = ("http", "foo", 80, None, None)
+        connections = [self._mock_connection() for _ in range(restutil.MAX_IDLE_CONNECTIONS_PER_HOST + 2)]
+        for conn in connections:
+            restutil.HttpConnectionPool.release(key, conn)
+
+        self.assertEqual(restutil.MAX_IDLE_CONNECTIONS_PER_HOST, restutil.HttpConnectionPool.get_idle_count(key))
+        self.assertEqual(1, connections[0].close.call_count)
+        self.assertEqual(1, connections[1].close.call_count)
+        self.assertEqual(connections[-1], restutil.HttpConnectionPool.acquire(key))
+
+    def test_is_connection_dropped(self):
+        import socket
+        server, client = socket.socketpair()
+        try:
+            self.assertFalse(restutil._is_connection_dropped(Mock(sock=client)))
+            server.close()
+            self.assertTrue(restutil._is_connection_dropped(Mock(sock=client)))
+        finally:
+            client.close()
+
+    def test_http_request_should_reuse_connections_when_the_response_is_not_read(self):
+        connections = []
+
+        class KeepAliveHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            timeout = 5
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                connections.append(self.client_address)
+
+            def do_GET(self):
+                self.send_response(httpclient.NOT_MODIFIED)
+                self.end_headers()
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length")))
+                self.send_response(httpclient.OK)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"OK")
+
+            def log_message(self, *args):
+                pass
+
+        class ThreadingServer(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        server = ThreadingServer(("127.0.0.1", 0), KeepAliveHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            port = server.server_address[1]
+            for _ in range(5):
+                resp = restutil._http_request("GET", "127.0.0.1", "/goalstate", port=port)
+                self.assertEqual(httpclient.NOT_MODIFIED, resp.status)
+            for _ in range(5):
+                resp = restutil._http_request("POST", "127.0.0.1", "/telemetrydata", port=port, data=b"event")
+                self.assertEqual(httpclient.OK, resp.status)
+
+            self.assertEqual(1, len(connections))
+            self.assertEqual(1, restutil.HttpConnectionPool.get_idle_count())
+        finally:
+            restutil.HttpConnectionPool.clear()
+            server.shutdown()
+            server.server_close()
+
+
 if __name__ == '__main__':
     unittest.main()
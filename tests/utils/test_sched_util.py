@@ -0,0 +1,143 @@
+# Copyright Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+import threading
+import time
+
+from azurelinuxagent.common.utils.schedutil import PeriodicTask, Scheduler
+from tests.tools import AgentTestCase, patch
+
+
+class TestScheduler(AgentTestCase):
+    def setUp(self):
+        AgentTestCase.setUp(self)
+        self.scheduler = Scheduler()
+        self.thread = None
+
+    def tearDown(self):
+        self._stop_scheduler()
+        AgentTestCase.tearDown(self)
+
+    def _start_scheduler(self):
+        self.thread = threading.Thread(target=self.scheduler.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _stop_scheduler(self):
+        self.scheduler.stop()
+        if self.thread is not None:
+            self.thread.join(5)
+            self.assertFalse(self.thread.is_alive(), "The scheduler did not stop")
+            self.thread = None
+
+    def test_run_should_execute_each_task_on_its_own_period(self):
+        executions = {"fast": 0, "slow": 0, "delayed": 0}
+
+        def count(name):
+            def operation():
+                executions[name] += 1
+            return operation
+
+        self.scheduler.add_task(PeriodicTask("fast", count("fast"), 0.05))
+        self.scheduler.add_task(PeriodicTask("slow", count("slow"), 60))
+        self.scheduler.add_task(PeriodicTask("delayed", count("delayed"), 0.05, initial_delay=60))
+
+        self._start_scheduler()
+        time.sleep(0.5)
+        self._stop_scheduler()
+
+        self.assertGreaterEqual(executions["fast"], 5)
+        self.assertEqual(1, executions["slow"], "The slow task should have been executed only when the scheduler started")
+        self.assertEqual(0, executions["delayed"], "The delayed task should not have been executed")
+
+    def test_run_should_execute_the_tasks_that_are_due_at_the_same_time_in_the_order_they_were_added(self):
+        executions = []
+
+        for name in ["first", "second", "third"]:
+            self.scheduler.add_task(PeriodicTask(name, lambda n=name: executions.append(n), 60))
+
+        self._start_scheduler()
+        time.sleep(0.2)
+        self._stop_scheduler()
+
+        self.assertEqual(["first", "second", "third"], executions)
+
+    def test_stop_should_wake_up_the_scheduler(self):
+        self.scheduler.add_task(PeriodicTask("task", lambda: None, 3600))
+        self._start_scheduler()
+        time.sleep(0.1)
+
+        start_time = time.time()
+        self._stop_scheduler()
+
+        self.assertLess(time.time() - start_time, 1, "The scheduler should not wait for the next task after stop()")
+
+    def test_run_should_keep_running_the_tasks_after_an_error_and_record_their_statistics(self):
+        def fail():
+            raise Exception("test error")
+
+        def sleep():
+            time.sleep(0.05)
+
+        self.scheduler.add_task(PeriodicTask("failing", fail, 0.05))
+        self.scheduler.add_task(PeriodicTask("slow", sleep, 0.05, timeout=0.01))
+
+        with patch("azurelinuxagent.common.utils.schedutil.logger.warn") as mock_warn:
+            self._start_scheduler()
+            time.sleep(0.5)
+            self._stop_scheduler()
+
+        failing, slow = self.scheduler.get_statistics()
+
+        self.assertGreater(failing["run_count"], 1)
+        self.assertEqual(failing["run_count"], failing["failure_count"])
+        self.assertGreater(slow["run_count"], 1)
+        self.assertEqual(slow["run_count"], slow["timeout_count"])
+        self.assertGreaterEqual(slow["max_run_time"], 0.05)
+        self.assertTrue(any("test error" in str(args) for args, _ in mock_warn.call_args_list))
+        self.assertTrue(any("exceeding its timeout" in args[0] for args, _ in mock_warn.call_args_list))
+
+    def test_run_should_skip_the_executions_missed_by_a_slow_task(self):
+        executions = []
+
+        def operation():
+            executions.append(time.time())
+            if len(executions) == 1:
+                time.sleep(0.35)
+
+        self.scheduler.add_task(PeriodicTask("task", operation, 0.1))
+
+        self._start_scheduler()
+        time.sleep(0.5)
+        self._stop_scheduler()
+
+        self.assertGreaterEqual(len(executions), 2)
+        # the executions due at 0.1, 0.2 and 0.3 seconds should have been skipped
+        self.assertAlmostEqual(0.4, executions[1] - executions[0], delta=0.05)
+
+    def test_jitter_should_not_accumulate(self):
+        executions = []
+        self.scheduler.add_task(PeriodicTask("task", lambda: executions.append(time.time()), 0.1, jitter=0.05))
+
+        self._start_scheduler()
+        time.sleep(0.95)
+        self._stop_scheduler()
+
+        offsets = [e - executions[0] for e in executions]
+        self.assertGreaterEqual(len(offsets), 9)
+        for i in range(1, len(offsets)):
+            self.assertGreaterEqual(offsets[i], i * 0.1, "Execution {0} was too early: {1}".format(i, offsets))
+            self.assertLess(offsets[i], i * 0.1 + 0.05 + 0.03, "Execution {0} was too late: {1}".format(i, offsets))
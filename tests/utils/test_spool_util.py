@@ -0,0 +1,184 @@
+# Copyright Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+import os
+import time
+
+from azurelinuxagent.common.utils import spoolutil
+from azurelinuxagent.common.utils.spoolutil import Spool, SEGMENT_FILE_REGEX
+from tests.tools import AgentTestCase, patch
+
+
+class TestSpool(AgentTestCase):
+    def setUp(self):
+        AgentTestCase.setUp(self)
+        self.spool_dir = os.path.join(self.tmp_dir, "spool")
+        self.spool = Spool(self.spool_dir)
+
+    def tearDown(self):
+        self.spool.close()
+        AgentTestCase.tearDown(self)
+
+    def _get_segments(self):
+        return sorted([f for f in os.listdir(self.spool_dir) if SEGMENT_FILE_REGEX.match(f) is not None])
+
+    def _age_segments(self, seconds):
+        for segment in self._get_segments():
+            path = os.path.join(self.spool_dir, segment)
+            mtime = os.path.getmtime(path) - seconds
+            os.utime(path, (mtime, mtime))
+
+    def test_read_should_return_the_records_appended_since_the_previous_read(self):
+        self.spool.append(b"record 1")
+        self.spool.append(b"record\n2")
+        self.spool.append(b"")
+
+        self.assertEqual([b"record 1", b"record\n2", b""], self.spool.read())
+        self.assertEqual([], self.spool.read())
+
+        self.spool.append(b"record 3")
+
+        self.assertEqual([b"record 3"], self.spool.read())
+        self.assertEqual(1, len(self._get_segments()), "All the records should have been appended to the same segment")
+
+    def test_read_should_resume_from_the_cursor_of_a_previous_reader(self):
+        self.spool.append(b"record 1")
+        self.assertEqual([b"record 1"], Spool(self.spool_dir).read())
+
+        self.spool.append(b"record 2")
+        self.assertEqual([b"record 2"], Spool(self.spool_dir).read())
+
+    def test_read_should_leave_incomplete_records_for_the_next_read(self):
+        self.spool.append(b"record 1")
+        segment = os.path.join(self.spool_dir, self._get_segments()[0])
+
+        with open(segment, "ab") as segment_file:
+            segment_file.write(b"8\nrec")
+
+        self.assertEqual([b"record 1"], self.spool.read())
+
+        with open(segment, "ab") as segment_file:
+            segment_file.write(b"ord 2\n")
+
+        self.assertEqual([b"record 2"], self.spool.read())
+
+    def test_read_should_skip_corrupt_segments(self):
+        self.spool.append(b"record 1")
+        segment = os.path.join(self.spool_dir, self._get_segments()[0])
+
+        with open(segment, "ab") as segment_file:
+            segment_file.write(b"not a record\n")
+
+        with patch("azurelinuxagent.common.utils.spoolutil.logger.warn") as mock_warn:
+            self.assertEqual([b"record 1"], self.spool.read())
+
+        self.assertEqual(1, mock_warn.call_count)
+        self.assertIn("is corrupt", mock_warn.call_args[0][0])
+
+        self.spool.append(b"record 2")
+        self.assertEqual([b"record 2"], self.spool.read())
+
+    def test_append_should_start_a_new_segment_when_the_current_one_is_too_old(self):
+        self.spool.append(b"record 1")
+
+        with patch("azurelinuxagent.common.utils.spoolutil.time.time", return_value=time.time() + spoolutil.SEGMENT_MAX_AGE):
+            self.spool.append(b"record 2")
+
+        self.assertEqual(2, len(self._get_segments()))
+        self.assertEqual([b"record 1", b"record 2"], self.spool.read())
+
+    def test_append_should_start_a_new_segment_when_the_current_one_is_removed(self):
+        self.spool.append(b"record 1")
+        os.remove(os.path.join(self.spool_dir, self._get_segments()[0]))
+
+        self.spool.append(b"record 2")
+
+        self.assertEqual([b"record 2"], self.spool.read())
+
+    def test_read_should_remove_closed_segments(self):
+        self.spool.append(b"record 1")
+        self.spool.close()
+        self._age_segments(spoolutil.SEGMENT_MAX_AGE + 120)
+
+        self.spool.append(b"record 2")
+        self.assertEqual(2, len(self._get_segments()))
+
+        self.assertEqual([b"record 1", b"record 2"], self.spool.read())
+        self.assertEqual(1, len(self._get_segments()), "The closed segment should have been removed")
+        self.assertEqual([], self.spool.read())
+
+    def test_append_should_remove_the_oldest_segments_when_there_are_too_many(self):
+        with patch("azurelinuxagent.common.utils.spoolutil.SEGMENT_MAX_SIZE", 1):
+            with patch("azurelinuxagent.common.utils.spoolutil.MAX_NUMBER_OF_SEGMENTS", 3):
+                for i in range(5):
+                    self.spool.append("record {0}".format(i).encode("ascii"))
+
+        self.assertEqual(3, len(self._get_segments()))
+        self.assertEqual([b"record 2", b"record 3", b"record 4"], self.spool.read())
+
+    def test_read_batches_should_return_the_unacknowledged_batches_on_the_next_read(self):
+        for i in range(5):
+            self.spool.append("record {0}".format(i).encode("ascii"))
+
+        batches = list(self.spool.read_batches(max_batch_size=16))
+        self.assertEqual([[b"record 0", b"record 1"], [b"record 2", b"record 3"], [b"record 4"]], [b for b, _ in batches])
+
+        batches[0][1]()
+
+        self.assertEqual([b"record 2", b"record 3", b"record 4"], self.spool.read())
+
+    def test_read_batches_should_acknowledge_the_first_records_of_a_batch(self):
+        self.spool.append(b"record 1")
+        self.spool.close()
+        self._age_segments(spoolutil.SEGMENT_MAX_AGE + 120)
+        self.spool.append(b"record 2")
+        self.spool.append(b"record 3")
+
+        batches = list(self.spool.read_batches())
+        self.assertEqual([[b"record 1", b"record 2", b"record 3"]], [b for b, _ in batches])
+
+        batches[0][1](2)
+
+        self.assertEqual(1, len(self._get_segments()), "The closed segment should have been removed")
+        self.assertEqual([b"record 3"], self.spool.read())
+
+    def test_read_batches_should_not_remove_the_segments_with_records_that_are_not_acknowledged(self):
+        self.spool.append(b"record 1")
+        self.spool.append(b"record 2")
+        self.spool.close()
+        self._age_segments(spoolutil.SEGMENT_MAX_AGE + 120)
+
+        batches = list(self.spool.read_batches())
+        batches[0][1](1)
+
+        self.assertEqual(1, len(self._get_segments()))
+        self.assertEqual([b"record 2"], self.spool.read())
+        self.assertEqual(0, len(self._get_segments()))
+
+    def test_read_batches_acknowledging_a_batch_should_acknowledge_the_previous_batches(self):
+        self.spool.append(b"record 1")
+        self.spool.close()
+        self._age_segments(spoolutil.SEGMENT_MAX_AGE + 120)
+        self.spool.append(b"record 2")
+        self.spool.append(b"record 3")
+
+        batches = list(self.spool.read_batches(max_batch_size=1))
+        self.assertEqual([[b"record 1"], [b"record 2"], [b"record 3"]], [b for b, _ in batches])
+
+        batches[1][1]()
+
+        self.assertEqual(1, len(self._get_segments()), "The closed segment should have been removed")
+        self.assertEqual([b"record 3"], self.spool.read())
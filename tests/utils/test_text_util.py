@@ -209,5 +209,43 @@ class TestTextUtil(AgentTestCase):
         self.assertRaises(TypeError, textutil.format_memory_value, 'bytes', None)
 
 
+    def test_xml_helpers_should_search_the_descendants_of_a_node(self):
+        xml_doc = textutil.parse_doc(u'<Root id="r"><Item name="a">A<Item name="b">B</Item></Item><Item name="c"/></Root>')
+
+        self.assertEqual("r", textutil.getattrib(textutil.find(xml_doc, "Root"), "id"))
+        self.assertEqual(["a", "b", "c"], [textutil.getattrib(n, "name") for n in textutil.findall(xml_doc, "Item")])
+
+        item_a = textutil.find(xml_doc, "Item")
+        self.assertEqual(["b"], [textutil.getattrib(n, "name") for n in textutil.findall(item_a, "Item")])
+        self.assertEqual("A", textutil.gettext(item_a))
+        self.assertEqual("B", textutil.findtext(item_a, "Item"))
+
+        self.assertIsNone(textutil.find(xml_doc, "Missing"))
+        self.assertIsNone(textutil.findtext(xml_doc, "Missing"))
+        self.assertEqual([], textutil.findall(None, "Item"))
+        self.assertIsNone(textutil.gettext(textutil.find(xml_doc, "Root")))
+
+    def test_xml_helpers_should_return_the_same_values_as_minidom(self):
+        xml_doc = textutil.parse_doc(u'<Root><Empty/><Tail><Child/>text after child</Tail><Unicode>\u00e9\u00e8</Unicode></Root>')
+
+        self.assertIsNone(textutil.findtext(xml_doc, "Empty"))
+        self.assertEqual("text after child", textutil.findtext(xml_doc, "Tail"))
+        self.assertEqual(u"\u00e9\u00e8", textutil.findtext(xml_doc, "Unicode"))
+        # missing attributes are returned as an empty string
+        self.assertEqual("", textutil.getattrib(textutil.find(xml_doc, "Empty"), "missing"))
+        self.assertIsNone(textutil.getattrib(None, "missing"))
+
+    def test_xml_helpers_should_support_namespaces(self):
+        xml_doc = textutil.parse_doc(u'<Environment xmlns="urn:a" xmlns:b="urn:b"><b:Version>1.0</b:Version></Environment>')
+
+        self.assertIsNotNone(textutil.find(xml_doc, "Environment", namespace="urn:a"))
+        self.assertEqual("1.0", textutil.findtext(xml_doc, "Version", namespace="urn:b"))
+        self.assertIsNone(textutil.find(xml_doc, "Version", namespace="urn:a"))
+
+    def test_parse_doc_should_raise_an_expat_error_on_invalid_documents(self):
+        from xml.parsers.expat import ExpatError
+        self.assertRaises(ExpatError, textutil.parse_doc, u"<Root><Item></Root>")
+
+
 if __name__ == '__main__':
     unittest.main()